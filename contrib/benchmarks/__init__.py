@@ -0,0 +1,5 @@
+"""
+Benchmarks for the wallet operations that slow down as wallets grow.
+
+See the README in this directory for how to run them.
+"""
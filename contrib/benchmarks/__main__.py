@@ -0,0 +1,213 @@
+"""
+Generate a synthetic wallet, time the wallet operations against it and write the results.
+
+    python3 -m contrib.benchmarks --scale small --output results.json
+    python3 -m contrib.benchmarks --scale small --compare results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from electrumsv.app_state import AppStateProxy, DefaultApp
+from electrumsv.constants import DATABASE_EXT
+from electrumsv.logs import logs
+from electrumsv.simple_config import SimpleConfig
+from electrumsv.storage import WalletStorage
+from electrumsv.version import PACKAGE_VERSION
+from electrumsv.wallet import Wallet
+
+from .cases import BenchmarkContext, CASES, RESTClient, run_case
+from .generator import generate_wallet, GeneratedWallet, SCALES, WalletSpec
+
+
+RESULTS_FORMAT_VERSION = 1
+
+
+def _print(text: str) -> None:
+    print(text, file=sys.stderr, flush=True)
+
+
+def _print_progress(stage: str, done: int, total: int) -> None:
+    _print(f"generating {stage}: {done}/{total}")
+
+
+def _get_git_revision() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.realpath(__file__)),
+            check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.decode().strip()
+
+
+def _parse_args(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python3 -m contrib.benchmarks",
+        description="Time wallet operations against a generated wallet.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small",
+        help="the preset size of the generated wallet (default: small)")
+    parser.add_argument("--keys", type=int, help="the number of keys, overriding the scale")
+    parser.add_argument("--transactions", type=int,
+        help="the number of transactions, overriding the scale")
+    parser.add_argument("--utxos", type=int,
+        help="the number of unspent outputs, overriding the scale")
+    parser.add_argument("--seed", type=int, default=1,
+        help="the seed all generated data is derived from (default: 1)")
+    parser.add_argument("--repeat", type=int, default=5,
+        help="how many times to time each case (default: 5)")
+    parser.add_argument("--batch-size", type=int, default=100,
+        help="how many transactions the transaction processing cases add (default: 100)")
+    parser.add_argument("--cases", help="a comma separated list of the cases to run")
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    parser.add_argument("--data-dir",
+        help="where to keep generated wallets for reuse (default: a temporary directory)")
+    parser.add_argument("--output", help="the file to write the results to, or - for stdout")
+    parser.add_argument("--compare", help="a results file to compare these results to")
+    parser.add_argument("--verbose", action="store_true", help="show the wallet logging")
+    return parser.parse_args(args)
+
+
+def _get_spec(args: argparse.Namespace) -> WalletSpec:
+    spec = SCALES[args.scale]._replace(seed=args.seed)
+    if args.keys is not None:
+        spec = spec._replace(key_count=args.keys)
+    if args.transactions is not None:
+        spec = spec._replace(transaction_count=args.transactions)
+    if args.utxos is not None:
+        spec = spec._replace(utxo_count=args.utxos)
+    elif args.transactions is not None:
+        spec = spec._replace(utxo_count=max(1, spec.transaction_count // 2))
+    spec.validate()
+    return spec
+
+
+def _compare_results(baseline: Dict[str, Any], results: Dict[str, Any]) -> None:
+    _print(f"{'case':<32} {'baseline/item':>14} {'current/item':>14} {'ratio':>8}")
+    for name, case_result in results["cases"].items():
+        # Different scales are compared by time per item.
+        current_time = case_result["median"] / max(1, case_result["items"])
+        baseline_result = baseline["cases"].get(name)
+        if baseline_result is None:
+            _print(f"{name:<32} {'-':>14} {current_time*1000:>12.4f}ms")
+            continue
+        baseline_time = baseline_result["median"] / max(1, baseline_result["items"])
+        ratio = current_time / baseline_time if baseline_time else float("inf")
+        _print(f"{name:<32} {baseline_time*1000:>12.4f}ms {current_time*1000:>12.4f}ms "
+            f"{ratio:>7.2f}x")
+
+
+def main(argv: List[str]) -> int:
+    args = _parse_args(argv)
+    if args.list:
+        for case in CASES:
+            print(case.name)
+        return 0
+
+    case_names = [ case.name for case in CASES ]
+    if args.cases:
+        selected_names = args.cases.split(",")
+        unknown_names = set(selected_names) - set(case_names)
+        if unknown_names:
+            _print(f"unknown cases: {', '.join(sorted(unknown_names))}")
+            return 1
+        case_names = [ name for name in case_names if name in selected_names ]
+
+    spec = _get_spec(args)
+    logs.set_level("debug" if args.verbose else "warning")
+
+    data_path = args.data_dir if args.data_dir else tempfile.mkdtemp()
+    config = SimpleConfig({ "electrum_sv_path": data_path })
+    app_state = AppStateProxy(config, "cmdline")
+    app_state.set_app(DefaultApp())
+    app_state.async_.__enter__()
+    rest_client: Optional[RESTClient] = None
+    wallet: Optional[Wallet] = None
+    try:
+        wallet_name = (f"benchmark-{spec.key_count}-{spec.transaction_count}-"
+            f"{spec.utxo_count}-{spec.seed}")
+        generated_path = os.path.join(config.electrum_path(), "generated")
+        wallets_path = os.path.join(config.electrum_path(), "wallets")
+        os.makedirs(generated_path, exist_ok=True)
+        os.makedirs(wallets_path, exist_ok=True)
+
+        # The generated wallet is kept unmodified, and each run works on a copy of it.
+        generated_wallet_path = os.path.join(generated_path, wallet_name)
+        generation_time: Optional[float] = None
+        if not os.path.exists(generated_wallet_path + DATABASE_EXT):
+            start_time = time.perf_counter()
+            generate_wallet(generated_wallet_path, spec, _print_progress)
+            generation_time = time.perf_counter() - start_time
+            _print(f"generated {wallet_name} in {generation_time:.1f}s")
+        wallet_path = os.path.join(wallets_path, wallet_name)
+        shutil.copyfile(generated_wallet_path + DATABASE_EXT, wallet_path + DATABASE_EXT)
+
+        wallet = Wallet(WalletStorage(wallet_path))
+        account = wallet.get_default_account()
+        assert account is not None
+        generated = GeneratedWallet(wallet_path, account.get_id(), spec)
+
+        skipped: Dict[str, str] = {}
+        if RESTClient is None:
+            for case in CASES:
+                if case.requires_rest:
+                    skipped[case.name] = "the REST API example application is not available"
+        else:
+            rest_client = RESTClient(wallet, wallet_name + DATABASE_EXT, generated.account_id)
+
+        context = BenchmarkContext(wallet, generated, config, args.batch_size, rest_client)
+        case_results: Dict[str, Any] = {}
+        for case in CASES:
+            if case.name not in case_names or case.name in skipped:
+                continue
+            result = run_case(case, context, args.repeat).to_dict()
+            case_results[case.name] = result
+            _print(f"{case.name:<32} {result['median']*1000:>10.2f}ms "
+                f"({result['items']} items)")
+    finally:
+        if rest_client is not None:
+            rest_client.close()
+        if wallet is not None:
+            wallet.stop()
+        app_state.async_.__exit__(None, None, None)
+        if not args.data_dir:
+            shutil.rmtree(data_path)
+
+    results = {
+        "format_version": RESULTS_FORMAT_VERSION,
+        "electrumsv_version": PACKAGE_VERSION,
+        "git_revision": _get_git_revision(),
+        "date_created": int(time.time()),
+        "python_version": platform.python_version(),
+        "sqlite_version": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "spec": spec._asdict(),
+        "generation_time": generation_time,
+        "repeat": args.repeat,
+        "batch_size": args.batch_size,
+        "cases": case_results,
+        "skipped": skipped,
+    }
+    if args.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            _compare_results(json.load(f), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,263 @@
+"""
+The benchmarked operations.
+
+Each case is a function that does any setup that should not be timed, and returns the function
+that is timed. The timed function returns the number of items it processed, whether that is
+keys, transactions, coins, inputs or history entries, so that results at different scales can
+be compared per item. Cases are run in the order they are defined, and those that modify the
+wallet come last so that they do not affect the others.
+"""
+
+import random
+import statistics
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from bitcoinx import hash_to_hex_str, P2PKH_Address, Script, Tx, TxInput, TxOutput
+
+from electrumsv.app_state import app_state
+from electrumsv.constants import ScriptType, TxFlags
+from electrumsv.networks import Net
+from electrumsv.simple_config import SimpleConfig
+from electrumsv.transaction import Transaction, TransactionContext, XTxOutput
+from electrumsv.wallet import AbstractAccount, Wallet
+from electrumsv.wallet_database import SynchronousWriter
+
+from .generator import BENCHMARK_PASSWORD, GeneratedWallet
+
+try:
+    from .restapi import RESTClient
+except ImportError:
+    RESTClient = None # type: ignore
+
+
+TimedFunction = Callable[[], int]
+CaseFunction = Callable[['BenchmarkContext'], TimedFunction]
+
+
+class BenchmarkCase(NamedTuple):
+    name: str
+    function: CaseFunction
+    requires_rest: bool
+
+
+class CaseResult(NamedTuple):
+    times: List[float]
+    items: int
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "times": self.times,
+            "min": min(self.times),
+            "median": statistics.median(self.times),
+            "max": max(self.times),
+            "items": self.items,
+        }
+
+
+CASES: List[BenchmarkCase] = []
+
+
+def benchmark(name: str, requires_rest: bool=False) -> Callable[[CaseFunction], CaseFunction]:
+    def register(function: CaseFunction) -> CaseFunction:
+        CASES.append(BenchmarkCase(name, function, requires_rest))
+        return function
+    return register
+
+
+class BenchmarkContext:
+    def __init__(self, wallet: Wallet, generated: GeneratedWallet, config: SimpleConfig,
+            batch_size: int, rest_client: Optional['RESTClient']=None) -> None:
+        self.wallet = wallet
+        self.generated = generated
+        self.config = config
+        self.batch_size = batch_size
+        self.rest_client = rest_client
+        self.rng = random.Random(generated.spec.seed)
+
+    @property
+    def account(self) -> AbstractAccount:
+        account = self.wallet.get_account(self.generated.account_id)
+        assert account is not None
+        return account
+
+    def wait_for_writes(self) -> None:
+        # Writes are applied in the order they are queued, so once this one is done the ones
+        # queued before it are as well.
+        with SynchronousWriter() as writer:
+            self.wallet.get_db_context().queue_write(lambda db: None, writer.get_callback())
+            assert writer.succeeded()
+
+    def make_payment_transactions(self, count: int) -> List[Tuple[bytes, Transaction, int]]:
+        """
+        Make new transactions that pay random keys in the account, as if they had been received
+        from other parties.
+        """
+        account = self.account
+        key_ids = list(account.get_keyinstance_ids())
+        script_sig = Script() << bytes(72) << bytes(33)
+        results: List[Tuple[bytes, Transaction, int]] = []
+        for _i in range(count):
+            key_id = key_ids[self.rng.randrange(len(key_ids))]
+            tx = Tx(1, [ TxInput(self.rng.getrandbits(256).to_bytes(32, "big"), 0, script_sig,
+                0xffffffff) ], [ TxOutput(self.rng.randint(1000, 10000000),
+                account.get_script_for_id(key_id, ScriptType.P2PKH)) ], 0)
+            results.append((tx.hash(), Transaction.from_bytes(tx.to_bytes()), key_id))
+        return results
+
+    def make_unsigned_transaction(self) -> Transaction:
+        # Spending a tenth of the balance leaves the coin chooser with a real choice to make.
+        account = self.account
+        utxos = account.get_utxos()
+        value = sum(utxo.value for utxo in utxos) // 10
+        address = P2PKH_Address(self.rng.getrandbits(160).to_bytes(20, "big"), Net.COIN)
+        outputs = [ XTxOutput(value, address.to_script()) ] # type: ignore
+        return account.make_unsigned_transaction(utxos, outputs, self.config)
+
+
+def run_case(case: BenchmarkCase, context: BenchmarkContext, repeat: int) -> CaseResult:
+    times: List[float] = []
+    items = 0
+    for _i in range(repeat):
+        timed_function = case.function(context)
+        start_time = time.perf_counter()
+        items = timed_function()
+        times.append(time.perf_counter() - start_time)
+    return CaseResult(times, items)
+
+
+@benchmark("wallet_load_state")
+def bench_wallet_load_state(context: BenchmarkContext) -> TimedFunction:
+    def _run() -> int:
+        context.wallet.load_state()
+        return len(context.wallet.get_account_ids())
+    return _run
+
+
+@benchmark("account_load")
+def bench_account_load(context: BenchmarkContext) -> TimedFunction:
+    # Accounts are loaded on first access, and reloading the wallet state discards them.
+    context.wallet.load_state()
+    def _run() -> int:
+        return len(context.account.get_keyinstance_ids())
+    return _run
+
+
+@benchmark("get_balance")
+def bench_get_balance(context: BenchmarkContext) -> TimedFunction:
+    account = context.account
+    def _run() -> int:
+        account.get_balance()
+        return 1
+    return _run
+
+
+@benchmark("get_history")
+def bench_get_history(context: BenchmarkContext) -> TimedFunction:
+    account = context.account
+    def _run() -> int:
+        return len(account.get_history())
+    return _run
+
+
+@benchmark("get_utxos")
+def bench_get_utxos(context: BenchmarkContext) -> TimedFunction:
+    account = context.account
+    def _run() -> int:
+        return len(account.get_utxos())
+    return _run
+
+
+@benchmark("rest_get_balance", requires_rest=True)
+def bench_rest_get_balance(context: BenchmarkContext) -> TimedFunction:
+    assert context.rest_client is not None
+    def _run() -> int:
+        context.rest_client.get("/utxos/balance")
+        return 1
+    return _run
+
+
+@benchmark("rest_get_utxos", requires_rest=True)
+def bench_rest_get_utxos(context: BenchmarkContext) -> TimedFunction:
+    assert context.rest_client is not None
+    def _run() -> int:
+        return len(context.rest_client.get("/utxos")["utxos"])
+    return _run
+
+
+@benchmark("rest_get_coin_state", requires_rest=True)
+def bench_rest_get_coin_state(context: BenchmarkContext) -> TimedFunction:
+    assert context.rest_client is not None
+    def _run() -> int:
+        return sum(context.rest_client.get("/utxos/coin_state").values())
+    return _run
+
+
+@benchmark("rest_get_transaction_history", requires_rest=True)
+def bench_rest_get_transaction_history(context: BenchmarkContext) -> TimedFunction:
+    assert context.rest_client is not None
+    def _run() -> int:
+        return len(context.rest_client.get("/txs/history")["history"])
+    return _run
+
+
+@benchmark("make_unsigned_transaction")
+def bench_make_unsigned_transaction(context: BenchmarkContext) -> TimedFunction:
+    def _run() -> int:
+        return len(context.make_unsigned_transaction().inputs)
+    return _run
+
+
+@benchmark("sign_transaction")
+def bench_sign_transaction(context: BenchmarkContext) -> TimedFunction:
+    # The keystores are used directly, as signing through the account also adds the signed
+    # transaction to the wallet.
+    account = context.account
+    tx = context.make_unsigned_transaction()
+    def _run() -> int:
+        tx_context = TransactionContext()
+        account.obtain_supporting_data(tx, tx_context)
+        for keystore in account.get_keystores():
+            keystore.sign_transaction(tx, BENCHMARK_PASSWORD, tx_context)
+        assert tx.is_complete()
+        return len(tx.inputs)
+    return _run
+
+
+@benchmark("set_key_history")
+def bench_set_key_history(context: BenchmarkContext) -> TimedFunction:
+    account = context.account
+    histories: Dict[int, List[Tuple[str, int]]] = {}
+    for tx_hash, _tx, key_id in context.make_payment_transactions(context.batch_size):
+        history = histories.setdefault(key_id,
+            account.get_key_history(key_id, ScriptType.P2PKH))
+        history.append((hash_to_hex_str(tx_hash), 0))
+
+    async def _set_key_histories() -> None:
+        for key_id, history in histories.items():
+            await account.set_key_history(key_id, ScriptType.P2PKH, history, {})
+
+    def _run() -> int:
+        app_state.async_.spawn_and_wait(_set_key_histories)
+        return len(histories)
+    return _run
+
+
+@benchmark("add_transaction")
+def bench_add_transaction(context: BenchmarkContext) -> TimedFunction:
+    # The keys are told about the transactions first, as they would be by the indexer.
+    account = context.account
+    entries = context.make_payment_transactions(context.batch_size)
+    async def _set_key_histories() -> None:
+        for tx_hash, _tx, key_id in entries:
+            history = account.get_key_history(key_id, ScriptType.P2PKH)
+            history.append((hash_to_hex_str(tx_hash), 0))
+            await account.set_key_history(key_id, ScriptType.P2PKH, history, {})
+    app_state.async_.spawn_and_wait(_set_key_histories)
+
+    def _run() -> int:
+        for tx_hash, tx, _key_id in entries:
+            context.wallet.add_transaction(tx_hash, tx, TxFlags.StateCleared)
+        context.wait_for_writes()
+        return len(entries)
+    return _run
@@ -0,0 +1,185 @@
+"""
+Synthetic wallet generation.
+
+A generated wallet has one standard account with the given number of receiving keys. Each
+transaction pays one of those keys from an external source, and the oldest transactions are
+spent by their successors, until the requested number of unspent outputs remain. Everything is
+derived from the seed, so the same specification always generates the same wallet.
+
+The keys are created through the account, but the transactions and their outputs and deltas
+are written directly to the database in bulk. This is the state the wallet would have after
+it had synchronised them, and is written in a small fraction of the time it would take to
+process each one through the wallet.
+"""
+
+import random
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from bitcoinx import BIP32PrivateKey, P2PKH_Address, Script, Tx, TxInput, TxOutput
+
+from electrumsv.constants import (KeystoreTextType, RECEIVING_SUBPATH, ScriptType,
+    TransactionOutputFlag, TxFlags)
+from electrumsv.keystore import instantiate_keystore_from_text
+from electrumsv.networks import Net
+from electrumsv.storage import WalletStorage
+from electrumsv.wallet import Wallet
+from electrumsv.wallet_database import (SynchronousWriter, TransactionDeltaTable,
+    TransactionOutputTable, TransactionTable, TxData)
+from electrumsv.wallet_database.tables import (TransactionDeltaRow, TransactionInputRow,
+    TransactionOutputRow, TransactionRow)
+
+
+BENCHMARK_PASSWORD = "benchmark"
+
+TRANSACTIONS_PER_BLOCK = 20
+# The local height is far enough past the last transaction that all of them are mature.
+CONFIRMATION_DEPTH = 200
+DATE_BASE = 1577836800
+WRITE_BATCH_SIZE = 10000
+
+ProgressCallback = Callable[[str, int, int], None]
+
+
+class WalletSpec(NamedTuple):
+    key_count: int
+    transaction_count: int
+    utxo_count: int
+    seed: int = 1
+
+    def validate(self) -> None:
+        if self.key_count < 1 or self.transaction_count < 1:
+            raise ValueError("there must be at least one key and one transaction")
+        if not 0 < self.utxo_count <= self.transaction_count:
+            raise ValueError("the unspent output count must be between 1 and the transaction "
+                "count")
+
+    def get_local_height(self) -> int:
+        return self.get_block_height(self.transaction_count - 1) + CONFIRMATION_DEPTH
+
+    def get_block_height(self, transaction_index: int) -> int:
+        return 1 + transaction_index // TRANSACTIONS_PER_BLOCK
+
+
+SCALES: Dict[str, WalletSpec] = {
+    "tiny": WalletSpec(1000, 1000, 500),
+    "small": WalletSpec(10000, 10000, 5000),
+    "medium": WalletSpec(100000, 100000, 50000),
+    "large": WalletSpec(1000000, 1000000, 500000),
+}
+
+
+class GeneratedWallet(NamedTuple):
+    wallet_path: str
+    account_id: int
+    spec: WalletSpec
+
+
+def _random_bytes(rng: random.Random, count: int) -> bytes:
+    return rng.getrandbits(count * 8).to_bytes(count, "big")
+
+
+def _report(progress: Optional[ProgressCallback], stage: str, done: int, total: int) -> None:
+    if progress is not None:
+        progress(stage, done, total)
+
+
+def generate_wallet(wallet_path: str, spec: WalletSpec,
+        progress: Optional[ProgressCallback]=None) -> GeneratedWallet:
+    """
+    Generate a wallet at the given path, which must not already exist. The application state
+    must be set up before this is called.
+    """
+    spec.validate()
+    rng = random.Random(spec.seed)
+
+    storage = WalletStorage.create(wallet_path, BENCHMARK_PASSWORD)
+    storage.put("stored_height", spec.get_local_height())
+    wallet = Wallet(storage)
+    try:
+        xprv = BIP32PrivateKey.from_seed(_random_bytes(rng, 32), Net.COIN)
+        keystore = instantiate_keystore_from_text(KeystoreTextType.EXTENDED_PRIVATE_KEY,
+            xprv.to_extended_key_string(), BENCHMARK_PASSWORD)
+        account = wallet.create_account_from_keystore(keystore)
+
+        key_ids: List[int] = []
+        while len(key_ids) < spec.key_count:
+            count = min(WRITE_BATCH_SIZE, spec.key_count - len(key_ids))
+            key_ids.extend(key.keyinstance_id
+                for key in account.create_keys(count, RECEIVING_SUBPATH))
+            _report(progress, "keys", len(key_ids), spec.key_count)
+
+        scripts: Dict[int, Script] = {}
+        for i in range(0, len(key_ids), WRITE_BATCH_SIZE):
+            for key_id, script_type, script in account.get_possible_scripts_for_ids(
+                    key_ids[i:i+WRITE_BATCH_SIZE]):
+                if script_type == ScriptType.P2PKH:
+                    scripts[key_id] = script
+            _report(progress, "scripts", len(scripts), spec.key_count)
+
+        _write_transactions(wallet, spec, rng, key_ids, scripts, progress)
+    finally:
+        wallet.stop()
+
+    return GeneratedWallet(wallet_path, account.get_id(), spec)
+
+
+def _write_transactions(wallet: Wallet, spec: WalletSpec, rng: random.Random,
+        key_ids: List[int], scripts: Dict[int, Script],
+        progress: Optional[ProgressCallback]) -> None:
+    spent_count = spec.transaction_count - spec.utxo_count
+    # A placeholder signature and public key push, to give the inputs their usual size.
+    script_sig = Script() << bytes(72) << bytes(33)
+    db_context = wallet.get_db_context()
+
+    previous: Optional[Tuple[bytes, int, int]] = None
+    for batch_start in range(0, spec.transaction_count, WRITE_BATCH_SIZE):
+        tx_rows: List[TransactionRow] = []
+        input_rows: List[TransactionInputRow] = []
+        txo_rows: List[TransactionOutputRow] = []
+        delta_rows: List[TransactionDeltaRow] = []
+        batch_end = min(batch_start + WRITE_BATCH_SIZE, spec.transaction_count)
+        for i in range(batch_start, batch_end):
+            key_id = key_ids[rng.randrange(len(key_ids))]
+            value = rng.randint(1000, 10000000)
+
+            inputs = [ TxInput(_random_bytes(rng, 32), 0, script_sig, 0xffffffff) ]
+            deltas: Dict[int, int] = { key_id: value }
+            if previous is not None and i <= spent_count:
+                previous_tx_hash, previous_key_id, previous_value = previous
+                inputs.append(TxInput(previous_tx_hash, 0, script_sig, 0xffffffff))
+                deltas[previous_key_id] = deltas.get(previous_key_id, 0) - previous_value
+            outputs = [
+                TxOutput(value, scripts[key_id]),
+                TxOutput(rng.randint(1000, 10000000),
+                    P2PKH_Address(_random_bytes(rng, 20), Net.COIN).to_script()),
+            ]
+            tx = Tx(1, inputs, outputs, 0)
+            tx_hash = tx.hash()
+
+            date_added = DATE_BASE + i * 60
+            tx_rows.append(TransactionRow(tx_hash, TxData(height=spec.get_block_height(i),
+                position=1 + i % TRANSACTIONS_PER_BLOCK, fee=200, date_added=date_added,
+                date_updated=date_added), tx.to_bytes(), TxFlags.StateSettled, None))
+            input_rows.extend(TransactionInputRow(txin.prev_hash, txin.prev_idx, tx_hash)
+                for txin in inputs)
+            txo_rows.append(TransactionOutputRow(tx_hash, 0, value, key_id,
+                TransactionOutputFlag.IS_SPENT if i < spent_count else
+                TransactionOutputFlag.NONE))
+            delta_rows.extend(TransactionDeltaRow(tx_hash, delta_key_id, value_delta)
+                for delta_key_id, value_delta in deltas.items())
+            previous = tx_hash, key_id, value
+
+        with TransactionTable(db_context) as table:
+            with SynchronousWriter() as writer:
+                table.create(tx_rows, completion_callback=writer.get_callback(),
+                    input_rows=input_rows)
+                assert writer.succeeded()
+        with TransactionOutputTable(db_context) as table:
+            with SynchronousWriter() as writer:
+                table.create(txo_rows, completion_callback=writer.get_callback())
+                assert writer.succeeded()
+        with TransactionDeltaTable(db_context) as table:
+            with SynchronousWriter() as writer:
+                table.create(delta_rows, completion_callback=writer.get_callback())
+                assert writer.succeeded()
+        _report(progress, "transactions", batch_end, spec.transaction_count)
@@ -0,0 +1,59 @@
+"""
+Access to the REST API example application handlers for the benchmarks.
+
+The handlers are served by a local aiohttp test server, so that the timings include the request
+handling and response encoding the same as they would for a real client.
+"""
+
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from electrumsv.app_state import app_state
+from electrumsv.wallet import Wallet
+
+from examples.applications.restapi.handlers import ExtensionEndpoints
+
+
+class _BenchmarkDaemon:
+    # The handlers look up the wallets they are asked for through the daemon.
+    def __init__(self, wallet: Wallet) -> None:
+        self._wallet = wallet
+
+    def get_wallet(self, wallet_path: str) -> Wallet:
+        return self._wallet
+
+
+class RESTClient:
+    def __init__(self, wallet: Wallet, wallet_name: str, account_id: int) -> None:
+        app_state.daemon = _BenchmarkDaemon(wallet)
+        self._endpoints = ExtensionEndpoints()
+        self._account_path = (ExtensionEndpoints.WALLETS_TLD.format(network="main") +
+            f"/{wallet_name}/{account_id}")
+        self._client: Optional[TestClient] = None
+        app_state.async_.spawn_and_wait(self._start)
+
+    async def _start(self) -> None:
+        app = web.Application()
+        app.add_routes(self._endpoints.routes)
+        self._client = TestClient(TestServer(app))
+        await self._client.start_server()
+
+    def close(self) -> None:
+        if self._client is not None:
+            app_state.async_.spawn_and_wait(self._client.close)
+            self._client = None
+
+    def get(self, path: str) -> Dict[str, Any]:
+        """
+        Make a request to the given path under the account, and return the decoded response.
+        """
+        return app_state.async_.spawn_and_wait(self._get, path)
+
+    async def _get(self, path: str) -> Dict[str, Any]:
+        assert self._client is not None
+        response = await self._client.get(self._account_path + path)
+        if response.status != 200:
+            raise Exception(f"request {path} failed: {response.status} {await response.text()}")
+        return await response.json()
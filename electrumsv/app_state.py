@@ -32,14 +32,17 @@ app_state.func()
 
 etc.
 '''
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import os
+import threading
 import time
 from typing import Optional, Tuple, Union
 
 from bitcoinx import Headers
 
 from .async_ import ASync
-from .constants import MAX_INCOMING_ELECTRUMX_MESSAGE_MB
+from .constants import MAX_INCOMING_ELECTRUMX_MESSAGE_MB, MAXIMUM_DERIVATION_WORKERS
 from .logs import logs
 from .networks import Net
 from .simple_config import SimpleConfig
@@ -87,6 +90,8 @@ class AppStateProxy(object):
         self.decimal_point = config.get('decimal_point', 8)
         self.num_zeros = config.get('num_zeros', 0)
         self.async_ = ASync()
+        self._derivation_pool: Optional[ProcessPoolExecutor] = None
+        self._derivation_pool_lock = threading.Lock()
 
     def has_app(self):
         return self.app is not None
@@ -145,6 +150,26 @@ class AppStateProxy(object):
         assert maximum_size >= 0, f"invalid cache size {maximum_size}"
         self.config.set_key('electrumx_message_size_limit', max(0, maximum_size))
 
+    def derivation_pool(self) -> ProcessPoolExecutor:
+        """
+        The processes that large numbers of public keys are derived in, started on first use.
+        The workers are spawned rather than forked, as forking copies the threads and locks of
+        the running application.
+        """
+        with self._derivation_pool_lock:
+            if self._derivation_pool is None:
+                worker_count = min(MAXIMUM_DERIVATION_WORKERS, os.cpu_count() or 1)
+                self._derivation_pool = ProcessPoolExecutor(max_workers=worker_count,
+                    mp_context=multiprocessing.get_context("spawn"))
+            return self._derivation_pool
+
+    def shutdown_derivation_pool(self) -> None:
+        with self._derivation_pool_lock:
+            derivation_pool = self._derivation_pool
+            self._derivation_pool = None
+        if derivation_pool is not None:
+            derivation_pool.shutdown(wait=True)
+
 
 
 class _AppStateMeta(type):
@@ -23,21 +23,37 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from bisect import bisect_left, bisect_right
 from collections import defaultdict, namedtuple
+from itertools import accumulate
 from math import floor, log10
-from typing import List
+from operator import attrgetter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TYPE_CHECKING
 
 from bitcoinx import sha256
 
 from .bitcoin import COIN
 from .logs import logs
-from .transaction import Transaction, XTxOutput
+from .simple_config import SimpleConfig
+from .transaction import Transaction, TxSizeEstimator, XTxOutput
 from .exceptions import NotEnoughFunds
 
+if TYPE_CHECKING:
+    from .wallet import AbstractAccount, UTXO
+
 
 logger = logs.get_logger("coinchooser")
 
 
+def coins_by_value(utxos: Iterable['UTXO']) -> Tuple[List['UTXO'], List[int], List[int]]:
+    '''Returns the coins ordered by value, their values and the running totals of their values,
+    where totals[i] is the value of the coins before index i.  Coins of the same value are
+    left in the order they are given in.'''
+    coins = sorted(utxos, key=attrgetter("value"))
+    values = list(map(attrgetter("value"), coins))
+    return coins, values, [ 0, *accumulate(values) ]
+
+
 # A simple deterministic PRNG.  Used to deterministically shuffle a
 # set of coins - the same set of coins should produce the same output.
 # Although choosing UTXOs "randomly" we want it to be deterministic,
@@ -172,11 +188,14 @@ class CoinChooserBase:
             logger.debug('not keeping dust %s', dust)
         return change, dust
 
-    def make_tx(self, coins, outputs, change_outs, fee_estimator, dust_threshold) -> Transaction:
+    def make_tx(self, utxos: List['UTXO'], outputs: List[XTxOutput],
+            change_outs: List[XTxOutput], fee_estimator: Callable[[int], int],
+            dust_threshold: int, account: 'AbstractAccount') -> Transaction:
         '''Select unspent coins to spend to pay outputs.  If the change is
         greater than dust_threshold (after adding the change output to
         the transaction) it is kept, otherwise none is sent and it is
         added to the transaction fee.'''
+        coins = [utxo.to_tx_input(account) for utxo in utxos]
 
         # Deterministic randomness from coins
         self.p = PRNG(b''.join(sorted(c.prevout_bytes() for c in coins)))
@@ -184,14 +203,15 @@ class CoinChooserBase:
         # Copy the ouputs so when adding change we don't modify "outputs"
         tx = Transaction.from_io([], outputs)
         # Size of the transaction with no inputs and no change
-        base_size = tx.estimated_size()
+        size_estimator = TxSizeEstimator.from_transaction(tx)
         spent_amount = tx.output_value()
 
         def sufficient_funds(buckets):
             '''Given a list of buckets, return True if it has enough
             value to pay for the transaction'''
             total_input = sum(bucket.value for bucket in buckets)
-            total_size = sum(bucket.size for bucket in buckets) + base_size
+            total_size = size_estimator.size_with(sum(len(bucket.coins) for bucket in buckets),
+                sum(bucket.size for bucket in buckets))
             return total_input >= spent_amount + fee_estimator(total_size)
 
         # Collect the coins into buckets, choose a subset of the buckets
@@ -200,11 +220,12 @@ class CoinChooserBase:
                                       self.penalty_func(tx))
 
         tx.inputs.extend(coin for b in buckets for coin in b.coins)
-        tx_size = base_size + sum(bucket.size for bucket in buckets)
+        size_estimator.add_input_size(sum(bucket.size for bucket in buckets), len(tx.inputs))
 
         # This takes a count of change outputs and returns a tx fee;
         change_output_size = change_outs[0].estimated_size()
-        fee = lambda count: fee_estimator(tx_size + count * change_output_size)
+        fee = lambda count: fee_estimator(size_estimator.size_with(0, 0, count,
+            count * change_output_size))
         change, dust = self.change_outputs(tx, change_outs, fee, dust_threshold)
         tx.outputs.extend(change)
 
@@ -283,3 +304,177 @@ class CoinChooserPrivacy(CoinChooserRandom):
             return badness
 
         return penalty
+
+class CoinChooserBranchAndBound(CoinChooserBase):
+    '''Scales to accounts with very many coins.  The coins are ordered by value, which the
+    account keeps them indexed by so that they are not sorted for every transaction, and a
+    depth-first branch and bound search over them looks for a selection that pays the outputs
+    and fee with so little left over that a change output is not worth making.  The search
+    gives up after a fixed number of steps, in which case the smallest coin that can pay with
+    change on its own is spent, or failing that the largest coins are.  Only the coins that
+    are spent are turned into transaction inputs.
+    '''
+
+    max_tries = 100000
+
+    def make_tx(self, utxos: List['UTXO'], outputs: List[XTxOutput],
+            change_outs: List[XTxOutput], fee_estimator: Callable[[int], int],
+            dust_threshold: int, account: 'AbstractAccount') -> Transaction:
+        # Copy the ouputs so when adding change we don't modify "outputs"
+        tx = Transaction.from_io([], outputs)
+        # Size of the transaction with no inputs and no change
+        size_estimator = TxSizeEstimator.from_transaction(tx)
+        change_output_size = change_outs[0].estimated_size()
+
+        coins, values, totals = account.get_coins_by_value(utxos)
+        indexes, inputs_size = self.choose_coins(coins, values, totals, size_estimator,
+            tx.output_value(), change_output_size, fee_estimator, dust_threshold, account)
+        tx.inputs.extend(coins[index].to_tx_input(account) for index in indexes)
+        # Deterministic randomness from the chosen coins, which are themselves chosen
+        # deterministically.
+        self.p = PRNG(b''.join(sorted(txin.prevout_bytes() for txin in tx.inputs)))
+
+        # This takes a count of change outputs and returns a tx fee;
+        size_estimator.add_input_size(inputs_size, len(indexes))
+        fee = lambda count: fee_estimator(size_estimator.size_with(0, 0, count,
+            count * change_output_size))
+        change, dust = self.change_outputs(tx, change_outs, fee, dust_threshold)
+        tx.outputs.extend(change)
+
+        logger.debug("using %d inputs", len(tx.inputs))
+        return tx
+
+    def choose_coins(self, coins: Sequence['UTXO'], values: List[int], totals: List[int],
+            size_estimator: TxSizeEstimator, spent_amount: int,
+            change_output_size: int, fee_estimator: Callable[[int], int], dust_threshold: int,
+            account: 'AbstractAccount') -> Tuple[List[int], int]:
+        '''Returns the indexes of the chosen coins, which are ordered by ascending value, and
+        the estimated size of their inputs.  The values of the coins and their running totals,
+        where totals[i] is the value of the coins before index i, are given with them.'''
+        if totals[-1] < spent_amount + fee_estimator(size_estimator.size()):
+            raise NotEnoughFunds()
+
+        sizes: Dict[int, int] = {}
+        def get_size(index: int) -> int:
+            size = sizes.get(index)
+            if size is None:
+                size = sizes[index] = account.estimate_input_size(coins[index])
+            return size
+
+        # Any excess up to this is lost to the fee, rather than paid to a dust change output.
+        cost_of_change = fee_estimator(size_estimator.size_with(0, 0, 1, change_output_size)) - \
+            fee_estimator(size_estimator.size()) + dust_threshold
+        result = self._branch_and_bound(values, totals, get_size, size_estimator,
+            spent_amount, cost_of_change, fee_estimator)
+        if result is None:
+            result = self._select_with_change(values, get_size, size_estimator,
+                spent_amount, change_output_size, fee_estimator, dust_threshold)
+        logger.debug("chose %d of %d coins", len(result[0]), len(coins))
+        return result
+
+    def _branch_and_bound(self, values: List[int], totals: List[int],
+            get_size: Callable[[int], int], size_estimator: TxSizeEstimator,
+            spent_amount: int, cost_of_change: int, fee_estimator: Callable[[int], int]) \
+                -> Optional[Tuple[List[int], int]]:
+        # The coins are tried from the largest down, and index is the next one to try.
+        selected: List[int] = []
+        selected_value = selected_size = 0
+        index = len(values) - 1
+        for _try in range(self.max_tries):
+            fee = fee_estimator(size_estimator.size_with(len(selected), selected_size))
+            excess = selected_value - spent_amount - fee
+            if excess >= 0:
+                if excess <= cost_of_change:
+                    return selected, selected_size
+                backtrack = True
+            else:
+                # Backtrack if even all the smaller coins are not enough.
+                backtrack = selected_value + totals[index + 1] < spent_amount + fee
+            if backtrack:
+                if not selected:
+                    return None
+                # Leave out the last coin included, and the coins of the same value before it
+                # as they would only lead to the same selections.
+                last_index = selected.pop()
+                selected_value -= values[last_index]
+                selected_size -= get_size(last_index)
+                index = bisect_left(values, values[last_index], 0, last_index) - 1
+                continue
+
+            size = get_size(index)
+            marginal_fee = fee_estimator(size_estimator.size_with(len(selected) + 1,
+                selected_size + size)) - fee
+            # Skip straight past the coins that would overpay on their own, taking the inputs
+            # that spend them to be the same size as this one.
+            index = bisect_right(values, cost_of_change - excess + marginal_fee, 0,
+                index + 1) - 1
+            if index < 0:
+                continue
+            size = get_size(index)
+            # A coin that costs more in fee than it is worth can never help.
+            if values[index] > fee_estimator(size_estimator.size_with(len(selected) + 1,
+                    selected_size + size)) - fee:
+                selected.append(index)
+                selected_value += values[index]
+                selected_size += size
+            index -= 1
+        return None
+
+    def _select_with_change(self, values: List[int], get_size: Callable[[int], int],
+            size_estimator: TxSizeEstimator, spent_amount: int, change_output_size: int,
+            fee_estimator: Callable[[int], int], dust_threshold: int) -> Tuple[List[int], int]:
+        def with_change(count: int, value: int, size: int) -> bool:
+            return value >= spent_amount + dust_threshold + \
+                fee_estimator(size_estimator.size_with(count, size, 1, change_output_size))
+
+        # The smallest coin that can pay on its own.  The coins that cannot pay even before the
+        # size of their input is counted are skipped.
+        minimum_value = spent_amount + dust_threshold + \
+            fee_estimator(size_estimator.size_with(0, 0, 1, change_output_size))
+        for index in range(bisect_left(values, minimum_value), len(values)):
+            size = get_size(index)
+            if with_change(1, values[index], size):
+                return [ index ], size
+
+        # Otherwise the largest coins until they can pay.
+        selected: List[int] = []
+        selected_value = selected_size = 0
+        for index in range(len(values) - 1, -1, -1):
+            size = get_size(index)
+            if values[index] <= fee_estimator(size_estimator.size_with(len(selected) + 1,
+                    selected_size + size)) - \
+                    fee_estimator(size_estimator.size_with(len(selected), selected_size)):
+                # None of the smaller coins are worth spending either.
+                break
+            selected.append(index)
+            selected_value += values[index]
+            selected_size += size
+            if with_change(len(selected), selected_value, selected_size):
+                return selected, selected_size
+
+        # The change would be dust, but that does not matter if there is enough without it.
+        if selected_value < spent_amount + \
+                fee_estimator(size_estimator.size_with(len(selected), selected_size)):
+            raise NotEnoughFunds()
+        return selected, selected_size
+
+
+COIN_CHOOSERS = {
+    'BranchAndBound': CoinChooserBranchAndBound,
+    'Privacy': CoinChooserPrivacy,
+}
+
+DEFAULT_COIN_CHOOSER = 'Privacy'
+# If no coin chooser has been picked, coins are chosen by branch and bound when there are more
+# than this many of them. The privacy chooser takes seconds with a few thousand coins.
+LARGE_COIN_COUNT = 1000
+LARGE_COIN_CHOOSER = 'BranchAndBound'
+
+def get_name(config: SimpleConfig, coin_count: int=0) -> str:
+    kind = config.get('coin_chooser')
+    if kind not in COIN_CHOOSERS:
+        kind = LARGE_COIN_CHOOSER if coin_count > LARGE_COIN_COUNT else DEFAULT_COIN_CHOOSER
+    return kind
+
+def get_coin_chooser(config: SimpleConfig, coin_count: int=0) -> CoinChooserBase:
+    return COIN_CHOOSERS[get_name(config, coin_count)]()
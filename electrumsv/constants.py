@@ -28,7 +28,7 @@ class StorageKind(IntEnum):
 
 DATABASE_EXT = ".sqlite"
 MIGRATION_FIRST = 22
-MIGRATION_CURRENT = 26
+MIGRATION_CURRENT = 28
 
 class TxFlags(IntFlag):
     Unset = 0
@@ -199,6 +199,12 @@ MINIMUM_TXDATA_CACHE_SIZE_MB = 0
 DEFAULT_TXDATA_CACHE_SIZE_MB = 32
 MAXIMUM_TXDATA_CACHE_SIZE_MB = 2147483647 # Maximum the spinbox widget can handle :-()
 
+# The default number of entries in a page of account history.
+HISTORY_PAGE_SIZE = 200
+
+# The most processes large numbers of public keys are derived in at once.
+MAXIMUM_DERIVATION_WORKERS = 4
+
 DEFAULT_COSIGNER_COUNT = 2
 MAXIMUM_COSIGNER_COUNT = 15
 
@@ -25,7 +25,7 @@
 
 import ast
 import base64
-from typing import Any, cast, Dict, Optional, Tuple, Union
+from typing import Any, Callable, cast, Dict, List, Optional, Tuple, Union
 import os
 import time
 import jsonrpclib
@@ -36,7 +36,9 @@ from .commands import known_commands, Commands
 from .exchange_rate import FxTask
 from .jsonrpc import VerifyingJSONRPCServer
 from .logs import logs
+from .metrics import metrics
 from .network import Network
+from .profiling import profiling, PROFILES_DIRECTORY_NAME, ProfilingError
 from .simple_config import SimpleConfig
 from .storage import WalletStorage
 from .util import json_decode, DaemonThread, to_string, random_integer, get_wallet_name_from_path
@@ -47,6 +49,20 @@ from .restapi_endpoints import DefaultEndpoints
 
 logger = logs.get_logger("daemon")
 
+write_queue_metric = metrics.gauge("electrumsv_database_write_queue_depth",
+    "The number of database writes waiting to be committed, by wallet.", ("wallet",))
+write_entry_metric = metrics.counter("electrumsv_database_writes_total",
+    "The number of database writes committed, by wallet.", ("wallet",))
+cache_hit_metric = metrics.counter("electrumsv_transaction_cache_hits_total",
+    "The number of transaction cache lookups that found the transaction, by wallet.",
+    ("wallet",))
+cache_miss_metric = metrics.counter("electrumsv_transaction_cache_misses_total",
+    "The number of transaction cache lookups that did not find the transaction, by wallet.",
+    ("wallet",))
+cache_size_metric = metrics.gauge("electrumsv_transaction_cache_bytes",
+    "The size of the transactions held in the transaction cache, by wallet.", ("wallet",))
+wallet_metric = metrics.gauge("electrumsv_wallets", "The number of loaded wallets.")
+
 
 def get_lockfile(config: SimpleConfig) -> str:
     return os.path.join(config.path, 'daemon')
@@ -163,12 +179,36 @@ class Daemon(DaemonThread):
         # self.init_thread_watcher()
         self.is_gui = is_gui
 
+        self._register_metrics()
+
         # REST API - (asynchronous)
         self.rest_server = None
         if app_state.config.get("restapi"):
             self.init_restapi_server(config, fd)
             self.configure_restapi_server()
 
+    def _register_metrics(self) -> None:
+        # These values are already tracked by the wallets, so they are read when the metrics
+        # are collected rather than recorded as they change.
+        def get_wallet_values(get_value: Callable[[Wallet], float]) \
+                -> Callable[[], Dict[Tuple[str, ...], float]]:
+            def get_values() -> Dict[Tuple[str, ...], float]:
+                return { (wallet.name(),): get_value(wallet)
+                    for wallet in list(self.wallets.values()) }
+            return get_values
+
+        write_queue_metric.set_function(get_wallet_values(
+            lambda wallet: wallet.get_db_context().get_write_statistics().queue_depth))
+        write_entry_metric.set_function(get_wallet_values(
+            lambda wallet: wallet.get_db_context().get_write_statistics().entry_count))
+        cache_hit_metric.set_function(get_wallet_values(
+            lambda wallet: wallet.get_cache_statistics_for_tx_bytedata().hits))
+        cache_miss_metric.set_function(get_wallet_values(
+            lambda wallet: wallet.get_cache_statistics_for_tx_bytedata().misses))
+        cache_size_metric.set_function(get_wallet_values(
+            lambda wallet: wallet.get_cache_statistics_for_tx_bytedata().current_size))
+        wallet_metric.set_function(lambda: { (): len(self.wallets) })
+
     def configure_restapi_server(self):
         self.default_api = DefaultEndpoints()
         self.rest_server.register_routes(self.default_api)
@@ -206,6 +246,10 @@ class Daemon(DaemonThread):
         server.register_function(self.run_gui, 'gui')
         server.register_function(self.run_daemon, 'daemon')
         server.register_function(self.run_cmdline, 'run_cmdline')
+        server.register_function(self.get_metrics, 'metrics')
+        server.register_function(self.start_profiling, 'profiling_start')
+        server.register_function(self.stop_profiling, 'profiling_stop')
+        server.register_function(self.get_profiling_status, 'profiling_status')
 
     def init_thread_watcher(self) -> None:
         import threading
@@ -230,10 +274,34 @@ class Daemon(DaemonThread):
     def ping(self) -> bool:
         return True
 
+    def get_metrics(self, format: str="json") -> Union[str, Dict[str, Any]]:
+        if format == "prometheus":
+            return metrics.to_prometheus_text()
+        return metrics.to_dict()
+
+    def start_profiling(self, mode: str=profiling.SAMPLE, interval: Optional[float]=None,
+            threads: Optional[List[str]]=None, targets: Optional[List[str]]=None) \
+                -> Dict[str, Any]:
+        try:
+            return profiling.start(mode, self.config.file_path(PROFILES_DIRECTORY_NAME),
+                interval, threads, targets)
+        except ProfilingError as e:
+            return {'error': str(e)}
+
+    def stop_profiling(self) -> Dict[str, Any]:
+        try:
+            return profiling.stop()
+        except ProfilingError as e:
+            return {'error': str(e)}
+
+    def get_profiling_status(self) -> Dict[str, Any]:
+        return profiling.get_status()
+
     def run_daemon(self, config_options: dict) -> Union[bool, str, Dict[str, Any]]:
         config = SimpleConfig(config_options)
         sub = config.get('subcommand')
-        assert sub in [None, 'start', 'stop', 'status', 'load_wallet', 'close_wallet']
+        assert sub in [None, 'start', 'stop', 'status', 'load_wallet', 'close_wallet',
+            'metrics']
         response: Union[bool, str, Dict[str, Any]]
         if sub in [None, 'start']:
             response = "Daemon already running"
@@ -262,6 +330,8 @@ class Daemon(DaemonThread):
                 })
             else:
                 response = "Daemon offline"
+        elif sub == 'metrics':
+            response = metrics.to_dict()
         elif sub == 'stop':
             self.stop()
             response = "Daemon stopped"
@@ -374,5 +444,7 @@ class Daemon(DaemonThread):
     def stop(self) -> None:
         logger.warning("stopping")
         super().stop()
+        if profiling.is_active():
+            profiling.stop()
         self.stop_wallets()
         remove_lockfile(get_lockfile(self.config))
@@ -27,7 +27,7 @@ from electrumsv.i18n import _
 from electrumsv.keystore import Hardware_KeyStore
 from electrumsv.logs import logs
 from electrumsv.platform import platform
-from electrumsv.transaction import Transaction, TransactionContext
+from electrumsv.transaction import SigningSession, Transaction, TransactionContext
 from electrumsv.util import to_string
 
 from ..hw_wallet import HW_PluginBase
@@ -524,6 +524,9 @@ class DigitalBitbox_KeyStore(Hardware_KeyStore):
             pubkeyarray = []
 
             # Build hasharray from inputs
+            signing_session = tx_context.signing_session
+            if signing_session is None:
+                signing_session = SigningSession(tx)
             for txin in tx.inputs:
                 if txin.type() != ScriptType.P2PKH:
                     p2pkhTransaction = False
@@ -533,7 +536,7 @@ class DigitalBitbox_KeyStore(Hardware_KeyStore):
                         key_derivation = x_pubkey.bip32_path()
                         assert len(key_derivation) == 2
                         inputPath = "%s/%d/%d" % (self.get_derivation(), *key_derivation)
-                        inputHash = tx.preimage_hash(txin)
+                        inputHash = signing_session.preimage_hash(txin)
                         hasharray_i = {'hash': inputHash.hex(), 'keypath': inputPath}
                         hasharray.append(hasharray_i)
                         inputhasharray.append(inputHash)
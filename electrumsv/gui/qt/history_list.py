@@ -38,12 +38,12 @@ from PyQt5.QtWidgets import QLabel, QMenu, QTreeWidgetItem, QVBoxLayout, QWidget
 
 from electrumsv.app_state import app_state
 from electrumsv.bitcoin import COINBASE_MATURITY
-from electrumsv.constants import TxFlags
+from electrumsv.constants import HISTORY_PAGE_SIZE, TxFlags
 from electrumsv.i18n import _
 from electrumsv.logs import logs
 from electrumsv.platform import platform
 from electrumsv.util import timestamp_to_datetime, profiler, format_time
-from electrumsv.wallet import AbstractAccount
+from electrumsv.wallet import AbstractAccount, HistoryLine
 import electrumsv.web as web
 
 from .constants import ICON_NAME_INVOICE_PAYMENT
@@ -120,8 +120,11 @@ class HistoryList(MyTreeWidget):
         self._account_id: Optional[int] = None
         self._account: AbstractAccount = None
         self._wallet = main_window._wallet
+        # The history is loaded a page at a time as the user scrolls down to the end of it.
+        self._history_cursor: Optional[str] = None
 
         self._main_window.account_change_signal.connect(self._on_account_change)
+        self.verticalScrollBar().valueChanged.connect(self._on_scroll_value_changed)
 
         self.update_tx_headers()
 
@@ -139,6 +142,7 @@ class HistoryList(MyTreeWidget):
 
     def _on_account_change(self, new_account_id: int, new_account: AbstractAccount) -> None:
         self.clear()
+        self._history_cursor = None
         old_account_id = self._account_id
         self._account_id = new_account_id
         self._account = new_account
@@ -170,12 +174,26 @@ class HistoryList(MyTreeWidget):
     def _on_update_history_list(self) -> None:
         item = self.currentItem()
         current_tx_hash = item.data(Columns.STATUS, self.TX_ROLE) if item else None
+        # Reload as much of the history as was previously loaded, so the view is not reset.
+        row_count = max(HISTORY_PAGE_SIZE, self.topLevelItemCount())
         self.clear()
+        self._history_cursor = None
         if self._account is None:
             return
         fx = app_state.fx
         if fx:
             fx.history_used_spot = False
+        self._load_history_page(row_count, None, current_tx_hash)
+
+    def _on_scroll_value_changed(self, value: int) -> None:
+        if self._history_cursor is not None and value == self.verticalScrollBar().maximum():
+            self._load_history_page(HISTORY_PAGE_SIZE, self._history_cursor, None)
+
+    def _load_history_page(self, limit: int, cursor: Optional[str],
+            current_tx_hash: Optional[bytes]) -> None:
+        lines, self._history_cursor = self._account.get_history_page(cursor, limit,
+            self.get_domain())
+
         local_height = self._wallet.get_local_height()
         server_height = self._main_window.network.get_server_height() if self._main_window.network \
             else 0
@@ -183,9 +201,7 @@ class HistoryList(MyTreeWidget):
         chain = app_state.headers.longest_chain()
         missing_header_heights = []
         items = []
-        for line, balance in self._account.get_history(self.get_domain()):
-            tx_id = hash_to_hex_str(line.tx_hash)
-            conf = 0 if line.height <= 0 else max(local_height - line.height + 1, 0)
+        for line, balance in lines:
             timestamp = False
             if line.height > 0:
                 try:
@@ -196,43 +212,9 @@ class HistoryList(MyTreeWidget):
                     else:
                         logger.debug("Unable to backfill header at %d (> %d)",
                             line.height, server_height)
-            status = get_tx_status(self._account, line.tx_hash, line.height, conf, timestamp)
-            status_str = get_tx_desc(status, timestamp)
-            v_str = app_state.format_amount(line.value_delta, True, whitespaces=True)
-            balance_str = app_state.format_amount(balance, whitespaces=True)
-            label = self._wallet.get_transaction_label(line.tx_hash)
-            entry = [None, tx_id, status_str, label, v_str, balance_str]
-            if fx and fx.show_history():
-                date = timestamp_to_datetime(time.time() if conf <= 0 else timestamp)
-                for amount in [line.value_delta, balance]:
-                    text = fx.historical_value_str(amount, date)
-                    entry.append(text)
-
-            item = SortableTreeWidgetItem(entry)
-            # If there is no text,
-            item.setIcon(Columns.STATUS, get_tx_icon(status))
-            item.setToolTip(Columns.STATUS, get_tx_tooltip(status, conf))
-            if line.tx_flags & TxFlags.PaysInvoice:
-                item.setIcon(Columns.DESCRIPTION, self.invoiceIcon)
-            for i in range(len(entry)):
-                if i > Columns.DESCRIPTION:
-                    item.setTextAlignment(i, Qt.AlignRight | Qt.AlignVCenter)
-                else:
-                    item.setTextAlignment(i, Qt.AlignLeft | Qt.AlignVCenter)
-                if i != Columns.DATE:
-                    item.setFont(i, self.monospace_font)
-            if line.value_delta and line.value_delta < 0:
-                item.setForeground(Columns.DESCRIPTION, self.withdrawalBrush)
-                item.setForeground(Columns.AMOUNT, self.withdrawalBrush)
-            item.setData(Columns.STATUS, SortableTreeWidgetItem.DataRole, line.sort_key)
-            item.setData(Columns.DATE, SortableTreeWidgetItem.DataRole, line.sort_key)
-            item.setData(Columns.STATUS, self.ACCOUNT_ROLE, self._account_id)
-            item.setData(Columns.STATUS, self.TX_ROLE, line.tx_hash)
-
-            # self.insertTopLevelItem(0, item)
+            item = self._create_item(line, balance, local_height, timestamp)
             if current_tx_hash == line.tx_hash:
                 self.setCurrentItem(item)
-
             items.append(item)
 
         self.addTopLevelItems(items)
@@ -240,6 +222,45 @@ class HistoryList(MyTreeWidget):
         if len(missing_header_heights) and self._main_window.network:
             self._main_window.network.backfill_headers_at_heights(missing_header_heights)
 
+    def _create_item(self, line: HistoryLine, balance: int, local_height: int,
+            timestamp: Union[bool, int]) -> SortableTreeWidgetItem:
+        fx = app_state.fx
+        tx_id = hash_to_hex_str(line.tx_hash)
+        conf = 0 if line.height <= 0 else max(local_height - line.height + 1, 0)
+        status = get_tx_status(self._account, line.tx_hash, line.height, conf, timestamp)
+        status_str = get_tx_desc(status, timestamp)
+        v_str = app_state.format_amount(line.value_delta, True, whitespaces=True)
+        balance_str = app_state.format_amount(balance, whitespaces=True)
+        label = self._wallet.get_transaction_label(line.tx_hash)
+        entry = [None, tx_id, status_str, label, v_str, balance_str]
+        if fx and fx.show_history():
+            date = timestamp_to_datetime(time.time() if conf <= 0 else timestamp)
+            for amount in [line.value_delta, balance]:
+                text = fx.historical_value_str(amount, date)
+                entry.append(text)
+
+        item = SortableTreeWidgetItem(entry)
+        # If there is no text,
+        item.setIcon(Columns.STATUS, get_tx_icon(status))
+        item.setToolTip(Columns.STATUS, get_tx_tooltip(status, conf))
+        if line.tx_flags & TxFlags.PaysInvoice:
+            item.setIcon(Columns.DESCRIPTION, self.invoiceIcon)
+        for i in range(len(entry)):
+            if i > Columns.DESCRIPTION:
+                item.setTextAlignment(i, Qt.AlignRight | Qt.AlignVCenter)
+            else:
+                item.setTextAlignment(i, Qt.AlignLeft | Qt.AlignVCenter)
+            if i != Columns.DATE:
+                item.setFont(i, self.monospace_font)
+        if line.value_delta and line.value_delta < 0:
+            item.setForeground(Columns.DESCRIPTION, self.withdrawalBrush)
+            item.setForeground(Columns.AMOUNT, self.withdrawalBrush)
+        item.setData(Columns.STATUS, SortableTreeWidgetItem.DataRole, line.sort_key)
+        item.setData(Columns.DATE, SortableTreeWidgetItem.DataRole, line.sort_key)
+        item.setData(Columns.STATUS, self.ACCOUNT_ROLE, self._account_id)
+        item.setData(Columns.STATUS, self.TX_ROLE, line.tx_hash)
+        return item
+
     def on_doubleclick(self, item: QTreeWidgetItem, column: int) -> None:
         if self.permit_edit(item, column):
             super(HistoryList, self).on_doubleclick(item, column)
@@ -25,7 +25,7 @@
 '''ElectrumSV Preferences dialog.'''
 
 from functools import partial
-from typing import Optional, TYPE_CHECKING
+from typing import List, Optional, TYPE_CHECKING
 import weakref
 
 from PyQt5.QtCore import Qt
@@ -34,7 +34,7 @@ from PyQt5.QtWidgets import (
     QVBoxLayout, QWidget
 )
 
-from electrumsv import qrscanner
+from electrumsv import coinchooser, qrscanner
 from electrumsv.app_state import app_state
 from electrumsv.constants import (MAXIMUM_TXDATA_CACHE_SIZE_MB, MINIMUM_TXDATA_CACHE_SIZE_MB,
     WalletSettings)
@@ -124,8 +124,31 @@ class PreferencesDialog(QDialog):
         options_box.setLayout(options_vbox)
         options_vbox.addWidget(unconf_cb)
 
+        # The automatic choice is not stored, so that it follows the number of coins.
+        chooser_names: List[Optional[str]] = [ None ]
+        chooser_names.extend(sorted(coinchooser.COIN_CHOOSERS))
+        chooser_label = HelpLabel(_('Coin selection') + ':', '\n\n'.join([
+            _('Choose how the coins that a transaction spends are selected.'),
+            _('Privacy: Spend all the coins of a key together, and avoid change that is very '
+                'different to the amount sent.'),
+            _('BranchAndBound: Look for coins that pay the amount without needing change. This '
+                'is fast for accounts with very many coins.'),
+            _('Automatic: Privacy, or BranchAndBound when there are more than {} '
+                'coins.').format(coinchooser.LARGE_COIN_COUNT),
+        ]))
+        chooser_combo = QComboBox()
+        chooser_combo.addItems([ _('Automatic') ] + sorted(coinchooser.COIN_CHOOSERS))
+        chooser_name = app_state.config.get('coin_chooser')
+        chooser_combo.setCurrentIndex(chooser_names.index(chooser_name)
+            if chooser_name in chooser_names else 0)
+        chooser_combo.setEnabled(app_state.config.is_modifiable('coin_chooser'))
+        def on_chooser(index: int) -> None:
+            app_state.config.set_key('coin_chooser', chooser_names[index])
+        chooser_combo.currentIndexChanged.connect(on_chooser)
+
         form = FormSectionWidget(minimum_label_width=120)
         form.add_row(_('Custom Fee Rate'), customfee_e)
+        form.add_row(chooser_label, chooser_combo)
         form.add_row(_("Options"), options_box, True)
 
         vbox = QVBoxLayout()
@@ -580,7 +580,7 @@ class TxDialog(QDialog, MessageBoxMixin):
             utxo = account._utxos.get(txo_key)
             if utxo is not None:
                 return utxo.keyinstance_id
-            stxo_keyinstance_id = account._stxos.get(txo_key)
+            stxo_keyinstance_id = account.get_stxo(txo_key.tx_hash, txo_key.tx_index)
             if stxo_keyinstance_id is not None:
                 return stxo_keyinstance_id
             return None
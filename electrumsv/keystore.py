@@ -48,6 +48,12 @@ from .wallet_database.tables import KeyInstanceRow, MasterKeyRow
 
 logger = logs.get_logger("keystore")
 
+def _derive_child_public_keys(xpub: str, indexes: Sequence[int]) -> List[bytes]:
+    # This is run in the derivation pool processes, and the key objects cannot be pickled.
+    xpubkey = bip32_key_from_string(xpub)
+    return [ xpubkey.child_safe(n).to_bytes() for n in indexes ]
+
+
 class KeyStore:
     derivation_type = DerivationType.NONE
     label: Optional[str] = None
@@ -161,6 +167,15 @@ class Software_KeyStore(KeyStore):
     def check_password(self, password: Optional[str]) -> None:
         raise NotImplementedError
 
+    def get_private_keys_from_xpubkeys(self, x_pubkeys: Sequence[XPublicKey],
+            password: str) -> Dict[XPublicKey, Tuple[bytes, bool]]:
+        '''
+        The private keys for the given extended public keys. Keystores that can share the work
+        of obtaining one key with the others override this.
+        '''
+        return { x_pubkey: self.get_private_key_from_xpubkey(x_pubkey, password)
+            for x_pubkey in x_pubkeys }
+
     def sign_transaction(self, tx: Transaction, password: str,
             tx_context: TransactionContext) -> None:
         if self.is_watching_only():
@@ -168,14 +183,12 @@ class Software_KeyStore(KeyStore):
         # Raise if password is not correct.
         self.check_password(password)
         # Add private keys
-        keypairs: Dict[XPublicKey, Tuple[bytes, bool]] = {}
-        for txin in tx.inputs:
-            for x_pubkey in txin.unused_x_pubkeys():
-                if self.is_signature_candidate(x_pubkey):
-                    keypairs[x_pubkey] = self.get_private_key_from_xpubkey(x_pubkey, password)
+        x_pubkeys = { x_pubkey: None for txin in tx.inputs
+            for x_pubkey in txin.unused_x_pubkeys() if self.is_signature_candidate(x_pubkey) }
+        keypairs = self.get_private_keys_from_xpubkeys(list(x_pubkeys), password)
         # Sign
         if keypairs:
-            tx.sign(keypairs)
+            tx.sign(keypairs, tx_context.signing_session)
 
 
 class Imported_KeyStore(Software_KeyStore):
@@ -360,28 +373,64 @@ class DerivablePaths:
     def get_next_index(self, derivation_path: Sequence[int]) -> int:
         return self._sequence_watermarks.get(derivation_path, 0)
 
+    def derive_pubkey(self, derivation_path: Sequence[int]) -> PublicKey:
+        raise NotImplementedError
+
+    def derive_pubkeys(self, derivation_parent: Sequence[int],
+            indexes: Sequence[int]) -> List[PublicKey]:
+        '''Derive the public keys for the given child indexes of the derivation parent.'''
+        return [ self.derive_pubkey(tuple(derivation_parent) + (n,)) for n in indexes ]
+
 
 class Xpub(DerivablePaths):
+    # Ranges of at least this many keys are derived in a process pool, in chunks of the given
+    # size. Smaller ranges are not worth the cost of passing the keys between processes.
+    PARALLEL_DERIVATION_THRESHOLD = 10000
+    PARALLEL_DERIVATION_CHUNK_SIZE = 2500
+
     def __init__(self) -> None:
         self.xpub: Optional[str] = None
-        self._child_xpubs: Dict[Sequence[int], str] = {}
+        # The parsed keys for the derivation parents we have derived keys for, and the master
+        # public key they were derived from.
+        self._child_xpubkeys: Dict[Tuple[int, ...], BIP32PublicKey] = {}
+        self._child_xpubkeys_xpub: Optional[str] = None
 
     def get_master_public_key(self) -> Optional[str]:
         return self.xpub
 
     def get_fingerprint(self) -> bytes:
-        return bip32_key_from_string(self.xpub).fingerprint()
+        return self._get_child_xpubkey(()).fingerprint()
+
+    def _get_child_xpubkey(self, derivation_parent: Sequence[int]) -> BIP32PublicKey:
+        if self._child_xpubkeys_xpub != self.xpub:
+            self._child_xpubkeys = {}
+            self._child_xpubkeys_xpub = self.xpub
+        derivation_parent = tuple(derivation_parent)
+        xpubkey = self._child_xpubkeys.get(derivation_parent)
+        if xpubkey is None:
+            if len(derivation_parent):
+                xpubkey = self._get_child_xpubkey(derivation_parent[:-1]).child_safe(
+                    derivation_parent[-1])
+            else:
+                xpubkey = bip32_key_from_string(self.xpub)
+            self._child_xpubkeys[derivation_parent] = xpubkey
+        return xpubkey
 
     def derive_pubkey(self, derivation_path: Sequence[int]) -> PublicKey:
-        parent_path = derivation_path[:-1]
-        xpub = self._child_xpubs.get(parent_path)
-        if xpub is None:
-            xpubkey = bip32_key_from_string(self.xpub)
-            for n in parent_path:
-                xpubkey = xpubkey.child_safe(n)
-            xpub = xpubkey.to_extended_key_string()
-            self._child_xpubs[parent_path] = xpub
-        return self.get_pubkey_from_xpub(xpub, derivation_path[-1:])
+        return self._get_child_xpubkey(derivation_path[:-1]).child_safe(derivation_path[-1])
+
+    def derive_pubkeys(self, derivation_parent: Sequence[int],
+            indexes: Sequence[int]) -> List[PublicKey]:
+        xpubkey = self._get_child_xpubkey(derivation_parent)
+        if len(indexes) < self.PARALLEL_DERIVATION_THRESHOLD:
+            return [ xpubkey.child_safe(n) for n in indexes ]
+
+        xpub = xpubkey.to_extended_key_string()
+        chunk_size = self.PARALLEL_DERIVATION_CHUNK_SIZE
+        futures = [ app_state.derivation_pool().submit(_derive_child_public_keys, xpub,
+            indexes[i:i+chunk_size]) for i in range(0, len(indexes), chunk_size) ]
+        return [ PublicKey.from_bytes(public_key_bytes) for future in futures
+            for public_key_bytes in future.result() ]
 
     @classmethod
     def get_pubkey_from_xpub(self, xpub: str, sequence: Sequence[int]) -> PublicKey:
@@ -399,6 +448,35 @@ class Xpub(DerivablePaths):
         return False
 
 
+class BIP32SigningKeys:
+    '''
+    The private keys derived from a decrypted master private key while signing. The keys for the
+    derivation parents are kept, so that paths with a common prefix only derive it the once, until
+    `clear` is called to let go of them.
+    '''
+
+    def __init__(self, xprv: str) -> None:
+        self._parent_keys: Dict[Tuple[int, ...], BIP32PrivateKey] = {
+            (): bip32_key_from_string(xprv) }
+
+    def _get_parent_key(self, derivation_parent: Tuple[int, ...]) -> BIP32PrivateKey:
+        privkey = self._parent_keys.get(derivation_parent)
+        if privkey is None:
+            privkey = self._get_parent_key(derivation_parent[:-1]).child_safe(
+                derivation_parent[-1])
+            self._parent_keys[derivation_parent] = privkey
+        return privkey
+
+    def get_private_key(self, derivation_path: Sequence[int]) -> BIP32PrivateKey:
+        derivation_path = tuple(derivation_path)
+        if not derivation_path:
+            return self._parent_keys[()]
+        return self._get_parent_key(derivation_path[:-1]).child_safe(derivation_path[-1])
+
+    def clear(self) -> None:
+        self._parent_keys.clear()
+
+
 class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
     derivation_type = DerivationType.BIP32
 
@@ -478,17 +556,28 @@ class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
         return True
 
     def get_private_key(self, derivation_path: Sequence[int], password: str) -> Tuple[bytes, bool]:
-        xprv = self.get_master_private_key(password)
-        privkey = bip32_key_from_string(xprv)
-        for n in derivation_path:
-            privkey = privkey.child_safe(n)
-        return privkey.to_bytes(), True
+        signing_keys = BIP32SigningKeys(self.get_master_private_key(password))
+        try:
+            return signing_keys.get_private_key(derivation_path).to_bytes(), True
+        finally:
+            signing_keys.clear()
 
     def get_private_key_from_xpubkey(self, x_pubkey: XPublicKey,
             password: str) -> Tuple[bytes, bool]:
         derivation_path = x_pubkey.derivation_path()
         return self.get_private_key(derivation_path, password)
 
+    def get_private_keys_from_xpubkeys(self, x_pubkeys: Sequence[XPublicKey],
+            password: str) -> Dict[XPublicKey, Tuple[bytes, bool]]:
+        # The master private key is decrypted once, and each parent key derived once.
+        signing_keys = BIP32SigningKeys(self.get_master_private_key(password))
+        try:
+            return { x_pubkey: (signing_keys.get_private_key(
+                    x_pubkey.derivation_path()).to_bytes(), True)
+                for x_pubkey in x_pubkeys }
+        finally:
+            signing_keys.clear()
+
     # If we do not do this it falls through to the the base KeyStore method, not Xpub.
     def is_signature_candidate(self, x_pubkey: XPublicKey) -> bool:
         return Xpub.is_signature_candidate(self, x_pubkey)
@@ -606,10 +695,14 @@ class Old_KeyStore(DerivablePaths, Deterministic_KeyStore):
     def can_export(self) -> bool:
         return True
 
-    def get_private_key(self, derivation_path: Sequence[int], password: str) -> Tuple[bytes, bool]:
+    def _get_stretched_exponent(self, password: str) -> int:
         seed = self._get_hex_seed_bytes(password)
-        self.check_seed(seed)
         secexp = self.stretch_key(seed)
+        self._check_stretched_exponent(secexp)
+        return secexp
+
+    def get_private_key(self, derivation_path: Sequence[int], password: str) -> Tuple[bytes, bool]:
+        secexp = self._get_stretched_exponent(password)
         pk = self.get_private_key_from_stretched_exponent(derivation_path, secexp)
         return pk, False
 
@@ -619,8 +712,21 @@ class Old_KeyStore(DerivablePaths, Deterministic_KeyStore):
         assert self.mpk == mpk.hex()
         return self.get_private_key(path, password)
 
+    def get_private_keys_from_xpubkeys(self, x_pubkeys: Sequence[XPublicKey],
+            password: str) -> Dict[XPublicKey, Tuple[bytes, bool]]:
+        # Stretching the seed is by design slow, so it is only done the once.
+        secexp = self._get_stretched_exponent(password)
+        keypairs: Dict[XPublicKey, Tuple[bytes, bool]] = {}
+        for x_pubkey in x_pubkeys:
+            mpk, path = x_pubkey.old_keystore_mpk_and_path()
+            assert self.mpk == mpk.hex()
+            keypairs[x_pubkey] = self.get_private_key_from_stretched_exponent(path, secexp), False
+        return keypairs
+
     def check_seed(self, seed) -> None:
-        secexp = self.stretch_key(seed)
+        self._check_stretched_exponent(self.stretch_key(seed))
+
+    def _check_stretched_exponent(self, secexp: int) -> None:
         master_private_key = PrivateKey(int_to_be_bytes(secexp, 32))
         master_public_key = master_private_key.public_key.to_bytes(compressed=False)[1:]
         if master_public_key != bytes.fromhex(self.mpk):
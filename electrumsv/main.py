@@ -27,6 +27,7 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import asyncio
+import multiprocessing
 import os
 import sys
 import time
@@ -271,6 +272,7 @@ def run_app_with_daemon(fd, is_gui, config_options):
             # Shut down the daemon before exiting the async loop
             d.stop()
             d.join()
+            app_state.shutdown_derivation_pool()
     sys.exit(0)
 
 
@@ -338,6 +340,8 @@ def set_restapi_credentials(config, config_options):
 
 
 def main():
+    # Key derivation uses a process pool, and frozen builds need this to start the workers.
+    multiprocessing.freeze_support()
     enforce_requirements()
     if sys.platform == 'win32':
         from electrumsv.winconsole import setup_windows_console
@@ -0,0 +1,328 @@
+# ElectrumSV - lightweight Bitcoin SV client
+# Copyright (C) 2019-2020 The ElectrumSV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+ElectrumSV metrics.
+
+Counters, gauges and histograms for the places where time goes in a running wallet. The values
+are kept in process, and can be queried through the daemon JSON-RPC `metrics` method and the
+REST API, either as a dictionary or in the Prometheus text exposition format.
+
+Values that are expensive to keep up to date as they change, or that already exist elsewhere,
+can instead be given a function that is called when the metric is collected.
+'''
+
+from contextlib import contextmanager
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from .logs import logs
+
+
+logger = logs.get_logger("metrics")
+
+LabelValues = Tuple[str, ...]
+MetricFunction = Callable[[], Dict[LabelValues, float]]
+
+# In seconds, these cover everything from cache lookups to slow network requests.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0, 30.0)
+
+
+class Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._function: Optional[MetricFunction] = None
+
+    def set_function(self, function: Optional[MetricFunction]) -> None:
+        '''
+        Obtain the values by calling the given function when the metric is collected, rather
+        than by recording them as they change. The function returns the values mapped by their
+        label values, which for a metric without labels is the empty tuple.
+        '''
+        self._function = function
+
+    def _check_labels(self, labels: LabelValues) -> None:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects the labels {self.label_names}, got {labels}")
+
+    def collect(self) -> List[Tuple[LabelValues, Any]]:
+        function = self._function
+        if function is not None:
+            try:
+                return sorted(function().items())
+            except Exception:
+                # A failure to gather one metric should not prevent the others being reported.
+                logger.exception("unable to collect metric %s", self.name)
+                return []
+        with self._lock:
+            return sorted(self._get_values())
+
+    def _get_values(self) -> List[Tuple[LabelValues, Any]]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    '''A total that only ever increases.'''
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]=()) -> None:
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float=1, labels: LabelValues=()) -> None:
+        if amount < 0:
+            raise ValueError("counters can only be increased")
+        self._check_labels(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels: LabelValues=()) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def _get_values(self) -> List[Tuple[LabelValues, Any]]:
+        return list(self._values.items())
+
+
+class Gauge(Metric):
+    '''A value that can go up and down.'''
+    TYPE = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]=()) -> None:
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, labels: LabelValues=()) -> None:
+        self._check_labels(labels)
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount: float=1, labels: LabelValues=()) -> None:
+        self._check_labels(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount: float=1, labels: LabelValues=()) -> None:
+        self.inc(-amount, labels)
+
+    def remove(self, labels: LabelValues) -> None:
+        with self._lock:
+            self._values.pop(labels, None)
+
+    def get(self, labels: LabelValues=()) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def _get_values(self) -> List[Tuple[LabelValues, Any]]:
+        return list(self._values.items())
+
+
+class HistogramValue:
+    def __init__(self, bucket_count: int) -> None:
+        # These are the counts of the observations that fell in each bucket, not cumulative.
+        self.bucket_counts = [ 0 ] * bucket_count
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    '''
+    Counts observations, usually durations, in buckets by their size. The bucket bounds are
+    inclusive upper limits, and there is always a final bucket for everything larger.
+    '''
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]=(),
+            buckets: Sequence[float]=DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, label_names)
+        bounds = sorted(buckets)
+        if not bounds or bounds[-1] != math.inf:
+            bounds.append(math.inf)
+        self.buckets = tuple(bounds)
+        self._values: Dict[LabelValues, HistogramValue] = {}
+
+    def set_function(self, function: Optional[MetricFunction]) -> None:
+        raise NotImplementedError("histograms can only be observed")
+
+    def observe(self, value: float, labels: LabelValues=()) -> None:
+        self._check_labels(labels)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = HistogramValue(len(self.buckets))
+            entry.bucket_counts[index] += 1
+            entry.count += 1
+            entry.sum += value
+
+    @contextmanager
+    def time(self, labels: LabelValues=()) -> Iterator[None]:
+        '''Observe how long the body of the `with` statement takes, in seconds.'''
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, labels)
+
+    def get_count(self, labels: LabelValues=()) -> int:
+        with self._lock:
+            entry = self._values.get(labels)
+            return entry.count if entry is not None else 0
+
+    def _get_values(self) -> List[Tuple[LabelValues, Any]]:
+        results = []
+        for labels, entry in self._values.items():
+            cumulative_counts: List[int] = []
+            total = 0
+            for bucket_count in entry.bucket_counts:
+                total += bucket_count
+                cumulative_counts.append(total)
+            results.append((labels, (cumulative_counts, entry.count, entry.sum)))
+        return results
+
+
+MetricType = TypeVar("MetricType", bound=Metric)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    text = ",".join(f'{name}="{_escape_label_value(str(value))}"'
+        for name, value in zip(names, values))
+    return "{"+ text +"}"
+
+
+class Metrics:
+    '''The registry of all the metrics in this process.'''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str]=()) -> Counter:
+        return self._register(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str]=()) -> Gauge:
+        return self._register(Gauge, name, documentation, label_names)
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str]=(),
+            buckets: Sequence[float]=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def _register(self, metric_class: Callable[..., MetricType], name: str, documentation: str,
+            label_names: Sequence[str], **kwargs: Any) -> MetricType:
+        # Registering the same metric again returns the existing one, so that modules can be
+        # reloaded and so that unrelated code can share a metric.
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, label_names,
+                    **kwargs)
+            elif type(metric) is not metric_class or metric.label_names != tuple(label_names):
+                raise ValueError(f"metric {name} is already registered differently")
+            return metric # type: ignore
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def _get_metrics(self) -> List[Metric]:
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        '''
+        The current values of all the metrics, in a form that can be encoded as JSON. Histogram
+        bucket counts are cumulative, as they are in the Prometheus format.
+        '''
+        results: Dict[str, Any] = {}
+        for metric in self._get_metrics():
+            values: List[Dict[str, Any]] = []
+            for labels, value in metric.collect():
+                entry: Dict[str, Any] = { "labels": dict(zip(metric.label_names, labels)) }
+                if isinstance(metric, Histogram):
+                    cumulative_counts, count, total = value
+                    entry["buckets"] = { _format_value(bound): bucket_count
+                        for bound, bucket_count in zip(metric.buckets, cumulative_counts) }
+                    entry["count"] = count
+                    entry["sum"] = total
+                else:
+                    entry["value"] = value
+                values.append(entry)
+            results[metric.name] = {
+                "type": metric.TYPE,
+                "help": metric.documentation,
+                "values": values,
+            }
+        return results
+
+    def to_prometheus_text(self) -> str:
+        '''The current values of all the metrics, in the Prometheus text exposition format.'''
+        lines: List[str] = []
+        for metric in self._get_metrics():
+            documentation = metric.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+            lines.append(f"# HELP {metric.name} {documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for labels, value in metric.collect():
+                if isinstance(metric, Histogram):
+                    cumulative_counts, count, total = value
+                    bucket_label_names = metric.label_names + ("le",)
+                    for bound, bucket_count in zip(metric.buckets, cumulative_counts):
+                        label_text = _format_labels(bucket_label_names,
+                            labels + (_format_value(bound),))
+                        lines.append(f"{metric.name}_bucket{label_text} {bucket_count}")
+                    label_text = _format_labels(metric.label_names, labels)
+                    lines.append(f"{metric.name}_sum{label_text} {_format_value(total)}")
+                    lines.append(f"{metric.name}_count{label_text} {count}")
+                else:
+                    label_text = _format_labels(metric.label_names, labels)
+                    lines.append(f"{metric.name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
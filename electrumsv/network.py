@@ -22,17 +22,18 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import asyncio
-from collections import defaultdict
+from collections import defaultdict, deque
 from contextlib import suppress
 from enum import IntEnum
 from functools import partial
+import itertools
 import os
 import random
 import re
 import ssl
 import stat
 import time
-from typing import Any, Dict, List, Optional, TYPE_CHECKING, Tuple
+from typing import Any, Deque, Dict, List, Optional, TYPE_CHECKING, Tuple, Union
 
 import certifi
 from aiorpcx import (
@@ -47,9 +48,10 @@ from bitcoinx import (
 
 from .app_state import app_state
 from .bitcoin import scripthash_hex
-from .constants import ScriptType, TxFlags
+from .constants import RECEIVING_SUBPATH, ScriptType, TxFlags
 from .i18n import _
 from .logs import logs
+from .metrics import metrics
 from .transaction import Transaction
 from .util import chunks, JSON, protocol_tuple, TriggeredCallbacks, version_string
 from .networks import Net
@@ -65,6 +67,7 @@ HEADER_SIZE = 80
 ONE_MINUTE = 60
 ONE_DAY = 24 * 3600
 HEADERS_SUBSCRIBE = 'blockchain.headers.subscribe'
+REQUEST_TRANSACTION = 'blockchain.transaction.get'
 REQUEST_MERKLE_PROOF = 'blockchain.transaction.get_merkle'
 SCRIPTHASH_HISTORY = 'blockchain.scripthash.get_history'
 SCRIPTHASH_SUBSCRIBE = 'blockchain.scripthash.subscribe'
@@ -90,6 +93,23 @@ BROADCAST_TX_MSG_LIST = (
     ('bad-txns-nonfinal', _("transaction is not final"))
 )
 
+rpc_request_time_metric = metrics.histogram("electrumsv_rpc_request_seconds",
+    "The round trip time of each request made to the server, by method.", ("method",))
+rpc_batch_time_metric = metrics.histogram("electrumsv_rpc_batch_seconds",
+    "The round trip time of each batch of requests made to the server, by method.", ("method",))
+rpc_batch_size_metric = metrics.histogram("electrumsv_rpc_batch_requests",
+    "The number of requests in each batch made to the server, by method.", ("method",),
+    buckets=(1, 5, 10, 25, 50, 100, 200, 500))
+rpc_error_metric = metrics.counter("electrumsv_rpc_errors_total",
+    "The number of requests and batches made to the server that failed, by method.", ("method",))
+subscription_metric = metrics.gauge("electrumsv_subscriptions",
+    "The number of script hashes subscribed to on the server.")
+status_backlog_metric = metrics.gauge("electrumsv_sync_status_backlog",
+    "The number of script hash status changes waiting to have their history obtained.")
+sync_backlog_metric = metrics.gauge("electrumsv_sync_backlog",
+    "The number of transactions each wallet is waiting to obtain, by what is missing.",
+    ("wallet", "kind"))
+
 
 def broadcast_failure_reason(exception):
     if isinstance(exception, RPCError):
@@ -334,21 +354,164 @@ class SVProxy(SOCKSProxy):
         return ', '.join((repr(self.address), self.kind(), repr(self.auth)))
 
 
+def _parse_transactions(tx_hexes: List[Tuple[bytes, str]]) \
+        -> List[Tuple[bytes, Union[Transaction, Exception]]]:
+    '''Parse received transactions, away from the event loop. A transaction that cannot be
+    parsed, or that does not have the hash it was requested by, is returned as an exception.'''
+    results: List[Tuple[bytes, Union[Transaction, Exception]]] = []
+    for tx_hash, tx_hex in tx_hexes:
+        try:
+            tx = Transaction.from_hex(tx_hex)
+            if tx.hash() != tx_hash:
+                raise ValueError(f'received transaction has hash {tx.txid()}')
+        except Exception as e:
+            results.append((tx_hash, e))
+        else:
+            results.append((tx_hash, tx))
+    return results
+
+
+def _verify_proofs(proof_entries: List[Tuple[bytes, int, Any, Any]]) \
+        -> List[Tuple[bytes, int, int, int, int, List[bytes]]]:
+    '''Verify received merkle proofs, away from the event loop. Each entry is (tx_hash,
+    tx_height, header, result) and those that are valid are returned in the form that
+    `Wallet.add_transaction_proofs` expects. Invalid proofs are logged and dropped.'''
+    hhts = hash_to_hex_str
+    results: List[Tuple[bytes, int, int, int, int, List[bytes]]] = []
+    for tx_hash, tx_height, header, result in proof_entries:
+        try:
+            branch = [hex_str_to_hash(item) for item in result['merkle']]
+            tx_pos = result['pos']
+            proven_root = _root_from_proof(tx_hash, branch, tx_pos)
+        except Exception as e:
+            logger.error(f'getting proof for {hhts(tx_hash)}: {e}')
+            continue
+        if header.merkle_root == proven_root:
+            logger.debug(f'received valid proof for {hhts(tx_hash)}')
+            results.append((tx_hash, tx_height, header.timestamp, tx_pos, tx_pos, branch))
+        else:
+            logger.error(f'invalid proof for tx {hhts(tx_hash)} in block '
+                         f'{hhts(header.hash)}; got {hhts(proven_root)} expected '
+                         f'{hhts(header.merkle_root)}')
+    return results
+
+
+def _verify_chunk_links(raw_chunk: bytes) -> None:
+    '''Check that each header in a received chunk links to the one before it, away from the
+    event loop.
+
+    Raises: MissingHeader'''
+    coin = Net.COIN
+    prev_hash = None
+    for start in range(0, len(raw_chunk), HEADER_SIZE):
+        raw_header = raw_chunk[start: start + HEADER_SIZE]
+        if prev_hash is not None and coin.header_prev_hash(raw_header) != prev_hash:
+            raise MissingHeader('prev_hash does not connect')
+        prev_hash = coin.header_hash(raw_header)
+
+
+async def _get_script_hash_triples(account: 'AbstractAccount', keyinstance_ids: List[int]) \
+        -> List[Tuple[int, ScriptType, str]]:
+    '''The (keyinstance_id, script_type, script_hash) triples for the possible scripts of the
+    given keys. The keys are derived in bulk away from the event loop.'''
+    def _get_triples() -> List[Tuple[int, ScriptType, str]]:
+        return [ (keyinstance_id, script_type, scripthash_hex(script))
+            for keyinstance_id, script_type, script
+            in account.get_possible_scripts_for_ids(keyinstance_ids) ]
+    return await asyncio.get_event_loop().run_in_executor(None, _get_triples)
+
+
+class _TimedBatchRequest:
+    '''
+    Wraps an `aiorpcx` batch request to record its round trip time, which is the time taken to
+    send it when the `async with` block exits.
+    '''
+
+    def __init__(self, batch) -> None:
+        self._batch = batch
+
+    async def __aenter__(self):
+        return await self._batch.__aenter__()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            return await self._batch.__aexit__(exc_type, exc_value, traceback)
+
+        start_time = time.perf_counter()
+        try:
+            return await self._batch.__aexit__(exc_type, exc_value, traceback)
+        except Exception:
+            rpc_error_metric.inc(labels=(self._get_method(),))
+            raise
+        finally:
+            # Batches that are cancelled or time out are still worth knowing about as they
+            # are a sign of a struggling server, so the failures are timed as well.
+            method = self._get_method()
+            rpc_batch_time_metric.observe(time.perf_counter() - start_time, (method,))
+            rpc_batch_size_metric.observe(len(self._batch), (method,))
+
+    def _get_method(self) -> str:
+        # The batches we make are all of the one method, but we do not rely on it.
+        methods = { item.method for item in self._batch.batch or () }
+        return methods.pop() if len(methods) == 1 else "mixed"
+
+
 class SVSession(RPCSession):
 
     ca_path = certifi.where()
     _connecting_tips: Dict[bytes, asyncio.Event] = {}
     _need_checkpoint_headers = True
+    # The sessions that have negotiated the protocol, and can serve chunks of headers to any
+    # session that is catching up.
+    _header_sources: List['SVSession'] = []
     # account -> list of script hashes.  Also acts as a list of registered accounts
     _subs_by_account: Dict['AbstractAccount', List[str]] = {}
     # script_hash -> (keyinstance_id, script_type)
     _keyinstance_map: Dict[str, Tuple[int, ScriptType]] = {}
 
+    # The default number of script hash subscriptions sent in each JSON-RPC batch. This can be
+    # overridden with the 'subscription_batch_size' config setting.
+    SUBSCRIPTION_BATCH_SIZE = 200
+    # The default number of subscription batches that can be awaiting their responses at any
+    # one time. This can be overridden with the 'subscription_batch_window' config setting.
+    SUBSCRIPTION_BATCH_WINDOW = 4
+    # How many times the failed subscriptions in a batch are resent before we give up.
+    SUBSCRIPTION_RETRY_LIMIT = 3
+    # The maximum number of script hash histories requested in each JSON-RPC batch.
+    HISTORY_BATCH_SIZE = 50
+    # The maximum number of history batches that can be awaiting their responses at any one
+    # time for this session.
+    HISTORY_BATCH_CONCURRENCY = 4
+    # The share of the incoming message size limit the response to a transaction batch may use.
+    # The number of transactions in a batch is worked out from the average hex length of those
+    # received so far, and the rest of the limit is headroom for transactions above that average.
+    TRANSACTION_BATCH_LIMIT_SHARE = 0.5
+    # The approximate response size of a transaction batch when the message size limit is off.
+    TRANSACTION_BATCH_UNLIMITED_BUDGET = 16 * 1024 * 1024
+    # The JSON-RPC framing around each transaction in a batch response.
+    TRANSACTION_RESPONSE_OVERHEAD = 50
+    # The maximum number of transactions requested in each JSON-RPC batch.
+    TRANSACTION_BATCH_MAXIMUM_COUNT = 500
+    # The assumed average transaction hex length before any transactions have been received.
+    TRANSACTION_HEX_SIZE_ESTIMATE = 4000
+    # The maximum number of merkle proofs requested in each JSON-RPC batch.
+    PROOF_BATCH_SIZE = 200
+    # The number of headers requested in each chunk when catching up.
+    HEADER_CHUNK_SIZE = 2016
+    # The maximum number of header chunks requested ahead of the one being connected. These
+    # are spread over the sessions able to serve them.
+    HEADER_CHUNK_WINDOW = 8
+    # The number of header chunks connected between each flush of the headers file.
+    HEADER_FLUSH_INTERVAL = 10
+
     def __init__(self, network, server, logger, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._handlers = {}
         self._network = network
         self._closed_event = app_state.async_.event()
+        self._history_semaphore = asyncio.Semaphore(self.HISTORY_BATCH_CONCURRENCY)
+        self._transactions_received = 0
+        self._transaction_hex_received = 0
         # These attributes are intended to part of the external API
         self.chain = None
         self.logger = logger
@@ -356,6 +519,19 @@ class SVSession(RPCSession):
         self.tip = None
         self.ptuple = (0, )
 
+    async def send_request(self, method, args=()):
+        start_time = time.perf_counter()
+        try:
+            return await super().send_request(method, args)
+        except Exception:
+            rpc_error_metric.inc(labels=(method,))
+            raise
+        finally:
+            rpc_request_time_metric.observe(time.perf_counter() - start_time, (method,))
+
+    def send_batch(self, raise_errors=False):
+        return _TimedBatchRequest(super().send_batch(raise_errors))
+
     def set_throttled(self, flag: bool) -> None:
         if flag:
             RPCSession.recalibrate_count = 30
@@ -406,9 +582,10 @@ class SVSession(RPCSession):
             return app_state.headers.connect(raw_header)
 
     @classmethod
-    def _connect_chunk(cls, start_height, raw_chunk):
+    def _connect_chunk(cls, start_height, raw_chunk, flush=True):
         '''It is assumed that if the last header of the raw chunk is before the checkpoint height
-        then it has been checked for validity.
+        then it has been checked for validity, and that the prev_hash links between the headers
+        in the chunk have been verified.
         '''
         headers_obj = app_state.headers
         checkpoint = headers_obj.checkpoint
@@ -420,13 +597,13 @@ class SVSession(RPCSession):
             return raw_chunk[start: start + HEADER_SIZE]
 
         def verify_chunk_contiguous_and_set(next_raw_header, to_height):
-            # Set headers backwards from a proven header, verifying the prev_hash links.
-            for height in reversed(range(start_height, to_height)):
-                raw_header = extract_header(height)
+            # Set headers backwards from a proven header, which the chunk must link to.
+            if to_height > start_height:
+                raw_header = extract_header(to_height - 1)
                 if coin.header_prev_hash(next_raw_header) != coin.header_hash(raw_header):
                     raise MissingHeader('prev_hash does not connect')
-                headers_obj.set_one(height, raw_header)
-                next_raw_header = raw_header
+            for height in range(start_height, to_height):
+                headers_obj.set_one(height, extract_header(height))
 
         try:
             # For pre-checkpoint headers with a verified proof, just set the headers after
@@ -448,7 +625,8 @@ class SVSession(RPCSession):
 
             return chain or headers_obj.longest_chain()
         finally:
-            headers_obj.flush()
+            if flush:
+                headers_obj.flush()
 
     async def _negotiate_protocol(self):
         '''Raises: RPCError, TaskTimeout'''
@@ -472,9 +650,10 @@ class SVSession(RPCSession):
             logger.info(f'{count:,d} checkpoint headers needed')
             await self._request_chunk(start_height, count)
 
-    async def _request_chunk(self, height, count):
-        '''Returns the greatest height successfully connected (might be lower than expected
-        because of a small server response).
+    async def _fetch_chunk(self, height: int, count: int) -> bytes:
+        '''Returns up to count raw headers from height. If they are before the checkpoint the
+        proof of the last is checked, and the prev_hash links between them are verified in a
+        worker thread.
 
         Raises: RPCError, TaskTimeout, DisconnectSessionError'''
         self.logger.info(f'requesting {count:,d} headers from height {height:,d}')
@@ -498,14 +677,130 @@ class SVSession(RPCSession):
                 branch = [hex_str_to_hash(item) for item in result['branch']]
                 self._check_header_proof(hex_root, branch, raw_chunk[-HEADER_SIZE:], last_height)
 
-            self.chain = self._connect_chunk(height, raw_chunk)
-        except (AssertionError, KeyError, TypeError, ValueError,
-                IncorrectBits, InsufficientPoW, MissingHeader) as e:
+            await asyncio.get_event_loop().run_in_executor(None, _verify_chunk_links, raw_chunk)
+        except (AssertionError, KeyError, TypeError, ValueError, MissingHeader) as e:
             raise DisconnectSessionError(f'{method} failed: {e}', blacklist=True)
+        return raw_chunk
 
+    def _connect_fetched_chunk(self, height: int, raw_chunk: bytes, flush: bool=True) -> int:
+        '''Returns the greatest height connected.
+
+        Raises: DisconnectSessionError'''
+        try:
+            self.chain = self._connect_chunk(height, raw_chunk, flush)
+        except (IncorrectBits, InsufficientPoW, MissingHeader) as e:
+            raise DisconnectSessionError(f'blockchain.block.headers failed: {e}',
+                blacklist=True)
+
+        rec_count = len(raw_chunk) // HEADER_SIZE
+        last_height = height + rec_count - 1
         self.logger.info(f'connected {rec_count:,d} headers up to height {last_height:,d}')
         return last_height
 
+    async def _request_chunk(self, height, count):
+        '''Returns the greatest height successfully connected (might be lower than expected
+        because of a small server response).
+
+        Raises: RPCError, TaskTimeout, DisconnectSessionError'''
+        raw_chunk = await self._fetch_chunk(height, count)
+        return self._connect_fetched_chunk(height, raw_chunk)
+
+    def _get_header_sources(self) -> List['SVSession']:
+        return [ self ] + [ session for session in SVSession._header_sources
+            if session is not self ]
+
+    async def _fetch_chunk_from(self, session: 'SVSession', height: int,
+            count: int) -> Tuple['SVSession', bytes]:
+        '''Fetch a chunk of headers from the given session, or from this session if that fails.
+        Returns the session the chunk came from and the chunk.
+
+        Raises: RPCError, TaskTimeout, DisconnectSessionError'''
+        if session is not self:
+            try:
+                return session, await session._fetch_chunk(height, count)
+            except DisconnectSessionError as e:
+                await session.disconnect(str(e), blacklist=e.blacklist)
+            except (RPCError, TaskTimeout) as e:
+                session.logger.error(f'requesting headers failed: {e}')
+            except CancelledError:
+                # The requests of a closed session are cancelled, which is not our concern.
+                if session in SVSession._header_sources:
+                    raise
+            self.logger.info(f'requesting the headers from height {height:,d} myself')
+        return self, await self._fetch_chunk(height, count)
+
+    async def _catch_up_with_chunks(self, height: int, tip_height: int) -> int:
+        '''Connect the headers after height up to tip_height, fetching the chunks they are in
+        from this and the other sessions able to serve them. The chunks are connected in order,
+        and the headers file is flushed every HEADER_FLUSH_INTERVAL chunks.
+
+        Returns the greatest height connected.
+        Raises: RPCError, TaskTimeout, DisconnectSessionError'''
+        count = self.HEADER_CHUNK_SIZE
+        chunk_heights = iter(range(height + 1, tip_height + 1, count))
+        pending: Deque[Tuple[int, Any]] = deque()
+        prev_hash: Optional[bytes] = None
+        connected_count = 0
+        headers_obj = app_state.headers
+        coin = headers_obj.coin
+        try:
+            async with TaskGroup() as group:
+                while True:
+                    while len(pending) < self.HEADER_CHUNK_WINDOW:
+                        chunk_height = next(chunk_heights, None)
+                        if chunk_height is None:
+                            break
+                        sources = self._get_header_sources()
+                        session = sources[(chunk_height // count) % len(sources)]
+                        task = await group.spawn(self._fetch_chunk_from(session, chunk_height,
+                            count))
+                        pending.append((chunk_height, task))
+                    if not pending:
+                        break
+
+                    chunk_height, task = pending.popleft()
+                    session, raw_chunk = await task
+                    # A small server response leaves a gap before this chunk.
+                    while height + 1 < chunk_height:
+                        last_height = await self._request_chunk(height + 1,
+                            chunk_height - height - 1)
+                        if last_height == height:
+                            raise DisconnectSessionError('no headers returned')
+                        height = last_height
+                        prev_hash = None
+                    # A chunk from another session that does not follow the headers connected
+                    # before it may be from a different fork, so we get our own.
+                    if session is not self and raw_chunk and prev_hash is not None and \
+                            coin.header_prev_hash(raw_chunk[:HEADER_SIZE]) != prev_hash:
+                        self.logger.info(f'headers from {session.server} at height '
+                            f'{chunk_height:,d} do not connect')
+                        raw_chunk = await self._fetch_chunk(chunk_height, count)
+                    if not raw_chunk:
+                        continue
+
+                    try:
+                        height = self._connect_fetched_chunk(chunk_height, raw_chunk,
+                            flush=False)
+                    except DisconnectSessionError as e:
+                        # The bad headers are those of the other session, not ours.
+                        if session is self:
+                            raise
+                        await session.disconnect(str(e), blacklist=True)
+                        self.logger.info(f'requesting the headers from height '
+                            f'{chunk_height:,d} myself')
+                        raw_chunk = await self._fetch_chunk(chunk_height, count)
+                        if not raw_chunk:
+                            continue
+                        height = self._connect_fetched_chunk(chunk_height, raw_chunk,
+                            flush=False)
+                    prev_hash = coin.header_hash(raw_chunk[-HEADER_SIZE:])
+                    connected_count += 1
+                    if connected_count % self.HEADER_FLUSH_INTERVAL == 0:
+                        headers_obj.flush()
+        finally:
+            headers_obj.flush()
+        return height
+
     async def _subscribe_headers(self):
         '''Raises: RPCError, TaskTimeout, DisconnectSessionError'''
         self._handlers[HEADERS_SUBSCRIBE] = self._on_new_tip
@@ -597,32 +892,92 @@ class SVSession(RPCSession):
         height = await self._request_headers_at_heights(heights)
         # Catch up
         while height < tip.height:
-            height = await self._request_chunk(height + 1, 2016)
+            last_height = await self._catch_up_with_chunks(height, tip.height)
+            if last_height == height:
+                raise DisconnectSessionError('no headers returned')
+            height = last_height
+
+    async def _subscribe_to_script_hashes(self, account: 'AbstractAccount',
+            script_hashes: List[str]) -> None:
+        '''Subscribe to the script hashes in one batch. Only the subscriptions that fail are
+        resent, and if any still fail after the retry limit is reached an error is raised.
+
+        Raises: BatchError, TaskTimeout'''
+        attempt = 0
+        while True:
+            async with self.send_batch(raise_errors=False) as batch:
+                for script_hash in script_hashes:
+                    batch.add_request(SCRIPTHASH_SUBSCRIBE, [script_hash])
+
+            failed_script_hashes: List[str] = []
+            for script_hash, result in zip(script_hashes, batch.results):
+                if isinstance(result, Exception):
+                    failed_script_hashes.append(script_hash)
+                else:
+                    await self._on_queue_status_changed(script_hash, result)
+            account.response_count += len(script_hashes) - len(failed_script_hashes)
+            account._wallet.progress_event.set()
 
-    async def _subscribe_to_script_hash(self, script_hash: str) -> None:
-        '''Raises: RPCError, TaskTimeout'''
-        status = await self.send_request(SCRIPTHASH_SUBSCRIBE, [script_hash])
-        await self._on_queue_status_changed(script_hash, status)
+            if not failed_script_hashes:
+                return
+            attempt += 1
+            if attempt > self.SUBSCRIPTION_RETRY_LIMIT:
+                raise BatchError(batch)
+            self.logger.debug("retrying %d of %d script hash subscriptions (attempt %d)",
+                len(failed_script_hashes), len(script_hashes), attempt)
+            script_hashes = failed_script_hashes
 
     async def _unsubscribe_from_script_hash(self, script_hash: str) -> bool:
         return await self.send_request(SCRIPTHASH_UNSUBSCRIBE, [script_hash])
 
-    async def _on_status_changed(self, script_hash: str, status: str) -> None:
-        keydata = self._keyinstance_map.get(script_hash)
-        if keydata is None:
-            self.logger.error(f'received status notification for unsubscribed {script_hash}')
-            return
-        keyinstance_id, script_type = keydata
+    async def acquire_history_slot(self) -> None:
+        await self._history_semaphore.acquire()
+
+    def release_history_slot(self) -> None:
+        self._history_semaphore.release()
 
-        # Accounts needing a notification.
-        accounts = [account for account, subs in self._subs_by_account.items()
-            if script_hash in subs and
-            _history_status(account.get_key_history(keyinstance_id, script_type)) != status]
-        if not accounts:
+    async def _on_statuses_changed(self, changes: Dict[str, str]) -> None:
+        '''Request the histories of the script hashes whose status differs from that of the
+        accounts that are subscribed to them, in one batch.
+
+        Raises: BatchError, DisconnectSessionError, TaskTimeout'''
+        wanted: List[Tuple[str, str, int, ScriptType, List['AbstractAccount']]] = []
+        for script_hash, status in changes.items():
+            keydata = self._keyinstance_map.get(script_hash)
+            if keydata is None:
+                self.logger.error(f'received status notification for unsubscribed {script_hash}')
+                continue
+            keyinstance_id, script_type = keydata
+
+            # Accounts needing a notification.
+            accounts = [account for account, subs in self._subs_by_account.items()
+                if script_hash in subs and
+                _history_status(account.get_key_history(keyinstance_id, script_type)) != status]
+            if accounts:
+                wanted.append((script_hash, status, keyinstance_id, script_type, accounts))
+        if not wanted:
             return
 
         # Status has changed; get history
-        result = await self.request_history(script_hash)
+        async with self.send_batch(raise_errors=False) as batch:
+            for script_hash, *_rest in wanted:
+                batch.add_request(SCRIPTHASH_HISTORY, [script_hash])
+
+        failed = False
+        for (script_hash, status, keyinstance_id, script_type, accounts), result in \
+                zip(wanted, batch.results):
+            if isinstance(result, Exception):
+                # A later status change for the script hash will already be queued.
+                self._network._queue_status_change(script_hash, status, replace=False)
+                failed = True
+                continue
+            await self._on_history(script_hash, status, keyinstance_id, script_type, accounts,
+                result)
+        if failed:
+            raise BatchError(batch)
+
+    async def _on_history(self, script_hash: str, status: str, keyinstance_id: int,
+            script_type: ScriptType, accounts: List['AbstractAccount'], result: Any) -> None:
         self.logger.debug(f'received history of {keyinstance_id} length {len(result)}')
         try:
             history = [(item['tx_hash'], item['height']) for item in result]
@@ -630,8 +985,8 @@ class SVSession(RPCSession):
             # Check that txids are unique
             assert len(set(tx_hash for tx_hash, tx_height in history)) == len(history), \
                 f'server history for {keyinstance_id} has duplicate transactions'
-        except (AssertionError, KeyError) as e:
-            self._network._on_status_queue.put_nowait((script_hash, status))  # re-queue
+        except (AssertionError, KeyError, TypeError) as e:
+            self._network._queue_status_change(script_hash, status, replace=False)  # re-queue
             raise DisconnectSessionError(f'bad history returned: {e}')
 
         # Check the status; it can change legitimately between initial notification and
@@ -734,6 +1089,8 @@ class SVSession(RPCSession):
         return await coro
 
     async def connection_lost(self):
+        with suppress(ValueError):
+            SVSession._header_sources.remove(self)
         await super().connection_lost()
         self._closed_event.set()
 
@@ -756,6 +1113,7 @@ class SVSession(RPCSession):
         '''
         # Negotiate the protocol before doing anything else
         await self._negotiate_protocol()
+        SVSession._header_sources.append(self)
         # Checkpoint headers are essential to attempting tip connection
         await self._get_checkpoint_headers()
         # Then subscribe headers and connect the server's tip
@@ -796,45 +1154,100 @@ class SVSession(RPCSession):
 
     async def request_tx(self, tx_id: str):
         '''Raises: RPCError, TaskTimeout'''
-        return await self.send_request('blockchain.transaction.get', [tx_id])
+        return await self.send_request(REQUEST_TRANSACTION, [tx_id])
+
+    def transaction_batch_byte_budget(self) -> int:
+        '''The number of bytes the response to a transaction batch is expected to stay within.
+        This is a share of the limit the framer enforces on incoming messages.'''
+        size_limit = app_state.electrumx_message_size_limit() * 1024 * 1024
+        if size_limit == 0:
+            return self.TRANSACTION_BATCH_UNLIMITED_BUDGET
+        return int(size_limit * self.TRANSACTION_BATCH_LIMIT_SHARE)
+
+    def transaction_batch_size(self) -> int:
+        '''The number of transactions to request in the next batch, so that the expected size of
+        the hex encoded response stays within the byte budget.'''
+        if self._transactions_received:
+            average_size = self._transaction_hex_received / self._transactions_received
+        else:
+            average_size = self.TRANSACTION_HEX_SIZE_ESTIMATE
+        average_size += self.TRANSACTION_RESPONSE_OVERHEAD
+        return max(1, min(self.TRANSACTION_BATCH_MAXIMUM_COUNT,
+            int(self.transaction_batch_byte_budget() // average_size)))
+
+    async def request_txs(self, tx_ids: List[str]) -> List[Any]:
+        '''Request the given transactions in one batch. The result for each is either the
+        transaction hex or the exception the server returned for it.
+
+        Raises: TaskTimeout'''
+        async with self.send_batch(raise_errors=False) as batch:
+            for tx_id in tx_ids:
+                batch.add_request(REQUEST_TRANSACTION, [tx_id])
+        results = list(batch.results)
+        for result in results:
+            if isinstance(result, str):
+                self._transactions_received += 1
+                self._transaction_hex_received += len(result)
+        return results
 
     async def request_proof(self, *args):
         '''Raises: RPCError, TaskTimeout'''
         return await self.send_request(REQUEST_MERKLE_PROOF, args)
 
+    async def request_proofs(self, entries: List[Tuple[str, int]]) -> List[Any]:
+        '''Request the merkle proofs for the given (tx_id, tx_height) pairs in one batch. The
+        result for each is either the proof or the exception the server returned for it.
+
+        Raises: TaskTimeout'''
+        async with self.send_batch(raise_errors=False) as batch:
+            for tx_id, tx_height in entries:
+                batch.add_request(REQUEST_MERKLE_PROOF, [tx_id, tx_height])
+        return list(batch.results)
+
     async def request_history(self, script_hash):
         '''Raises: RPCError, TaskTimeout'''
         return await self.send_request(SCRIPTHASH_HISTORY, [script_hash])
 
     async def _on_queue_status_changed(self, script_hash: str, status: str) -> None:
-        item = (script_hash, status)
-        self._network._on_status_queue.put_nowait(item)
+        self._network._queue_status_change(script_hash, status)
 
     async def subscribe_to_triples(self, account: 'AbstractAccount', triples) -> None:
-        '''triples is an iterable of (keyinstance_id, script_type, script_hash) triples.
+        '''triples is a sequence of (keyinstance_id, script_type, script_hash) triples. The
+        subscriptions are sent in batches in the given order, with a limited number of batches
+        awaiting their responses at any one time.
 
-        Raises: RPCError, TaskTimeout'''
+        Raises: BatchError, TaskTimeout'''
         # Set notification handler
         self._handlers[SCRIPTHASH_SUBSCRIBE] = self._on_queue_status_changed
         if account not in self._subs_by_account:
             self._subs_by_account[account] = []
         # Take reference so account can be unsubscribed asynchronously without conflict
         subs = self._subs_by_account[account]
+        script_hashes: List[str] = []
+        for keyinstance_id, script_type, script_hash in triples:
+            subs.append(script_hash)
+            # Send request even if already subscribed, as our user expects a response
+            # to trigger other actions and won't get one if we swallow it.
+            self._keyinstance_map[script_hash] = keyinstance_id, script_type
+            script_hashes.append(script_hash)
+
+        account.request_count += len(script_hashes)
+        account._wallet.progress_event.set()
+
+        batch_size = max(1, app_state.config.get('subscription_batch_size',
+            self.SUBSCRIPTION_BATCH_SIZE))
+        batch_window = max(1, app_state.config.get('subscription_batch_window',
+            self.SUBSCRIPTION_BATCH_WINDOW))
         async with TaskGroup() as group:
-            for keyinstance_id, script_type, script_hash in triples:
-                subs.append(script_hash)
-                # Send request even if already subscribed, as our user expects a response
-                # to trigger other actions and won't get one if we swallow it.
-                self._keyinstance_map[script_hash] = keyinstance_id, script_type
-                await group.spawn(self._subscribe_to_script_hash(script_hash))
-
-            # ensure GUI doesn't keep showing synchronizing...(100/101) when there are only 100 subs
-            account.request_count += len(set(triples) - set(subs))
-            account._wallet.progress_event.set()
-
-            while await group.next_done():
-                account.response_count += 1
-                account._wallet.progress_event.set()
+            in_flight_count = 0
+            for batch_script_hashes in chunks(script_hashes, batch_size):
+                if in_flight_count == batch_window:
+                    task = await group.next_done()
+                    # Raise any error, as the group will not see tasks we have taken from it.
+                    task.result()
+                    in_flight_count -= 1
+                await group.spawn(self._subscribe_to_script_hashes(account, batch_script_hashes))
+                in_flight_count += 1
 
         assert len(set(subs)) == len(subs), "account subscribed to the same keys twice"
 
@@ -916,8 +1329,12 @@ class Network(TriggeredCallbacks):
         # Add an wallet, remove an wallet, or redo all wallet verifications
         self._wallet_jobs = app_state.async_.queue()
 
-        # Feed pub-sub notifications to currently active SVSession for processing
-        self._on_status_queue = app_state.async_.queue()
+        # Feed pub-sub notifications to currently active SVSession for processing. Only the
+        # latest status for each script hash is kept, in the order they were first queued.
+        self._status_changes: Dict[str, str] = {}
+        self._status_changes_event = app_state.async_.event()
+        status_backlog_metric.set_function(lambda: { (): len(self._status_changes) })
+        subscription_metric.set_function(lambda: { (): len(SVSession._keyinstance_map) })
 
         dir_path = app_state.config.file_path('certs')
         if not os.path.exists(dir_path):
@@ -1023,6 +1440,8 @@ class Network(TriggeredCallbacks):
             elif job == 'remove':
                 if wallet in tasks:
                     tasks.pop(wallet).cancel()
+                sync_backlog_metric.remove((wallet.name(), "transactions"))
+                sync_backlog_metric.remove((wallet.name(), "proofs"))
             elif job == 'undo_verifications':
                 above_height = wallet
                 for wallet in tasks:
@@ -1117,32 +1536,54 @@ class Network(TriggeredCallbacks):
         had_timeout = False
         session = await self._main_session()
         session.logger.debug(f'requesting {len(missing_hashes)} missing transactions')
-        async with TaskGroup() as group:
-            tasks = {}
-            for tx_hash in missing_hashes:
-                tx_id = hash_to_hex_str(tx_hash)
-                tasks[await group.spawn(session.request_tx(tx_id))] = tx_hash
-
-            while tasks:
-                task = await group.next_done()
-                wallet.response_count += 1
-                wallet.progress_event.set()
-                tx_hash = tasks.pop(task)
-                tx_id = hash_to_hex_str(tx_hash)
+        # The transactions are requested in batches sized to fit within a byte budget. Each
+        # received batch is parsed and written in parallel with the fetching of the next, and
+        # we only return once they have all been written.
+        async with TaskGroup() as write_group:
+            index = 0
+            while index < len(missing_hashes):
+                batch_hashes = missing_hashes[index:index + session.transaction_batch_size()]
+                index += len(batch_hashes)
                 try:
-                    tx_hex = task.result()
-                    tx = Transaction.from_hex(tx_hex)
-                    session.logger.debug(f'received tx {tx_id} bytes: {len(tx_hex)//2}')
-                except CancelledError:
+                    results = await session.request_txs(
+                        [ hash_to_hex_str(tx_hash) for tx_hash in batch_hashes ])
+                except TaskTimeout:
                     had_timeout = True
-                except Exception as e:
-                    logger.exception(e)
-                    logger.error(f'fetching transaction {tx_id}: {e}')
-                else:
-                    wallet.add_transaction(tx_hash, tx, TxFlags.StateCleared | TxFlags.HasByteData,
-                        True)
+                    results = []
+                wallet.response_count += len(batch_hashes)
+                wallet.progress_event.set()
+
+                tx_hexes = []
+                for tx_hash, result in zip(batch_hashes, results):
+                    if isinstance(result, Exception):
+                        logger.error(f'fetching transaction {hash_to_hex_str(tx_hash)}: {result}')
+                    else:
+                        tx_hexes.append((tx_hash, result))
+                if tx_hexes:
+                    session.logger.debug(f'received {len(tx_hexes)} transactions, bytes: '
+                        f'{sum(len(tx_hex) for _tx_hash, tx_hex in tx_hexes)//2}')
+                    await write_group.spawn(self._add_transactions(wallet, tx_hexes))
         return had_timeout
 
+    async def _add_transactions(self, wallet: 'Wallet',
+            tx_hexes: List[Tuple[bytes, str]]) -> None:
+        loop = asyncio.get_event_loop()
+        parsed = await loop.run_in_executor(None, _parse_transactions, tx_hexes)
+        entries = []
+        for tx_hash, tx in parsed:
+            if isinstance(tx, Exception):
+                logger.error(f'parsing transaction {hash_to_hex_str(tx_hash)}: {tx}')
+            else:
+                entries.append((tx_hash, tx))
+        if not entries:
+            return
+        try:
+            await wallet.add_transactions_async(entries,
+                TxFlags.StateCleared | TxFlags.HasByteData, True)
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'writing {len(entries)} transactions: {e}')
+
     def _available_servers(self, protocol):
         now = time.time()
         unchosen = set(SVServer.all_servers.values()).difference(self.chosen_servers)
@@ -1160,50 +1601,78 @@ class Network(TriggeredCallbacks):
                 return server
             await sleep(10)
 
-    async def _request_proofs(self, wallet: 'Wallet', wanted_map) -> bool:
+    async def _request_proofs(self, wallet: 'Wallet', wanted_map: Dict[bytes, int]) -> bool:
         had_timeout = False
         session = await self._main_session()
         session.logger.debug(f'requesting {len(wanted_map)} proofs')
-        async with TaskGroup() as group:
-            tasks = {}
-            for tx_hash, tx_height in wanted_map.items():
-                tx_id = hash_to_hex_str(tx_hash)
-                tasks[await group.spawn(session.request_proof(tx_id, tx_height))] = (tx_hash,
-                    tx_id)
-            headers = await session.headers_at_heights(wanted_map.values())
-
-            while tasks:
-                task = await group.next_done()
-                tx_hash, tx_id = tasks.pop(task)
-                tx_height = wanted_map[tx_hash]
+        # Proofs are requested in batches ordered by height, so that the transactions in the
+        # same block share the one header lookup. The headers are looked up once for all batches.
+        wanted_entries = sorted(wanted_map.items(), key=lambda item: item[1])
+        headers: Dict[int, Any] = {}
+        # Each received batch is verified and written in parallel with the fetching of the
+        # next, and we only return once they have all been written.
+        async with TaskGroup() as verify_group:
+            for batch_entries in chunks(wanted_entries, session.PROOF_BATCH_SIZE):
+                batch_heights = set(tx_height for (_tx_hash, tx_height) in batch_entries)
+                missing_heights = batch_heights - set(headers)
+                if missing_heights:
+                    headers.update(await session.headers_at_heights(missing_heights))
                 try:
-                    result = task.result()
-                    branch = [hex_str_to_hash(item) for item in result['merkle']]
-                    tx_pos = result['pos']
-                    proven_root = _root_from_proof(tx_hash, branch, tx_pos)
-                    header = headers[wanted_map[tx_hash]]
-                except CancelledError:
+                    results = await session.request_proofs([ (hash_to_hex_str(tx_hash),
+                        tx_height) for (tx_hash, tx_height) in batch_entries ])
+                except TaskTimeout:
                     had_timeout = True
-                except Exception as e:
-                    logger.error(f'getting proof for {tx_id}: {e}')
-                else:
-                    if header.merkle_root == proven_root:
-                        logger.debug(f'received valid proof for {tx_id}')
-                        wallet.add_transaction_proof(tx_hash, tx_height, header.timestamp, tx_pos,
-                            tx_pos, branch)
+                    continue
+
+                proof_entries = []
+                for (tx_hash, tx_height), result in zip(batch_entries, results):
+                    if isinstance(result, Exception):
+                        logger.error(f'getting proof for {hash_to_hex_str(tx_hash)}: {result}')
                     else:
-                        hhts = hash_to_hex_str
-                        logger.error(f'invalid proof for tx {tx_id} in block '
-                                     f'{hhts(header.hash)}; got {hhts(proven_root)} expected '
-                                     f'{hhts(header.merkle_root)}')
+                        proof_entries.append((tx_hash, tx_height, headers[tx_height], result))
+                if proof_entries:
+                    await verify_group.spawn(self._add_transaction_proofs(wallet,
+                        proof_entries))
         return had_timeout
 
+    async def _add_transaction_proofs(self, wallet: 'Wallet',
+            proof_entries: List[Tuple[bytes, int, Any, Any]]) -> None:
+        loop = asyncio.get_event_loop()
+        verified = await loop.run_in_executor(None, _verify_proofs, proof_entries)
+        wallet.add_transaction_proofs(verified)
+
+    def _queue_status_change(self, script_hash: str, status: str,
+            replace: bool=True) -> None:
+        # Repeated changes for a script hash that has not been processed yet are merged.
+        if replace or script_hash not in self._status_changes:
+            self._status_changes[script_hash] = status
+            self._status_changes_event.set()
+
     async def _monitor_on_status(self, group):
-        """worker task to process new aiorpcx 'Notifications' from queue"""
+        """worker task to process queued script hash status changes in batches"""
         while True:
             session = await self._main_session()
-            script_hash, status = await self._on_status_queue.get()
-            await group.spawn(session._on_status_changed, script_hash, status)
+            # Changes keep being merged while the session is busy with earlier batches.
+            await session.acquire_history_slot()
+            try:
+                while not self._status_changes:
+                    self._status_changes_event.clear()
+                    await self._status_changes_event.wait()
+                script_hashes = list(itertools.islice(self._status_changes,
+                    session.HISTORY_BATCH_SIZE))
+                changes = { script_hash: self._status_changes.pop(script_hash)
+                    for script_hash in script_hashes }
+            except BaseException:
+                session.release_history_slot()
+                raise
+            await group.spawn(self._process_status_changes, session, changes)
+
+    async def _process_status_changes(self, session: 'SVSession',
+            changes: Dict[str, str]) -> None:
+        try:
+            await session._on_statuses_changed(changes)
+        finally:
+            session.release_history_slot()
 
     async def _monitor_txs(self, wallet: 'Wallet') -> None:
         '''Raises: RPCError, BatchError, TaskTimeout, DisconnectSessionError'''
@@ -1218,6 +1687,8 @@ class Network(TriggeredCallbacks):
             wanted_tx_map = wallet.missing_transactions()
             # The set of transactions we have data for, but not proof for.
             wanted_proof_map = wallet.unverified_transactions()
+            sync_backlog_metric.set(len(wanted_tx_map), (wallet.name(), "transactions"))
+            sync_backlog_metric.set(len(wanted_proof_map), (wallet.name(), "proofs"))
 
             coros = []
             if wanted_tx_map:
@@ -1241,10 +1712,15 @@ class Network(TriggeredCallbacks):
         additional_keys = set(account.existing_active_keys())
         while True:
             session.logger.info(f'subscribing to {len(additional_keys):,d} new keys for {account}')
-            # Do in reverse to require fewer account re-sync loops
-            pairs = [ (k, script_type, scripthash_hex(script)) for k in additional_keys
-                for script_type, script in account.get_possible_scripts_for_id(k) ]
-            pairs.reverse()
+            # Receiving keys are the ones most likely to have incoming payments, so they are
+            # subscribed to first. Otherwise do in reverse to require fewer account re-sync loops.
+            def key_priority(keyinstance_id: int) -> Tuple[bool, int]:
+                derivation_path = account.get_derivation_path(keyinstance_id)
+                is_receiving = derivation_path is not None and \
+                    tuple(derivation_path[:len(RECEIVING_SUBPATH)]) == RECEIVING_SUBPATH
+                return not is_receiving, -keyinstance_id
+            pairs = await _get_script_hash_triples(account,
+                sorted(additional_keys, key=key_priority))
             await session.subscribe_to_triples(account, pairs)
             additional_keys = await account.new_activated_keys()
             session = await self._main_session()
@@ -1256,8 +1732,7 @@ class Network(TriggeredCallbacks):
             session = await self._main_session()
             session.logger.info(f'unsubscribing from {len(keys):,d} '+
                 f'deactivated keys for {account}')
-            pairs = [ (k, script_type, scripthash_hex(script)) for k in keys
-                for script_type, script in account.get_possible_scripts_for_id(k) ]
+            pairs = await _get_script_hash_triples(account, keys)
             await session.unsubscribe_from_pairs(account, pairs)
 
     async def _maintain_wallet(self, wallet: 'Wallet') -> None:
@@ -0,0 +1,432 @@
+# ElectrumSV - lightweight Bitcoin SV client
+# Copyright (C) 2019-2020 The ElectrumSV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+ElectrumSV runtime profiling.
+
+A running wallet can be profiled without restarting it, through the daemon JSON-RPC interface
+or the REST API. There are two modes:
+
+- Sampling, which periodically records the stacks of selected threads and writes them in the
+  collapsed stack format used by flame graph tools.
+- Tracing, which times every call to the functions in selected modules or classes and writes
+  the results as a `pstats` file.
+
+Nothing is installed while profiling is not active, so there is no cost when it is not used.
+'''
+
+from collections import defaultdict
+import functools
+import importlib
+import inspect
+import marshal
+import os
+import sys
+import threading
+import time
+from types import CodeType, FrameType, ModuleType
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .logs import logs
+
+
+logger = logs.get_logger("profiling")
+
+# The results are written to this directory within the user's data directory.
+PROFILES_DIRECTORY_NAME = "profiles"
+
+# The pstats identity of a function: its file name, first line number and name.
+FunctionKey = Tuple[str, int, str]
+
+# Only our own code can be traced, as tracing replaces every function in the targets.
+TRACE_TARGET_PACKAGE = "electrumsv"
+
+
+class ProfilingError(Exception):
+    pass
+
+
+class StackSampler:
+    '''
+    Records the stacks of the threads whose names start with any of the given prefixes, at the
+    given interval in seconds. This only reads the frames of the sampled threads, and does not
+    slow them down other than by competing for the interpreter lock.
+    '''
+
+    def __init__(self, interval: float, thread_prefixes: Sequence[str]) -> None:
+        self._interval = interval
+        self._thread_prefixes = tuple(thread_prefixes)
+        self._stacks: Dict[str, int] = defaultdict(int)
+        self._labels: Dict[CodeType, str] = {}
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._main, name="profiling-sampler",
+            daemon=True)
+        self.sample_count = 0
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Dict[str, int]:
+        self._stop_event.set()
+        self._thread.join()
+        return dict(self._stacks)
+
+    def _main(self) -> None:
+        sampler_ident = threading.get_ident()
+        while not self._stop_event.wait(self._interval):
+            thread_names = { thread.ident: thread.name for thread in threading.enumerate()
+                if thread.ident != sampler_ident and thread.name.startswith(self._thread_prefixes)
+            }
+            for thread_ident, frame in sys._current_frames().items():
+                thread_name = thread_names.get(thread_ident)
+                if thread_name is not None:
+                    self._stacks[self._collapse_stack(thread_name, frame)] += 1
+            self.sample_count += 1
+
+    def _collapse_stack(self, thread_name: str, frame: Optional[FrameType]) -> str:
+        labels: List[str] = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = f"{_get_short_path(code.co_filename)}:" \
+                    f"{code.co_name}".replace(";", ":")
+            labels.append(label)
+            frame = frame.f_back
+        labels.append(thread_name.replace(";", ":"))
+        return ";".join(reversed(labels))
+
+
+class _CallEntry:
+    def __init__(self, key: FunctionKey, start_time: float) -> None:
+        self.key = key
+        self.start_time = start_time
+        self.child_time = 0.0
+
+
+class FunctionTracer:
+    '''
+    Times the calls to the functions and methods defined in the given targets. A target is the
+    name of a module, a class or a function, like `electrumsv.wallet`,
+    `electrumsv.network.SVSession` or `electrumsv.wallet.Wallet.add_transaction`, and must be
+    within the `electrumsv` package.
+
+    The functions are replaced with timing wrappers when tracing starts, and the originals are
+    put back when it stops. Code that imported a module-level function by name before tracing
+    started will still call the original. Generators are not traced, and coroutines are timed
+    from when they are first awaited until they complete, including the time they spend
+    waiting.
+    '''
+
+    def __init__(self, targets: Sequence[str]) -> None:
+        self._targets = list(targets)
+        self._replacements: List[Tuple[Any, str, Any]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # These are the values pstats expects: the primitive call count, the call count, the
+        # time spent in the function itself, the cumulative time and the calls by each caller.
+        self._stats: Dict[FunctionKey, List[Any]] = {}
+
+    def start(self) -> None:
+        entries: List[Tuple[Any, str, Any]] = []
+        for target in self._targets:
+            entries.extend(_resolve_target(target))
+        for owner, name, value in entries:
+            wrapped_value = self._wrap(value)
+            if wrapped_value is not None:
+                self._replacements.append((owner, name, value))
+                setattr(owner, name, wrapped_value)
+        if not self._replacements:
+            raise ProfilingError(f"no functions found to trace in {self._targets}")
+        logger.debug("tracing %d functions", len(self._replacements))
+
+    def stop(self) -> Dict[FunctionKey, Tuple[Any, ...]]:
+        for owner, name, value in reversed(self._replacements):
+            setattr(owner, name, value)
+        self._replacements.clear()
+        with self._lock:
+            return { key: (stats[0], stats[1], stats[2], stats[3],
+                    { caller_key: tuple(caller_stats) for caller_key, caller_stats
+                        in stats[4].items() })
+                for key, stats in self._stats.items() }
+
+    @property
+    def function_count(self) -> int:
+        return len(self._replacements)
+
+    def _wrap(self, value: Any) -> Any:
+        if isinstance(value, (staticmethod, classmethod)):
+            wrapped_function = self._wrap(value.__func__)
+            return type(value)(wrapped_function) if wrapped_function is not None else None
+        if not inspect.isfunction(value) or inspect.isgeneratorfunction(value) or \
+                inspect.isasyncgenfunction(value):
+            return None
+
+        code = value.__code__
+        key = (code.co_filename, code.co_firstlineno, value.__qualname__)
+        if inspect.iscoroutinefunction(value):
+            @functools.wraps(value)
+            async def trace_coroutine(*args: Any, **kwargs: Any) -> Any:
+                # Coroutines interleave on the event loop thread, so they cannot be placed in
+                # the call stack of that thread.
+                start_time = time.perf_counter()
+                try:
+                    return await value(*args, **kwargs)
+                finally:
+                    elapsed_time = time.perf_counter() - start_time
+                    self._record(key, None, elapsed_time, elapsed_time, True)
+            return trace_coroutine
+
+        @functools.wraps(value)
+        def trace_function(*args: Any, **kwargs: Any) -> Any:
+            stack: Optional[List[_CallEntry]] = getattr(self._local, "stack", None)
+            if stack is None:
+                stack = self._local.stack = []
+            entry = _CallEntry(key, time.perf_counter())
+            stack.append(entry)
+            try:
+                return value(*args, **kwargs)
+            finally:
+                stack.pop()
+                elapsed_time = time.perf_counter() - entry.start_time
+                caller_key = stack[-1].key if stack else None
+                if stack:
+                    stack[-1].child_time += elapsed_time
+                # Recursive calls are only counted in the cumulative time once.
+                is_primitive = all(other.key != key for other in stack)
+                self._record(key, caller_key, elapsed_time - entry.child_time, elapsed_time,
+                    is_primitive)
+        return trace_function
+
+    def _record(self, key: FunctionKey, caller_key: Optional[FunctionKey], own_time: float,
+            elapsed_time: float, is_primitive: bool) -> None:
+        cumulative_time = elapsed_time if is_primitive else 0.0
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = [ 0, 0, 0.0, 0.0, {} ]
+            stats[0] += is_primitive
+            stats[1] += 1
+            stats[2] += own_time
+            stats[3] += cumulative_time
+            if caller_key is not None:
+                caller_stats = stats[4].get(caller_key)
+                if caller_stats is None:
+                    caller_stats = stats[4][caller_key] = [ 0, 0, 0.0, 0.0 ]
+                caller_stats[0] += 1
+                caller_stats[1] += is_primitive
+                caller_stats[2] += own_time
+                caller_stats[3] += cumulative_time
+
+
+def _get_short_path(file_path: str) -> str:
+    # Paths within the installed packages are shown relative to the package directory.
+    for path in sorted(sys.path, key=len, reverse=True):
+        if path and file_path.startswith(path + os.sep):
+            return file_path[len(path)+1:]
+    return os.path.basename(file_path)
+
+
+def _is_package_name(name: Optional[str]) -> bool:
+    return name is not None and (name == TRACE_TARGET_PACKAGE or
+        name.startswith(TRACE_TARGET_PACKAGE + "."))
+
+
+def _resolve_target(target: str) -> List[Tuple[Any, str, Any]]:
+    # The name is checked before anything is imported, and what it names is checked after, as
+    # the modules in the package refer to objects from other packages that they import.
+    if not _is_package_name(target):
+        raise ProfilingError(f"trace target {target} is not within {TRACE_TARGET_PACKAGE}")
+
+    # Find the longest prefix of the name that is a module, then the object within it.
+    parts = target.split(".")
+    module: Optional[ModuleType] = None
+    attribute_names: List[str] = []
+    for i in range(len(parts), 0, -1):
+        try:
+            module = importlib.import_module(".".join(parts[:i]))
+        except ImportError:
+            continue
+        attribute_names = parts[i:]
+        break
+    if module is None:
+        raise ProfilingError(f"unknown trace target {target}")
+
+    owner: Any = None
+    value: Any = module
+    for attribute_name in attribute_names:
+        owner = value
+        if not hasattr(value, "__dict__") or attribute_name not in vars(value):
+            raise ProfilingError(f"unknown trace target {target}")
+        value = vars(value)[attribute_name]
+
+    module_name = value.__name__ if inspect.ismodule(value) else \
+        getattr(value, "__module__", None)
+    if not _is_package_name(module_name):
+        raise ProfilingError(f"trace target {target} is not within {TRACE_TARGET_PACKAGE}")
+
+    if inspect.ismodule(value):
+        entries: List[Tuple[Any, str, Any]] = []
+        for name, module_value in vars(value).items():
+            if getattr(module_value, "__module__", None) != value.__name__:
+                continue
+            if inspect.isclass(module_value):
+                entries.extend(_get_class_entries(module_value))
+            else:
+                entries.append((value, name, module_value))
+        return entries
+    if inspect.isclass(value):
+        return _get_class_entries(value)
+    return [ (owner, attribute_names[-1], value) ]
+
+
+def _get_class_entries(class_: type) -> List[Tuple[Any, str, Any]]:
+    # Special methods are left alone, as they are called implicitly and often very frequently.
+    return [ (class_, name, value) for name, value in vars(class_).items()
+        if not (name.startswith("__") and name.endswith("__")) ]
+
+
+def _check_names(names: Optional[Sequence[str]], description: str) -> None:
+    if names is not None and (not isinstance(names, (list, tuple)) or
+            not all(isinstance(name, str) for name in names)):
+        raise ProfilingError(f"the {description} must be a list of names")
+
+
+class Profiling:
+    '''
+    Manages the one profiling session that can be active at a time.
+    '''
+
+    SAMPLE = "sample"
+    TRACE = "trace"
+
+    DEFAULT_SAMPLE_INTERVAL = 0.005
+    MINIMUM_SAMPLE_INTERVAL = 0.001
+    # The event loop, the database writer and the database completion callback threads.
+    DEFAULT_THREAD_PREFIXES = ("async", "sqlite-writer", "sqlite-callback")
+    DEFAULT_TRACE_TARGETS = ("electrumsv.wallet", "electrumsv.network")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._mode: Optional[str] = None
+        self._directory: Optional[str] = None
+        self._start_time = 0.0
+        self._sampler: Optional[StackSampler] = None
+        self._tracer: Optional[FunctionTracer] = None
+        self._last_path: Optional[str] = None
+
+    def is_active(self) -> bool:
+        return self._mode is not None
+
+    def start(self, mode: str, directory: str, interval: Optional[float]=None,
+            threads: Optional[Sequence[str]]=None,
+            targets: Optional[Sequence[str]]=None) -> Dict[str, Any]:
+        '''
+        Start profiling in the given mode, writing the results to the given directory when it
+        is stopped. The sampling interval and thread name prefixes only apply to sampling, and
+        the targets only to tracing.
+        '''
+        # These may come from the REST API or the JSON-RPC interface unchecked.
+        if interval is not None and (isinstance(interval, bool) or
+                not isinstance(interval, (int, float))):
+            raise ProfilingError("the sample interval must be a number")
+        _check_names(threads, "thread name prefixes")
+        _check_names(targets, "trace targets")
+
+        with self._lock:
+            if self._mode is not None:
+                raise ProfilingError("profiling is already active")
+            if mode == self.SAMPLE:
+                if interval is None:
+                    interval = self.DEFAULT_SAMPLE_INTERVAL
+                elif interval < self.MINIMUM_SAMPLE_INTERVAL:
+                    raise ProfilingError(f"the sample interval must be at least "
+                        f"{self.MINIMUM_SAMPLE_INTERVAL} seconds")
+                self._sampler = StackSampler(interval,
+                    threads if threads is not None else self.DEFAULT_THREAD_PREFIXES)
+                self._sampler.start()
+            elif mode == self.TRACE:
+                tracer = FunctionTracer(targets if targets is not None else
+                    self.DEFAULT_TRACE_TARGETS)
+                tracer.start()
+                self._tracer = tracer
+            else:
+                raise ProfilingError(f"unknown profiling mode {mode}")
+            self._mode = mode
+            self._directory = directory
+            self._start_time = time.time()
+            logger.info("started profiling (%s)", mode)
+            return self._get_status()
+
+    def stop(self) -> Dict[str, Any]:
+        '''
+        Stop profiling and write the results. The status that is returned includes the path of
+        the file they were written to.
+        '''
+        with self._lock:
+            if self._mode is None:
+                raise ProfilingError("profiling is not active")
+            assert self._directory is not None
+            os.makedirs(self._directory, exist_ok=True)
+            file_name = "profile-{}-{}".format(self._mode,
+                time.strftime("%Y%m%d-%H%M%S", time.localtime(self._start_time)))
+            if self._sampler is not None:
+                stacks = self._sampler.stop()
+                self._sampler = None
+                path = os.path.join(self._directory, file_name +".txt")
+                with open(path, "w") as f:
+                    for stack, count in sorted(stacks.items(), key=lambda t: -t[1]):
+                        f.write(f"{stack} {count}\n")
+            else:
+                assert self._tracer is not None
+                stats = self._tracer.stop()
+                self._tracer = None
+                path = os.path.join(self._directory, file_name +".prof")
+                # This is the format `cProfile` writes and `pstats.Stats` reads.
+                with open(path, "wb") as f:
+                    marshal.dump(stats, f)
+            logger.info("stopped profiling (%s), written to '%s'", self._mode, path)
+            self._mode = None
+            self._last_path = path
+            return self._get_status()
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._get_status()
+
+    def _get_status(self) -> Dict[str, Any]:
+        status: Dict[str, Any] = {
+            "active": self._mode is not None,
+            "mode": self._mode,
+            "path": self._last_path,
+        }
+        if self._mode is not None:
+            status["duration"] = time.time() - self._start_time
+            if self._sampler is not None:
+                status["samples"] = self._sampler.sample_count
+            if self._tracer is not None:
+                status["functions"] = self._tracer.function_count
+        return status
+
+
+profiling = Profiling()
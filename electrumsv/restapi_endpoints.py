@@ -5,7 +5,10 @@ from aiohttp import web
 
 from .logs import logs
 from .app_state import app_state
-from .restapi import good_response, get_network_type
+from .metrics import metrics
+from .profiling import profiling, PROFILES_DIRECTORY_NAME, ProfilingError
+from .restapi import (bad_request, decode_request_body, Errors, good_response,
+    get_network_type)
 
 # PATHS
 VERSION = "/v1"
@@ -47,7 +50,12 @@ class DefaultEndpoints(HandlerUtils):
     def add_routes(self):
         self.routes = [
             web.get("/", handler=self.status),
-            web.get(BASE + "/ping", handler=self.ping)
+            web.get("/metrics", handler=self.prometheus_metrics),
+            web.get(BASE + "/ping", handler=self.ping),
+            web.get(BASE + "/metrics", handler=self.metrics),
+            web.get(BASE + "/profiling", handler=self.get_profiling_status),
+            web.post(BASE + "/profiling/start", handler=self.start_profiling),
+            web.post(BASE + "/profiling/stop", handler=self.stop_profiling),
         ]
 
     async def status(self, request):
@@ -57,4 +65,37 @@ class DefaultEndpoints(HandlerUtils):
     async def ping(self, request):
         return good_response({"value": "pong"})
 
+    async def metrics(self, request):
+        return good_response(metrics.to_dict())
+
+    async def prometheus_metrics(self, request):
+        # This is the path and format a Prometheus server expects to scrape.
+        return web.Response(text=metrics.to_prometheus_text(),
+            headers={ "Content-Type": "text/plain; version=0.0.4; charset=utf-8" })
+
+    async def get_profiling_status(self, request):
+        return good_response(profiling.get_status())
+
+    async def start_profiling(self, request):
+        try:
+            body = await decode_request_body(request)
+        except ValueError:
+            return bad_request(Errors.GENERIC_BAD_REQUEST_CODE, "the body is not valid JSON")
+        if not isinstance(body, dict):
+            return bad_request(Errors.GENERIC_BAD_REQUEST_CODE, "the body must be a JSON object")
+        try:
+            status = profiling.start(body.get("mode", profiling.SAMPLE),
+                self.app_state.config.file_path(PROFILES_DIRECTORY_NAME),
+                body.get("interval"), body.get("threads"), body.get("targets"))
+        except ProfilingError as e:
+            return bad_request(Errors.GENERIC_BAD_REQUEST_CODE, str(e))
+        return good_response(status)
+
+    async def stop_profiling(self, request):
+        try:
+            status = profiling.stop()
+        except ProfilingError as e:
+            return bad_request(Errors.GENERIC_BAD_REQUEST_CODE, str(e))
+        return good_response(status)
+
     # ----- Extended in examples/applications/restapi ----- #
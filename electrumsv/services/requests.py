@@ -1,5 +1,5 @@
 import time
-from typing import List, Optional, Sequence, Tuple, TYPE_CHECKING
+from typing import Iterable, List, Optional, Tuple, TYPE_CHECKING
 import weakref
 
 from electrumsv.constants import KeyInstanceFlag, PaymentFlag
@@ -84,7 +84,7 @@ class RequestService:
         wallet.trigger_callback('on_keys_updated', account_id, [ new_key ])
         return True
 
-    def check_paid_requests(self, checkable_key_ids: Sequence[int],
+    def check_paid_requests(self, checkable_key_ids: Iterable[int],
             exc_value: Optional[Exception]=None) -> None:
         if exc_value is not None:
             raise exc_value
@@ -6,7 +6,7 @@ from bitcoinx import Script
 from electrumsv.app_state import app_state
 from electrumsv.bitcoin import ScriptTemplate
 from electrumsv.constants import DerivationType, KeyInstanceFlag, ScriptType, TransactionOutputFlag
-from electrumsv.wallet import AbstractAccount
+from electrumsv.wallet import AbstractAccount, AccountRoutingIndex
 from electrumsv.wallet_database.tables import AccountRow, KeyInstanceRow, TransactionOutputRow
 
 
@@ -37,6 +37,7 @@ class MockWallet:
         self._transaction_cache = unittest.mock.Mock()
         self._db_context = unittest.mock.Mock()
         self._storage = unittest.mock.Mock()
+        self._routing_index = AccountRoutingIndex()
 
     def name(self) -> str:
         return "MockWallet.name"
@@ -183,5 +184,8 @@ def test_remove_transaction(mocker) -> None:
     mocker.patch("electrumsv.wallet_database.tables.TransactionOutputTable.read").return_value = [
         transactionoutput_rows[0], transactionoutput_rows[1],
     ]
+    # The outputs of the removed transaction are not spent.
+    mocker.patch("electrumsv.wallet_database.tables.TransactionOutputTable.read_txokeys"
+        ).return_value = [ transactionoutput_rows[2] ]
     account._remove_transaction(TX_HASH_2)
 
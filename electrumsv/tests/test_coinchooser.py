@@ -0,0 +1,152 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from bitcoinx import P2PKH_Address, PrivateKey
+import pytest
+
+from electrumsv import coinchooser
+from electrumsv.constants import ScriptType
+from electrumsv.exceptions import NotEnoughFunds
+from electrumsv.networks import Net
+from electrumsv.transaction import Transaction, XPublicKey, XTxOutput
+from electrumsv.wallet import UTXO
+
+
+FEE_PER_BYTE = 1
+DUST_THRESHOLD = 546
+
+private_key = PrivateKey.from_random()
+script_pubkey = P2PKH_Address(private_key.public_key.hash160(), Net.COIN).to_script()
+
+
+class MockAccount:
+    def __init__(self) -> None:
+        self.estimate_count = 0
+
+    def get_threshold(self, script_type: ScriptType) -> int:
+        return 1
+
+    def get_xpubkeys_for_id(self, keyinstance_id: int) -> List[XPublicKey]:
+        return [ XPublicKey(pubkey_bytes=private_key.public_key.to_bytes()) ]
+
+    def estimate_input_size(self, utxo: UTXO) -> int:
+        self.estimate_count += 1
+        return utxo.to_tx_input(self).estimated_size()
+
+    def get_coins_by_value(self, utxos: List[UTXO]) -> Tuple[List[UTXO], List[int], List[int]]:
+        return coinchooser.coins_by_value(utxos)
+
+
+class MockConfig:
+    def __init__(self, values: Dict[str, Any]) -> None:
+        self._values = values
+
+    def get(self, key: str, default: Optional[Any]=None) -> Any:
+        return self._values.get(key, default)
+
+
+def _make_utxos(values: List[int]) -> List[UTXO]:
+    return [ UTXO(value=value, script_pubkey=script_pubkey, script_type=ScriptType.P2PKH,
+            tx_hash=bytes([ n % 256, n // 256 ]) * 16, out_index=0, keyinstance_id=n,
+            address=None, is_coinbase=False, flags=0)
+        for n, value in enumerate(values) ]
+
+
+def _make_tx(chooser: coinchooser.CoinChooserBase, utxos: List[UTXO], amount: int,
+        account: Optional[MockAccount]=None) -> Transaction:
+    outputs = [ XTxOutput(amount, script_pubkey) ]
+    change_outs = [ XTxOutput(0, script_pubkey) ]
+    return chooser.make_tx(utxos, outputs, change_outs, lambda size: size * FEE_PER_BYTE,
+        DUST_THRESHOLD, account or MockAccount())
+
+
+def _input_values(tx: Transaction) -> List[int]:
+    return sorted(txin.value for txin in tx.inputs)
+
+
+def test_branch_and_bound_changeless() -> None:
+    # Only two of the coins add up to the amount and the fee with nothing worth keeping.
+    utxos = _make_utxos([ 50000, 20000, 30000, 7000, 90000 ])
+    tx = _make_tx(coinchooser.CoinChooserBranchAndBound(), utxos, 56500)
+    assert _input_values(tx) == [ 7000, 50000 ]
+    assert len(tx.outputs) == 1
+    fee = tx.get_fee()
+    assert fee >= tx.estimated_size() * FEE_PER_BYTE
+    assert fee < tx.estimated_size() * FEE_PER_BYTE + 34 + DUST_THRESHOLD
+
+
+def test_branch_and_bound_single_coin_with_change() -> None:
+    # No combination avoids change, so the smallest coin that can pay with change is spent.
+    utxos = _make_utxos([ 1000000, 300000, 5000000, 2000000 ])
+    tx = _make_tx(coinchooser.CoinChooserBranchAndBound(), utxos, 500000)
+    assert _input_values(tx) == [ 1000000 ]
+    assert len(tx.outputs) == 2
+    assert tx.get_fee() >= tx.estimated_size() * FEE_PER_BYTE
+
+
+def test_branch_and_bound_largest_coins() -> None:
+    utxos = _make_utxos([ 1000000 + n for n in range(20) ])
+    tx = _make_tx(coinchooser.CoinChooserBranchAndBound(), utxos, 2500000)
+    assert _input_values(tx) == [ 1000017, 1000018, 1000019 ]
+    assert len(tx.outputs) == 2
+    assert tx.output_value() + tx.get_fee() == sum(_input_values(tx))
+    assert tx.get_fee() >= tx.estimated_size() * FEE_PER_BYTE
+
+
+def test_branch_and_bound_uneconomic_coins() -> None:
+    # Coins worth less than the fee to spend them are never chosen.
+    utxos = _make_utxos([ 100 ] * 50 + [ 20000 ])
+    tx = _make_tx(coinchooser.CoinChooserBranchAndBound(), utxos, 10000)
+    assert _input_values(tx) == [ 20000 ]
+
+    with pytest.raises(NotEnoughFunds):
+        _make_tx(coinchooser.CoinChooserBranchAndBound(), utxos, 20000)
+
+
+def test_branch_and_bound_not_enough_funds() -> None:
+    utxos = _make_utxos([ 10000, 20000 ])
+    with pytest.raises(NotEnoughFunds):
+        _make_tx(coinchooser.CoinChooserBranchAndBound(), utxos, 30000)
+
+
+def test_branch_and_bound_deterministic() -> None:
+    utxos = _make_utxos([ (n * 7919) % 100000 + 1000 for n in range(500) ])
+    tx1 = _make_tx(coinchooser.CoinChooserBranchAndBound(), utxos, 1234567)
+    tx2 = _make_tx(coinchooser.CoinChooserBranchAndBound(), list(reversed(utxos)), 1234567)
+    assert tx1.inputs == tx2.inputs
+    assert tx1.outputs == tx2.outputs
+
+
+def test_branch_and_bound_bounded_work() -> None:
+    chooser = coinchooser.CoinChooserBranchAndBound()
+    chooser.max_tries = 100
+    account = MockAccount()
+    utxos = _make_utxos([ 1000 + n * 10 for n in range(20000) ])
+    tx = _make_tx(chooser, utxos, 150000, account)
+    assert sum(_input_values(tx)) >= tx.output_value() + tx.get_fee()
+    # Only the coins that were looked at had their input sizes estimated.
+    assert account.estimate_count < 1000
+
+
+def test_privacy_chooser() -> None:
+    utxos = _make_utxos([ 50000, 20000, 30000, 7000, 90000 ])
+    tx = _make_tx(coinchooser.CoinChooserPrivacy(), utxos, 56500)
+    assert sum(_input_values(tx)) >= tx.output_value() + tx.get_fee()
+    assert tx.get_fee() >= tx.estimated_size() * FEE_PER_BYTE
+
+
+def test_get_coin_chooser() -> None:
+    assert coinchooser.get_name(MockConfig({})) == coinchooser.DEFAULT_COIN_CHOOSER
+    assert coinchooser.get_name(MockConfig({ 'coin_chooser': 'Unknown' })) == \
+        coinchooser.DEFAULT_COIN_CHOOSER
+    assert isinstance(coinchooser.get_coin_chooser(MockConfig({})),
+        coinchooser.CoinChooserPrivacy)
+    assert isinstance(coinchooser.get_coin_chooser(MockConfig({ 'coin_chooser': 'Privacy' })),
+        coinchooser.CoinChooserPrivacy)
+    # Large numbers of coins are chosen by branch and bound, unless a chooser has been picked.
+    large_count = coinchooser.LARGE_COIN_COUNT + 1
+    assert isinstance(coinchooser.get_coin_chooser(MockConfig({}), large_count),
+        coinchooser.CoinChooserBranchAndBound)
+    assert isinstance(coinchooser.get_coin_chooser(MockConfig({}), large_count - 1),
+        coinchooser.CoinChooserPrivacy)
+    assert isinstance(coinchooser.get_coin_chooser(MockConfig({ 'coin_chooser': 'Privacy' }),
+        large_count), coinchooser.CoinChooserPrivacy)
@@ -1,16 +1,18 @@
 import pytest
 
-from bitcoinx import PublicKey, PrivateKey
+from bitcoinx import PublicKey, PrivateKey, bip32_key_from_string
 
 from electrumsv.exceptions import InvalidPassword, IncompatibleWalletError
 from electrumsv.keystore import (
-    Imported_KeyStore, Old_KeyStore, BIP32_KeyStore, from_bip39_seed,
+    Imported_KeyStore, Old_KeyStore, BIP32_KeyStore, BIP32SigningKeys, from_bip39_seed,
     from_master_key, from_seed
 )
 from electrumsv.crypto import pw_encode
 from electrumsv.networks import Net, SVMainnet, SVTestnet
 from electrumsv.transaction import XPublicKey
 
+from .util import AppStateProxyTest
+
 
 class TestOld_KeyStore:
 
@@ -58,6 +60,20 @@ class TestOld_KeyStore:
         assert result == (bytes.fromhex(
             '81279e4fe405363eb56e686726d450fe4a76a1d83b64311d7618b845683aab4a'), False)
 
+    def test_get_private_keys_from_xpubkeys(self):
+        seed = 'ee6ea9eceaf649640051a4c305ac5c59'
+        keystore = Old_KeyStore.from_seed(seed)
+        password = 'password'
+        keystore.update_password(password)
+        x_pubkeys = [ keystore.get_xpubkey((0, 10)), keystore.get_xpubkey((1, 3)) ]
+        keypairs = keystore.get_private_keys_from_xpubkeys(x_pubkeys, password)
+        assert keypairs == { x_pubkey: keystore.get_private_key_from_xpubkey(x_pubkey, password)
+            for x_pubkey in x_pubkeys }
+        assert keypairs[x_pubkeys[0]] == (bytes.fromhex(
+            '81279e4fe405363eb56e686726d450fe4a76a1d83b64311d7618b845683aab4a'), False)
+        with pytest.raises(InvalidPassword):
+            keystore.get_private_keys_from_xpubkeys(x_pubkeys, 'guess')
+
     def test_check_seed(self):
         seed = 'ee6ea9eceaf649640051a4c305ac5c59'
         keystore = Old_KeyStore.from_seed(seed)
@@ -248,6 +264,21 @@ class TestBIP32_KeyStore:
         assert privkey == (bytes.fromhex('985e4b09a0b05702c073b5086fcbb4b7dde4625bb98'
                                          '9ec51ce4c3337a7de2a13'), True)
 
+    def test_get_private_keys_from_xpubkeys(self):
+        xprv = ('xprv9s21ZrQH143K4XLpSd2berkCzJTXDv68rusDQFiQGSqa1ZmVXnYzYpTQ9'
+                'qYiSB7mHvg6kEsrd2ZtnHRJ61sZhSN4jZ2T8wxA4T75BE4QQZ1')
+        password = 'password'
+        keystore = BIP32_KeyStore({'xprv': pw_encode(xprv, password)})
+        keystore.xpub = bip32_key_from_string(xprv).public_key.to_extended_key_string()
+        x_pubkeys = [ keystore.get_xpubkey(derivation_path)
+            for derivation_path in ((1, 2, 3), (0, 1), (1, 2, 4), (1, 5)) ]
+        keypairs = keystore.get_private_keys_from_xpubkeys(x_pubkeys, password)
+        assert keypairs == { x_pubkey: keystore.get_private_key_from_xpubkey(x_pubkey, password)
+            for x_pubkey in x_pubkeys }
+        assert keypairs[x_pubkeys[0]] == (bytes.fromhex('985e4b09a0b05702c073b5086fcbb4b7dde46'
+            '25bb989ec51ce4c3337a7de2a13'), True)
+        with pytest.raises(InvalidPassword):
+            keystore.get_private_keys_from_xpubkeys(x_pubkeys, 'guess')
 
     @pytest.mark.parametrize("password", ('Password', None))
     def test_check_password(self, password):
@@ -266,6 +297,23 @@ class TestBIP32_KeyStore:
                 keystore.check_password(None)
 
 
+def test_bip32_signing_keys():
+    xprv = ('xprv9s21ZrQH143K4XLpSd2berkCzJTXDv68rusDQFiQGSqa1ZmVXnYzYpTQ9'
+            'qYiSB7mHvg6kEsrd2ZtnHRJ61sZhSN4jZ2T8wxA4T75BE4QQZ1')
+    master_key = bip32_key_from_string(xprv)
+    signing_keys = BIP32SigningKeys(xprv)
+    assert signing_keys.get_private_key(()) == master_key
+    for derivation_path in ((1, 2, 3), (1, 2, 4), (0, 2**31 + 5)):
+        privkey = master_key
+        for n in derivation_path:
+            privkey = privkey.child_safe(n)
+        assert signing_keys.get_private_key(derivation_path) == privkey
+    # Only the parents are kept, and those shared by several paths only the once.
+    assert sorted(signing_keys._parent_keys) == [ (), (0,), (1,), (1, 2) ]
+    signing_keys.clear()
+    assert not signing_keys._parent_keys
+
+
 class TestXPub:
 
     @pytest.mark.parametrize("for_change,n,pubkey_hex", (
@@ -279,6 +327,36 @@ class TestXPub:
         pubkey = keystore.derive_pubkey((for_change, n))
         assert pubkey == XPublicKey.from_hex(pubkey_hex).to_public_key()
 
+    @pytest.mark.parametrize("parallel", (False, True))
+    def test_derive_pubkeys(self, monkeypatch, parallel):
+        xpub = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
+                'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
+        keystore = BIP32_KeyStore({'xpub': xpub})
+        if parallel:
+            monkeypatch.setattr(keystore, "PARALLEL_DERIVATION_THRESHOLD", 1)
+            monkeypatch.setattr(keystore, "PARALLEL_DERIVATION_CHUNK_SIZE", 2)
+            proxy = AppStateProxyTest()
+            try:
+                pubkeys = keystore.derive_pubkeys((1,), [ 7, 5, 6 ])
+                assert proxy._derivation_pool is not None
+            finally:
+                proxy.shutdown_derivation_pool()
+            assert proxy._derivation_pool is None
+        else:
+            pubkeys = keystore.derive_pubkeys((1,), [ 7, 5, 6 ])
+        assert pubkeys == [ keystore.derive_pubkey((1, n)) for n in (7, 5, 6) ]
+        assert pubkeys[1] == XPublicKey.from_hex(
+            '033177256871768b5ee8e031647f3727e63d1b62c8d776d9b422a367fd8e721bd3').to_public_key()
+
+    def test_derive_pubkey_xpub_change(self):
+        keystore = BIP32_KeyStore({'xpub': ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6'
+            'e5KsF6cmt17Fv8wGvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')})
+        pubkey = keystore.derive_pubkey((0, 3))
+        # The parsed parent keys are discarded if the master public key changes.
+        keystore.xpub = ('xpub6BoXuZmXMAUMbiEuHuS3s3L6ienv7u5Npx6GMY3MwQnBj7qM89dojV'
+                         'kXTZtbpEvAzxSKAxnnsVDuwSAAvvXHWVncpX46V3LGj5SaKHtNNnc')
+        assert keystore.derive_pubkey((0, 3)) != pubkey
+
     def test_xpubkey(self):
         xpub = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
                 'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
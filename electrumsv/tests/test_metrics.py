@@ -0,0 +1,125 @@
+import math
+
+import pytest
+
+from electrumsv.metrics import Metrics
+
+
+def test_counter() -> None:
+    registry = Metrics()
+    counter = registry.counter("test_total", "Test.", ("method",))
+    counter.inc(labels=("a",))
+    counter.inc(2, labels=("a",))
+    counter.inc(labels=("b",))
+    assert counter.get(("a",)) == 3
+    assert counter.get(("b",)) == 1
+    assert counter.get(("c",)) == 0
+
+    with pytest.raises(ValueError):
+        counter.inc(-1, labels=("a",))
+    with pytest.raises(ValueError):
+        counter.inc()
+
+
+def test_gauge() -> None:
+    registry = Metrics()
+    gauge = registry.gauge("test", "Test.")
+    gauge.set(5)
+    gauge.dec(2)
+    gauge.inc()
+    assert gauge.get() == 4
+    assert gauge.collect() == [ ((), 4) ]
+
+    gauge.remove(())
+    assert gauge.collect() == []
+
+
+def test_metric_function() -> None:
+    registry = Metrics()
+    gauge = registry.gauge("test", "Test.", ("wallet",))
+    gauge.set(1, ("ignored",))
+    values = { ("b",): 2, ("a",): 1 }
+    gauge.set_function(lambda: values)
+    assert gauge.collect() == [ (("a",), 1), (("b",), 2) ]
+
+    def broken() -> dict:
+        raise Exception("unavailable")
+    gauge.set_function(broken)
+    # The failure is logged, and the other metrics can still be collected.
+    assert gauge.collect() == []
+
+
+def test_histogram() -> None:
+    registry = Metrics()
+    histogram = registry.histogram("test_seconds", "Test.", buckets=(0.1, 1.0))
+    assert histogram.buckets == (0.1, 1.0, math.inf)
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.get_count() == 4
+    [ (labels, (cumulative_counts, count, total)) ] = histogram.collect()
+    assert labels == ()
+    assert cumulative_counts == [ 2, 3, 4 ]
+    assert count == 4
+    assert total == pytest.approx(2.65)
+
+    with histogram.time():
+        pass
+    assert histogram.get_count() == 5
+
+
+def test_register_existing() -> None:
+    registry = Metrics()
+    counter = registry.counter("test_total", "Test.")
+    assert registry.counter("test_total", "Test.") is counter
+    assert registry.get("test_total") is counter
+    with pytest.raises(ValueError):
+        registry.gauge("test_total", "Test.")
+    with pytest.raises(ValueError):
+        registry.counter("test_total", "Test.", ("method",))
+
+
+def test_to_dict() -> None:
+    registry = Metrics()
+    registry.counter("b_total", "Counter.", ("method",)).inc(labels=("x",))
+    registry.histogram("a_seconds", "Histogram.", buckets=(1,)).observe(0.5)
+    assert registry.to_dict() == {
+        "a_seconds": {
+            "type": "histogram",
+            "help": "Histogram.",
+            "values": [
+                { "labels": {}, "buckets": { "1": 1, "+Inf": 1 }, "count": 1, "sum": 0.5 },
+            ],
+        },
+        "b_total": {
+            "type": "counter",
+            "help": "Counter.",
+            "values": [ { "labels": { "method": "x" }, "value": 1 } ],
+        },
+    }
+
+
+def test_to_prometheus_text() -> None:
+    registry = Metrics()
+    registry.counter("requests_total", "Requests\nmade.", ("method",)) \
+        .inc(3, labels=('say "hi"',))
+    registry.gauge("queue_depth", "Queue depth.").set(2.5)
+    histogram = registry.histogram("commit_seconds", "Commit time.", ("wallet",),
+        buckets=(0.1, 1))
+    histogram.observe(0.05, ("w1",))
+    histogram.observe(5, ("w1",))
+
+    assert registry.to_prometheus_text() == "\n".join([
+        '# HELP commit_seconds Commit time.',
+        '# TYPE commit_seconds histogram',
+        'commit_seconds_bucket{wallet="w1",le="0.1"} 1',
+        'commit_seconds_bucket{wallet="w1",le="1"} 1',
+        'commit_seconds_bucket{wallet="w1",le="+Inf"} 2',
+        'commit_seconds_sum{wallet="w1"} 5.05',
+        'commit_seconds_count{wallet="w1"} 2',
+        '# HELP queue_depth Queue depth.',
+        '# TYPE queue_depth gauge',
+        'queue_depth 2.5',
+        '# HELP requests_total Requests\\nmade.',
+        '# TYPE requests_total counter',
+        'requests_total{method="say \\"hi\\""} 3',
+    ]) + "\n"
@@ -0,0 +1,585 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any, Dict, List, Set, Tuple
+import unittest.mock
+
+from aiorpcx import BatchError, RPCError, TaskGroup
+from bitcoinx import double_sha256, hash_to_hex_str, hex_str_to_hash, InsufficientPoW
+import pytest
+
+from electrumsv import network as network_module
+from electrumsv.constants import ScriptType
+from electrumsv.network import (_history_status, _parse_transactions, _TimedBatchRequest,
+    Network, REQUEST_MERKLE_PROOF, REQUEST_TRANSACTION, rpc_batch_size_metric,
+    rpc_batch_time_metric, rpc_error_metric, SCRIPTHASH_HISTORY, SCRIPTHASH_SUBSCRIBE, SVSession)
+from electrumsv.networks import Net
+from electrumsv.transaction import Transaction
+
+
+TX_HEX = ("01000000011a284a701e6a69ba68ac4b1a4509ac04f5c10547e3165fe869d5e910fe91bc4c04000000"+
+    "6b483045022100e81ce3382de4d63efad1e2bc4a7ebe70fb03d8451c1bc176b2dfd310f7a636f302200eab4382"+
+    "9f9d4c94be41c640f9f6261657dcac6dc345718b89e7a80645dbe27f412102defddf740fa60b0dcdc88578d9de"+
+    "a51350db9245e4f1a5072be00e9fb0573fddffffffff02a0860100000000001976a914717b9a7840ef60ef2e2a"+
+    "6fca85d55988e070137988acda837e18000000001976a914c0eab5430fd02e18edfc28607eae975001e7560488"+
+    "ac00000000")
+
+
+class MockBatch:
+    def __init__(self, session: 'MockSession') -> None:
+        self._session = session
+        self.requests: List[Any] = []
+        self.results = None
+
+    def add_request(self, method: str, args=()) -> None:
+        self.requests.append((method, args))
+
+    async def __aenter__(self) -> 'MockBatch':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        self._session.in_flight_count += 1
+        self._session.maximum_in_flight_count = max(self._session.maximum_in_flight_count,
+            self._session.in_flight_count)
+        # Give the other batches a chance to be sent.
+        await asyncio.sleep(0)
+        self._session.in_flight_count -= 1
+        self._session.batch_sizes.append(len(self.requests))
+        results = []
+        for method, args in self.requests:
+            script_hash = args[0] if len(args) == 1 else tuple(args)
+            if script_hash in self._session.failing_script_hashes:
+                self._session.failing_script_hashes[script_hash] -= 1
+                if self._session.failing_script_hashes[script_hash] == 0:
+                    del self._session.failing_script_hashes[script_hash]
+                results.append(RPCError(1, "failed"))
+            elif method == REQUEST_MERKLE_PROOF:
+                self._session.requested_proofs.append(script_hash)
+                results.append(self._session.proofs.get(script_hash[0],
+                    RPCError(2, "not found")))
+            elif method == REQUEST_TRANSACTION:
+                self._session.requested_tx_ids.append(script_hash)
+                if script_hash in self._session.transactions:
+                    results.append(self._session.transactions[script_hash])
+                else:
+                    results.append(RPCError(2, "not found"))
+            elif method == SCRIPTHASH_SUBSCRIBE:
+                self._session.subscribed_script_hashes.append(script_hash)
+                results.append(f"status-{script_hash}")
+            else:
+                assert method == SCRIPTHASH_HISTORY
+                self._session.history_script_hashes.append(script_hash)
+                results.append(self._session.histories[script_hash])
+        self.results = tuple(results)
+
+
+class MockSession(SVSession):
+    def __init__(self) -> None:
+        self._handlers = {}
+        self._network = unittest.mock.Mock()
+        self._history_semaphore = asyncio.Semaphore(self.HISTORY_BATCH_CONCURRENCY)
+        self.logger = unittest.mock.Mock()
+        self.in_flight_count = 0
+        self.maximum_in_flight_count = 0
+        self.batch_sizes: List[int] = []
+        self.subscribed_script_hashes: List[str] = []
+        self.failing_script_hashes: Dict[str, int] = {}
+        self.history_script_hashes: List[str] = []
+        self.histories: Dict[str, List[Dict[str, Any]]] = {}
+        self.requested_tx_ids: List[str] = []
+        self.transactions: Dict[str, str] = {}
+        self.requested_proofs: List[Tuple[str, int]] = []
+        self.proofs: Dict[str, Dict[str, Any]] = {}
+        self.header_heights: List[List[int]] = []
+        self.headers: Dict[int, Any] = {}
+        self._transactions_received = 0
+        self._transaction_hex_received = 0
+
+    def send_batch(self, raise_errors: bool=False) -> MockBatch:
+        assert not raise_errors
+        return MockBatch(self)
+
+    async def headers_at_heights(self, heights) -> Dict[int, Any]:
+        self.header_heights.append(sorted(heights))
+        return { height: self.headers[height] for height in heights }
+
+
+@pytest.fixture
+def config(mocker) -> Dict[str, Any]:
+    settings: Dict[str, Any] = {}
+    mock_app_state = mocker.patch.object(network_module, "app_state")
+    mock_app_state.config.get.side_effect = lambda key, default=None: settings.get(key, default)
+    return settings
+
+
+def _make_triples(count: int) -> List[Any]:
+    return [ (i, ScriptType.P2PKH, f"{i:064x}") for i in range(count) ]
+
+
+def _subscribe(session: MockSession, account: Any, triples: List[Any]) -> None:
+    try:
+        asyncio.get_event_loop().run_until_complete(session.subscribe_to_triples(account,
+            triples))
+    finally:
+        SVSession._subs_by_account.pop(account, None)
+        SVSession._keyinstance_map.clear()
+
+
+@pytest.mark.timeout(5)
+def test_subscribe_to_triples_batched(config) -> None:
+    config["subscription_batch_size"] = 10
+    config["subscription_batch_window"] = 3
+    account = unittest.mock.Mock(request_count=0, response_count=0)
+    session = MockSession()
+    triples = _make_triples(95)
+    _subscribe(session, account, triples)
+
+    assert session.batch_sizes == [ 10 ] * 9 + [ 5 ]
+    assert session.maximum_in_flight_count == 3
+    # The order is retained so that the prioritised keys are subscribed to first.
+    assert session.subscribed_script_hashes == [ t[2] for t in triples ]
+    assert account.request_count == account.response_count == 95
+    assert session._network._queue_status_change.call_count == 95
+
+
+@pytest.mark.timeout(5)
+def test_subscribe_to_triples_retries_failed(config) -> None:
+    config["subscription_batch_size"] = 10
+    account = unittest.mock.Mock(request_count=0, response_count=0)
+    session = MockSession()
+    triples = _make_triples(20)
+    session.failing_script_hashes = { triples[3][2]: 1, triples[15][2]: 2 }
+    _subscribe(session, account, triples)
+
+    # Only the failed subscriptions are resent.
+    assert sorted(session.batch_sizes) == [ 1, 1, 1, 10, 10 ]
+    assert set(session.subscribed_script_hashes) == set(t[2] for t in triples)
+    assert account.request_count == account.response_count == 20
+
+
+@pytest.mark.timeout(5)
+def test_subscribe_to_triples_retry_limit(config) -> None:
+    account = unittest.mock.Mock(request_count=0, response_count=0)
+    session = MockSession()
+    triples = _make_triples(5)
+    session.failing_script_hashes = { triples[0][2]: SVSession.SUBSCRIPTION_RETRY_LIMIT + 1 }
+    with pytest.raises(BatchError):
+        _subscribe(session, account, triples)
+    assert account.request_count == 5
+    assert account.response_count == 4
+
+
+class MockAccount:
+    def __init__(self, key_histories: Dict[int, List[Any]]) -> None:
+        self.key_histories = key_histories
+
+    def get_key_history(self, keyinstance_id: int, script_type: ScriptType) -> List[Any]:
+        return self.key_histories.get(keyinstance_id, [])
+
+    async def set_key_history(self, keyinstance_id: int, script_type: ScriptType,
+            history: List[Any], tx_fees: Dict[str, int]) -> None:
+        self.key_histories[keyinstance_id] = history
+
+
+def _make_histories(count: int) -> Dict[str, List[Dict[str, Any]]]:
+    return { f"{i:064x}": [ { "tx_hash": f"{i+1000:064x}", "height": i } ]
+        for i in range(count) }
+
+
+@pytest.mark.timeout(5)
+def test_on_statuses_changed_batched() -> None:
+    session = MockSession()
+    histories = session.histories = _make_histories(4)
+    account = MockAccount({})
+    for i, script_hash in enumerate(histories):
+        SVSession._keyinstance_map[script_hash] = i, ScriptType.P2PKH
+    # The account already has the history for the first script hash.
+    account.key_histories[0] = [ (item["tx_hash"], item["height"])
+        for item in histories[f"{0:064x}"] ]
+    SVSession._subs_by_account[account] = list(histories)
+    changes = { script_hash: _history_status([ (item["tx_hash"], item["height"])
+        for item in history ]) for script_hash, history in histories.items() }
+    try:
+        asyncio.get_event_loop().run_until_complete(session._on_statuses_changed(changes))
+    finally:
+        SVSession._subs_by_account.pop(account, None)
+        SVSession._keyinstance_map.clear()
+
+    assert session.batch_sizes == [ 3 ]
+    assert session.history_script_hashes == list(histories)[1:]
+    assert len(account.key_histories) == 4
+
+
+@pytest.mark.timeout(5)
+def test_on_statuses_changed_requeues_failed() -> None:
+    session = MockSession()
+    histories = session.histories = _make_histories(2)
+    account = MockAccount({})
+    for i, script_hash in enumerate(histories):
+        SVSession._keyinstance_map[script_hash] = i, ScriptType.P2PKH
+    SVSession._subs_by_account[account] = list(histories)
+    failed_script_hash = list(histories)[1]
+    session.failing_script_hashes = { failed_script_hash: 1 }
+    try:
+        with pytest.raises(BatchError):
+            asyncio.get_event_loop().run_until_complete(session._on_statuses_changed(
+                { script_hash: "status" for script_hash in histories }))
+    finally:
+        SVSession._subs_by_account.pop(account, None)
+        SVSession._keyinstance_map.clear()
+
+    assert list(account.key_histories) == [ 0 ]
+    session._network._queue_status_change.assert_called_once_with(failed_script_hash,
+        "status", replace=False)
+
+
+@pytest.mark.timeout(5)
+def test_monitor_on_status_merges_changes() -> None:
+    network = Network.__new__(Network)
+    network._status_changes = {}
+    network._status_changes_event = asyncio.Event()
+    session = MockSession()
+    processed: List[Dict[str, str]] = []
+    async def _on_statuses_changed(changes: Dict[str, str]) -> None:
+        processed.append(changes)
+    session._on_statuses_changed = _on_statuses_changed
+    async def _main_session() -> MockSession:
+        return session
+    network._main_session = _main_session
+
+    network._queue_status_change("a", "1")
+    network._queue_status_change("b", "2")
+    network._queue_status_change("a", "3")
+    network._queue_status_change("b", "4", replace=False)
+
+    async def _run() -> None:
+        group = TaskGroup()
+        monitor_task = await group.spawn(network._monitor_on_status, group)
+        while not processed:
+            await asyncio.sleep(0)
+        monitor_task.cancel()
+        await group.cancel_remaining()
+    asyncio.get_event_loop().run_until_complete(_run())
+
+    assert processed == [ { "a": "3", "b": "2" } ]
+    assert network._status_changes == {}
+    # The history slot was given back once the batch was processed.
+    assert session._history_semaphore._value == session.HISTORY_BATCH_CONCURRENCY
+
+
+def _make_transaction_hexes(count: int) -> Dict[str, str]:
+    results = {}
+    for i in range(count):
+        tx = Transaction.from_hex(TX_HEX)
+        tx.locktime = i
+        results[tx.txid()] = tx.to_hex()
+    return results
+
+
+class MockWallet:
+    def __init__(self) -> None:
+        self.request_count = 0
+        self.response_count = 0
+        self.progress_event = asyncio.Event()
+        self.added: List[List[Tuple[bytes, Transaction]]] = []
+        self.proofs: List[List[Tuple[Any, ...]]] = []
+
+    async def add_transactions_async(self, entries: List[Tuple[bytes, Transaction]], flags: Any,
+            external: bool=False) -> None:
+        self.added.append(entries)
+
+    def add_transaction_proofs(self, entries: List[Tuple[Any, ...]]) -> None:
+        self.proofs.append(entries)
+
+
+@pytest.mark.timeout(5)
+def test_request_transactions_batched(mocker) -> None:
+    tx_hexes = _make_transaction_hexes(7)
+    tx_size = len(next(iter(tx_hexes.values()))) + MockSession.TRANSACTION_RESPONSE_OVERHEAD
+    session = MockSession()
+    session.transactions = dict(tx_hexes)
+    missing_tx_id = f"{1:064x}"
+    # A limit of one megabyte, with the share of it sized to fit three transactions.
+    mock_app_state = mocker.patch.object(network_module, "app_state")
+    mock_app_state.electrumx_message_size_limit.return_value = 1
+    mocker.patch.object(session, "TRANSACTION_BATCH_LIMIT_SHARE", tx_size * 3 / (1024 * 1024))
+    mocker.patch.object(session, "TRANSACTION_HEX_SIZE_ESTIMATE",
+        tx_size * 2 - MockSession.TRANSACTION_RESPONSE_OVERHEAD)
+    network = Network.__new__(Network)
+    async def _main_session() -> MockSession:
+        return session
+    network._main_session = _main_session
+    wallet = MockWallet()
+    tx_hashes = [ hex_str_to_hash(tx_id) for tx_id in list(tx_hexes) + [ missing_tx_id ] ]
+
+    had_timeout = asyncio.get_event_loop().run_until_complete(
+        network._request_transactions(wallet, tx_hashes))
+
+    assert not had_timeout
+    # The first batch uses the size estimate, and the rest the average received size.
+    assert session.batch_sizes == [ 1, 3, 3, 1 ]
+    assert session.requested_tx_ids == list(tx_hexes) + [ missing_tx_id ]
+    assert wallet.request_count == wallet.response_count == 8
+    # The missing transaction is not written, and each batch is written in one call.
+    assert [ len(entries) for entries in wallet.added ] == [ 1, 3, 3 ]
+    assert [ tx.txid() for entries in wallet.added for (tx_hash, tx) in entries ] == \
+        list(tx_hexes)
+
+
+@pytest.mark.parametrize("size_limit,budget", [ (50, 25 * 1024 * 1024),
+    (0, SVSession.TRANSACTION_BATCH_UNLIMITED_BUDGET) ])
+def test_transaction_batch_byte_budget(mocker, size_limit: int, budget: int) -> None:
+    mock_app_state = mocker.patch.object(network_module, "app_state")
+    mock_app_state.electrumx_message_size_limit.return_value = size_limit
+    session = MockSession()
+    assert session.transaction_batch_byte_budget() == budget
+    # The hex length of each transaction counts against the budget, not the binary size.
+    session._transactions_received = 1
+    session._transaction_hex_received = 2 * 1024 * 1024 - SVSession.TRANSACTION_RESPONSE_OVERHEAD
+    assert session.transaction_batch_size() == budget // (2 * 1024 * 1024)
+
+
+def test_parse_transactions() -> None:
+    tx_hexes = _make_transaction_hexes(2)
+    tx_id1, tx_id2 = list(tx_hexes)
+    results = _parse_transactions([ (hex_str_to_hash(tx_id1), tx_hexes[tx_id1]),
+        (hex_str_to_hash(tx_id1), tx_hexes[tx_id2]), (hex_str_to_hash(tx_id2), "zz") ])
+    assert isinstance(results[0][1], Transaction)
+    assert results[0][1].txid() == tx_id1
+    # Transactions that do not match the requested hash, or that do not parse, are errors.
+    assert isinstance(results[1][1], ValueError)
+    assert isinstance(results[2][1], Exception)
+
+
+@pytest.mark.timeout(5)
+def test_request_proofs_batched(monkeypatch) -> None:
+    session = MockSession()
+    monkeypatch.setattr(session, "PROOF_BATCH_SIZE", 3)
+    # Each block at heights 10 to 13 contains a pair of our transactions.
+    wanted_map: Dict[bytes, int] = {}
+    for height in (13, 12, 11, 10):
+        tx_hash_0 = double_sha256(bytes([ height, 0 ]))
+        tx_hash_1 = double_sha256(bytes([ height, 1 ]))
+        merkle_root = double_sha256(tx_hash_0 + tx_hash_1)
+        if height == 12:
+            merkle_root = bytes(32)
+        session.headers[height] = SimpleNamespace(merkle_root=merkle_root, timestamp=height * 100,
+            hash=bytes(32))
+        session.proofs[hash_to_hex_str(tx_hash_0)] = { "pos": 0,
+            "merkle": [ hash_to_hex_str(tx_hash_1) ] }
+        session.proofs[hash_to_hex_str(tx_hash_1)] = { "pos": 1,
+            "merkle": [ hash_to_hex_str(tx_hash_0) ] }
+        wanted_map[tx_hash_0] = height
+        wanted_map[tx_hash_1] = height
+    missing_tx_hash = bytes(32)
+    wanted_map[missing_tx_hash] = 13
+
+    network = Network.__new__(Network)
+    async def _main_session() -> MockSession:
+        return session
+    network._main_session = _main_session
+    wallet = MockWallet()
+    had_timeout = asyncio.get_event_loop().run_until_complete(
+        network._request_proofs(wallet, wanted_map))
+
+    assert not had_timeout
+    # The proofs are requested in height order, and each header is only looked up once.
+    assert session.batch_sizes == [ 3, 3, 3 ]
+    assert [ height for (_tx_id, height) in session.requested_proofs ] == \
+        [ 10, 10, 11, 11, 12, 12, 13, 13, 13 ]
+    assert session.header_heights == [ [ 10, 11 ], [ 12 ], [ 13 ] ]
+    # Each batch of valid proofs is added in one call, skipping the invalid and missing proofs.
+    assert [ [ entry[1] for entry in entries ] for entries in wallet.proofs ] == \
+        [ [ 10, 10, 11 ], [ 11 ], [ 13, 13 ] ]
+    tx_hash, height, timestamp, position, proof_position, branch = wallet.proofs[0][1]
+    assert (height, timestamp, position, proof_position) == (10, 1000, 1, 1)
+    assert branch == [ double_sha256(bytes([ 10, 0 ])) ]
+
+
+class MockRPCBatch:
+    def __init__(self, methods: List[str], error: Exception=None) -> None:
+        self.batch = [ SimpleNamespace(method=method) for method in methods ]
+        self._error = error
+
+    def __len__(self) -> int:
+        return len(self.batch)
+
+    async def __aenter__(self) -> 'MockRPCBatch':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        if self._error is not None:
+            raise self._error
+
+
+def test_timed_batch_request_metrics() -> None:
+    async def _send(batch: MockRPCBatch) -> None:
+        async with _TimedBatchRequest(batch) as entered_batch:
+            assert entered_batch is batch
+
+    labels = (SCRIPTHASH_HISTORY,)
+    batch_count = rpc_batch_time_metric.get_count(labels)
+    error_count = rpc_error_metric.get(labels)
+    asyncio.get_event_loop().run_until_complete(_send(MockRPCBatch([ SCRIPTHASH_HISTORY ] * 3)))
+    assert rpc_batch_time_metric.get_count(labels) == batch_count + 1
+    assert rpc_batch_size_metric.get_count(labels) >= 1
+    assert rpc_error_metric.get(labels) == error_count
+
+    batch = MockRPCBatch([ SCRIPTHASH_HISTORY ], BatchError(None))
+    with pytest.raises(BatchError):
+        asyncio.get_event_loop().run_until_complete(_send(batch))
+    assert rpc_batch_time_metric.get_count(labels) == batch_count + 2
+    assert rpc_error_metric.get(labels) == error_count + 1
+
+    mixed_labels = ("mixed",)
+    mixed_count = rpc_batch_time_metric.get_count(mixed_labels)
+    asyncio.get_event_loop().run_until_complete(_send(MockRPCBatch([ SCRIPTHASH_HISTORY,
+        SCRIPTHASH_SUBSCRIBE ])))
+    assert rpc_batch_time_metric.get_count(mixed_labels) == mixed_count + 1
+
+
+def _make_raw_headers(count: int, salt: bytes=b"", fork_height: int=0) -> List[bytes]:
+    raw_headers: List[bytes] = []
+    prev_hash = bytes(32)
+    for height in range(count):
+        header_salt = salt if height >= fork_height else b""
+        raw_header = (bytes(4) + prev_hash +
+            double_sha256(header_salt + height.to_bytes(4, "little")) + bytes(12))
+        raw_headers.append(raw_header)
+        prev_hash = double_sha256(raw_header)
+    return raw_headers
+
+
+class MockHeaders:
+    def __init__(self, checkpoint_raw_header: bytes) -> None:
+        self.coin = Net.COIN
+        self.checkpoint = SimpleNamespace(height=0, raw_header=checkpoint_raw_header)
+        self.connected: List[bytes] = []
+        self.insufficient_pow: Set[bytes] = set()
+        self.flush_count = 0
+
+    def connect(self, raw_header: bytes) -> Tuple[Any, str]:
+        if raw_header in self.insufficient_pow:
+            raise InsufficientPoW(self.coin.deserialized_header(raw_header, -1))
+        self.connected.append(raw_header)
+        return None, "chain"
+
+    def longest_chain(self) -> str:
+        return "chain"
+
+    def flush(self) -> None:
+        self.flush_count += 1
+
+
+class MockHeaderSession(MockSession):
+    def __init__(self, name: str, raw_headers: List[bytes], delay: float=0,
+            max_count: int=1000, error: Exception=None) -> None:
+        super().__init__()
+        self.server = name
+        self.raw_headers = raw_headers
+        self.delay = delay
+        self.max_count = max_count
+        self.error = error
+        self.requested_chunks: List[Tuple[int, int]] = []
+        self.disconnect_reason = None
+        self.disconnect_blacklist = False
+
+    async def send_request(self, method, args=()) -> Dict[str, Any]:
+        assert method == "blockchain.block.headers"
+        height, count, cp_height = args
+        assert cp_height == 0
+        self.requested_chunks.append((height, count))
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        raw_chunk = b"".join(self.raw_headers[height:height + min(count, self.max_count)])
+        return { "count": len(raw_chunk) // 80, "hex": raw_chunk.hex() }
+
+    async def disconnect(self, reason, *, blacklist=False) -> None:
+        self.disconnect_reason = reason
+        self.disconnect_blacklist = blacklist
+
+
+@pytest.fixture
+def headers(mocker) -> MockHeaders:
+    raw_headers = _make_raw_headers(96)
+    mock_app_state = mocker.patch.object(network_module, "app_state")
+    mock_app_state.headers = MockHeaders(raw_headers[0])
+    mock_app_state.headers.raw_headers = raw_headers
+    return mock_app_state.headers
+
+
+def _catch_up(session: MockHeaderSession, helpers: List[MockHeaderSession], height: int,
+        tip_height: int) -> int:
+    SVSession._header_sources.extend([ session ] + helpers)
+    try:
+        return asyncio.get_event_loop().run_until_complete(
+            session._catch_up_with_chunks(height, tip_height))
+    finally:
+        SVSession._header_sources.clear()
+
+
+@pytest.mark.timeout(5)
+def test_catch_up_with_chunks(headers, monkeypatch) -> None:
+    monkeypatch.setattr(SVSession, "HEADER_CHUNK_SIZE", 10)
+    monkeypatch.setattr(SVSession, "HEADER_CHUNK_WINDOW", 4)
+    monkeypatch.setattr(SVSession, "HEADER_FLUSH_INTERVAL", 3)
+    # The helpers are slower, so their chunks arrive after the ones that follow them.
+    session = MockHeaderSession("main", headers.raw_headers)
+    helpers = [ MockHeaderSession("helper1", headers.raw_headers, delay=0.02),
+        MockHeaderSession("helper2", headers.raw_headers, delay=0.01) ]
+
+    assert _catch_up(session, helpers, 0, 95) == 95
+
+    assert headers.connected == headers.raw_headers[1:]
+    assert session.requested_chunks == [ (1, 10), (31, 10), (61, 10), (91, 10) ]
+    assert helpers[0].requested_chunks == [ (11, 10), (41, 10), (71, 10) ]
+    assert helpers[1].requested_chunks == [ (21, 10), (51, 10), (81, 10) ]
+    # Once for every three of the ten chunks, and once at the end.
+    assert headers.flush_count == 4
+
+
+@pytest.mark.timeout(5)
+def test_catch_up_with_chunks_bad_helpers(headers, monkeypatch) -> None:
+    monkeypatch.setattr(SVSession, "HEADER_CHUNK_SIZE", 10)
+    session = MockHeaderSession("main", headers.raw_headers)
+    raw_headers = list(headers.raw_headers)
+    raw_headers[25] = raw_headers[24]
+    helpers = [
+        # Returns part of each chunk, leaving a gap.
+        MockHeaderSession("short", headers.raw_headers, max_count=4),
+        # Returns a chunk that does not link up internally.
+        MockHeaderSession("broken", raw_headers),
+        MockHeaderSession("failing", headers.raw_headers, error=RPCError(1, "failed")),
+        # Follows a different chain.
+        MockHeaderSession("fork", _make_raw_headers(96, b"fork")),
+    ]
+
+    assert _catch_up(session, helpers, 0, 95) == 95
+
+    assert headers.connected == headers.raw_headers[1:]
+    assert helpers[0].requested_chunks == [ (11, 10), (61, 10) ]
+    assert helpers[1].requested_chunks == [ (21, 10), (71, 10) ]
+    assert helpers[1].disconnect_reason is not None
+    assert helpers[3].requested_chunks == [ (41, 10), (91, 10) ]
+    # The gaps are filled, and the chunks the other helpers could not provide fetched.
+    assert sorted(session.requested_chunks) == [ (1, 10), (15, 6), (21, 10), (31, 10),
+        (41, 10), (51, 10), (65, 6), (81, 10), (91, 10) ]
+
+
+@pytest.mark.timeout(5)
+def test_catch_up_with_chunks_bad_pow(headers, monkeypatch) -> None:
+    monkeypatch.setattr(SVSession, "HEADER_CHUNK_SIZE", 10)
+    session = MockHeaderSession("main", headers.raw_headers)
+    # These link up to the headers before them, but do not have the proof of work.
+    raw_headers = _make_raw_headers(96, b"bad", 15)
+    headers.insufficient_pow.add(raw_headers[15])
+    helper = MockHeaderSession("bad", raw_headers)
+
+    assert _catch_up(session, [ helper ], 0, 95) == 95
+
+    # The headers before the bad one are connected again with the rest of our own chunk.
+    assert list(dict.fromkeys(headers.connected)) == headers.raw_headers[1:]
+    assert helper.disconnect_reason is not None
+    assert helper.disconnect_blacklist
+    assert session.disconnect_reason is None
+    assert (11, 10) in session.requested_chunks
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import pstats
+import threading
+import time
+
+import pytest
+
+from electrumsv.profiling import FunctionTracer, Profiling, ProfilingError, StackSampler
+
+
+class TracedClass:
+    def outer(self, value: int) -> int:
+        return self.inner(value) + self.inner(value)
+
+    def inner(self, value: int) -> int:
+        return value * 2
+
+    def recursive(self, depth: int) -> int:
+        return 0 if depth == 0 else 1 + self.recursive(depth - 1)
+
+    async def coroutine(self) -> int:
+        await asyncio.sleep(0)
+        return 1
+
+    def generator(self):
+        yield 1
+
+    @staticmethod
+    def static(value: int) -> int:
+        return value
+
+    def __repr__(self) -> str:
+        return "TracedClass"
+
+
+def traced_function() -> int:
+    return TracedClass().outer(1)
+
+
+def _busy_thread_main(stop_event: threading.Event) -> None:
+    while not stop_event.is_set():
+        sum(range(1000))
+
+
+def _get_stats(stats: dict, name: str) -> tuple:
+    [ value ] = [ value for key, value in stats.items() if key[2] == name ]
+    return value
+
+
+def test_stack_sampler() -> None:
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_busy_thread_main, args=(stop_event,),
+        name="test-busy")
+    ignored_thread = threading.Thread(target=_busy_thread_main, args=(stop_event,),
+        name="test-ignored")
+    thread.start()
+    ignored_thread.start()
+    try:
+        sampler = StackSampler(0.001, [ "test-busy" ])
+        sampler.start()
+        while sampler.sample_count < 5:
+            time.sleep(0.01)
+        stacks = sampler.stop()
+    finally:
+        stop_event.set()
+        thread.join()
+        ignored_thread.join()
+
+    assert stacks
+    for stack, count in stacks.items():
+        assert count > 0
+        frames = stack.split(";")
+        assert frames[0] == "test-busy"
+        assert any(frame.endswith(":_busy_thread_main") for frame in frames)
+
+
+def test_function_tracer() -> None:
+    original_outer = TracedClass.outer
+    original_generator = TracedClass.generator
+    original_static = vars(TracedClass)["static"]
+    tracer = FunctionTracer([ "electrumsv.tests.test_profiling.TracedClass" ])
+    tracer.start()
+    try:
+        assert TracedClass.outer is not original_outer
+        # Generators and special methods are left alone.
+        assert TracedClass.generator is original_generator
+        assert vars(TracedClass)["__repr__"].__name__ == "__repr__"
+        assert tracer.function_count == 5
+
+        obj = TracedClass()
+        assert obj.outer(2) == 8
+        assert obj.outer(3) == 12
+        assert obj.recursive(3) == 3
+        assert TracedClass.static(5) == 5
+        assert asyncio.get_event_loop().run_until_complete(obj.coroutine()) == 1
+    finally:
+        stats = tracer.stop()
+
+    assert TracedClass.outer is original_outer
+    assert vars(TracedClass)["static"] is original_static
+
+    outer_stats = _get_stats(stats, "TracedClass.outer")
+    inner_stats = _get_stats(stats, "TracedClass.inner")
+    assert outer_stats[:2] == (2, 2)
+    assert inner_stats[:2] == (4, 4)
+    # The time spent in the inner calls is not counted in the outer function's own time.
+    assert outer_stats[2] <= outer_stats[3]
+    assert outer_stats[3] >= inner_stats[3]
+    outer_key = [ key for key in stats if key[2] == "TracedClass.outer" ][0]
+    assert inner_stats[4] == { outer_key: pytest.approx((4, 4, inner_stats[2],
+        inner_stats[3])) }
+
+    # Only the outermost of the recursive calls is primitive.
+    recursive_stats = _get_stats(stats, "TracedClass.recursive")
+    assert recursive_stats[:2] == (1, 4)
+    assert _get_stats(stats, "TracedClass.static")[:2] == (1, 1)
+    assert _get_stats(stats, "TracedClass.coroutine")[:2] == (1, 1)
+
+
+def test_function_tracer_module() -> None:
+    tracer = FunctionTracer([ "electrumsv.tests.test_profiling" ])
+    tracer.start()
+    try:
+        assert traced_function() == 4
+    finally:
+        stats = tracer.stop()
+    # Functions imported from other modules are not traced.
+    assert all(key[0] == __file__ for key in stats)
+    assert _get_stats(stats, "traced_function")[:2] == (1, 1)
+    assert _get_stats(stats, "TracedClass.inner")[:2] == (2, 2)
+
+
+def test_function_tracer_unknown_target() -> None:
+    with pytest.raises(ProfilingError):
+        FunctionTracer([ "electrumsv.tests.test_profiling.MissingClass" ]).start()
+    with pytest.raises(ProfilingError):
+        FunctionTracer([ "no_such_module_exists" ]).start()
+
+
+@pytest.mark.parametrize("target", ("json", "os.path.join", "electrumsvx",
+    # These are other modules and functions imported by our modules.
+    "electrumsv.profiling.os", "electrumsv.profiling.importlib.import_module"))
+def test_function_tracer_outside_package(target) -> None:
+    original_join = os.path.join
+    with pytest.raises(ProfilingError):
+        FunctionTracer([ target ]).start()
+    assert os.path.join is original_join
+
+
+def test_profiling_sample(tmp_path) -> None:
+    profiling = Profiling()
+    with pytest.raises(ProfilingError):
+        profiling.stop()
+    with pytest.raises(ProfilingError):
+        profiling.start("unknown", str(tmp_path))
+    with pytest.raises(ProfilingError):
+        profiling.start(Profiling.SAMPLE, str(tmp_path), interval=0)
+    with pytest.raises(ProfilingError):
+        profiling.start(Profiling.SAMPLE, str(tmp_path), interval="0.01")
+    with pytest.raises(ProfilingError):
+        profiling.start(Profiling.SAMPLE, str(tmp_path), threads="MainThread")
+    with pytest.raises(ProfilingError):
+        profiling.start(Profiling.TRACE, str(tmp_path), targets=[ 1 ])
+    assert not profiling.is_active()
+
+    status = profiling.start(Profiling.SAMPLE, str(tmp_path), interval=0.001,
+        threads=[ "MainThread" ])
+    assert status["active"] and status["mode"] == Profiling.SAMPLE
+    with pytest.raises(ProfilingError):
+        profiling.start(Profiling.TRACE, str(tmp_path))
+    time.sleep(0.05)
+    status = profiling.stop()
+    assert not status["active"]
+    assert not profiling.is_active()
+    assert os.path.dirname(status["path"]) == str(tmp_path)
+    with open(status["path"], "r") as f:
+        lines = f.read().splitlines()
+    assert lines
+    assert all(line.startswith("MainThread;") for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+def test_profiling_trace(tmp_path) -> None:
+    profiling = Profiling()
+    directory = os.path.join(str(tmp_path), "profiles")
+    profiling.start(Profiling.TRACE, directory,
+        targets=[ "electrumsv.tests.test_profiling.TracedClass" ])
+    assert profiling.get_status()["functions"] == 5
+    TracedClass().outer(1)
+    status = profiling.stop()
+
+    assert status["path"].endswith(".prof")
+    stats = pstats.Stats(status["path"])
+    assert stats.total_calls == 3
+    assert stats.prim_calls == 3
@@ -1,8 +1,17 @@
+import asyncio
+import json
+import unittest.mock
+
 from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+import pytest
 
 import electrumsv
 from electrumsv.restapi import bad_request, Fault, not_found, internal_server_error, \
     fault_to_http_response, Errors, unauthorized, forbidden, get_network_type
+from electrumsv.restapi_endpoints import DefaultEndpoints
+from electrumsv.metrics import metrics
+from electrumsv.profiling import profiling
 
 
 class MockAppStateMain():
@@ -86,3 +95,64 @@ def test_get_network_type(monkeypatch):
     assert get_network_type() == 'test'
     monkeypatch.setattr(electrumsv.restapi, 'get_app_state', fake_get_app_state_stn)
     assert get_network_type() == 'stn'
+
+
+def test_metrics_endpoints():
+    counter = metrics.counter("test_restapi_requests_total", "Test requests.")
+    counter.inc()
+    endpoints = DefaultEndpoints()
+    loop = asyncio.new_event_loop()
+    try:
+        response = loop.run_until_complete(
+            endpoints.metrics(make_mocked_request("GET", "/v1/main/metrics")))
+        text_response = loop.run_until_complete(
+            endpoints.prometheus_metrics(make_mocked_request("GET", "/metrics")))
+    finally:
+        loop.close()
+
+    data = json.loads(response.text)
+    assert data["test_restapi_requests_total"]["type"] == "counter"
+    assert data["test_restapi_requests_total"]["values"][0]["value"] == counter.get()
+    assert text_response.content_type == "text/plain"
+    assert f"test_restapi_requests_total {int(counter.get())}\n" in text_response.text
+
+
+def test_profiling_endpoints():
+    endpoints = DefaultEndpoints()
+    loop = asyncio.new_event_loop()
+    try:
+        response = loop.run_until_complete(
+            endpoints.get_profiling_status(make_mocked_request("GET", "/v1/main/profiling")))
+        stop_response = loop.run_until_complete(
+            endpoints.stop_profiling(make_mocked_request("POST", "/v1/main/profiling/stop")))
+    finally:
+        loop.close()
+
+    assert json.loads(response.text) == profiling.get_status()
+    assert not profiling.is_active()
+    assert stop_response.status == 400
+    assert json.loads(stop_response.text)["code"] == Errors.GENERIC_BAD_REQUEST_CODE
+
+
+class MockRequest:
+    def __init__(self, body: bytes) -> None:
+        self._body = body
+
+    async def read(self) -> bytes:
+        return self._body
+
+
+@pytest.mark.parametrize("body", (b"[]", b"not json", b'{"interval": "0.01"}',
+    b'{"threads": "async"}', b'{"mode": "trace", "targets": ["json"]}'))
+def test_start_profiling_bad_request(body):
+    endpoints = DefaultEndpoints()
+    endpoints.app_state = unittest.mock.Mock()
+    loop = asyncio.new_event_loop()
+    try:
+        response = loop.run_until_complete(endpoints.start_profiling(MockRequest(body)))
+    finally:
+        loop.close()
+
+    assert response.status == 400
+    assert json.loads(response.text)["code"] == Errors.GENERIC_BAD_REQUEST_CODE
+    assert not profiling.is_active()
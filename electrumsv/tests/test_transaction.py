@@ -1,13 +1,18 @@
 import json
+
+import attr
 import pytest
 
 from bitcoinx import (
-    Address, PrivateKey, PublicKey, Tx, Script, TxOutput, bip32_key_from_string, hash160, Bitcoin
+    Address, PrivateKey, PublicKey, SigHash, Tx, Script, TxOutput, bip32_key_from_string, hash160,
+    Bitcoin
 )
 
 from electrumsv.bitcoin import address_from_string
 from electrumsv.keystore import Old_KeyStore, BIP32_KeyStore
-from electrumsv.transaction import XPublicKey, Transaction, TransactionContext, NO_SIGNATURE
+from electrumsv.constants import ScriptType
+from electrumsv.transaction import (dummy_signature, SigningSession, XPublicKey, Transaction,
+    TransactionContext, TxSizeEstimator, XTxInput, NO_SIGNATURE)
 
 
 unsigned_blob = '010000000149f35e43fefd22d8bb9e4b3ff294c6286154c25712baf6ab77b646e5074d6aed010000005701ff4c53ff0488b21e0000000000000000004f130d773e678a58366711837ec2e33ea601858262f8eaef246a7ebd19909c9a03c3b30e38ca7d797fee1223df1c9827b2a9f3379768f520910260220e0560014600002300feffffffd8e43201000000000118e43201000000001976a914e158fb15c888037fdc40fb9133b4c1c3c688706488ac5fbd0700'
@@ -152,6 +157,30 @@ class TestTransaction2:
         assert tx.is_complete()
         assert tx.txid() == "b83acf939a92c420d0cb8d45d5d4dfad4e90369ebce0f49a45808dc1b41259b0"
 
+    @pytest.mark.parametrize("unsigned_hex", (unsigned_tx, unsigned_blob))
+    def test_signing_session_preimage_hash(self, unsigned_hex):
+        tx = Transaction.from_extended_bytes(bytes.fromhex(unsigned_hex))
+        session = SigningSession(tx)
+        sighash = SigHash(Transaction.nHashType())
+        for input_index, txin in enumerate(tx.inputs):
+            expected_hash = tx.signature_hash(input_index, txin.value,
+                Transaction.get_preimage_script_bytes(txin), sighash=sighash)
+            assert session.preimage_hash(txin) == expected_hash
+            # An equal input that is not the one in the transaction.
+            txin_copy = attr.evolve(txin)
+            assert session.preimage_hash(txin_copy) == expected_hash
+
+    def test_signing_session_derive_public_key(self):
+        tx = Transaction.from_extended_bytes(bytes.fromhex(unsigned_blob))
+        txin = tx.inputs[0]
+        derived_x_pubkeys = []
+        def derive_public_key(x_pubkey):
+            derived_x_pubkeys.append(x_pubkey)
+            return x_pubkey.to_public_key()
+        session = SigningSession(tx, derive_public_key)
+        assert session.preimage_hash(txin) == SigningSession(tx).preimage_hash(txin)
+        assert derived_x_pubkeys == [ txin.x_pubkeys[0] ]
+
     def test_update_signatures(self):
         signed_tx = Tx.from_hex(signed_tx_3)
         sigs = [next(input.script_sig.ops())[:-1] for input in signed_tx.inputs]
@@ -244,6 +273,13 @@ class TestTransaction2:
         assert tx.serialize() == fully_signed_hex
         assert json.dumps(tx.to_dict()) == fully_signed_json
 
+        # Sign with both through the one session
+        tx = Transaction.from_extended_bytes(bytes.fromhex(unsigned_hex))
+        tx_context = TransactionContext(signing_session=SigningSession(tx))
+        keystore1.sign_transaction(tx, "OLD", tx_context)
+        keystore2.sign_transaction(tx, "BIP32", tx_context)
+        assert tx.serialize() == fully_signed_hex
+
 
 class TestXPublicKey:
 
@@ -347,3 +383,61 @@ class TestXPublicKey:
         tx = Transaction.from_extended_bytes(bytes.fromhex(tx_hex))
         # We do not serialize the old extended byte format anymore.
         assert tx.serialize() != tx_hex
+
+
+class TestTxSizeEstimator:
+
+    @pytest.mark.parametrize("script_type,threshold,compressed", (
+        (ScriptType.P2PKH, 1, [ True ]),
+        (ScriptType.P2PKH, 1, [ False ]),
+        (ScriptType.P2PK, 1, [ True ]),
+        (ScriptType.MULTISIG_BARE, 2, [ True, False, True ]),
+        (ScriptType.MULTISIG_P2SH, 2, [ True, False, True ]),
+        (ScriptType.MULTISIG_P2SH, 1, [ True ] * 15),
+        (ScriptType.MULTISIG_ACCUMULATOR, 2, [ True, False, True ]),
+        (ScriptType.MULTISIG_ACCUMULATOR, 3, [ False, True, True ]),
+    ))
+    def test_estimated_size_matches_signed_size(self, script_type, threshold, compressed):
+        x_pubkeys = [ XPublicKey(pubkey_bytes=PrivateKey.from_random().public_key.to_bytes(
+            compressed=is_compressed)) for is_compressed in compressed ]
+        # The signatures are the largest size, which is what the estimate allows for.
+        signatures = [ dummy_signature ] * threshold + \
+            [ NO_SIGNATURE ] * (len(x_pubkeys) - threshold)
+        txin = XTxInput(prev_hash=bytes(32), prev_idx=0, script_sig=Script(),
+            sequence=0xffffffff, value=1000, x_pubkeys=x_pubkeys, threshold=threshold,
+            signatures=signatures, script_type=script_type)
+        output = TxOutput(1000, Address.from_string('1MYXdf4moacvaEKZ57ozerpJ3t9xSeN6LK',
+            Bitcoin).to_script())
+        tx = Transaction.from_io([ txin ], [ output ])
+        assert tx.is_complete()
+        assert tx.estimated_size() == len(tx.to_bytes())
+        assert txin.estimated_size() == len(txin.to_bytes())
+
+    def test_output_count_varint(self):
+        output = TxOutput(1000, Address.from_string('1MYXdf4moacvaEKZ57ozerpJ3t9xSeN6LK',
+            Bitcoin).to_script())
+        tx = Transaction.from_io([], [])
+        estimator = TxSizeEstimator.from_transaction(tx)
+        # The output count takes three bytes from 253 outputs on.
+        for count in range(1, 256):
+            tx.outputs.append(output)
+            estimator.add_output(output)
+            assert estimator.size() == len(tx.to_bytes())
+        for _i in range(255):
+            removed_output = tx.outputs.pop()
+            estimator.remove_output(removed_output)
+            assert estimator.size() == len(tx.to_bytes())
+
+    def test_matches_estimated_size(self):
+        tx = Transaction.from_extended_bytes(bytes.fromhex(unsigned_blob))
+        estimator = TxSizeEstimator.from_transaction(tx)
+        # The estimate allows for the largest signature.
+        assert estimator.size() == len(bytes.fromhex(signed_blob)) + 1
+
+        txin = tx.inputs[0]
+        output = tx.outputs[0]
+        assert estimator.size_with(1, txin.estimated_size(), 1, output.estimated_size()) == \
+            estimator.size() + txin.estimated_size() + output.estimated_size()
+        estimator.remove_input(txin)
+        estimator.remove_output(output)
+        assert estimator.size() == len(Transaction.from_io([], []).to_bytes())
@@ -1,8 +1,9 @@
 import pytest
 import unittest
 
-from electrumsv.util import format_satoshis, get_identified_release_signers
-from electrumsv.util.cache import LRUCache
+from electrumsv.util import (format_satoshis, function_time_metric,
+    get_identified_release_signers, profiler)
+from electrumsv.util.cache import CacheStatistics, LRUCache, TransactionDataCache
 
 from .conftest import get_tx_datacarrier_size, get_tx_small_size
 
@@ -86,6 +87,22 @@ def test_get_identified_release_signers():
     assert not get_identified_release_signers(entry)
 
 
+def test_profiler() -> None:
+    @profiler
+    def profiled(value: int) -> int:
+        if value < 0:
+            raise ValueError()
+        return value * 2
+
+    labels = (profiled.__qualname__,)
+    count = function_time_metric.get_count(labels)
+    assert profiled(2) == 4
+    assert profiled.__name__ == "profiled"
+    with pytest.raises(ValueError):
+        profiled(-1)
+    assert function_time_metric.get_count(labels) == count + 2
+
+
 def test_lrucache_no_limit():
     with pytest.raises(AssertionError):
         cache = LRUCache()
@@ -250,3 +267,62 @@ def test_lrucache_add_past_limit_lru_ordering(max_count: int, max_size: int, tes
     added, removals = cache.set(b'6', test_tx_small)
     assert added
     assert removals == [(b'4', test_tx_small)]
+
+
+def test_transactiondatacache_charges_bytes(test_tx_small) -> None:
+    small_bytes = test_tx_small.to_bytes()
+    other_bytes = small_bytes + b'\0'
+    cache = TransactionDataCache(max_size=len(small_bytes) + len(other_bytes))
+    added, removals = cache.set(b'1', test_tx_small)
+    assert added
+    assert removals == []
+    added, removals = cache.set_bytes(b'2', other_bytes)
+    assert added
+    assert cache.current_size == len(small_bytes) + len(other_bytes)
+    assert b'1' in cache and b'2' in cache
+
+    # The added parsed transaction is kept, and the serialised one is parsed on access.
+    assert cache.get(b'1') is test_tx_small
+    cache.set_bytes(b'2', small_bytes)
+    tx = cache.get(b'2')
+    assert tx.to_bytes() == small_bytes
+    assert cache.get(b'2') is tx
+    assert cache.get_bytes(b'2') == small_bytes
+
+    # Adding past the size limit evicts the least recently used from both tiers.
+    added, removals = cache.set_bytes(b'3', other_bytes)
+    assert added
+    assert removals == [ (b'1', small_bytes) ]
+    assert b'1' not in cache
+    assert cache._transaction_cache.get(b'1') is None
+
+    cache.set(b'2', None)
+    assert b'2' not in cache
+    assert cache.get(b'2') is None
+    assert cache.current_size == len(other_bytes)
+
+
+def test_transactiondatacache_hot_tier(test_tx_small) -> None:
+    small_bytes = test_tx_small.to_bytes()
+    cache = TransactionDataCache(max_size=10 * len(small_bytes), hot_count=2)
+    for key in (b'1', b'2', b'3'):
+        cache.set_bytes(key, small_bytes)
+    txs = [ cache.get(key) for key in (b'1', b'2', b'3') ]
+    # Only the two most recently accessed parsed transactions are kept.
+    assert len(cache._transaction_cache) == 2
+    assert cache.get(b'3') is txs[2]
+    assert cache.get(b'1') is not txs[0]
+    assert len(cache) == 3
+
+    cache.set_maximum_size(len(small_bytes))
+    assert len(cache) == 1
+    assert b'1' in cache
+    assert len(cache._transaction_cache) == 1
+
+
+def test_lrucache_statistics(test_tx_small) -> None:
+    cache = LRUCache(max_count=10)
+    cache.set(b'1', test_tx_small, 100)
+    cache.get(b'1')
+    cache.get(b'2')
+    assert cache.get_statistics() == CacheStatistics(1, 1, 1, 100, cache.get_sizes()[1])
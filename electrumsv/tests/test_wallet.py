@@ -6,22 +6,29 @@ import shutil
 import sys
 import tempfile
 import threading
-from typing import Dict, Optional, List, Set
+from typing import Dict, Optional, List, Set, Tuple
 import unittest
 
+from bitcoinx import hash_to_hex_str, Script, Tx, TxInput, TxOutput
 import pytest
 
 from electrumsv.constants import (DATABASE_EXT, DerivationType, KeystoreTextType, ScriptType,
-    StorageKind, CHANGE_SUBPATH, RECEIVING_SUBPATH, KeyInstanceFlag)
+    StorageKind, CHANGE_SUBPATH, RECEIVING_SUBPATH, KeyInstanceFlag, TransactionOutputFlag,
+    TxFlags)
 from electrumsv.crypto import pw_decode
 from electrumsv.exceptions import InvalidPassword, IncompatibleWalletError
 from electrumsv.keystore import (from_seed, from_xpub, Old_KeyStore, Multisig_KeyStore)
 from electrumsv.networks import Net, SVMainnet, SVTestnet
 from electrumsv.storage import get_categorised_files, WalletStorage, WalletStorageInfo
+from electrumsv.transaction import Transaction
+from electrumsv.types import TxoKeyType
+from electrumsv.bitcoin import COINBASE_MATURITY
 from electrumsv.wallet import (ImportedPrivkeyAccount, ImportedAddressAccount, MultisigAccount,
-    Wallet, StandardAccount, AbstractAccount)
-from electrumsv.wallet_database import DatabaseContext
-from electrumsv.wallet_database.tables import AccountRow, KeyInstanceRow, TransactionDeltaTable
+    Wallet, StandardAccount, AbstractAccount, AccountRoutingIndex, BalanceIndex, CoinValueIndex,
+    HistoryCursor, HistoryIndex, SyncState, UTXO)
+from electrumsv.wallet_database import DatabaseContext, SynchronousWriter
+from electrumsv.wallet_database.tables import (AccountRow, KeyInstanceRow, TransactionDeltaTable,
+    TransactionOutputRow, TransactionOutputTable, TransactionTable, TxData)
 
 from .util import setup_async, tear_down_async, TEST_WALLET_PATH
 
@@ -291,6 +298,13 @@ def check_create_keys(wallet: Wallet, account_script_type: ScriptType) -> None:
             assert last_keyinstances == new_keyinstances[:len(last_keyinstances)]
         keyinstance_batches.append(new_keyinstances)
 
+    # The scripts for keys derived in bulk match those for keys derived one at a time.
+    keyinstances.extend(account.create_keys(3, CHANGE_SUBPATH))
+    keyinstance_ids = [ keyinstance.keyinstance_id for keyinstance in reversed(keyinstances) ]
+    assert account.get_possible_scripts_for_ids(keyinstance_ids) == [
+        (keyinstance_id, script_type, script) for keyinstance_id in keyinstance_ids
+        for script_type, script in account.get_possible_scripts_for_id(keyinstance_id) ]
+
 
 
 # Verify that different legacy wallets are created with correct keystores in both parent
@@ -527,6 +541,405 @@ def test_detect_used_keys(mocker):
     assert account._keyinstances[3].flags == KeyInstanceFlag.USER_SET_ACTIVE
 
 
+
+def test_sync_state() -> None:
+    tx_hash_a, tx_hash_b, tx_hash_c = bytes([1]) * 32, bytes([2]) * 32, bytes([3]) * 32
+    sync_state = SyncState()
+    assert sync_state.get_key_history(1) == []
+    assert sync_state.get_transaction_key_ids(tx_hash_a) == set()
+
+    removed, added = sync_state.set_key_history_hashes(1, [ (tx_hash_a, 10), (tx_hash_b, 0) ])
+    assert (removed, added) == (set(), { tx_hash_a, tx_hash_b })
+    # The server form of the history uses hex transaction ids.
+    removed, added = sync_state.set_key_history(2, [ (hash_to_hex_str(tx_hash_b), 0),
+        (hash_to_hex_str(tx_hash_c), -1) ])
+    assert (removed, added) == (set(), { tx_hash_b, tx_hash_c })
+    assert sync_state.get_key_history(2) == [ (hash_to_hex_str(tx_hash_b), 0),
+        (hash_to_hex_str(tx_hash_c), -1) ]
+    assert sync_state.get_key_history_hashes(1) == [ (tx_hash_a, 10), (tx_hash_b, 0) ]
+    assert sync_state.get_transaction_key_ids(tx_hash_a) == { 1 }
+    assert sync_state.get_transaction_key_ids(tx_hash_b) == { 1, 2 }
+
+    removed, added = sync_state.set_key_history_hashes(1, [ (tx_hash_b, 5) ])
+    assert (removed, added) == ({ tx_hash_a }, set())
+    assert sync_state.get_key_history_hashes(1) == [ (tx_hash_b, 5) ]
+    assert sync_state.get_transaction_key_ids(tx_hash_a) == set()
+    removed, added = sync_state.set_key_history_hashes(2, [])
+    assert (removed, added) == ({ tx_hash_b, tx_hash_c }, set())
+    assert sync_state.get_transaction_key_ids(tx_hash_b) == { 1 }
+
+    # The ids of transactions no longer linked to keys are reused.
+    sync_state.set_key_history_hashes(3, [ (tx_hash_c, 1), (tx_hash_a, 2) ])
+    assert sync_state.get_key_history_hashes(3) == [ (tx_hash_c, 1), (tx_hash_a, 2) ]
+    report = sync_state.get_memory_report()
+    assert (report["key_count"], report["link_count"], report["transaction_count"]) == \
+        (2, 3, 3)
+    assert len(sync_state._tx_hashes) == 3
+
+
+@unittest.mock.patch('electrumsv.wallet.app_state')
+def test_lazy_account_loading(mock_app_state, tmp_storage) -> None:
+    mock_app_state.app = unittest.mock.Mock()
+    wallet = Wallet(tmp_storage)
+    account_1 = wallet.create_account_from_keystore(from_seed('cycle rocket west magnet parrot '
+        'shuffle foot correct salt library feed song', ''))
+    account_2 = wallet.create_account_from_keystore(from_seed('powerful random nobody notice '
+        'nothing important anyway look away hidden message over', ''))
+    keyinstances = account_1.create_keys(2, RECEIVING_SUBPATH)
+    tx_hash = bytes([1]) * 32
+    with TransactionTable(wallet.get_db_context()) as table:
+        with SynchronousWriter() as writer:
+            table.create([ (tx_hash, TxData(height=1, position=0, date_added=1, date_updated=1),
+                b'', TxFlags.StateSettled, None) ], completion_callback=writer.get_callback())
+            assert writer.succeeded()
+    with TransactionOutputTable(wallet.get_db_context()) as table:
+        with SynchronousWriter() as writer:
+            table.create([
+                TransactionOutputRow(tx_hash, 0, 100, keyinstances[0].keyinstance_id,
+                    TransactionOutputFlag.IS_SPENT),
+                TransactionOutputRow(tx_hash, 1, 200, keyinstances[1].keyinstance_id,
+                    TransactionOutputFlag.NONE),
+            ], completion_callback=writer.get_callback())
+            assert writer.succeeded()
+
+    # Reloading the wallet does not load any accounts until they are accessed.
+    wallet.load_state()
+    assert wallet.get_account_ids() == { account_1.get_id(), account_2.get_id() }
+    assert wallet.get_loaded_accounts() == []
+
+    account = wallet.get_account(account_1.get_id())
+    assert wallet.get_loaded_accounts() == [ account ]
+    assert wallet.get_account(account_1.get_id()) is account
+    # Only the loaded account's coins are known to the routing index.
+    spend_tx = unittest.mock.Mock(inputs=[ unittest.mock.Mock(prev_hash=tx_hash, prev_idx=1) ])
+    assert wallet._routing_index.get_account_ids(bytes(32), spend_tx) == { account.get_id() }
+
+    # The coin script is only derived when it is first used.
+    utxo = account.get_utxo(tx_hash, 1)
+    assert utxo._script_loader is not None
+    assert utxo.script_pubkey == account.get_script_for_id(keyinstances[1].keyinstance_id)
+    assert utxo._script_loader is None
+
+    # The spent output is only read from the database when it is looked up.
+    assert account._stxos == {}
+    assert account.get_stxo(tx_hash, 0) == keyinstances[0].keyinstance_id
+    assert account.get_stxo(tx_hash, 1) is None
+    assert account._stxos == { (tx_hash, 0): keyinstances[0].keyinstance_id }
+
+    assert [ a.get_id() for a in wallet.get_accounts() ] == [ account_1.get_id(),
+        account_2.get_id() ]
+    assert len(wallet.get_loaded_accounts()) == 2
+
+
+@unittest.mock.patch('electrumsv.wallet.app_state')
+def test_lazy_account_loading_on_demand(mock_app_state, tmp_storage) -> None:
+    mock_app_state.app = unittest.mock.Mock()
+    wallet = Wallet(tmp_storage)
+    account_1 = wallet.create_account_from_keystore(from_seed('cycle rocket west magnet parrot '
+        'shuffle foot correct salt library feed song', ''))
+    account_2 = wallet.create_account_from_keystore(from_seed('powerful random nobody notice '
+        'nothing important anyway look away hidden message over', ''))
+    [ keyinstance ] = account_1.create_keys(1, RECEIVING_SUBPATH)
+    tx_hash = bytes([1]) * 32
+    with TransactionTable(wallet.get_db_context()) as table:
+        with SynchronousWriter() as writer:
+            table.create([ (tx_hash, TxData(height=1, position=0, date_added=1, date_updated=1),
+                b'', TxFlags.StateSettled, None) ], completion_callback=writer.get_callback())
+            assert writer.succeeded()
+    with TransactionOutputTable(wallet.get_db_context()) as table:
+        with SynchronousWriter() as writer:
+            table.create([ TransactionOutputRow(tx_hash, 0, 100, keyinstance.keyinstance_id,
+                TransactionOutputFlag.NONE) ], completion_callback=writer.get_callback())
+            assert writer.succeeded()
+    x_pubkey = account_2.get_keystore().get_xpubkey(RECEIVING_SUBPATH + (0,))
+    wallet.load_state()
+
+    # Only the account that has the key is loaded to resolve it.
+    account, keyinstance_id = wallet.resolve_xpubkey(x_pubkey)
+    assert account.get_id() == account_2.get_id()
+    assert [ a.get_id() for a in wallet.get_loaded_accounts() ] == [ account_2.get_id() ]
+
+    # Only the account with coins spent by a transaction is loaded to route it.
+    spend_tx = unittest.mock.Mock(inputs=[ unittest.mock.Mock(prev_hash=tx_hash, prev_idx=0) ])
+    spend_tx.is_coinbase.return_value = False
+    wallet._load_spent_accounts([ (bytes(32), spend_tx) ])
+    assert wallet._routing_index.get_account_ids(bytes(32), spend_tx) == { account_1.get_id() }
+    assert len(wallet.get_loaded_accounts()) == 2
+
+
+@unittest.mock.patch('electrumsv.wallet.app_state')
+def test_lazy_account_loading_concurrent_cache_changes(mock_app_state, tmp_storage) -> None:
+    mock_app_state.app = unittest.mock.Mock()
+    wallet = Wallet(tmp_storage)
+    account = wallet.create_account_from_keystore(from_seed('cycle rocket west magnet parrot '
+        'shuffle foot correct salt library feed song', ''))
+    tx = Transaction.from_bytes(Tx(1, [ TxInput(bytes([1]) * 32, 0, Script(), 0xffffffff) ],
+        [ TxOutput(1000, Script(bytes([ 0x6a ]))) ], 0).to_bytes())
+    wallet.load_state()
+    with SynchronousWriter() as writer:
+        wallet._transaction_cache.add_transactions([ (tx.hash(), tx, TxFlags.StateSettled) ],
+            writer.get_callback())
+        assert writer.succeeded()
+
+    # The cache notifies the wallet of the deletion with its lock held, while the account is
+    # being loaded on another thread and has read its metadata from the cache.
+    deleted_event = threading.Event()
+    def delete_transaction() -> None:
+        with SynchronousWriter() as writer:
+            wallet._transaction_cache.delete(tx.hash(), writer.get_callback())
+            assert writer.succeeded()
+        deleted_event.set()
+
+    realize_stored_account = wallet._realize_stored_account
+    def _realize_stored_account(row: AccountRow):
+        loaded_account = realize_stored_account(row)
+        thread = threading.Thread(target=delete_transaction)
+        thread.start()
+        assert deleted_event.wait(5.0)
+        return loaded_account
+
+    with unittest.mock.patch.object(wallet, "_realize_stored_account",
+            _realize_stored_account):
+        loaded_account = wallet.get_account(account.get_id())
+    assert loaded_account.get_id() == account.get_id()
+    # The deletion made while the account was loading is given to it when it is registered.
+    assert loaded_account._metadata_changes == { tx.hash() }
+    assert wallet._loading_metadata_changes == {}
+
+
+@unittest.mock.patch('electrumsv.wallet.app_state')
+def test_account_coins_by_value(mock_app_state, tmp_storage) -> None:
+    mock_app_state.app = unittest.mock.Mock()
+    wallet = Wallet(tmp_storage)
+    account = wallet.create_account_from_keystore(from_seed('cycle rocket west magnet parrot '
+        'shuffle foot correct salt library feed song', ''))
+    keys = account.create_keys(4, RECEIVING_SUBPATH)
+    for n, (value, key) in enumerate(zip([ 300, 100, 200 ], keys)):
+        account.register_utxo(bytes([n]) * 32, 0, value, TransactionOutputFlag.NONE, key)
+
+    # All the coins of the account are taken from the index, which is kept up to date.
+    coins, values, totals = account.get_coins_by_value(account.get_utxos())
+    assert account._coin_value_index is not None
+    assert (values, totals) == ([ 100, 200, 300 ], [ 0, 100, 300, 600 ])
+    account.register_utxo(bytes([3]) * 32, 0, 150, TransactionOutputFlag.NONE, keys[3])
+    coins, values, totals = account.get_coins_by_value(account.get_utxos())
+    assert (values, totals) == ([ 100, 150, 200, 300 ], [ 0, 100, 250, 450, 750 ])
+    assert [ coin.value for coin in coins ] == values
+
+    # Some of the coins are ordered by themselves.
+    coins, values, totals = account.get_coins_by_value(account.get_utxos()[1:])
+    assert (values, totals) == ([ 100, 150, 200 ], [ 0, 100, 250, 450 ])
+
+
+@unittest.mock.patch('electrumsv.wallet.app_state')
+def test_process_spent_before_funded(mock_app_state, tmp_storage) -> None:
+    mock_app_state.app = unittest.mock.Mock()
+    wallet = Wallet(tmp_storage)
+    account = wallet.create_account_from_keystore(from_seed('cycle rocket west magnet parrot '
+        'shuffle foot correct salt library feed song', ''))
+    [ key ] = account.create_keys(1, RECEIVING_SUBPATH)
+    key_id = key.keyinstance_id
+    account._keyinstances[key_id] = key._replace(script_type=ScriptType.P2PKH)
+    script = account.get_script_for_id(key_id)
+
+    funding_tx = Transaction.from_bytes(Tx(1, [ TxInput(bytes([1]) * 32, 0, Script(),
+        0xffffffff) ], [ TxOutput(1000, script) ], 0).to_bytes())
+    spending_tx = Transaction.from_bytes(Tx(1, [ TxInput(funding_tx.hash(), 0, Script(),
+        0xffffffff) ], [ TxOutput(900, Script(bytes([ 0x6a ]))) ], 0).to_bytes())
+    account._sync_state.set_key_history_hashes(key_id,
+        [ (funding_tx.hash(), 1), (spending_tx.hash(), 1) ])
+    wallet._routing_index.add_transactions(account.get_id(),
+        [ funding_tx.hash(), spending_tx.hash() ])
+
+    # The spending transaction is added first, and is found when the output it spends is.
+    entries = [ (spending_tx.hash(), spending_tx), (funding_tx.hash(), funding_tx) ]
+    with SynchronousWriter() as writer:
+        wallet._transaction_cache.add_transactions([ (tx_hash, tx, TxFlags.StateSettled)
+            for (tx_hash, tx) in entries ], writer.get_callback())
+        assert writer.succeeded()
+    with SynchronousWriter() as writer:
+        assert wallet._process_transactions(entries, writer.get_callback()) == \
+            [ set(), { account.get_id() } ]
+        assert writer.succeeded()
+
+    assert account.get_utxo(funding_tx.hash(), 0) is None
+    assert account.get_stxo(funding_tx.hash(), 0) == key_id
+    with TransactionDeltaTable(wallet.get_db_context()) as table:
+        assert sorted(table.read()) == sorted([ (funding_tx.hash(), key_id, 1000),
+            (spending_tx.hash(), key_id, -1000) ])
+
+
+def test_history_index() -> None:
+    metadatas = {
+        b"a": TxData(height=10, position=1, date_added=5),
+        b"b": TxData(height=10, position=0, date_added=4),
+        b"c": TxData(height=0, date_added=3),
+        b"d": TxData(height=None, date_added=2),
+    }
+    index = HistoryIndex()
+    index.load({ b"a": 100, b"b": 50, b"d": 1000 }, metadatas.get)
+    assert index.get_count() == 2
+    assert index.get_balance() == 150
+    assert [ (e[1], e[3]) for e in index.read() ] == [ (b"a", 150), (b"b", 50) ]
+
+    # Unconfirmed transactions are the most recent, and further deltas are combined.
+    index.apply_value_deltas({ b"c": -30, b"a": 5 }, metadatas.get)
+    assert [ (e[1], e[2], e[3]) for e in index.read() ] == \
+        [ (b"c", -30, 125), (b"a", 105, 155), (b"b", 50, 50) ]
+    assert [ e[1] for e in index.read(1) ] == [ b"c" ]
+
+    # Mining the unconfirmed transaction moves it into place.
+    metadatas[b"c"] = TxData(height=9, position=3, date_added=3)
+    index.update_metadata(b"c", metadatas[b"c"])
+    assert [ (e[1], e[3]) for e in index.read() ] == [ (b"a", 125), (b"b", 20), (b"c", -30) ]
+
+    # A cleared transaction is now included.
+    metadatas[b"d"] = TxData(height=0, date_added=2)
+    index.update_metadata(b"d", metadatas[b"d"])
+    assert index.read(1)[0][1:] == (b"d", 1000, 1125)
+
+    index.update_metadata(b"a", None)
+    index.remove(b"d")
+    assert index.get_balance() == 20
+    assert [ e[1] for e in index.read() ] == [ b"b", b"c" ]
+
+
+def test_history_page(mocker) -> None:
+    metadatas = { bytes([i]) * 32: TxData(height=i, position=0, date_added=i)
+        for i in range(1, 6) }
+    metadatas[b"\0" * 32] = TxData(height=0, date_added=100)
+
+    class MockAccount(AbstractAccount):
+        def __init__(self) -> None:
+            self._wallet = mocker.Mock()
+            self._wallet._transaction_cache.get_metadata.side_effect = metadatas.get
+            self._wallet._transaction_cache.get_flags.return_value = TxFlags.StateSettled
+            self._utxos_lock = threading.RLock()
+            self._metadata_changes = set()
+            self._metadata_changes_lock = threading.Lock()
+            self._history_index = HistoryIndex()
+            self._history_index.load({ tx_hash: 10 for tx_hash in metadatas }, metadatas.get)
+
+    account = MockAccount()
+    pages = []
+    cursor = None
+    while True:
+        lines, cursor = account.get_history_page(cursor, 4)
+        pages.append([ (line.height, balance) for line, balance in lines ])
+        if cursor is None:
+            break
+    assert pages == [ [ (0, 60), (5, 50), (4, 40), (3, 30) ], [ (2, 20), (1, 10) ] ]
+
+    # The balance carried by the cursor is used even if earlier history has changed.
+    lines, cursor = account.get_history_page(None, 1)
+    account._history_index.apply_value_deltas({ b"\1" * 32: 100 }, metadatas.get)
+    lines, cursor = account.get_history_page(cursor, 10)
+    assert [ (line.height, balance) for line, balance in lines ] == \
+        [ (5, 50), (4, 40), (3, 30), (2, 20), (1, 10) ]
+    assert cursor is None
+
+    with pytest.raises(ValueError):
+        account.get_history_page("not a cursor")
+
+
+def test_history_cursor_encoding() -> None:
+    cursor = HistoryCursor((1e9, 1610000000), b"\1" * 32, -5)
+    assert HistoryCursor.decode(cursor.encode()) == cursor
+    for text in ("", "W10=", HistoryCursor((1, None), b"\1" * 32, 0).encode()):
+        with pytest.raises(ValueError):
+            HistoryCursor.decode(text)
+
+
+def test_balance_index() -> None:
+    def make_utxo(tx_hash: bytes, out_index: int, value: int, is_coinbase: bool=False) -> UTXO:
+        return UTXO(value=value, script_pubkey=None, script_type=ScriptType.P2PKH,
+            tx_hash=tx_hash, out_index=out_index, keyinstance_id=1, flags=0, address=None,
+            is_coinbase=is_coinbase)
+
+    heights = { b"a": 10, b"b": 0, b"c": 20 }
+    utxo_a1 = make_utxo(b"a", 0, 100)
+    utxo_a2 = make_utxo(b"a", 1, 200)
+    utxo_b1 = make_utxo(b"b", 0, 50)
+    utxo_c1 = make_utxo(b"c", 0, 1000, is_coinbase=True)
+
+    index = BalanceIndex()
+    for utxo in (utxo_a1, utxo_a2, utxo_b1, utxo_c1):
+        index.add_utxo(utxo, heights[utxo.tx_hash])
+    assert index.get_balance(20, heights.get) == (300, 50, 1000)
+    assert index.get_balance(20 + COINBASE_MATURITY, heights.get) == (1300, 50, 0)
+
+    index.update_height(b"b", 11)
+    index.update_height(b"a", 0)
+    assert index.get_balance(20, heights.get) == (50, 300, 1000)
+
+    index.remove_utxo(utxo_a1)
+    index.remove_utxo(utxo_c1)
+    assert index.get_balance(20, heights.get) == (50, 200, 0)
+    index.remove_utxo(utxo_a2)
+    index.update_height(b"a", 10)
+    assert index.get_balance(20, heights.get) == (50, 0, 0)
+
+
+def test_coin_value_index() -> None:
+    def make_utxo(tx_hash: bytes, out_index: int, value: int) -> UTXO:
+        return UTXO(value=value, script_pubkey=Script(), script_type=ScriptType.P2PKH,
+            tx_hash=tx_hash, out_index=out_index, keyinstance_id=1, address=None,
+            is_coinbase=False, flags=TransactionOutputFlag.NONE)
+
+    utxo_a1 = make_utxo(b"a", 0, 300)
+    utxo_a2 = make_utxo(b"a", 1, 100)
+    utxo_b1 = make_utxo(b"b", 0, 200)
+    utxo_c1 = make_utxo(b"c", 0, 100)
+
+    index = CoinValueIndex([ utxo_a1, utxo_c1 ])
+    assert index.get_coins() == ([ utxo_c1, utxo_a1 ], [ 100, 300 ], [ 0, 100, 400 ])
+
+    # Coins of the same value are in the order they are added in.
+    index.add_utxo(utxo_b1)
+    index.add_utxo(utxo_a2)
+    assert index.get_coins() == ([ utxo_c1, utxo_a2, utxo_b1, utxo_a1 ],
+        [ 100, 100, 200, 300 ], [ 0, 100, 200, 400, 700 ])
+
+    coins, values, totals = index.get_coins()
+    index.remove_utxo(utxo_c1)
+    index.remove_utxo(utxo_a1)
+    assert index.get_coins() == ([ utxo_a2, utxo_b1 ], [ 100, 200 ], [ 0, 100, 300 ])
+    # What was given out before is not changed by later changes.
+    assert (coins, values, totals) == ([ utxo_c1, utxo_a2, utxo_b1, utxo_a1 ],
+        [ 100, 100, 200, 300 ], [ 0, 100, 200, 400, 700 ])
+
+
+def test_account_routing_index() -> None:
+    def make_tx(*outpoints: Tuple[bytes, int]) -> unittest.mock.Mock:
+        tx = unittest.mock.Mock()
+        tx.inputs = [ unittest.mock.Mock(prev_hash=prev_hash, prev_idx=prev_idx)
+            for prev_hash, prev_idx in outpoints ]
+        return tx
+
+    tx_hash_a, tx_hash_b, tx_hash_c = bytes([1]) * 32, bytes([2]) * 32, bytes([3]) * 32
+    index = AccountRoutingIndex()
+    assert index.get_account_ids(tx_hash_a, make_tx((tx_hash_b, 0))) == set()
+
+    index.add_transactions(1, [ tx_hash_a, tx_hash_b ])
+    index.add_transactions(2, [ tx_hash_b ])
+    index.add_transactions(2, [ tx_hash_b ])
+    assert index.get_account_ids(tx_hash_a, make_tx()) == { 1 }
+    assert index.get_account_ids(tx_hash_b, make_tx()) == { 1, 2 }
+
+    # Transactions that spend the unspent outputs of an account are routed to it.
+    index.add_utxo(3, TxoKeyType(tx_hash_a, 1))
+    assert index.get_account_ids(tx_hash_c, make_tx((tx_hash_a, 0))) == set()
+    assert index.get_account_ids(tx_hash_c, make_tx((tx_hash_a, 0), (tx_hash_a, 1))) == { 3 }
+    assert index.get_account_ids(tx_hash_a, make_tx((tx_hash_a, 1))) == { 1, 3 }
+    index.remove_utxos([ TxoKeyType(tx_hash_a, 1), TxoKeyType(tx_hash_a, 2) ])
+    assert index.get_account_ids(tx_hash_c, make_tx((tx_hash_a, 1))) == set()
+
+    index.remove_transactions(2, [ tx_hash_a, tx_hash_b, tx_hash_c ])
+    assert index.get_account_ids(tx_hash_b, make_tx()) == { 1 }
+    assert index._tx_accounts[tx_hash_b] == 1
+    index.remove_transactions(1, [ tx_hash_a, tx_hash_b ])
+    assert index._tx_accounts == {}
+
 # class TestImportedPrivkeyAccount:
 #     # TODO(rt12) REQUIRED add some unit tests for this account type. The following is obsolete.
 #     def test_pubkeys_to_a_ddress(self, tmp_storage, network):
@@ -1,6 +1,8 @@
+import asyncio
 import os
+import threading
 import pytest
-from typing import Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
 import bitcoinx
 
@@ -8,8 +10,8 @@ from electrumsv.constants import TxFlags, TRANSACTION_FLAGS
 from electrumsv.transaction import Transaction
 from electrumsv.logs import logs
 from electrumsv import wallet_database
-from electrumsv.wallet_database import (DatabaseContext, SynchronousWriter, TxData, TxProof,
-    TransactionCache, TransactionCacheEntry)
+from electrumsv.wallet_database import (AsyncCompletion, DatabaseContext, SynchronousWriter,
+    TxData, TxProof, TransactionCache, TransactionCacheEntry)
 from electrumsv.wallet_database.migration import create_database, update_database
 from electrumsv.wallet_database.sqlite_support import WriteEntryType
 from electrumsv.wallet_database.tables import WalletDataRow
@@ -207,6 +209,7 @@ class TestTransactionCache:
 
     def setup_method(self):
         db = self.store._db
+        db.execute(f"DELETE FROM TransactionInputs")
         db.execute(f"DELETE FROM Transactions")
         db.commit()
 
@@ -267,6 +270,104 @@ class TestTransactionCache:
         assert cache.have_transaction_data_cached(tx_hash)
         assert TxFlags.StateCleared == entry.flags & TxFlags.StateCleared
 
+    @pytest.mark.timeout(5)
+    def test_add_transactions(self):
+        cache = TransactionCache(self.store)
+
+        tx_1 = Transaction.from_hex(tx_hex_1)
+        tx_2 = Transaction.from_hex(tx_hex_2)
+        # The first transaction is only known by its metadata, the second is new.
+        data = [ tx_1.hash(), TxData(height=1295924,position=4,fee=None, date_added=1,
+            date_updated=1), None, TxFlags.Unset, None ]
+        with SynchronousWriter() as writer:
+            cache.add([ data ], completion_callback=writer.get_callback())
+            assert writer.succeeded()
+
+        callback_count = 0
+        with SynchronousWriter() as writer:
+            writer_callback = writer.get_callback()
+            def _completion_callback(exc_value: Optional[Exception]) -> None:
+                nonlocal callback_count
+                callback_count += 1
+                writer_callback(exc_value)
+            cache.add_transactions([ (tx_1.hash(), tx_1, TxFlags.StateCleared),
+                (tx_2.hash(), tx_2, TxFlags.StateCleared) ], _completion_callback)
+            assert writer.succeeded()
+        assert callback_count == 1
+
+        for tx in (tx_1, tx_2):
+            entry = cache.get_entry(tx.hash())
+            assert entry is not None
+            assert cache.have_transaction_data_cached(tx.hash())
+            assert TxFlags.StateCleared == entry.flags & TxFlags.StateCleared
+        assert cache.get_height(tx_1.hash()) == 1295924
+
+    @pytest.mark.timeout(5)
+    def test_add_transactions_async_completion(self, monkeypatch) -> None:
+        cache = TransactionCache(self.store)
+
+        tx_1 = Transaction.from_hex(tx_hex_1)
+        tx_2 = Transaction.from_hex(tx_hex_2)
+        data = [ tx_1.hash(), TxData(height=1295924,position=4,fee=None, date_added=1,
+            date_updated=1), None, TxFlags.Unset, None ]
+        with SynchronousWriter() as writer:
+            cache.add([ data ], completion_callback=writer.get_callback())
+            assert writer.succeeded()
+
+        # The wrapping of the completion for the insert, the update and the tracked inputs does
+        # not keep it from being resolved directly by the writer thread.
+        dispatcher = self.db_context._write_dispatcher
+        def _submit(*args) -> None:
+            raise AssertionError("unexpected completion thread pool use")
+        monkeypatch.setattr(dispatcher._callback_thread_pool, "submit", _submit)
+
+        async def _test() -> None:
+            completion = AsyncCompletion()
+            cache.add_transactions([ (tx_1.hash(), tx_1, TxFlags.StateCleared),
+                (tx_2.hash(), tx_2, TxFlags.StateCleared) ], completion)
+            await completion
+
+        asyncio.run(_test())
+        assert cache._unwritten_inputs == {}
+        for tx in (tx_1, tx_2):
+            entry = cache.get_entry(tx.hash())
+            assert entry is not None
+            assert TxFlags.StateCleared == entry.flags & TxFlags.StateCleared
+
+    @pytest.mark.timeout(5)
+    def test_get_spending_transactions(self, monkeypatch) -> None:
+        cache = TransactionCache(self.store)
+
+        tx_1 = Transaction.from_hex(tx_hex_1)
+        tx_2 = Transaction.from_hex(tx_hex_2)
+        txin_1, txin_2 = tx_1.inputs[0], tx_2.inputs[0]
+        assert cache.get_spending_transactions(txin_1.prev_hash) == {}
+
+        # The inputs of transactions are known before they are written.
+        writes = []
+        monkeypatch.setattr(self.db_context, "queue_write",
+            lambda *args, **kwargs: writes.append(args))
+        cache.add_transaction(tx_1.hash(), tx_1)
+        assert cache.get_spending_transactions(txin_1.prev_hash) == {
+            txin_1.prev_idx: [ tx_1.hash() ] }
+        monkeypatch.undo()
+
+        with SynchronousWriter() as writer:
+            [ write_args ] = writes
+            self.db_context.queue_write(*write_args)
+            cache.add_transaction(tx_2.hash(), tx_2, completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        assert cache._unwritten_inputs == {}
+        assert cache.get_spending_transactions(txin_1.prev_hash) == {
+            txin_1.prev_idx: [ tx_1.hash() ] }
+        assert cache.get_spending_transactions(txin_2.prev_hash) == {
+            txin_2.prev_idx: [ tx_2.hash() ] }
+
+        with SynchronousWriter() as writer:
+            cache.delete(tx_1.hash(), completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        assert cache.get_spending_transactions(txin_1.prev_hash) == {}
+
     @pytest.mark.timeout(5)
     def test_add_then_update(self):
         cache = TransactionCache(self.store)
@@ -599,6 +700,33 @@ class TestTransactionCache:
         results = cache.get_unverified_entries(11)
         assert 1 == len(results)
 
+    @pytest.mark.timeout(5)
+    def test_get_unverified_entries_uncapped(self) -> None:
+        cache = TransactionCache(self.store)
+
+        base_tx = Transaction.from_hex(tx_hex_1)
+        entries = []
+        for i in range(250):
+            tx = Transaction.from_hex(tx_hex_1)
+            tx.locktime = i
+            data = TxData(height=11, date_added=1, date_updated=1)
+            entries.append((tx.hash(), data, tx, TxFlags.StateCleared, None))
+        with SynchronousWriter() as writer:
+            cache.add(entries, completion_callback=writer.get_callback())
+            assert writer.succeeded()
+
+        results = cache.get_unverified_entries(11)
+        assert 250 == len(results)
+
+        with SynchronousWriter() as writer:
+            cache.update_proofs([ (tx_hash, TxProof(1, [ base_tx.hash() ]))
+                for (tx_hash, _data, _tx, _flags, _description) in entries[:5] ],
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        proofs = dict(self.store.read_proof([ t[0] for t in entries[:6] ]))
+        assert proofs[entries[0][0]] == TxProof(1, [ base_tx.hash() ])
+        assert proofs[entries[5][0]] is None
+
     @pytest.mark.timeout(5)
     def test_apply_reorg(self) -> None:
         common_height = 5
@@ -684,6 +812,45 @@ class TestTransactionCache:
         assert data_n3.fee == n3.metadata.fee
         assert TxFlags.StateDispatched | expected_flags == n3.flags, TxFlags.to_repr(n3.flags)
 
+    @pytest.mark.timeout(5)
+    def test_metadata_change_callback(self) -> None:
+        cache = TransactionCache(self.store)
+        changes: List[List[bytes]] = []
+        cache.set_metadata_change_callback(changes.append)
+
+        tx_1 = Transaction.from_hex(tx_hex_1)
+        tx_hash_1 = tx_1.hash()
+        data_1 = TxData(height=0, fee=44, date_added=1, date_updated=1)
+        with SynchronousWriter() as writer:
+            cache.add([ (tx_hash_1, data_1, tx_1, TxFlags.StateCleared, None) ],
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        assert changes == []
+
+        # Changes to the fee do not affect the ordering of the transaction.
+        with SynchronousWriter() as writer:
+            cache.update([ (tx_hash_1, TxData(fee=55), None, TxFlags.HasFee) ],
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        assert changes == []
+
+        with SynchronousWriter() as writer:
+            cache.update([ (tx_hash_1, TxData(height=10, position=2), None,
+                TxFlags.HasHeight | TxFlags.HasPosition | TxFlags.StateSettled) ],
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        assert changes == [ [ tx_hash_1 ] ]
+
+        with SynchronousWriter() as writer:
+            cache.apply_reorg(5, completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        assert changes[1:] == [ [ tx_hash_1 ] ]
+
+        with SynchronousWriter() as writer:
+            cache.delete(tx_hash_1, completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        assert changes[2:] == [ [ tx_hash_1 ] ]
+
 
 class TestSqliteWriteDispatcher:
     @classmethod
@@ -749,3 +916,129 @@ class TestSqliteWriteDispatcher:
 
         assert _write_callback_called
 
+
+    # As we use threading pytest can deadlock if something errors. This will break the deadlock
+    # and display stacktraces.
+    @pytest.mark.timeout(5)
+    def test_write_dispatcher_isolates_failure(self) -> None:
+        self.dispatcher = wallet_database.SqliteWriteDispatcher(self.db_context)
+        self.dispatcher._writer_loop_event.wait()
+
+        # Hold up the writer thread so that the following writes get batched together.
+        blocked_event = threading.Event()
+        blocking_event = threading.Event()
+        def _blocking_write_callback(conn):
+            blocked_event.set()
+            blocking_event.wait()
+        self.dispatcher.put(WriteEntryType(_blocking_write_callback, None, 0))
+        blocked_event.wait()
+
+        write_counts: Dict[int, int] = {}
+        completion_results: Dict[int, Optional[Exception]] = {}
+        def _make_entry(index: int) -> WriteEntryType:
+            def _write_callback(conn):
+                write_counts[index] = write_counts.get(index, 0) + 1
+                if index == 5:
+                    raise ValueError("bad write")
+            def _completion_callback(exc_value: Optional[Exception]) -> None:
+                completion_results[index] = exc_value
+            return WriteEntryType(_write_callback, _completion_callback, 0)
+
+        for i in range(8):
+            self.dispatcher.put(_make_entry(i))
+        blocking_event.set()
+        self.dispatcher.stop()
+
+        assert len(completion_results) == 8
+        assert isinstance(completion_results.pop(5), ValueError)
+        assert all(v is None for v in completion_results.values())
+        # Entries in the same half as the failing entry get reapplied the most, and entries after
+        # it were never reached until the final retry.
+        assert write_counts == { 0: 2, 1: 2, 2: 2, 3: 2, 4: 4, 5: 4, 6: 1, 7: 1 }
+
+        statistics = self.dispatcher.get_statistics()
+        assert statistics.failed_entry_count == 1
+        assert statistics.retried_batch_count == 3
+        assert statistics.entry_count == 1 + 7
+        assert statistics.queue_depth == 0
+        assert statistics.batch_size_limit == \
+            wallet_database.SqliteWriteDispatcher.MAXIMUM_BATCH_SIZE
+
+    @pytest.mark.timeout(5)
+    def test_write_dispatcher_batch_size_hint_limit(self, monkeypatch) -> None:
+        monkeypatch.setattr(wallet_database.SqliteWriteDispatcher, "MAXIMUM_BATCH_BYTES", 100)
+        self.dispatcher = wallet_database.SqliteWriteDispatcher(self.db_context)
+        self.dispatcher._writer_loop_event.wait()
+
+        blocked_event = threading.Event()
+        blocking_event = threading.Event()
+        def _blocking_write_callback(conn):
+            blocked_event.set()
+            blocking_event.wait()
+        self.dispatcher.put(WriteEntryType(_blocking_write_callback, None, 0))
+        blocked_event.wait()
+
+        for i in range(4):
+            self.dispatcher.put(WriteEntryType(lambda conn: None, None, 50))
+        blocking_event.set()
+        self.dispatcher.stop()
+
+        statistics = self.dispatcher.get_statistics()
+        assert statistics.batch_count == 3
+        assert statistics.entry_count == 5
+        assert statistics.last_batch_size == 2
+
+
+class TestDatabaseContextAsync:
+    @classmethod
+    def setup_class(cls):
+        unique_name = os.urandom(8).hex()
+        cls.db_filename = DatabaseContext.shared_memory_uri(unique_name)
+        cls.db_context = DatabaseContext(cls.db_filename)
+        # We hold onto an open connection to ensure that the database persists for the
+        # lifetime of the tests.
+        cls.db = cls.db_context.acquire_connection()
+        create_database(cls.db)
+
+    @classmethod
+    def teardown_class(cls):
+        cls.db_context.release_connection(cls.db)
+        cls.db_context.close()
+
+    @pytest.mark.timeout(5)
+    def test_write_then_read(self) -> None:
+        def _write(db) -> None:
+            db.execute("INSERT INTO WalletData (key, value, date_created, date_updated) "
+                "VALUES (?, ?, ?, ?)", ("async-key", "[1]", 1, 1))
+
+        def _read(db, key: str):
+            return db.execute("SELECT value FROM WalletData WHERE key=?", (key,)).fetchall()
+
+        async def _test() -> List[Tuple[str]]:
+            await self.db_context.write(_write)
+            return await self.db_context.read(_read, "async-key")
+
+        assert asyncio.run(_test()) == [ ("[1]",) ]
+
+    @pytest.mark.timeout(5)
+    def test_write_failure_raised(self) -> None:
+        def _write(db) -> None:
+            raise ValueError("write failure")
+
+        async def _test() -> None:
+            await self.db_context.write(_write)
+
+        with pytest.raises(ValueError):
+            asyncio.run(_test())
+
+    @pytest.mark.timeout(5)
+    def test_async_completion_not_dispatched_to_thread_pool(self, monkeypatch) -> None:
+        dispatcher = self.db_context._write_dispatcher
+        def _submit(*args) -> None:
+            raise AssertionError("unexpected completion thread pool use")
+        monkeypatch.setattr(dispatcher._callback_thread_pool, "submit", _submit)
+
+        async def _test() -> None:
+            await self.db_context.write(lambda db: None)
+
+        asyncio.run(_test())
@@ -0,0 +1,269 @@
+"""
+Query plan regression tests for the wallet database.
+
+Every SQL statement defined on the `tables.py` table classes is explained against a seeded
+wallet database, and any statement that would scan an entire table fails the test unless it is
+a deliberate full read listed in `FULL_READS`. Statement constants that are only used as the
+base of a larger statement are explained in the forms the table code builds from them.
+
+There is deliberately no `ANALYZE` done on the seeded database, as wallets in the wild do not
+have statistics tables and the query planner should be judged on the schema alone.
+"""
+
+import os
+import re
+try:
+    # Linux expects the latest package version of 3.31.1 (as of p)
+    import pysqlite3 as sqlite3
+except ModuleNotFoundError:
+    # MacOS expects the latest brew version of 3.32.1 (as of 2020-07-10).
+    # Windows builds use the official Python 3.7.9 builds and version of 3.31.1.
+    import sqlite3 # type: ignore
+import tempfile
+from typing import Dict, List, Optional, Set, Tuple
+
+import pytest
+
+from electrumsv.constants import (DATABASE_EXT, DerivationType, KeyInstanceFlag, PaymentFlag,
+    ScriptType, TransactionOutputFlag, TxFlags, WalletEventFlag, WalletEventType)
+from electrumsv.wallet_database import migration, tables
+
+
+ACCOUNT_COUNT = 3
+KEYS_PER_ACCOUNT = 2000
+TRANSACTION_COUNT = 6000
+
+
+# Statements that are never executed as they are, and are instead used to build other
+# statements which are already checked in their own right.
+FRAGMENTS = {
+    "TransactionDeltaTable.CREATE_SQL_BASE",
+    "TransactionDeltaTable.READ_ACCOUNT_TXFILTERING_SQL_2",
+}
+
+# The forms the table code builds from the base statements. Each is checked in place of the
+# bare statement, which is additionally checked if it is a deliberate full read.
+COMPOSED_STATEMENTS: Dict[str, List[str]] = {
+    "WalletDataTable.READ_SQL": [
+        " WHERE key=?",
+        " WHERE key IN (?,?)",
+    ],
+    "TransactionTable.READ_MANY_BASE_SQL": [
+        " WHERE tx_hash IN (?,?)",
+        " WHERE (flags & ?) != 0 AND tx_hash IN (?,?)",
+        " INNER JOIN AccountTransactions ATX USING(tx_hash) WHERE ATX.account_id=?",
+        " INNER JOIN AccountTransactions ATX USING(tx_hash) WHERE ATX.account_id=? "
+            "AND (flags & ?) != 0",
+    ],
+    "TransactionTable.READ_METADATA_MANY_BASE_SQL": [
+        " WHERE tx_hash IN (?,?)",
+        " WHERE (flags & ?) != 0 AND tx_hash IN (?,?)",
+        " INNER JOIN AccountTransactions ATX USING(tx_hash) WHERE ATX.account_id=?",
+    ],
+    "TransactionTable.READ_DESCRIPTION_SQL": [
+        " AND tx_hash IN (?,?)",
+    ],
+    "TransactionTable.READ_PROOF_SQL": [
+        " WHERE tx_hash IN (?,?)",
+    ],
+    "KeyInstanceTable.READ_SQL": [
+        " WHERE keyinstance_id IN (?,?)",
+        " WHERE (flags & ?) != 0 AND keyinstance_id IN (?,?)",
+    ],
+    "TransactionOutputTable.READ_SQL": [
+        " WHERE keyinstance_id IN (?,?)",
+        " WHERE (flags & ?) != 0 AND keyinstance_id IN (?,?)",
+        " WHERE tx_hash=? AND tx_index=? OR tx_hash=? AND tx_index=?",
+    ],
+    "TransactionDeltaTable.READ_ACCOUNT_TXFILTERING_SQL_1": [
+        tables.TransactionDeltaTable.READ_ACCOUNT_TXFILTERING_SQL_2,
+        " WHERE (T.flags & ?) == ? "+ tables.TransactionDeltaTable.READ_ACCOUNT_TXFILTERING_SQL_2,
+    ],
+    "PaymentRequestTable.READ_ALL_SQL": [
+        " WHERE P.paymentrequest_id=?",
+        " WHERE P.keyinstance_id=?",
+    ],
+    "InvoiceTable.READ_ALL_SQL": [
+        " WHERE invoice_id=?",
+        " WHERE tx_hash=?",
+        " WHERE payment_uri=?",
+        " WHERE value=? AND payment_uri=?",
+    ],
+}
+
+# Statements that are intended to read all the rows in their table. These are either on tables
+# that stay small, or are done once when the wallet is loaded.
+FULL_READS: Dict[str, str] = {
+    "WalletDataTable.READ_SQL": "all the wallet data is read when the storage is opened",
+    "MasterKeyTable.READ_SQL": "all master keys are read when the wallet is loaded",
+    "AccountTable.READ_SQL": "all accounts are read when the wallet is loaded",
+    "TransactionTable.READ_METADATA_MANY_BASE_SQL":
+        "the transaction cache metadata is populated when the wallet is loaded",
+    "TransactionTable.READ_DESCRIPTION_SQL":
+        "the transaction descriptions are read when the wallet is loaded",
+    "TransactionDeltaTable.READ_ALL_SQL": "only used to dump the table contents",
+    "PaymentRequestTable.READ_ALL_SQL": "the flag filtered read of all payment requests",
+    "WalletEventTable.READ_ALL_SQL": "wallet events are shown in full in the notifications view",
+    "WalletEventTable.READ_ALL_MASK_SQL": "wallet events are shown in full in the notifications "
+        "view",
+}
+
+# Full reads of large tables that should not touch the table rows (and their overflow pages
+# of transaction data) at all.
+COVERING_READS = {
+    "TransactionTable.READ_METADATA_MANY_BASE_SQL",
+    "TransactionTable.READ_DESCRIPTION_SQL",
+    "TransactionDeltaTable.READ_ALL_SQL",
+}
+
+
+def _get_sql_constants() -> Dict[str, str]:
+    constants: Dict[str, str] = {}
+    for class_name, klass in sorted(vars(tables).items()):
+        if not isinstance(klass, type) or not issubclass(klass, tables.BaseWalletStore) or \
+                klass is tables.BaseWalletStore:
+            continue
+        for attr_name, value in vars(klass).items():
+            if attr_name.isupper() and attr_name != "LOGGER_NAME" and isinstance(value, str):
+                constants[f"{class_name}.{attr_name}"] = value
+    return constants
+
+
+def _prepare_statement(sql: str) -> str:
+    # Batched statements have their variables substituted in.
+    return sql.replace("{0}", "?,?").replace("{}", "?,?").replace("%d", "1")
+
+
+def _get_statements() -> List[Tuple[str, str]]:
+    statements: List[Tuple[str, str]] = []
+    for name, sql in _get_sql_constants().items():
+        if name in FRAGMENTS:
+            continue
+        if name in COMPOSED_STATEMENTS:
+            for suffix in COMPOSED_STATEMENTS[name]:
+                statements.append((name, _prepare_statement(sql + suffix)))
+            if name in FULL_READS:
+                statements.append((name, _prepare_statement(sql)))
+        else:
+            statements.append((name, _prepare_statement(sql)))
+    return statements
+
+
+STATEMENTS = _get_statements()
+
+
+def _seed_database(db: sqlite3.Connection) -> None:
+    timestamp = 1600000000
+    db.execute(tables.MasterKeyTable.CREATE_SQL,
+        (1, None, DerivationType.BIP32, b'master key', timestamp, timestamp))
+    db.executemany(tables.AccountTable.CREATE_SQL,
+        [ (account_id, 1, ScriptType.P2PKH, f"account {account_id}", timestamp, timestamp)
+        for account_id in range(1, ACCOUNT_COUNT+1) ])
+
+    key_rows = []
+    for account_id in range(1, ACCOUNT_COUNT+1):
+        for i in range(KEYS_PER_ACCOUNT):
+            keyinstance_id = (account_id - 1) * KEYS_PER_ACCOUNT + i + 1
+            key_rows.append((keyinstance_id, account_id, 1, DerivationType.BIP32,
+                b'derivation data %d' % i, ScriptType.P2PKH, KeyInstanceFlag.IS_ACTIVE, None,
+                timestamp, timestamp))
+    db.executemany(tables.KeyInstanceTable.CREATE_SQL, key_rows)
+    key_count = len(key_rows)
+
+    tx_rows = []
+    delta_rows = []
+    txo_rows = []
+    for i in range(TRANSACTION_COUNT):
+        tx_hash = os.urandom(32)
+        keyinstance_id = i % key_count + 1
+        description = f"description {i}" if i % 10 == 0 else None
+        tx_rows.append((tx_hash, os.urandom(1000), TxFlags.HasByteData | TxFlags.StateSettled,
+            100000 + i, 1, 100, description, timestamp, timestamp))
+        delta_rows.append((tx_hash, keyinstance_id, 1000, timestamp, timestamp))
+        txo_rows.append((tx_hash, 0, 1000, keyinstance_id,
+            TransactionOutputFlag.IS_SPENT if i % 2 else TransactionOutputFlag.NONE,
+            timestamp, timestamp))
+    db.executemany(tables.TransactionTable.CREATE_SQL, tx_rows)
+    db.executemany(tables.TransactionDeltaTable.CREATE_SQL, delta_rows)
+    db.executemany(tables.TransactionOutputTable.CREATE_SQL, txo_rows)
+
+    db.executemany(tables.PaymentRequestTable.CREATE_SQL,
+        [ (i, i, PaymentFlag.UNPAID, 1000, 3600, None, timestamp, timestamp)
+        for i in range(1, 201) ])
+    db.executemany(tables.InvoiceTable.CREATE_SQL,
+        [ ((i % ACCOUNT_COUNT) + 1, tx_rows[i][0], f"bitcoin:?r=https://x.com/{i}", None,
+            PaymentFlag.UNPAID, 1000, "{}", None, timestamp, timestamp)
+        for i in range(200) ])
+    db.executemany(tables.WalletEventTable.CREATE_SQL,
+        [ (i, WalletEventType.SEED_BACKUP_REMINDER, (i % ACCOUNT_COUNT) + 1,
+            WalletEventFlag.FEATURED | WalletEventFlag.UNREAD, timestamp + i, timestamp + i)
+        for i in range(1, 201) ])
+    db.commit()
+
+
+@pytest.fixture(scope="module")
+def seeded_db():
+    wallet_path = os.path.join(tempfile.mkdtemp(), "wallet_query_plans")
+    migration.create_database_file(wallet_path)
+    migration.update_database_file(wallet_path)
+    db = sqlite3.connect(wallet_path + DATABASE_EXT)
+    _seed_database(db)
+    yield db
+    db.close()
+
+
+def _get_query_plan(db: sqlite3.Connection, sql: str) -> List[str]:
+    cursor = db.execute("EXPLAIN QUERY PLAN "+ sql, [ None ] * sql.count("?"))
+    rows = cursor.fetchall()
+    cursor.close()
+    return [ row[3] for row in rows ]
+
+
+def _get_table_names(db: sqlite3.Connection) -> Set[str]:
+    cursor = db.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    rows = cursor.fetchall()
+    cursor.close()
+    return { row[0] for row in rows }
+
+
+def _get_scanned_table(db: sqlite3.Connection, detail: str, sql: str) -> Optional[str]:
+    match = re.match(r"SCAN (?:TABLE )?(\w+)", detail)
+    if match is None:
+        return None
+    aliases = { alias: name for name, alias in
+        re.findall(r"(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)", sql, re.IGNORECASE) }
+    # Scanning the results of a view or common table expression is fine, as the underlying
+    # table accesses are listed in the plan in their own right.
+    name = aliases.get(match.group(1), match.group(1))
+    if name not in _get_table_names(db):
+        return None
+    return name
+
+
+@pytest.mark.timeout(20)
+@pytest.mark.parametrize("name,sql", STATEMENTS)
+def test_query_plan_has_no_table_scans(seeded_db, name: str, sql: str) -> None:
+    plan = _get_query_plan(seeded_db, sql)
+    scanned_tables = [ table_name for table_name in
+        (_get_scanned_table(seeded_db, detail, sql) for detail in plan) if table_name is not None ]
+    if scanned_tables and sql == _prepare_statement(_get_sql_constants()[name]) and \
+            name in FULL_READS:
+        return
+    assert not scanned_tables, f"{name}: {plan}"
+
+
+@pytest.mark.timeout(20)
+@pytest.mark.parametrize("name", sorted(COVERING_READS))
+def test_full_reads_use_covering_index(seeded_db, name: str) -> None:
+    plan = _get_query_plan(seeded_db, _get_sql_constants()[name])
+    assert all("COVERING INDEX" in detail for detail in plan
+        if detail.startswith("SCAN")), f"{name}: {plan}"
+
+
+def test_statement_lists_are_current() -> None:
+    # Ensure that renamed or removed statements do not leave stale exceptions behind.
+    names = set(_get_sql_constants())
+    assert FRAGMENTS <= names
+    assert set(COMPOSED_STATEMENTS) <= names
+    assert set(FULL_READS) <= names
+    assert COVERING_READS <= set(FULL_READS)
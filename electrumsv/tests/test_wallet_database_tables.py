@@ -11,20 +11,23 @@ except ModuleNotFoundError:
     # Windows builds use the official Python 3.7.9 builds and version of 3.31.1.
     import sqlite3 # type: ignore
 import tempfile
-from typing import List
+import threading
+from typing import List, Optional
 
-from electrumsv.constants import (TxFlags, ScriptType, DerivationType, TransactionOutputFlag,
-    PaymentFlag, KeyInstanceFlag, WalletEventFlag, WalletEventType)
+from electrumsv.constants import (DATABASE_EXT, TxFlags, ScriptType, DerivationType,
+    TransactionOutputFlag, PaymentFlag, KeyInstanceFlag, WalletEventFlag, WalletEventType)
 from electrumsv.logs import logs
 from electrumsv.types import TxoKeyType
 from electrumsv.wallet_database import (migration, KeyInstanceTable, MasterKeyTable,
     PaymentRequestTable, TransactionTable, DatabaseContext, TransactionDeltaTable,
     TransactionOutputTable, SynchronousWriter, TxData, TxProof, AccountTable)
-from electrumsv.wallet_database.sqlite_support import LeakedSQLiteConnectionError
+from electrumsv.wallet_database.migrations import migration_0028_transaction_inputs
+from electrumsv.wallet_database.sqlite_support import (ConnectionPoolTimeoutError,
+    LeakedSQLiteConnectionError)
 from electrumsv.wallet_database.tables import (AccountRow, InvoiceAccountRow, InvoiceRow,
     InvoiceTable, KeyInstanceRow, MAGIC_UNTOUCHED_BYTEDATA, MasterKeyRow, PaymentRequestRow,
-    TransactionDeltaRow, TransactionDeltaKeySummaryRow, TransactionRow, TransactionOutputRow,
-    WalletEventTable, WalletEventRow)
+    TransactionDeltaRow, TransactionDeltaKeySummaryRow, TransactionInputRow, TransactionRow,
+    TransactionOutputRow, TransactionWriteBatch, WalletEventTable, WalletEventRow)
 
 
 logs.set_level("debug")
@@ -64,6 +67,23 @@ def test_migrations() -> None:
     migration.create_database_file(wallet_path)
 
 
+def test_migration_transaction_inputs() -> None:
+    wallet_path = os.path.join(tempfile.mkdtemp(), "wallet_create")
+    migration.create_database_file(wallet_path)
+    db = sqlite3.connect(wallet_path + DATABASE_EXT)
+    db.execute("DROP TABLE TransactionInputs")
+    tx = bitcoinx.Tx.from_hex(tx_hex_1)
+    db.executemany("INSERT INTO Transactions (tx_hash, tx_data, flags, date_created, "
+        "date_updated) VALUES (?, ?, 0, 1, 1)",
+        [ (tx.hash(), tx.to_bytes()), (os.urandom(32), None), (os.urandom(32), b'corrupt') ])
+
+    # The inputs of the existing transactions are added.
+    migration_0028_transaction_inputs.execute(db)
+    rows = db.execute("SELECT prev_hash, prev_idx, tx_hash FROM TransactionInputs").fetchall()
+    db.close()
+    assert rows == [ (tx.inputs[0].prev_hash, tx.inputs[0].prev_idx, tx.hash()) ]
+
+
 @pytest.mark.timeout(8)
 def test_database_context() -> None:
     db_context = _db_context()
@@ -71,17 +91,17 @@ def test_database_context() -> None:
     db_context._write_dispatcher._writer_loop_event.wait()
 
     # initial state
-    assert db_context._connection_pool.qsize() == 0
+    assert len(db_context._connection_pool) == 0
     assert len(db_context._active_connections) == 1  # for writer thread
 
     # should autoincrement additional connections as needed
     conn = db_context.acquire_connection()
-    assert db_context._connection_pool.qsize() == 0
+    assert len(db_context._connection_pool) == 0
     assert len(db_context._active_connections) == 2
 
     # return 1 connection to the pool
     db_context.release_connection(conn)
-    assert db_context._connection_pool.qsize() == 1
+    assert len(db_context._connection_pool) == 1
     assert len(db_context._active_connections) == 1
 
     # an exception is raised immediately on closing due to outstanding connections
@@ -89,7 +109,7 @@ def test_database_context() -> None:
     with pytest.raises(LeakedSQLiteConnectionError):
         db_context.close()
 
-    assert db_context._connection_pool.qsize() == 0
+    assert len(db_context._connection_pool) == 0
     assert len(db_context._active_connections) == 0
 
     # any further use of the outstanding connection raises an exception too
@@ -97,6 +117,49 @@ def test_database_context() -> None:
         conn.commit()
 
 
+@pytest.mark.timeout(8)
+def test_database_context_connection_limit(db_context: DatabaseContext, monkeypatch) -> None:
+    db_context._write_dispatcher._writer_loop_event.wait()
+    monkeypatch.setattr(db_context, "MAXIMUM_CONNECTION_COUNT", 2)
+    monkeypatch.setattr(db_context, "CONNECTION_WAIT_TIMEOUT", 0.1)
+
+    # The writer thread holds the first connection.
+    conn = db_context.acquire_connection()
+    with pytest.raises(ConnectionPoolTimeoutError):
+        db_context.acquire_connection()
+
+    # A waiting acquirer gets the released connection.
+    monkeypatch.setattr(db_context, "CONNECTION_WAIT_TIMEOUT", 5.0)
+    threading.Timer(0.1, db_context.release_connection, (conn,)).start()
+    assert db_context.acquire_connection() is conn
+    db_context.release_connection(conn)
+
+    statistics = db_context.get_pool_statistics()
+    assert statistics.connection_count == 2
+    assert statistics.created_count == 2
+    assert statistics.idle_count == 1
+    assert statistics.wait_count == 1
+
+
+@pytest.mark.timeout(8)
+def test_database_context_thread_affinity(db_context: DatabaseContext) -> None:
+    db_context._write_dispatcher._writer_loop_event.wait()
+
+    thread_conns = []
+    def _acquire() -> None:
+        thread_conns.append(db_context.acquire_connection())
+    thread = threading.Thread(target=_acquire)
+    thread.start()
+    thread.join()
+    conn = db_context.acquire_connection()
+
+    # The thread's connection is the most recently released, but this thread gets its own.
+    db_context.release_connection(conn)
+    db_context.release_connection(thread_conns[0])
+    assert db_context.acquire_connection() is conn
+    db_context.release_connection(conn)
+
+
 @pytest.mark.timeout(8)
 def test_table_masterkeys_crud(db_context: DatabaseContext) -> None:
     table = MasterKeyTable(db_context)
@@ -474,6 +537,7 @@ class TestTransactionTable:
 
     def setup_method(self):
         db = self.store._db
+        db.execute(f"DELETE FROM TransactionInputs")
         db.execute(f"DELETE FROM Transactions")
         db.commit()
 
@@ -678,6 +742,32 @@ class TestTransactionTable:
         get_hashes = self._get_store_hashes()
         assert 0 == len(get_hashes)
 
+    @pytest.mark.timeout(8)
+    def test_spending_transactions(self) -> None:
+        prev_hash = os.urandom(32)
+        metadata = TxData(height=1, fee=2, position=None, date_added=1, date_updated=1)
+        tx_hashes = [ os.urandom(32) for i in range(3) ]
+        with SynchronousWriter() as writer:
+            self.store.create([ (tx_hash, metadata, os.urandom(10), TxFlags.Unset, None)
+                    for tx_hash in tx_hashes ],
+                completion_callback=writer.get_callback(),
+                input_rows=[ TransactionInputRow(prev_hash, 0, tx_hashes[0]),
+                    TransactionInputRow(prev_hash, 1, tx_hashes[1]),
+                    TransactionInputRow(prev_hash, 1, tx_hashes[2]) ])
+            assert writer.succeeded()
+        assert sorted(self.store.read_spending_transactions(prev_hash)) == sorted([
+            (0, tx_hashes[0]), (1, tx_hashes[1]), (1, tx_hashes[2]) ])
+
+        # Clearing the data of a transaction forgets what it spends.
+        with SynchronousWriter() as writer:
+            self.store.update([ (tx_hashes[1], metadata, None, TxFlags.Unset) ],
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        with SynchronousWriter() as writer:
+            self.store.delete([ tx_hashes[2] ], completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        assert self.store.read_spending_transactions(prev_hash) == [ (0, tx_hashes[0]) ]
+
     @pytest.mark.timeout(8)
     def test_get_all_pending(self):
         get_tx_hashes = set([])
@@ -1259,6 +1349,82 @@ def test_table_transactiondeltas_crud(db_context: DatabaseContext) -> None:
     table.close()
 
 
+def test_transaction_write_batch(db_context: DatabaseContext) -> None:
+    TX_BYTES = os.urandom(10)
+    TX_HASH = bitcoinx.double_sha256(TX_BYTES)
+    ACCOUNT_ID = 10
+    MASTERKEY_ID = 20
+    TXOUT_FLAGS = TransactionOutputFlag.NONE
+
+    with TransactionTable(db_context) as transaction_table:
+        with SynchronousWriter() as writer:
+            transaction_table.create([ (TX_HASH, TxData(height=1, fee=2, position=None,
+                    date_added=1, date_updated=1), TX_BYTES,
+                    TxFlags.HasByteData|TxFlags.HasFee|TxFlags.HasHeight, None) ],
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+    with MasterKeyTable(db_context) as masterkey_table:
+        with SynchronousWriter() as writer:
+            masterkey_table.create([ (MASTERKEY_ID, None, 2, b'111') ],
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+    with AccountTable(db_context) as account_table:
+        with SynchronousWriter() as writer:
+            account_table.create([ (ACCOUNT_ID, MASTERKEY_ID, ScriptType.P2PKH, 'name') ],
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+    with KeyInstanceTable(db_context) as keyinstance_table:
+        with SynchronousWriter() as writer:
+            keyinstance_table.create([
+                (key_id, ACCOUNT_ID, MASTERKEY_ID, DerivationType.BIP32, bytes([ key_id ]),
+                    ScriptType.P2PKH, True, None) for key_id in (1, 2) ],
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+
+    batch = TransactionWriteBatch()
+    batch.add_outputs([ TransactionOutputRow(TX_HASH, 0, 100, 1, TXOUT_FLAGS),
+        TransactionOutputRow(TX_HASH, 1, 200, 2, TXOUT_FLAGS) ])
+    # The flags for a pending output are applied to the row that is inserted.
+    batch.add_output_flags([ (TransactionOutputFlag.IS_SPENT, TX_HASH, 1) ])
+    batch.add_value_deltas([ TransactionDeltaRow(TX_HASH, 1, 100),
+        TransactionDeltaRow(TX_HASH, 2, 200), TransactionDeltaRow(TX_HASH, 2, -50) ])
+    assert len(batch) == 4
+
+    callback_errors: List[Optional[Exception]] = []
+    batch.add_completion_callback(callback_errors.append)
+    with SynchronousWriter() as writer:
+        batch.write(db_context, writer.get_callback())
+        assert writer.succeeded()
+    assert callback_errors == [ None ]
+    assert len(batch) == 0
+
+    with TransactionOutputTable(db_context) as output_table:
+        assert sorted(output_table.read()) == [
+            TransactionOutputRow(TX_HASH, 0, 100, 1, TXOUT_FLAGS),
+            TransactionOutputRow(TX_HASH, 1, 200, 2, TransactionOutputFlag.IS_SPENT) ]
+    with TransactionDeltaTable(db_context) as delta_table:
+        assert sorted(delta_table.read()) == [ TransactionDeltaRow(TX_HASH, 1, 100),
+            TransactionDeltaRow(TX_HASH, 2, 150) ]
+
+    # Flags for outputs that were written earlier, and deltas relative to existing rows.
+    batch.add_output_flags([ (TransactionOutputFlag.IS_SPENT, TX_HASH, 0) ])
+    batch.add_value_deltas([ TransactionDeltaRow(TX_HASH, 1, -100) ])
+    with SynchronousWriter() as writer:
+        batch.write(db_context, writer.get_callback())
+        assert writer.succeeded()
+
+    with TransactionOutputTable(db_context) as output_table:
+        assert all(row.flags == TransactionOutputFlag.IS_SPENT for row in output_table.read())
+    with TransactionDeltaTable(db_context) as delta_table:
+        assert sorted(delta_table.read()) == [ TransactionDeltaRow(TX_HASH, 1, 0),
+            TransactionDeltaRow(TX_HASH, 2, 150) ]
+
+    # The completion callback is called even if there is nothing to write.
+    with SynchronousWriter() as writer:
+        batch.write(db_context, writer.get_callback())
+        assert writer.succeeded()
+
+
 @pytest.mark.timeout(8)
 def test_table_paymentrequests_crud(db_context: DatabaseContext) -> None:
     table = PaymentRequestTable(db_context)
@@ -25,7 +25,7 @@
 import enum
 from io import BytesIO
 import struct
-from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 import attr
 from bitcoinx import (
@@ -92,6 +92,8 @@ class TransactionContext:
     invoice_id: Optional[int] = attr.ib(default=None)
     description: Optional[str] = attr.ib(default=None)
     prev_txs: Dict[bytes, 'Transaction'] = attr.ib(default=attr.Factory(dict))
+    # Set while an account's keystores sign the transaction, for them to share.
+    signing_session: Optional['SigningSession'] = attr.ib(default=None)
 
 
 class XPublicKeyType(enum.IntEnum):
@@ -316,13 +318,9 @@ class XTxInput(TxInput):
 
     def estimated_size(self) -> int:
         '''Return an estimated of serialized input size in bytes.'''
-        saved_script_sig = self.script_sig
-        x_pubkeys = [x_pubkey.to_public_key() for x_pubkey in self.x_pubkeys]
-        signatures = [dummy_signature] * self.threshold
-        self.script_sig = create_script_sig(self.script_type, self.threshold, x_pubkeys, signatures)
-        size = self.size()
-        self.script_sig = saved_script_sig
-        return size
+        script_sig_size = estimated_script_sig_size(self.script_type, self.threshold,
+            self.x_pubkeys)
+        return 40 + varint_size(script_sig_size) + script_sig_size
 
     def size(self) -> int:
         return len(TxInput.to_bytes(self))
@@ -348,7 +346,7 @@ class XTxOutput(TxOutput):
     x_pubkeys: List[XPublicKey] = attr.ib(default=attr.Factory(list))
 
     def estimated_size(self) -> int:
-        return len(self.to_bytes())
+        return output_size(self)
 
     def __repr__(self):
         return (
@@ -357,6 +355,121 @@ class XTxOutput(TxOutput):
         )
 
 
+def varint_size(value: int) -> int:
+    '''The size in bytes of the value serialised as a varint.'''
+    if value < 253:
+        return 1
+    if value <= 0xffff:
+        return 3
+    if value <= 0xffffffff:
+        return 5
+    return 9
+
+
+def push_size(length: int) -> int:
+    '''The size in bytes of the script operation that pushes data of the given length, where
+    the data is more than one byte long.'''
+    if length < Ops.OP_PUSHDATA1:
+        return 1 + length
+    if length <= 0xff:
+        return 2 + length
+    if length <= 0xffff:
+        return 3 + length
+    return 5 + length
+
+
+def output_size(output: TxOutput) -> int:
+    '''The serialised size of the output in bytes.'''
+    script_size = len(output.script_pubkey.to_bytes())
+    return 8 + varint_size(script_size) + script_size
+
+
+def estimated_script_sig_size(script_type: ScriptType, threshold: int,
+        x_pubkeys: List[XPublicKey]) -> int:
+    '''
+    The size in bytes of the script signature of an input once it is signed, from the size
+    of each part of the script for its type. The public keys only need to be known to be
+    compressed or not, so unlike creating the script this does not derive them.
+    '''
+    signature_size = push_size(len(dummy_signature))
+    if script_type == ScriptType.P2PK:
+        return signature_size
+    elif script_type == ScriptType.P2PKH:
+        return signature_size + _public_key_push_size(x_pubkeys[0])
+    elif script_type == ScriptType.MULTISIG_BARE:
+        return 1 + threshold * signature_size
+    elif script_type == ScriptType.MULTISIG_P2SH:
+        nested_script_size = len(push_int(threshold)) + len(push_int(len(x_pubkeys))) + 1 + \
+            sum(_public_key_push_size(x_pubkey) for x_pubkey in x_pubkeys)
+        return 1 + threshold * signature_size + push_size(nested_script_size)
+    elif script_type == ScriptType.MULTISIG_ACCUMULATOR:
+        # The first keys are taken to be the ones that sign, and the rest are skipped.
+        return sum(signature_size + _public_key_push_size(x_pubkey) + 1
+            for x_pubkey in x_pubkeys[:threshold]) + len(x_pubkeys) - threshold
+    raise ValueError(f"unable to realize script {script_type}")
+
+
+def _public_key_push_size(x_pubkey: XPublicKey) -> int:
+    return push_size(33 if x_pubkey.is_compressed() else 65)
+
+
+class TxSizeEstimator:
+    '''
+    The estimated serialised size of a transaction, kept up to date as inputs and outputs are
+    added and removed. This avoids serialising the transaction to measure it, which is slow for
+    transactions with many inputs and outputs and for code that estimates the size repeatedly
+    as it builds a transaction, like coin selection.
+    '''
+
+    def __init__(self) -> None:
+        self.input_count = 0
+        self.inputs_size = 0
+        self.output_count = 0
+        self.outputs_size = 0
+
+    @classmethod
+    def from_transaction(cls, tx: Tx) -> 'TxSizeEstimator':
+        estimator = cls()
+        for txin in tx.inputs:
+            estimator.add_input(txin)
+        for output in tx.outputs:
+            estimator.add_output(output)
+        return estimator
+
+    def add_input(self, txin: XTxInput) -> None:
+        self.add_input_size(txin.estimated_size())
+
+    def remove_input(self, txin: XTxInput) -> None:
+        self.add_input_size(-txin.estimated_size(), -1)
+
+    def add_input_size(self, size: int, count: int=1) -> None:
+        '''Account for inputs whose total estimated size is already known.'''
+        self.input_count += count
+        self.inputs_size += size
+
+    def add_output(self, output: TxOutput) -> None:
+        self.add_output_size(output_size(output))
+
+    def remove_output(self, output: TxOutput) -> None:
+        self.add_output_size(-output_size(output), -1)
+
+    def add_output_size(self, size: int, count: int=1) -> None:
+        self.output_count += count
+        self.outputs_size += size
+
+    def size(self) -> int:
+        return self.size_with(0, 0)
+
+    def size_with(self, input_count: int, inputs_size: int, output_count: int=0,
+            outputs_size: int=0) -> int:
+        '''The size the transaction would be with the given inputs and outputs added.'''
+        input_count += self.input_count
+        output_count += self.output_count
+        # The version and locktime are four bytes each.
+        return 8 + varint_size(input_count) + self.inputs_size + inputs_size + \
+            varint_size(output_count) + self.outputs_size + outputs_size
+
+
 def _script_GetOp(_bytes):
     i = 0
     blen = len(_bytes)
@@ -597,13 +710,14 @@ class Transaction(Tx):
         if len(self.inputs) != len(signatures):
             raise RuntimeError('expected {} signatures; got {}'
                                .format(len(self.inputs), len(signatures)))
+        session = SigningSession(self)
         for txin, signature in zip(self.inputs, signatures):
             full_sig = signature + bytes([self.nHashType()])
             logger.warning(f'Signature: {full_sig.hex()}')
             if full_sig in txin.signatures:
                 continue
             pubkeys = [x_pubkey.to_public_key() for x_pubkey in txin.x_pubkeys]
-            pre_hash = self.preimage_hash(txin)
+            pre_hash = session.preimage_hash(txin)
             rec_sig_base = der_signature_to_compact(signature)
             for recid in range(4):
                 rec_sig = rec_sig_base + bytes([recid])
@@ -653,12 +767,8 @@ class Transaction(Tx):
         return 0x01 | cls.SIGHASH_FORKID
 
     def preimage_hash(self, txin):
-        input_index = self.inputs.index(txin)
-        script_code = self.get_preimage_script_bytes(txin)
-        sighash = SigHash(self.nHashType())
-        # Original BTC algorithm: https://en.bitcoin.it/wiki/OP_CHECKSIG
-        # Current algorithm: https://github.com/moneybutton/bips/blob/master/bip-0143.mediawiki
-        return self.signature_hash(input_index, txin.value, script_code, sighash=sighash)
+        '''Use a `SigningSession` instead when hashing more than one input.'''
+        return SigningSession(self).preimage_hash(txin)
 
     def serialize(self) -> str:
         return self.to_bytes().hex()
@@ -686,16 +796,7 @@ class Transaction(Tx):
 
     def estimated_size(self) -> int:
         '''Return an estimated tx size in bytes.'''
-        saved_inputs = self.inputs
-        # NOTE(typing) Trying to assign name "inputs" that is not in "__slots__" of type
-        #     "electrumsv.transaction.Transaction"
-        self.inputs: List[XTxInput] = [] # type: ignore
-        size_without_inputs = len(self.to_bytes())
-        # NOTE(typing) Trying to assign name "inputs" that is not in "__slots__" of type
-        #     "electrumsv.transaction.Transaction"
-        self.inputs = saved_inputs # type: ignore
-        input_size = sum(txin.estimated_size() for txin in self.inputs)
-        return size_without_inputs + input_size
+        return TxSizeEstimator.from_transaction(self).size()
 
     def signature_count(self) -> Tuple[int, int]:
         r = 0
@@ -706,23 +807,11 @@ class Transaction(Tx):
             r += txin.threshold
         return s, r
 
-    def sign(self, keypairs: Dict[XPublicKey, Tuple[bytes, bool]]) -> None:
-        assert all(isinstance(key, XPublicKey) for key in keypairs)
-        for txin in self.inputs:
-            if txin.is_complete():
-                continue
-            for j, x_pubkey in enumerate(txin.x_pubkeys):
-                if x_pubkey in keypairs:
-                    logger.debug("adding signature for %s", x_pubkey)
-                    sec, compressed = keypairs[x_pubkey]
-                    txin.signatures[j] = self._sign_txin(txin, sec)
-        logger.debug("is_complete %s", self.is_complete())
-
-    def _sign_txin(self, txin: XTxInput, privkey_bytes: bytes) -> bytes:
-        pre_hash = self.preimage_hash(txin)
-        privkey = PrivateKey(privkey_bytes)
-        sig = privkey.sign(pre_hash, None)
-        return sig + pack_byte(self.nHashType())
+    def sign(self, keypairs: Dict[XPublicKey, Tuple[bytes, bool]],
+            session: Optional['SigningSession']=None) -> None:
+        if session is None:
+            session = SigningSession(self)
+        session.sign(keypairs)
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Transaction':
@@ -797,3 +886,92 @@ class Transaction(Tx):
             return self.to_dict()
         raise NotImplementedError(f"unhanded format {format}")
 
+
+
+def _signature_hashes(tx: Transaction) -> Tuple[bytes, bytes, bytes]:
+    '''
+    The hashes of the prevouts, sequences and outputs that the preimage of every input commits to.
+
+    bitcoinX has no public API for these, so this is the one place its private `Tx` methods are
+    called. They are present in the bitcoinX version pinned in
+    `contrib/requirements/requirements-binaries.txt` and must be checked when that pin changes.
+    '''
+    return tx._hash_prevouts(), tx._hash_sequence(), tx._hash_outputs()
+
+
+class SigningSession:
+    '''
+    Signs the inputs of a transaction, doing the work that is the same for each input once.
+
+    The signature hash of each input is the hash of a preimage that only differs between the
+    inputs in the part for the input itself. The hashes of all the prevouts, sequences and
+    outputs that go into it are computed once for the session, where computing them for each
+    input made signing a transaction quadratic in its size. The script codes are also kept, for
+    the other keystores that sign. The public keys for the script codes are derived with
+    `derive_public_key` where given, so that the keystore that owns them can use its cached
+    parent keys, and from the extended public key otherwise.
+
+    The inputs and outputs of the transaction must not be changed while the session is used.
+    '''
+
+    def __init__(self, tx: Transaction,
+            derive_public_key: Optional[Callable[[XPublicKey], Optional[PublicKey]]]=None) -> None:
+        self.tx = tx
+        self._derive_public_key = derive_public_key
+        self._input_indexes = { id(txin): input_index
+            for input_index, txin in enumerate(tx.inputs) }
+        # Original BTC algorithm: https://en.bitcoin.it/wiki/OP_CHECKSIG
+        # Current algorithm: https://github.com/moneybutton/bips/blob/master/bip-0143.mediawiki
+        # This is SIGHASH_ALL, so all the inputs and outputs are committed to.
+        sighash = SigHash(tx.nHashType())
+        assert sighash.base == SigHash.ALL and not sighash.anyone_can_pay
+        hash_prevouts, hash_sequence, hash_outputs = _signature_hashes(tx)
+        self._preimage_prefix = b''.join((pack_le_int32(tx.version), hash_prevouts,
+            hash_sequence))
+        self._preimage_suffix = b''.join((hash_outputs, pack_le_uint32(tx.locktime),
+            pack_le_uint32(sighash)))
+        self._script_codes: Dict[int, bytes] = {}
+
+    def preimage_hash(self, txin: XTxInput) -> bytes:
+        input_index = self._input_indexes.get(id(txin))
+        if input_index is None:
+            # An equal input that is not the one in the transaction.
+            input_index = self.tx.inputs.index(txin)
+        script_code = self._script_codes.get(input_index)
+        if script_code is None:
+            script_code = self._script_codes[input_index] = self._get_script_code(txin)
+        return double_sha256(b''.join((self._preimage_prefix,
+            txin.to_bytes_for_signature(txin.value, script_code), self._preimage_suffix)))
+
+    def sign(self, keypairs: Dict[XPublicKey, Tuple[bytes, bool]]) -> None:
+        assert all(isinstance(key, XPublicKey) for key in keypairs)
+        for txin in self.tx.inputs:
+            if txin.is_complete():
+                continue
+            for j, x_pubkey in enumerate(txin.x_pubkeys):
+                if x_pubkey in keypairs:
+                    logger.debug("adding signature for %s", x_pubkey)
+                    sec, compressed = keypairs[x_pubkey]
+                    txin.signatures[j] = self.sign_input(txin, sec)
+        logger.debug("is_complete %s", self.tx.is_complete())
+
+    def sign_input(self, txin: XTxInput, privkey_bytes: bytes) -> bytes:
+        pre_hash = self.preimage_hash(txin)
+        privkey = PrivateKey(privkey_bytes)
+        sig = privkey.sign(pre_hash, None)
+        return sig + pack_byte(self.tx.nHashType())
+
+    def _get_script_code(self, txin: XTxInput) -> bytes:
+        script_type = txin.type()
+        if script_type == ScriptType.P2PKH:
+            return self._get_public_key(txin.x_pubkeys[0]).P2PKH_script().to_bytes()
+        elif script_type == ScriptType.P2PK:
+            return self._get_public_key(txin.x_pubkeys[0]).P2PK_script().to_bytes()
+        return Transaction.get_preimage_script_bytes(txin)
+
+    def _get_public_key(self, x_pubkey: XPublicKey) -> PublicKey:
+        if self._derive_public_key is not None:
+            public_key = self._derive_public_key(x_pubkey)
+            if public_key is not None:
+                return public_key
+        return x_pubkey.to_public_key()
@@ -25,6 +25,7 @@
 from collections import defaultdict
 from decimal import Decimal
 from datetime import datetime
+import functools
 import json
 import hmac
 import os
@@ -40,6 +41,7 @@ from typing import Any, cast, Dict, Iterable, List, Optional, Sequence, Tuple
 from bitcoinx import PublicKey, be_bytes_to_int
 
 from ..logs import logs
+from ..metrics import metrics
 from ..startup import package_dir
 from ..version import PACKAGE_DATE
 
@@ -191,17 +193,25 @@ def constant_time_compare(val1, val2):
     return hmac.compare_digest(to_bytes(val1, 'utf8'), to_bytes(val2, 'utf8'))
 
 
-# decorator that prints execution time
+function_time_metric = metrics.histogram("electrumsv_function_seconds",
+    "The time taken by calls to functions decorated with the profiler.", ("function",))
+
+
+# decorator that records execution time
 def profiler(func):
-    def do_profile(func, args, kw_args):
-        n = func.__name__
-        logger = logs.get_logger("profiler")
-        t0 = time.time()
-        o = func(*args, **kw_args)
-        t = time.time() - t0
-        logger.debug("%s %.4f", n, t)
-        return o
-    return lambda *args, **kw_args: do_profile(func, args, kw_args)
+    name = func.__qualname__
+    logger = logs.get_logger("profiler")
+
+    @functools.wraps(func)
+    def do_profile(*args, **kw_args):
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kw_args)
+        finally:
+            t = time.perf_counter() - t0
+            function_time_metric.observe(t, (name,))
+            logger.debug("%s %.4f", name, t)
+    return do_profile
 
 
 def android_ext_dir():
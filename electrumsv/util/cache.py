@@ -1,6 +1,6 @@
 import sys
 from threading import RLock
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, cast, Dict, List, NamedTuple, Optional, Tuple
 
 from .misc import obj_size
 from ..transaction import Transaction
@@ -11,7 +11,7 @@ class Node:
     previous: 'Node'
     next: 'Node'
     key: bytes
-    value: Transaction
+    value: Any
 
     def __init__(self, previous: Optional['Node']=None, next: Optional['Node']=None,
             key: bytes=b'', value=None,  value_size: int=0) -> None:
@@ -26,11 +26,21 @@ class Node:
         self.value_size = value_size
 
 
+class CacheStatistics(NamedTuple):
+    hits: int
+    misses: int
+    entry_count: int
+    current_size: int
+    maximum_size: int
+
+
 # Derived from functools.lrucache, LRUCache should be considered licensed under Python license.
 # This intentionally does not have a dictionary interface for now.
 class LRUCache:
-    def __init__(self, max_count: Optional[int]=None, max_size: Optional[int]=None) -> None:
+    def __init__(self, max_count: Optional[int]=None, max_size: Optional[int]=None,
+            sizeof: Callable[[Any], int]=obj_size) -> None:
         self._cache: Dict[bytes, Node] = {}
+        self._sizeof = sizeof
 
         assert max_count is not None or max_size is not None, "need some limit"
         if max_size is None:
@@ -47,16 +57,23 @@ class LRUCache:
         # This will be a node in a bi-directional circular linked list with itself as sole entry.
         self._root = Node()
 
-    def set_maximum_size(self, maximum_size: int, resize: bool=True) -> None:
+    def set_maximum_size(self, maximum_size: int, resize: bool=True) \
+            -> List[Tuple[bytes, Any]]:
         self._max_size = maximum_size
         if resize:
             with self._lock:
-                self._resize()
+                return self._resize()
+        return []
 
     def get_sizes(self) -> Tuple[int, int]:
         return (self.current_size, self._max_size)
 
-    def _add(self, key: bytes, value: Transaction, size: int) -> Node:
+    def get_statistics(self) -> CacheStatistics:
+        with self._lock:
+            return CacheStatistics(self.hits, self.misses, len(self._cache), self.current_size,
+                self._max_size)
+
+    def _add(self, key: bytes, value: Any, size: int) -> Node:
         most_recent_node = self._root.previous
         new_node = Node(most_recent_node, self._root, key, value, size)
         most_recent_node.next = self._root.previous = self._cache[key] = new_node
@@ -69,10 +86,14 @@ class LRUCache:
     def __contains__(self, key: bytes) -> bool:
         return key in self._cache
 
-    def set(self, key: bytes, value: Optional[Transaction]) -> Tuple[bool, List[Tuple[
-            bytes, Transaction]]]:
+    def set(self, key: bytes, value: Optional[Any], size: Optional[int]=None) \
+            -> Tuple[bool, List[Tuple[bytes, Any]]]:
+        """
+        Add, replace or with a value of `None` remove the entry for the given key. The size of
+        the value is worked out with the `sizeof` function unless the caller provides it.
+        """
         added = False
-        removals: List[Tuple[bytes, Transaction]] = []
+        removals: List[Tuple[bytes, Any]] = []
         with self._lock:
             node = self._cache.get(key, None)
             if node is not None:
@@ -86,8 +107,11 @@ class LRUCache:
                 del self._cache[key]
                 removals.append((key, old_value))
 
-            size = obj_size(value)
-            if value is not None and size <= self._max_size:
+            if value is None:
+                return added, removals
+            if size is None:
+                size = self._sizeof(value)
+            if size <= self._max_size:
                 added_node = self._add(key, value, size)
                 a, b, c, d = len(self._cache)-1, self._max_count, self.current_size, self._max_size
                 resize_removals = self._resize()
@@ -98,7 +122,7 @@ class LRUCache:
 
         return added, removals
 
-    def get(self, key: bytes) -> Optional[Transaction]:
+    def get(self, key: bytes) -> Optional[Any]:
         with self._lock:
             node = self._cache.get(key)
             if node is not None:
@@ -114,7 +138,7 @@ class LRUCache:
             self.misses += 1
         return None
 
-    def _resize(self) -> List[Tuple[bytes, Transaction]]:
+    def _resize(self) -> List[Tuple[bytes, Any]]:
         removals = []
         # Discount the root node when considering count.
         while len(self._cache) > self._max_count or self.current_size > self._max_size:
@@ -127,3 +151,95 @@ class LRUCache:
             del self._cache[discard_key]
             removals.append((discard_key, discard_value))
         return removals
+
+
+class TransactionDataCache:
+    """
+    A cache of serialised transactions, where each is charged the exact length of its bytes
+    against the size limit. Parsed transactions are only created when they are accessed, and
+    the most recently accessed are kept in a smaller hot tier limited by count.
+
+    This has the subset of the `LRUCache` interface that the transaction cache uses.
+    """
+
+    # The maximum number of parsed transactions kept in the hot tier.
+    HOT_TRANSACTION_COUNT = 500
+
+    def __init__(self, max_size: int, hot_count: Optional[int]=None) -> None:
+        self._lock = RLock()
+        self._bytedata_cache = LRUCache(max_size=max_size, sizeof=len)
+        self._transaction_cache = LRUCache(max_count=hot_count if hot_count is not None
+            else self.HOT_TRANSACTION_COUNT)
+
+    @property
+    def hits(self) -> int:
+        return self._bytedata_cache.hits
+
+    @property
+    def misses(self) -> int:
+        return self._bytedata_cache.misses
+
+    @property
+    def current_size(self) -> int:
+        return self._bytedata_cache.current_size
+
+    def set_maximum_size(self, maximum_size: int, resize: bool=True) -> None:
+        with self._lock:
+            for key, _value in self._bytedata_cache.set_maximum_size(maximum_size, resize):
+                self._transaction_cache.set(key, None)
+
+    def get_sizes(self) -> Tuple[int, int]:
+        return self._bytedata_cache.get_sizes()
+
+    def get_statistics(self) -> CacheStatistics:
+        return self._bytedata_cache.get_statistics()
+
+    def __len__(self) -> int:
+        return len(self._bytedata_cache)
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self._bytedata_cache
+
+    def set(self, key: bytes, value: Optional[Transaction], bytedata: Optional[bytes]=None) \
+            -> Tuple[bool, List[Tuple[bytes, bytes]]]:
+        """
+        Add, replace or with a value of `None` remove the given transaction. The caller should
+        provide the serialised form of the transaction if it already has it.
+        """
+        if value is not None and bytedata is None:
+            bytedata = value.to_bytes()
+        with self._lock:
+            added, removals = self._set_bytes(key, bytedata)
+            if added:
+                self._transaction_cache.set(key, value, len(cast(bytes, bytedata)))
+            return added, removals
+
+    def set_bytes(self, key: bytes, bytedata: Optional[bytes]) \
+            -> Tuple[bool, List[Tuple[bytes, bytes]]]:
+        """
+        Add, replace or with a value of `None` remove the given serialised transaction. It will
+        not be parsed until it is accessed.
+        """
+        with self._lock:
+            return self._set_bytes(key, bytedata)
+
+    def _set_bytes(self, key: bytes, bytedata: Optional[bytes]) \
+            -> Tuple[bool, List[Tuple[bytes, bytes]]]:
+        added, removals = self._bytedata_cache.set(key, bytedata)
+        for removed_key, _value in removals:
+            self._transaction_cache.set(removed_key, None)
+        return added, removals
+
+    def get(self, key: bytes) -> Optional[Transaction]:
+        with self._lock:
+            bytedata = self._bytedata_cache.get(key)
+            if bytedata is None:
+                return None
+            tx = self._transaction_cache.get(key)
+            if tx is None:
+                tx = Transaction.from_bytes(bytedata)
+                self._transaction_cache.set(key, tx, len(bytedata))
+            return tx
+
+    def get_bytes(self, key: bytes) -> Optional[bytes]:
+        return self._bytedata_cache.get(key)
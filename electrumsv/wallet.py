@@ -27,16 +27,21 @@
 #   - StandardAccount: one keystore, P2PKH
 #   - MultisigAccount: several keystores, P2SH
 
+import array
+import base64
+import bisect
 from collections import defaultdict
+from contextlib import ExitStack
 from datetime import datetime
 from functools import partial
 import itertools
 import json
 import os
 import random
+import sys
 import threading
 import time
-from typing import (Any, cast, Dict, Iterable, List, NamedTuple, Optional, Sequence,
+from typing import (Any, Callable, cast, Dict, Iterable, List, NamedTuple, Optional, Sequence,
     Set, Tuple, TypeVar, TYPE_CHECKING, Union)
 import weakref
 
@@ -49,9 +54,9 @@ from . import coinchooser
 from .app_state import app_state
 from .bitcoin import compose_chain_string, COINBASE_MATURITY, ScriptTemplate
 from .constants import (AccountType, CHANGE_SUBPATH, DEFAULT_TXDATA_CACHE_SIZE_MB, DerivationType,
-    KeyInstanceFlag, KeystoreTextType, MAXIMUM_TXDATA_CACHE_SIZE_MB, MINIMUM_TXDATA_CACHE_SIZE_MB,
-    RECEIVING_SUBPATH, ScriptType, TransactionOutputFlag, TxFlags, WalletEventFlag,
-    WalletEventType, WalletSettings)
+    HISTORY_PAGE_SIZE, KeyInstanceFlag, KeystoreTextType, MAXIMUM_TXDATA_CACHE_SIZE_MB,
+    MINIMUM_TXDATA_CACHE_SIZE_MB, RECEIVING_SUBPATH, ScriptType, TransactionOutputFlag, TxFlags,
+    WalletEventFlag, WalletEventType, WalletSettings)
 from .contacts import Contacts
 from .crypto import pw_encode, sha256
 from .exceptions import (ExcessiveFee, NotEnoughFunds, PreviousTransactionsMissingException,
@@ -66,19 +71,21 @@ from .script import AccumulatorMultiSigOutput
 from .services import InvoiceService, KeyService, RequestService
 from .simple_config import SimpleConfig
 from .storage import WalletStorage
-from .transaction import (Transaction, TransactionContext, TxSerialisationFormat, NO_SIGNATURE,
-    XPublicKey, XPublicKeyType, XTxInput, XTxOutput)
+from .transaction import (SigningSession, Transaction, TransactionContext, TxSerialisationFormat,
+    NO_SIGNATURE, XPublicKey, XPublicKeyType, XTxInput, XTxOutput)
 from .types import TxoKeyType, WaitingUpdateCallback
 from .util import (format_satoshis, get_wallet_name_from_path, profiler, timestamp_to_datetime,
     TriggeredCallbacks)
-from .wallet_database import TxData, TxProof, TransactionCacheEntry, TransactionCache
+from .util.cache import CacheStatistics
+from .wallet_database import (TxData, TxProof, TransactionCacheEntry, TransactionCache,
+    TransactionWriteBatch)
 from .wallet_database.tables import (AccountRow, AccountTable, InvoiceTable,
     KeyInstanceRow, KeyInstanceTable, MasterKeyRow, MasterKeyTable, TransactionTable,
     TransactionOutputTable, TransactionOutputRow, TransactionDeltaTable, TransactionDeltaRow,
     TransactionDeltaSumRow, PaymentRequestTable, PaymentRequestRow, WalletEventRow,
     WalletEventTable)
-from .wallet_database.sqlite_support import CompletionCallbackType, DatabaseContext, \
-    SynchronousWriter
+from .wallet_database.sqlite_support import AsyncCompletion, CompletionCallbackType, \
+    DatabaseContext, SynchronousWriter
 
 if TYPE_CHECKING:
     from .network import Network
@@ -102,8 +109,11 @@ class BIP32KeyData:
     script_pubkey: bytes
 
 
+HistorySortKey = Tuple[Union[int, float], Optional[int]]
+
+
 class HistoryLine(NamedTuple):
-    sort_key: Tuple[int, int]
+    sort_key: HistorySortKey
     tx_hash: bytes
     tx_flags: TxFlags
     height: Optional[int]
@@ -113,15 +123,37 @@ class HistoryLine(NamedTuple):
 @attr.s(slots=True, hash=False)
 class UTXO:
     value = attr.ib()
-    script_pubkey = attr.ib()
+    _script_pubkey = attr.ib()
     script_type: ScriptType = attr.ib()
     tx_hash: bytes = attr.ib()
     out_index: int = attr.ib()
     keyinstance_id: int = attr.ib()
-    address = attr.ib()
+    _address = attr.ib()
     # To determine if matured and spendable
     is_coinbase = attr.ib()
     flags: TransactionOutputFlag = attr.ib()
+    # If provided the script and address are derived on first access, rather than when the
+    # coin is loaded. It is passed the key id and returns the script and optional address.
+    _script_loader: Optional[Callable[[int], Tuple[Script, Optional[ScriptTemplate]]]] = \
+        attr.ib(default=None, repr=False)
+
+    @property
+    def script_pubkey(self) -> Script:
+        if self._script_loader is not None:
+            self._load_script()
+        return self._script_pubkey
+
+    @property
+    def address(self) -> Optional[ScriptTemplate]:
+        if self._script_loader is not None:
+            self._load_script()
+        return self._address
+
+    def _load_script(self) -> None:
+        script_loader = self._script_loader
+        if script_loader is not None:
+            self._script_pubkey, self._address = script_loader(self.keyinstance_id)
+            self._script_loader = None
 
     def __eq__(self, other):
         return isinstance(other, UTXO) and self.key() == other.key()
@@ -154,39 +186,461 @@ class UTXO:
 
 
 class SyncState:
+    """
+    The server-provided history of each key, and which keys each transaction is linked to.
+
+    There can be millions of links between keys and transactions, so this avoids holding a
+    Python object for each. Transaction hashes are interned as integer ids, the history of each
+    key is held as one array of interleaved transaction ids and heights, and a transaction
+    linked to a single key (the common case) refers to it directly rather than through a
+    container.
+    """
+
     def __init__(self) -> None:
-        self._key_history: Dict[int, List[Tuple[str, int]]] = {}
-        self._tx_keys: Dict[str, Set[int]] = {}
+        # Interned transaction ids are indexes into `_tx_hashes`, and are reused once they are
+        # no longer linked to any key.
+        self._tx_hashes: List[Optional[bytes]] = []
+        self._tx_numbers: Dict[bytes, int] = {}
+        self._free_tx_numbers: List[int] = []
+        # key_id -> [ transaction id, height, transaction id, height, ... ]
+        self._key_history: Dict[int, array.array] = {}
+        # transaction id -> key id, or the array of key ids if there is more than one.
+        self._tx_keys: Dict[int, Union[int, array.array]] = {}
+
+    def _intern(self, tx_hash: bytes) -> int:
+        tx_number = self._tx_numbers.get(tx_hash)
+        if tx_number is None:
+            if self._free_tx_numbers:
+                tx_number = self._free_tx_numbers.pop()
+                self._tx_hashes[tx_number] = tx_hash
+            else:
+                tx_number = len(self._tx_hashes)
+                self._tx_hashes.append(tx_hash)
+            self._tx_numbers[tx_hash] = tx_number
+        return tx_number
+
+    def _release(self, tx_number: int) -> None:
+        tx_hash = cast(bytes, self._tx_hashes[tx_number])
+        del self._tx_numbers[tx_hash]
+        self._tx_hashes[tx_number] = None
+        self._free_tx_numbers.append(tx_number)
 
     def get_key_history(self, key_id: int) -> List[Tuple[str, int]]:
-        return self._key_history.get(key_id, [])
+        "The history of the key in the form the server provides it, with hex transaction ids."
+        return [ (hash_to_hex_str(tx_hash), height)
+            for (tx_hash, height) in self.get_key_history_hashes(key_id) ]
+
+    def get_key_history_hashes(self, key_id: int) -> List[Tuple[bytes, int]]:
+        entry = self._key_history.get(key_id)
+        if entry is None:
+            return []
+        tx_hashes = self._tx_hashes
+        return [ (cast(bytes, tx_hashes[tx_number]), height)
+            for (tx_number, height) in zip(entry[0::2], entry[1::2]) ]
 
     def set_key_history(self, key_id: int, history: List[Tuple[str, int]]) \
-            -> Tuple[Set[str], Set[str]]:
-        old_history = self._key_history.get(key_id, [])
-        self._key_history[key_id] = history
+            -> Tuple[Set[bytes], Set[bytes]]:
+        "Set the history of the key from the server-provided form, with hex transaction ids."
+        return self.set_key_history_hashes(key_id,
+            [ (hex_str_to_hash(tx_id), height) for (tx_id, height) in history ])
+
+    def set_key_history_hashes(self, key_id: int, history: List[Tuple[bytes, int]]) \
+            -> Tuple[Set[bytes], Set[bytes]]:
+        "Returns the hashes of the transactions that are removed from and added to the key."
+        old_entry = self._key_history.get(key_id)
+        old_tx_numbers = set(old_entry[0::2]) if old_entry is not None else set()
+
+        new_entry = array.array('i')
+        for tx_hash, height in history:
+            new_entry.append(self._intern(tx_hash))
+            new_entry.append(height)
+        new_tx_numbers = new_entry[0::2]
+        if len(history):
+            self._key_history[key_id] = new_entry
+        elif old_entry is not None:
+            del self._key_history[key_id]
+
+        removed_tx_numbers = old_tx_numbers.difference(new_tx_numbers)
+        added_tx_numbers = set(new_tx_numbers) - old_tx_numbers
+        added_tx_hashes = set(cast(bytes, self._tx_hashes[n]) for n in added_tx_numbers)
+        removed_tx_hashes = set(cast(bytes, self._tx_hashes[n]) for n in removed_tx_numbers)
+
+        for tx_number in removed_tx_numbers:
+            key_ids = self._tx_keys[tx_number]
+            if isinstance(key_ids, int):
+                del self._tx_keys[tx_number]
+                self._release(tx_number)
+            else:
+                key_ids.remove(key_id)
+                if len(key_ids) == 1:
+                    self._tx_keys[tx_number] = key_ids[0]
+
+        for tx_number in added_tx_numbers:
+            existing_key_ids = self._tx_keys.get(tx_number)
+            if existing_key_ids is None:
+                self._tx_keys[tx_number] = key_id
+            elif isinstance(existing_key_ids, int):
+                self._tx_keys[tx_number] = array.array('q', (existing_key_ids, key_id))
+            else:
+                existing_key_ids.append(key_id)
+
+        return removed_tx_hashes, added_tx_hashes
 
-        old_tx_ids = set(t[0] for t in old_history)
-        new_tx_ids = set(t[0] for t in history)
+    def get_transaction_key_ids(self, tx_hash: bytes) -> Set[int]:
+        tx_number = self._tx_numbers.get(tx_hash)
+        if tx_number is None:
+            return set()
+        key_ids = self._tx_keys[tx_number]
+        if isinstance(key_ids, int):
+            return { key_ids }
+        return set(key_ids)
+
+    def get_transaction_hashes(self) -> List[bytes]:
+        return list(self._tx_numbers)
+
+    def get_memory_report(self) -> Dict[str, int]:
+        "The number of each kind of entry held and the approximate bytes used to hold them."
+        history_size = sum(sys.getsizeof(entry) for entry in self._key_history.values())
+        tx_keys_size = sum(sys.getsizeof(key_ids) for key_ids in self._tx_keys.values()
+            if not isinstance(key_ids, int))
+        transaction_count = len(self._tx_numbers)
+        return {
+            "key_count": len(self._key_history),
+            "link_count": sum(len(entry) // 2 for entry in self._key_history.values()),
+            "transaction_count": transaction_count,
+            "history_bytes": sys.getsizeof(self._key_history) + history_size,
+            "transaction_bytes": sys.getsizeof(self._tx_hashes) +
+                sys.getsizeof(self._tx_numbers) + sys.getsizeof(self._tx_keys) +
+                transaction_count * sys.getsizeof(bytes(32)) + tx_keys_size,
+        }
 
-        removed_tx_ids = old_tx_ids - new_tx_ids
-        added_tx_ids = new_tx_ids - old_tx_ids
 
-        for tx_id in removed_tx_ids:
-            self._tx_keys[tx_id].remove(key_id)
+def history_sort_key(metadata: TxData) -> Optional[HistorySortKey]:
+    "The ordering of a transaction in the account history, or `None` if it is excluded."
+    # Signed but not cleared.
+    if metadata.height is None:
+        return None
+    height, position = metadata.height, metadata.position
+    if position is not None:
+        return height, position
+    elif height > 0:
+        return height, metadata.date_added
+    return 1e9, metadata.date_added
 
-        for tx_id in added_tx_ids:
-            if tx_id not in self._tx_keys:
-                self._tx_keys[tx_id] = set()
-            self._tx_keys[tx_id].add(key_id)
 
-        return removed_tx_ids, added_tx_ids
+class HistoryCursor(NamedTuple):
+    "The position of the last entry on a history page and the balance before it was applied."
+    sort_key: HistorySortKey
+    tx_hash: bytes
+    balance: int
 
-    def get_transaction_key_ids(self, tx_id: str) -> Set[int]:
-        tx_keys = self._tx_keys.get(tx_id)
-        if tx_keys is None:
-            return set()
-        return tx_keys
+    def encode(self) -> str:
+        data = [ self.sort_key[0], self.sort_key[1], hash_to_hex_str(self.tx_hash),
+            self.balance ]
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    @classmethod
+    def decode(klass, text: str) -> 'HistoryCursor':
+        "Raises `ValueError` if the text is not a valid cursor."
+        try:
+            height, position, tx_id, balance = json.loads(base64.urlsafe_b64decode(text))
+            tx_hash = hex_str_to_hash(tx_id)
+        except (TypeError, ValueError) as e:
+            raise ValueError("invalid history cursor") from e
+        if not all(isinstance(v, (int, float)) for v in (height, position)) or \
+                not isinstance(balance, int) or len(tx_hash) != 32:
+            raise ValueError("invalid history cursor")
+        return klass((height, position), tx_hash, balance)
+
+
+class HistoryIndex:
+    """
+    The history of an account in sorted order, with the combined value delta of each
+    transaction. It is loaded with the account and then kept up to date as transaction deltas
+    are written and transaction heights change. This means the most recent history and the
+    running balance can be read without reading and sorting the whole history.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._value_deltas: Dict[bytes, int] = {}
+        self._sort_keys: Dict[bytes, HistorySortKey] = {}
+        # In ascending order, with the transaction hash to make the entries unique.
+        self._ordered: List[Tuple[HistorySortKey, bytes]] = []
+        self._balance = 0
+
+    def load(self, value_deltas: Dict[bytes, int],
+            get_metadata: Callable[[bytes], Optional[TxData]]) -> None:
+        with self._lock:
+            self._value_deltas = dict(value_deltas)
+            self._sort_keys.clear()
+            self._ordered.clear()
+            self._balance = 0
+            for tx_hash, value_delta in self._value_deltas.items():
+                metadata = get_metadata(tx_hash)
+                sort_key = history_sort_key(metadata) if metadata is not None else None
+                if sort_key is not None:
+                    self._sort_keys[tx_hash] = sort_key
+                    self._ordered.append((sort_key, tx_hash))
+                    self._balance += value_delta
+            self._ordered.sort()
+
+    def apply_value_deltas(self, value_deltas: Dict[bytes, int],
+            get_metadata: Callable[[bytes], Optional[TxData]]) -> None:
+        with self._lock:
+            for tx_hash, value_delta in value_deltas.items():
+                if tx_hash in self._value_deltas:
+                    self._value_deltas[tx_hash] += value_delta
+                    if tx_hash in self._sort_keys:
+                        self._balance += value_delta
+                else:
+                    self._value_deltas[tx_hash] = value_delta
+                    self._insert(tx_hash, get_metadata(tx_hash))
+
+    def update_metadata(self, tx_hash: bytes, metadata: Optional[TxData]) -> None:
+        "Reposition the transaction, or remove it if it has been deleted."
+        with self._lock:
+            if tx_hash not in self._value_deltas:
+                return
+            if metadata is None:
+                self.remove(tx_hash)
+                return
+            if history_sort_key(metadata) != self._sort_keys.get(tx_hash):
+                self._delete(tx_hash)
+                self._insert(tx_hash, metadata)
+
+    def remove(self, tx_hash: bytes) -> None:
+        with self._lock:
+            if tx_hash in self._value_deltas:
+                self._delete(tx_hash)
+                del self._value_deltas[tx_hash]
+
+    def _insert(self, tx_hash: bytes, metadata: Optional[TxData]) -> None:
+        sort_key = history_sort_key(metadata) if metadata is not None else None
+        if sort_key is not None:
+            self._sort_keys[tx_hash] = sort_key
+            bisect.insort(self._ordered, (sort_key, tx_hash))
+            self._balance += self._value_deltas[tx_hash]
+
+    def _delete(self, tx_hash: bytes) -> None:
+        sort_key = self._sort_keys.pop(tx_hash, None)
+        if sort_key is not None:
+            index = bisect.bisect_left(self._ordered, (sort_key, tx_hash))
+            del self._ordered[index]
+            self._balance -= self._value_deltas[tx_hash]
+
+    def get_balance(self) -> int:
+        return self._balance
+
+    def get_count(self) -> int:
+        return len(self._ordered)
+
+    def read(self, limit: Optional[int]=None, cursor: Optional[HistoryCursor]=None) \
+            -> List[Tuple[HistorySortKey, bytes, int, int]]:
+        """
+        Get the most recent entries first, with the balance after each was applied. If a cursor
+        is given, the entries are those that precede it and the balances continue on from the
+        balance it carries.
+        """
+        results: List[Tuple[HistorySortKey, bytes, int, int]] = []
+        with self._lock:
+            if cursor is None:
+                balance = self._balance
+                index = len(self._ordered)
+            else:
+                balance = cursor.balance
+                index = bisect.bisect_left(self._ordered, (cursor.sort_key, cursor.tx_hash))
+            stop_index = 0 if limit is None else max(0, index - limit)
+            while index > stop_index:
+                index -= 1
+                sort_key, tx_hash = self._ordered[index]
+                value_delta = self._value_deltas[tx_hash]
+                results.append((sort_key, tx_hash, value_delta, balance))
+                balance -= value_delta
+        return results
+
+
+class BalanceIndex:
+    """
+    The totals of the unspent outputs of an account by confirmation state, kept up to date as
+    outputs are added and spent and as the heights of their transactions change. Coinbase
+    outputs are totalled when the balance is requested, as their maturity depends on the
+    current height. This must be used with the account's UTXO lock held.
+    """
+
+    def __init__(self) -> None:
+        self._tx_values: Dict[bytes, int] = {}
+        self._tx_counts: Dict[bytes, int] = {}
+        self._confirmed_tx_hashes: Set[bytes] = set()
+        self._confirmed_value = 0
+        self._unconfirmed_value = 0
+        self._coinbase_utxos: Dict[TxoKeyType, int] = {}
+
+    def add_utxo(self, utxo: 'UTXO', height: Optional[int]) -> None:
+        if utxo.is_coinbase:
+            self._coinbase_utxos[utxo.key()] = utxo.value
+            return
+        tx_hash = utxo.tx_hash
+        if tx_hash in self._tx_values:
+            self._tx_values[tx_hash] += utxo.value
+            self._tx_counts[tx_hash] += 1
+        else:
+            self._tx_values[tx_hash] = utxo.value
+            self._tx_counts[tx_hash] = 1
+            if height is not None and height > 0:
+                self._confirmed_tx_hashes.add(tx_hash)
+        if tx_hash in self._confirmed_tx_hashes:
+            self._confirmed_value += utxo.value
+        else:
+            self._unconfirmed_value += utxo.value
+
+    def remove_utxo(self, utxo: 'UTXO') -> None:
+        if utxo.is_coinbase:
+            del self._coinbase_utxos[utxo.key()]
+            return
+        tx_hash = utxo.tx_hash
+        if tx_hash in self._confirmed_tx_hashes:
+            self._confirmed_value -= utxo.value
+        else:
+            self._unconfirmed_value -= utxo.value
+        self._tx_values[tx_hash] -= utxo.value
+        self._tx_counts[tx_hash] -= 1
+        if self._tx_counts[tx_hash] == 0:
+            del self._tx_values[tx_hash]
+            del self._tx_counts[tx_hash]
+            self._confirmed_tx_hashes.discard(tx_hash)
+
+    def update_height(self, tx_hash: bytes, height: Optional[int]) -> None:
+        value = self._tx_values.get(tx_hash)
+        if value is None:
+            return
+        is_confirmed = height is not None and height > 0
+        if is_confirmed == (tx_hash in self._confirmed_tx_hashes):
+            return
+        if is_confirmed:
+            self._confirmed_tx_hashes.add(tx_hash)
+            self._confirmed_value += value
+            self._unconfirmed_value -= value
+        else:
+            self._confirmed_tx_hashes.remove(tx_hash)
+            self._confirmed_value -= value
+            self._unconfirmed_value += value
+
+    def get_balance(self, local_height: int,
+            get_height: Callable[[bytes], Optional[int]]) -> Tuple[int, int, int]:
+        c, u, x = self._confirmed_value, self._unconfirmed_value, 0
+        for txo_key, value in self._coinbase_utxos.items():
+            height = get_height(txo_key.tx_hash) or 0
+            if height + COINBASE_MATURITY > local_height:
+                x += value
+            elif height > 0:
+                c += value
+            else:
+                u += value
+        return c, u, x
+
+
+class CoinValueIndex:
+    """
+    The unspent outputs of an account ordered by value, for the branch and bound coin chooser
+    to select from without sorting them for every transaction. Outputs of the same value are
+    in the order they were added, as they are in the account. Outputs are inserted and removed
+    in place as they are added and spent, and the running totals of their values are rebuilt
+    on the next selection after a change. This must be used with the account's UTXO lock held.
+    """
+
+    def __init__(self, utxos: Iterable['UTXO']) -> None:
+        self._coins, self._values, totals = coinchooser.coins_by_value(utxos)
+        self._totals: Optional[List[int]] = totals
+
+    def add_utxo(self, utxo: 'UTXO') -> None:
+        index = bisect.bisect_right(self._values, utxo.value)
+        self._coins.insert(index, utxo)
+        self._values.insert(index, utxo.value)
+        self._totals = None
+
+    def remove_utxo(self, utxo: 'UTXO') -> None:
+        # The coin is found by identity among those of the same value.
+        index = self._coins.index(utxo, bisect.bisect_left(self._values, utxo.value),
+            bisect.bisect_right(self._values, utxo.value))
+        del self._coins[index]
+        del self._values[index]
+        self._totals = None
+
+    def get_coins(self) -> Tuple[List['UTXO'], List[int], List[int]]:
+        if self._totals is None:
+            self._totals = [ 0, *itertools.accumulate(self._values) ]
+        # The coins and values are changed in place so are copied, the totals are replaced.
+        return list(self._coins), list(self._values), self._totals
+
+
+class AccountRoutingIndex:
+    """
+    Which of the wallet's accounts a transaction needs to be given to for processing, found in
+    one pass over its inputs rather than by giving it to every account.
+
+    An account can only match the outputs of a transaction that the server has linked to one of
+    its keys, and can only match the inputs that spend its unspent outputs. So this maps the
+    linked transactions and the unspent outpoints to the accounts they belong to. Transactions
+    are usually linked to a single account, which is referred to directly rather than through a
+    set.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._tx_accounts: Dict[bytes, Union[int, Set[int]]] = {}
+        self._utxo_accounts: Dict[TxoKeyType, int] = {}
+
+    def add_transactions(self, account_id: int, tx_hashes: Iterable[bytes]) -> None:
+        with self._lock:
+            for tx_hash in tx_hashes:
+                account_ids = self._tx_accounts.get(tx_hash)
+                if account_ids is None:
+                    self._tx_accounts[tx_hash] = account_id
+                elif isinstance(account_ids, int):
+                    if account_ids != account_id:
+                        self._tx_accounts[tx_hash] = { account_ids, account_id }
+                else:
+                    account_ids.add(account_id)
+
+    def remove_transactions(self, account_id: int, tx_hashes: Iterable[bytes]) -> None:
+        with self._lock:
+            for tx_hash in tx_hashes:
+                account_ids = self._tx_accounts.get(tx_hash)
+                if account_ids is None:
+                    continue
+                if isinstance(account_ids, int):
+                    if account_ids == account_id:
+                        del self._tx_accounts[tx_hash]
+                    continue
+                account_ids.discard(account_id)
+                if len(account_ids) == 1:
+                    self._tx_accounts[tx_hash] = account_ids.pop()
+
+    def add_utxo(self, account_id: int, txo_key: TxoKeyType) -> None:
+        with self._lock:
+            self._utxo_accounts[txo_key] = account_id
+
+    def remove_utxos(self, txo_keys: Iterable[TxoKeyType]) -> None:
+        with self._lock:
+            for txo_key in txo_keys:
+                self._utxo_accounts.pop(txo_key, None)
+
+    def get_account_ids(self, tx_hash: bytes, tx: Transaction) -> Set[int]:
+        with self._lock:
+            account_ids = self._tx_accounts.get(tx_hash)
+            if account_ids is None:
+                result: Set[int] = set()
+            elif isinstance(account_ids, int):
+                result = { account_ids }
+            else:
+                result = set(account_ids)
+            utxo_accounts = self._utxo_accounts
+            for txin in tx.inputs:
+                account_id = utxo_accounts.get(TxoKeyType(txin.prev_hash, txin.prev_idx))
+                if account_id is not None:
+                    result.add(account_id)
+        return result
 
 
 def dust_threshold(network):
@@ -234,9 +688,26 @@ class AbstractAccount:
         self.response_count = 0
         self.last_poll_time: Optional[float] = None
 
+        self._history_index = HistoryIndex()
+        # The balance index is built on first use, as most of the account state has to be loaded.
+        self._balance_index: Optional[BalanceIndex] = None
+        self._coin_value_index: Optional[CoinValueIndex] = None
+        self._metadata_changes: Set[bytes] = set()
+        self._metadata_changes_lock = threading.Lock()
+
+        # The coin scripts are derived on demand, and the coins should not keep the account alive.
+        account_ref = weakref.ref(self)
+        def _load_utxo_script(keyinstance_id: int) -> Tuple[Script, Optional[ScriptTemplate]]:
+            account = account_ref()
+            assert account is not None, "the account of the coin has been released"
+            return account._get_utxo_script(keyinstance_id)
+        self._utxo_script_loader = _load_utxo_script
+
         self._load_sync_state()
         self._utxos: Dict[TxoKeyType, UTXO] = {}
         self._utxos_lock = threading.RLock()
+        # Spent outputs are left in the database and this only holds those that have been
+        # encountered in this session, whether loaded, queried or spent.
         self._stxos: Dict[TxoKeyType, int] = {}
         self._keypath: Dict[int, Sequence[int]] = {}
         self._keyinstances: Dict[int, KeyInstanceRow] = { r.keyinstance_id: r for r
@@ -412,7 +883,12 @@ class AbstractAccount:
             for utxo_key in utxokeys:
                 if utxo_key in self._frozen_coins:
                     self._frozen_coins.remove(utxo_key)
-                del self._utxos[utxo_key]
+                utxo = self._utxos.pop(utxo_key)
+                if self._balance_index is not None:
+                    self._balance_index.remove_utxo(utxo)
+                if self._coin_value_index is not None:
+                    self._coin_value_index.remove_utxo(utxo)
+        self._wallet._routing_index.remove_utxos(utxokeys)
         for stxokey in stxokeys:
             del self._stxos[stxokey]
         for key_id in key_ids:
@@ -448,6 +924,11 @@ class AbstractAccount:
     def get_possible_scripts_for_id(self, keyinstance_id: int) -> List[Tuple[ScriptType, Script]]:
         raise NotImplementedError
 
+    def get_possible_scripts_for_ids(self, keyinstance_ids: Sequence[int]) \
+            -> List[Tuple[int, ScriptType, Script]]:
+        return [ (keyinstance_id, script_type, script) for keyinstance_id in keyinstance_ids
+            for script_type, script in self.get_possible_scripts_for_id(keyinstance_id) ]
+
     def get_script_for_id(self, keyinstance_id: int,
             script_type: Optional[ScriptType]=None) -> Script:
         script_template = self.get_script_template_for_id(keyinstance_id, script_type)
@@ -568,19 +1049,22 @@ class AbstractAccount:
 
         with TransactionDeltaTable(self._wallet._db_context) as table:
             rows = table.read_key_history(self._id)
+            history_rows = table.read_history(self._id)
+
+        self._history_index.load({ row.tx_hash: int(row.value_delta) for row in history_rows },
+            self.get_transaction_metadata)
 
-        key_history: Dict[int, List[Tuple[str, int]]] = {}
+        key_history: Dict[int, List[Tuple[bytes, int]]] = {}
         maximum_position = 0
-        positions: Dict[str, int] = {}
+        positions: Dict[bytes, int] = {}
         for tx_hash, keyinstance_id in rows:
             metadata = cast(TxData, self.get_transaction_metadata(tx_hash))
             if metadata.height is not None:
-                tx_id = hash_to_hex_str(tx_hash)
                 if metadata.position is not None:
-                    positions[tx_id] = metadata.position
+                    positions[tx_hash] = metadata.position
                     maximum_position = max(maximum_position, metadata.position)
                 entries = key_history.setdefault(keyinstance_id, [])
-                entries.append((tx_id, metadata.height))
+                entries.append((tx_hash, metadata.height))
 
         # From elsewhere:
         #   The history is in immediately usable order. Transactions are listed in ascending
@@ -593,7 +1077,10 @@ class AbstractAccount:
         # seeds.
         for keyinstance_id, entries in key_history.items():
             entries.sort(key=lambda v: (v[1], positions.get(v[0], maximum_position+1)))
-            self._sync_state.set_key_history(keyinstance_id, entries)
+            self._sync_state.set_key_history_hashes(keyinstance_id, entries)
+        self._wallet._routing_index.add_transactions(self._id,
+            self._sync_state.get_transaction_hashes())
+        self._logger.debug("loaded sync state %r", self._sync_state.get_memory_report())
 
     def _load_keys(self, keyinstance_rows: List[KeyInstanceRow]) -> None:
         pass
@@ -601,6 +1088,8 @@ class AbstractAccount:
     def _load_txos(self, output_rows: List[TransactionOutputRow]) -> None:
         self._stxos.clear()
         self._utxos.clear()
+        self._balance_index = None
+        self._coin_value_index = None
         self._frozen_coins: Set[TxoKeyType] = set([])
 
         for row in output_rows:
@@ -611,19 +1100,26 @@ class AbstractAccount:
         if row.flags & TransactionOutputFlag.IS_SPENT:
             self._stxos[txo_key] = row.keyinstance_id
         else:
+            # The script is derived when the coin is first used, not for every loaded coin.
             keyinstance = self._keyinstances[row.keyinstance_id]
-            script_template = self.get_script_template_for_id(row.keyinstance_id)
+            self.register_utxo(row.tx_hash, row.tx_index, row.value, row.flags, keyinstance)
+
+    def _get_utxo_script(self, keyinstance_id: int) -> Tuple[Script, Optional[ScriptTemplate]]:
+        keyinstance = self._keyinstances[keyinstance_id]
+        if keyinstance.script_type == ScriptType.NONE:
+            script_template = self.get_script_template_for_id(keyinstance_id)
             address = script_template if isinstance(script_template, Address) else None
-            self.register_utxo(row.tx_hash, row.tx_index, row.value, row.flags,
-                keyinstance, script_template.to_script(), address)
+            return script_template.to_script(), address
+        script, _script_bytes, address = self._get_cached_script(keyinstance_id)
+        return script, address
 
     def register_utxo(self, tx_hash: bytes, output_index: int, value: int,
             flags: TransactionOutputFlag, keyinstance: KeyInstanceRow,
-            script: Script, address: Optional[ScriptTemplate]=None) -> None:
+            script: Optional[Script]=None, address: Optional[ScriptTemplate]=None) -> None:
         is_coinbase = (flags & TransactionOutputFlag.IS_COINBASE) != 0
         utxo_key = TxoKeyType(tx_hash, output_index)
         with self._utxos_lock:
-            self._utxos[utxo_key] = UTXO(
+            utxo = self._utxos[utxo_key] = UTXO(
                 value=value,
                 script_pubkey=script,
                 script_type=keyinstance.script_type,
@@ -632,7 +1128,13 @@ class AbstractAccount:
                 keyinstance_id=keyinstance.keyinstance_id,
                 flags=flags,
                 address=address,
-                is_coinbase=is_coinbase)
+                is_coinbase=is_coinbase,
+                script_loader=self._utxo_script_loader if script is None else None)
+            if self._balance_index is not None:
+                self._balance_index.add_utxo(utxo, self._get_transaction_height(tx_hash))
+            if self._coin_value_index is not None:
+                self._coin_value_index.add_utxo(utxo)
+            self._wallet._routing_index.add_utxo(self._id, utxo_key)
             if flags & TransactionOutputFlag.IS_FROZEN:
                 if flags & TransactionOutputFlag.IS_SPENT:
                     self._logger.warning("Ignoring frozen flag for spent txo %s:%d",
@@ -643,15 +1145,20 @@ class AbstractAccount:
     # Should be called with the transaction lock.
     def create_transaction_output(self, tx_hash: bytes, output_index: int, value: int,
             flags: TransactionOutputFlag, keyinstance: KeyInstanceRow,
-            script: Script, address: Optional[ScriptTemplate]=None):
+            script: Script, address: Optional[ScriptTemplate]=None,
+            write_batch: Optional[TransactionWriteBatch]=None) -> None:
         if flags & TransactionOutputFlag.IS_SPENT:
             self._stxos[TxoKeyType(tx_hash, output_index)] = keyinstance.keyinstance_id
         else:
             self.register_utxo(tx_hash, output_index, value, flags, keyinstance,
                 script, address)
 
-        self._wallet.create_transactionoutputs(self._id, [ TransactionOutputRow(tx_hash,
-            output_index, value, keyinstance.keyinstance_id, flags) ])
+        rows = [ TransactionOutputRow(tx_hash, output_index, value, keyinstance.keyinstance_id,
+            flags) ]
+        if write_batch is not None:
+            write_batch.add_outputs(rows)
+        else:
+            self._wallet.create_transactionoutputs(self._id, rows)
 
     def is_deterministic(self) -> bool:
         # Not all wallets have a keystore, like imported address for instance.
@@ -754,20 +1261,50 @@ class AbstractAccount:
         return PrivateKey(secret).to_WIF(compressed=compressed, coin=Net.COIN)
 
     # Should be called with the transaction lock.
-    def set_utxo_spent(self, tx_hash: bytes, output_index: int) -> None:
+    def set_utxo_spent(self, tx_hash: bytes, output_index: int,
+            write_batch: Optional[TransactionWriteBatch]=None) -> None:
         with self._utxos_lock:
             txo_key = TxoKeyType(tx_hash, output_index)
             utxo = self._utxos.pop(txo_key)
+            if self._balance_index is not None:
+                self._balance_index.remove_utxo(utxo)
+            if self._coin_value_index is not None:
+                self._coin_value_index.remove_utxo(utxo)
+            self._wallet._routing_index.remove_utxos([ txo_key ])
         retained_flags = utxo.flags & TransactionOutputFlag.IS_COINBASE
-        self._wallet.update_transactionoutput_flags(
-            [ (retained_flags | TransactionOutputFlag.IS_SPENT, tx_hash, output_index)  ])
+        entries = [ (retained_flags | TransactionOutputFlag.IS_SPENT, tx_hash, output_index) ]
+        if write_batch is not None:
+            write_batch.add_output_flags(entries)
+        else:
+            self._wallet.update_transactionoutput_flags(entries)
         self._stxos[txo_key] = utxo.keyinstance_id
 
     def is_frozen_utxo(self, utxo):
         return utxo.key() in self._frozen_coins
 
     def get_stxo(self, tx_hash: bytes, output_index: int) -> Optional[int]:
-        return self._stxos.get(TxoKeyType(tx_hash, output_index), None)
+        txo_key = TxoKeyType(tx_hash, output_index)
+        return self._get_stxos([ txo_key ]).get(txo_key)
+
+    def _get_stxos(self, txo_keys: List[TxoKeyType]) -> Dict[TxoKeyType, int]:
+        "Map any of the given outputs spent by this account to the key that received them."
+        stxos: Dict[TxoKeyType, int] = {}
+        unknown_txo_keys: List[TxoKeyType] = []
+        for txo_key in txo_keys:
+            keyinstance_id = self._stxos.get(txo_key)
+            if keyinstance_id is None:
+                unknown_txo_keys.append(txo_key)
+            else:
+                stxos[txo_key] = keyinstance_id
+        if len(unknown_txo_keys):
+            with TransactionOutputTable(self._wallet._db_context) as table:
+                rows = table.read_txokeys(unknown_txo_keys)
+            for row in rows:
+                if row.flags & TransactionOutputFlag.IS_SPENT and \
+                        row.keyinstance_id in self._keyinstances:
+                    txo_key = TxoKeyType(row.tx_hash, row.tx_index)
+                    stxos[txo_key] = self._stxos[txo_key] = row.keyinstance_id
+        return stxos
 
     def get_utxo(self, tx_hash: bytes, output_index: int) -> Optional[UTXO]:
         return self._utxos.get(TxoKeyType(tx_hash, output_index), None)
@@ -796,6 +1333,21 @@ class AbstractAccount:
         with self._utxos_lock:
             return [ utxo for utxo in self._utxos.values() if is_spendable_utxo(utxo)]
 
+    def get_coins_by_value(self, utxos: List[UTXO]) -> Tuple[List[UTXO], List[int], List[int]]:
+        '''
+        The given coins ordered by value, with their values and the running totals of their
+        values where totals[i] is the value of the coins before index i. When the coins are all
+        the unspent coins of the account, as they usually are, they come from the index of them
+        by value that the account keeps.
+        '''
+        with self._utxos_lock:
+            # The coins the account gave out are compared by identity, which is cheap.
+            if len(utxos) == len(self._utxos) and utxos == list(self._utxos.values()):
+                if self._coin_value_index is None:
+                    self._coin_value_index = CoinValueIndex(self._utxos.values())
+                return self._coin_value_index.get_coins()
+        return coinchooser.coins_by_value(utxos)
+
     def existing_active_keys(self) -> List[int]:
         with self._activated_keys_lock:
             self._activated_keys = []
@@ -807,9 +1359,27 @@ class AbstractAccount:
             return self.get_balance(self._frozen_coins)
 
     def get_balance(self, domain=None, exclude_frozen_coins: bool=False) -> Tuple[int, int, int]:
+        if domain is not None:
+            return self._get_domain_balance(domain, exclude_frozen_coins)
+
+        with self._utxos_lock:
+            self._apply_metadata_changes()
+            if self._balance_index is None:
+                self._balance_index = BalanceIndex()
+                for utxo in self._utxos.values():
+                    self._balance_index.add_utxo(utxo,
+                        self._get_transaction_height(utxo.tx_hash))
+            c, u, x = self._balance_index.get_balance(self._wallet.get_local_height(),
+                self._get_transaction_height)
+            if exclude_frozen_coins and len(self._frozen_coins):
+                fc, fu, fx = self._get_domain_balance(
+                    [ k for k in self._frozen_coins if k in self._utxos ])
+                c, u, x = c - fc, u - fu, x - fx
+            return c, u, x
+
+    def _get_domain_balance(self, domain, exclude_frozen_coins: bool=False) \
+            -> Tuple[int, int, int]:
         with self._utxos_lock:
-            if domain is None:
-                domain = set(self._utxos.keys())
             c = u = x = 0
             for k in domain:
                 if exclude_frozen_coins and k in self._frozen_coins:
@@ -866,9 +1436,20 @@ class AbstractAccount:
         return cache_value
 
     def process_key_usage(self, tx_hash: bytes, tx: Transaction,
-            relevant_txos: Optional[List[Tuple[int, XTxOutput]]]) -> bool:
+            relevant_txos: Optional[List[Tuple[int, XTxOutput]]],
+            write_batch: Optional[TransactionWriteBatch]=None) -> bool:
+        """
+        Match the transaction's outputs and inputs to this account's keys and coins. The
+        database changes are added to the given batch, which the caller must write while still
+        holding the transaction lock. Without a batch they are written before this returns.
+        """
         with self.transaction_lock:
-            return self._process_key_usage(tx_hash, tx, relevant_txos)
+            if write_batch is not None:
+                return self._process_key_usage(tx_hash, tx, relevant_txos, write_batch)
+            write_batch = TransactionWriteBatch()
+            result = self._process_key_usage(tx_hash, tx, relevant_txos, write_batch)
+            write_batch.write(self._wallet.get_db_context())
+            return result
 
     # def _process_key_usage(self, tx_hash: bytes, tx: Transaction) -> None:
     #     import cProfile, pstats, io
@@ -884,9 +1465,9 @@ class AbstractAccount:
     #     print(s.getvalue())
 
     def _process_key_usage(self, tx_hash: bytes, tx: Transaction,
-            relevant_txos: Optional[List[Tuple[int, XTxOutput]]]) -> bool:
-        tx_id = hash_to_hex_str(tx_hash)
-        key_ids = self._sync_state.get_transaction_key_ids(tx_id)
+            relevant_txos: Optional[List[Tuple[int, XTxOutput]]],
+            write_batch: TransactionWriteBatch) -> bool:
+        key_ids = self._sync_state.get_transaction_key_ids(tx_hash)
         key_matches = [(self.get_keyinstance(key_id),
             *self._get_cached_script(key_id)) for key_id in key_ids]
 
@@ -895,17 +1476,12 @@ class AbstractAccount:
         tx_deltas: Dict[Tuple[bytes, int], int] = defaultdict(int)
         new_txos: List[Tuple[bytes, int, int, TransactionOutputFlag, KeyInstanceRow,
             ScriptTemplate]] = []
+        output_matches: List[Tuple[int, XTxOutput, KeyInstanceRow, Script,
+            Optional[ScriptTemplate]]] = []
         # NOTE(typing) Item "List[Tuple[int, XTxOutput]]" of
         #     "Union[Iterator[Tuple[int, XTxOutput]], List[Tuple[int, XTxOutput]],
         #     enumerate[Any]]" has no attribute "__next__"
         for output_index, output in relevant_txos or enumerate(tx.outputs): # type: ignore
-            utxo = self.get_utxo(tx_hash, output_index)
-            if utxo is not None:
-                continue
-            keyinstance_id = self.get_stxo(tx_hash, output_index)
-            if keyinstance_id is not None:
-                continue
-
             output_bytes = bytes(output.script_pubkey)
             for keyinstance, script, script_bytes, address in key_matches:
                 if script_bytes == output_bytes:
@@ -913,47 +1489,64 @@ class AbstractAccount:
             else:
                 continue
 
-            # Search the known candidates to see if we already have this txo's spending input.
+            utxo = self.get_utxo(tx_hash, output_index)
+            if utxo is None:
+                output_matches.append((output_index, output, keyinstance, script, address))
+
+        # Spent outputs are not kept in memory, so the ones we match are looked up together.
+        stxos = self._get_stxos([ TxoKeyType(tx_hash, output_index)
+            for output_index, *_rest in output_matches ])
+        output_matches = [ entry for entry in output_matches
+            if TxoKeyType(tx_hash, entry[0]) not in stxos ]
+        # Any transaction we already have that spends one of the new outputs.
+        spends = self._wallet._transaction_cache.get_spending_transactions(tx_hash) \
+            if len(output_matches) else {}
+        for output_index, output, keyinstance, script, address in output_matches:
             txo_flags = base_txo_flags
-            for spend_tx_id, _height in self._sync_state.get_key_history(
-                    keyinstance.keyinstance_id):
-                if spend_tx_id == tx_id:
-                    continue
-                spend_tx_hash = hex_str_to_hash(spend_tx_id)
-                spend_tx = self._wallet._transaction_cache.get_transaction(spend_tx_hash)
-                if spend_tx is None:
+            for spend_tx_hash in spends.get(output_index, []):
+                # The spending transaction is only processed as such once the server has
+                # linked it to the key, and it may since have been removed.
+                if keyinstance.keyinstance_id not in \
+                        self._sync_state.get_transaction_key_ids(spend_tx_hash):
                     continue
-                for spend_txin in spend_tx.inputs:
-                    if spend_txin.prev_hash == tx_hash and spend_txin.prev_idx == output_index:
-                        break
-                else:
+                if not self._wallet._transaction_cache.have_transaction_data(spend_tx_hash):
                     continue
 
                 tx_deltas[(spend_tx_hash, keyinstance.keyinstance_id)] -= output.value
                 txo_flags |= TransactionOutputFlag.IS_SPENT
                 break
 
-            # TODO(rt12) BACKLOG batch create the outputs.
             self.create_transaction_output(tx_hash, output_index, output.value,
-                txo_flags, keyinstance, script, address)
+                txo_flags, keyinstance, script, address, write_batch)
             tx_deltas[(tx_hash, keyinstance.keyinstance_id)] += output.value
 
         for input_index, input in enumerate(tx.inputs):
-            keyinstance_id = self.get_stxo(input.prev_hash, input.prev_idx)
-            if keyinstance_id is not None:
-                continue
+            # Outputs already spent are never unspent coins, so there is no need to check them.
             utxo = self.get_utxo(input.prev_hash, input.prev_idx)
             if utxo is None:
                 continue
 
-            self.set_utxo_spent(input.prev_hash, input.prev_idx)
+            self.set_utxo_spent(input.prev_hash, input.prev_idx, write_batch)
             tx_deltas[(tx_hash, utxo.keyinstance_id)] -= utxo.value
 
         if len(tx_deltas):
-            check_keyinstance_ids = set(r[1] for r in tx_deltas.keys())
-            self._wallet.create_or_update_transactiondelta_relative(
-                [ TransactionDeltaRow(k[0], k[1], v) for k, v in tx_deltas.items() ],
-                partial(self.requests.check_paid_requests, check_keyinstance_ids))
+            write_batch.add_value_deltas(
+                [ TransactionDeltaRow(k[0], k[1], v) for k, v in tx_deltas.items() ])
+            # Paid requests are checked once for all the keys changed in the batch.
+            check_keyinstance_ids = write_batch.changed_keyinstance_ids.get(self._id)
+            if check_keyinstance_ids is None:
+                check_keyinstance_ids = write_batch.changed_keyinstance_ids[self._id] = set()
+                write_batch.add_completion_callback(
+                    partial(self.requests.check_paid_requests, check_keyinstance_ids))
+            check_keyinstance_ids.update(r[1] for r in tx_deltas.keys())
+
+            # The write may be retried as part of a different batch, so the in-memory history
+            # is updated here rather than in a write callback.
+            history_deltas: Dict[bytes, int] = defaultdict(int)
+            for (delta_tx_hash, _keyinstance_id), value_delta in tx_deltas.items():
+                history_deltas[delta_tx_hash] += value_delta
+            self._history_index.apply_value_deltas(history_deltas,
+                self.get_transaction_metadata)
 
             affected_keys = [self._keyinstances[k] for (_x, k) in tx_deltas.keys()]
             self._wallet.trigger_callback('on_keys_updated', self._id, affected_keys)
@@ -980,6 +1573,8 @@ class AbstractAccount:
         with self.transaction_lock:
             self._logger.debug("removing tx from history %s", tx_id)
             self._remove_transaction(tx_hash)
+            # The transaction deltas are deleted with the transaction.
+            self._history_index.remove(tx_hash)
             self._logger.debug("deleting tx from cache and datastore: %s", tx_id)
             self._wallet._transaction_cache.delete(tx_hash, _completion_callback)
 
@@ -991,24 +1586,23 @@ class AbstractAccount:
             # tx_deltas: Dict[Tuple[bytes, int], int] = defaultdict(int)
 
             txo_key: TxoKeyType
-            utxos: List[UTXO] = []
-            for output_index, txout in enumerate(tx.outputs):
-                txo_key = TxoKeyType(tx_hash, output_index)
-                # Check if any outputs of this transaction have been spent already.
-                if txo_key in self._stxos:
-                    raise Exception("Cannot remove as spent by child")
+            output_keys = [ TxoKeyType(tx_hash, output_index)
+                for output_index in range(len(tx.outputs)) ]
+            # Check if any outputs of this transaction have been spent already.
+            if len(self._get_stxos(output_keys)):
+                raise Exception("Cannot remove as spent by child")
 
-                with self._utxos_lock:
+            utxos: List[UTXO] = []
+            with self._utxos_lock:
+                for txo_key in output_keys:
                     if txo_key in self._utxos:
                         utxos.append(self._utxos[txo_key])
 
             # Collect the spent key metadata.
-            candidate_spent_keys: Dict[TxoKeyType, int] = {}
-            for input_index, txin in enumerate(tx.inputs):
-                txo_key = TxoKeyType(txin.prev_hash, txin.prev_idx)
-                if txo_key in self._stxos:
-                    spent_keyinstance_id = self._stxos.pop(txo_key)
-                    candidate_spent_keys[txo_key] = spent_keyinstance_id
+            candidate_spent_keys = self._get_stxos([ TxoKeyType(txin.prev_hash, txin.prev_idx)
+                for txin in tx.inputs ])
+            for txo_key in candidate_spent_keys:
+                del self._stxos[txo_key]
 
             # Read the transaction outputs for any collected spent keys.
             txos: Dict[TxoKeyType, TransactionOutputRow] = {}
@@ -1044,6 +1638,11 @@ class AbstractAccount:
                     if utxo_key in self._frozen_coins:
                         self._frozen_coins.remove(utxo_key)
                     del self._utxos[utxo_key]
+                    if self._balance_index is not None:
+                        self._balance_index.remove_utxo(utxo)
+                    if self._coin_value_index is not None:
+                        self._coin_value_index.remove_utxo(utxo)
+                    self._wallet._routing_index.remove_utxos([ utxo_key ])
 
             if len(txout_flags):
                 self._wallet.update_transactionoutput_flags(txout_flags)
@@ -1091,26 +1690,7 @@ class AbstractAccount:
         # - The key usage has been processed.
         # As some of the events may read from the database or access wallet state.
         update_state_changes: List[Tuple[bytes, TxFlags, TxFlags]] = []
-        pending_event_count = 1
-
-        def do_post_processing() -> None:
-            nonlocal update_state_changes
-            self._logger.debug("set_key_history post-processing %d state changes",
-                len(update_state_changes))
-            for state_change in update_state_changes:
-                self._wallet.trigger_callback('transaction_state_change', self._id, *state_change)
-
-            self._wallet.txs_changed_event.set()
-            self.synchronize()
-
-        def on_event_completed() -> None:
-            nonlocal pending_event_count
-            pending_event_count -= 1
-            if pending_event_count > 0:
-                return
-
-            # We do not want to block the completion thread.
-            app_state.app.run_in_thread(do_post_processing)
+        completions: List[AsyncCompletion] = []
 
         with self.lock:
             self._logger.debug("set_key_history key_id=%s fees=%s", keyinstance_id, tx_fees)
@@ -1129,7 +1709,13 @@ class AbstractAccount:
             # The history is in immediately usable order. Transactions are listed in ascending
             # block height (height > 0), followed by the unconfirmed (height == 0) and then
             # those with unconfirmed parents (height < 0). [ (tx_hash, tx_height), ... ]
-            self._sync_state.set_key_history(keyinstance_id, hist)
+            removed_tx_hashes, added_tx_hashes = self._sync_state.set_key_history(
+                keyinstance_id, hist)
+            routing_index = self._wallet._routing_index
+            routing_index.add_transactions(self._id, added_tx_hashes)
+            routing_index.remove_transactions(self._id, [ tx_hash
+                for tx_hash in removed_tx_hashes
+                if not self._sync_state.get_transaction_key_ids(tx_hash) ])
 
             adds = []
             updates = []
@@ -1161,36 +1747,141 @@ class AbstractAccount:
                     updates.append((tx_hash, data, None, flags))
                 unique_tx_hashes.add(tx_hash)
 
-            def _completion_callback(exc_value: Any) -> None:
-                if exc_value is not None:
-                    raise exc_value # pylint: disable=raising-bad-type
-                on_event_completed()
-
             if len(adds):
                 # The completion callback is guaranteed to be called.
-                pending_event_count += 1
-                self._wallet._transaction_cache.add(adds, completion_callback=_completion_callback)
+                completion = AsyncCompletion()
+                self._wallet._transaction_cache.add(adds, completion_callback=completion)
+                completions.append(completion)
 
             if len(updates):
                 # The completion callback is only guaranteed to be called if database updates are
                 # actually made. We can infer this from the return value which is how many are.
-                pending_event_count += 1
+                completion = AsyncCompletion()
                 if self._wallet._transaction_cache.update(updates,
-                    completion_callback=_completion_callback) == 0:
-                        pending_event_count -= 1
+                        completion_callback=completion) > 0:
+                    completions.append(completion)
+
+            # The key usage for all the transactions is written together, and this is done
+            # before the transaction lock is released so later changes are written after it.
+            with self.transaction_lock:
+                write_batch = TransactionWriteBatch()
+                for tx_id, tx_height in hist:
+                    tx_hash = hex_str_to_hash(tx_id)
+                    entry_flags = self._wallet._transaction_cache.get_flags(tx_hash)
+                    if entry_flags & TxFlags.HasByteData == TxFlags.HasByteData:
+                        tx = self._wallet._transaction_cache.get_transaction(tx_hash)
+                        relevant_txos = self.get_relevant_txos(keyinstance_id, tx, tx_id)
+                        self.process_key_usage(tx_hash, tx, relevant_txos, write_batch)
+                if len(write_batch):
+                    completion = AsyncCompletion()
+                    write_batch.write(self._wallet.get_db_context(), completion)
+                    completions.append(completion)
 
-            for tx_id, tx_height in hist:
-                tx_hash = hex_str_to_hash(tx_id)
-                entry_flags = self._wallet._transaction_cache.get_flags(tx_hash)
-                if entry_flags & TxFlags.HasByteData == TxFlags.HasByteData:
-                    tx = self._wallet._transaction_cache.get_transaction(tx_hash)
-                    relevant_txos = self.get_relevant_txos(keyinstance_id, tx, tx_id)
-                    self.process_key_usage(tx_hash, tx, relevant_txos)
+        try:
+            for completion in completions:
+                await completion
+        except Exception:
+            self._logger.exception("set_key_history failed writing key_id=%s", keyinstance_id)
+            return
+
+        self._logger.debug("set_key_history post-processing %d state changes",
+            len(update_state_changes))
+        for state_change in update_state_changes:
+            self._wallet.trigger_callback('transaction_state_change', self._id, *state_change)
 
-        # Reaching this stage is the only guaranteed event in triggering post-processing.
-        on_event_completed()
+        self._wallet.txs_changed_event.set()
+        await self._trigger_synchronization()
 
-    def get_history(self, domain: Optional[Set[int]]=None) -> List[Tuple[HistoryLine, int]]:
+    def _get_transaction_height(self, tx_hash: bytes) -> Optional[int]:
+        metadata = self.get_transaction_metadata(tx_hash)
+        return metadata.height if metadata is not None else None
+
+    def _on_transaction_metadata_changes(self, tx_hashes: List[bytes]) -> None:
+        # This is called with the transaction cache lock held, so the changes are only recorded
+        # here and are applied by the next reader of the indexes.
+        with self._metadata_changes_lock:
+            self._metadata_changes.update(tx_hashes)
+
+    def _apply_metadata_changes(self) -> None:
+        # Must be called with the UTXO lock held, which serialises the application of changes.
+        with self._metadata_changes_lock:
+            if not len(self._metadata_changes):
+                return
+            tx_hashes, self._metadata_changes = self._metadata_changes, set()
+        for tx_hash in tx_hashes:
+            metadata = self.get_transaction_metadata(tx_hash)
+            self._history_index.update_metadata(tx_hash, metadata)
+            if self._balance_index is not None:
+                self._balance_index.update_height(tx_hash,
+                    metadata.height if metadata is not None else None)
+
+    def get_history(self, domain: Optional[Set[int]]=None,
+            limit: Optional[int]=None) -> List[Tuple[HistoryLine, int]]:
+        """
+        Get the history of the account, most recent first, with the balance after each entry.
+        The history of the whole account is read from the history index, where only the returned
+        entries are visited.
+        """
+        if domain is not None:
+            history = self._get_domain_history(domain)
+            return history if limit is None else history[:limit]
+
+        return self._read_history_index(limit)
+
+    def get_history_page(self, cursor: Optional[str]=None, limit: int=HISTORY_PAGE_SIZE,
+            domain: Optional[Set[int]]=None) \
+            -> Tuple[List[Tuple[HistoryLine, int]], Optional[str]]:
+        """
+        Get a page of the history of the account, most recent first, with the balance after each
+        entry. The returned cursor can be passed back to get the following page, and is `None`
+        if there are no further entries. The cursor carries the running balance, so a page
+        continues on from the balances of the page before it even if earlier history has
+        changed in the meantime.
+
+        Raises `ValueError` if the cursor is invalid.
+        """
+        history_cursor = HistoryCursor.decode(cursor) if cursor is not None else None
+        if domain is not None:
+            history = self._get_domain_history(domain)
+            start_index = 0
+            if history_cursor is not None:
+                cursor_key = (history_cursor.sort_key, history_cursor.tx_hash)
+                while start_index < len(history) and \
+                        (history[start_index][0].sort_key,
+                            history[start_index][0].tx_hash) >= cursor_key:
+                    start_index += 1
+            page = history[start_index:start_index + limit]
+            has_more = start_index + limit < len(history)
+        else:
+            # Read one more entry than needed to know if there is a following page.
+            page = self._read_history_index(limit + 1, history_cursor)
+            has_more = len(page) > limit
+            page = page[:limit]
+
+        next_cursor: Optional[str] = None
+        if has_more and len(page):
+            line, balance = page[-1]
+            next_cursor = HistoryCursor(line.sort_key, line.tx_hash,
+                balance - line.value_delta).encode()
+        return page, next_cursor
+
+    def _read_history_index(self, limit: Optional[int]=None,
+            cursor: Optional[HistoryCursor]=None) -> List[Tuple[HistoryLine, int]]:
+        with self._utxos_lock:
+            self._apply_metadata_changes()
+        entries = self._history_index.read(limit, cursor)
+
+        history: List[Tuple[HistoryLine, int]] = []
+        for sort_key, tx_hash, value_delta, balance in entries:
+            metadata = self._wallet._transaction_cache.get_metadata(tx_hash)
+            if metadata is None:
+                continue
+            tx_flags = self._wallet._transaction_cache.get_flags(tx_hash)
+            history.append((HistoryLine(sort_key, tx_hash, tx_flags, metadata.height,
+                value_delta), balance))
+        return history
+
+    def _get_domain_history(self, domain: Set[int]) -> List[Tuple[HistoryLine, int]]:
         history_raw: List[HistoryLine] = []
         with TransactionDeltaTable(self._wallet._db_context) as table:
             rows = table.read_history(self._id, domain)
@@ -1200,17 +1891,11 @@ class AbstractAccount:
             # Signed but not cleared.
             if metadata.height is None:
                 continue
-            height, position = metadata.height, metadata.position
-            if position is not None:
-                sort_key = height, position
-            elif height is not None and height > 0:
-                sort_key = (height, metadata.date_added)
-            else:
-                sort_key = (1e9, metadata.date_added)
-            history_raw.append(HistoryLine(sort_key, row.tx_hash, row.tx_flags, height,
+            sort_key = cast(HistorySortKey, history_sort_key(metadata))
+            history_raw.append(HistoryLine(sort_key, row.tx_hash, row.tx_flags, metadata.height,
                 row.value_delta))
 
-        history_raw.sort(key = lambda v: v.sort_key)
+        history_raw.sort(key = lambda v: (v.sort_key, v.tx_hash))
 
         history: List[Tuple[HistoryLine, int]] = []
         balance = 0
@@ -1295,6 +1980,10 @@ class AbstractAccount:
     def dust_threshold(self):
         return dust_threshold(self._network)
 
+    def estimate_input_size(self, utxo: UTXO) -> int:
+        '''The estimated size of the input that spends the coin, once it is signed.'''
+        return utxo.to_tx_input(self).estimated_size()
+
     def make_unsigned_transaction(self, utxos: List[UTXO], outputs: List[XTxOutput],
             config: SimpleConfig, fixed_fee: Optional[int]=None) -> Transaction:
         # check outputs
@@ -1313,7 +2002,6 @@ class AbstractAccount:
             raise Exception('Dynamic fee estimates not available')
 
         fee_estimator = config.estimate_fee if fixed_fee is None else lambda size: fixed_fee
-        inputs = [utxo.to_tx_input(self) for utxo in utxos]
         if all_index is None:
             # Let the coin chooser select the coins to spend
             # TODO(rt12) BACKLOG Hardware wallets should use 1 change at most. Make sure the
@@ -1332,11 +2020,12 @@ class AbstractAccount:
                         self.get_xpubkeys_for_id(keyinstance.keyinstance_id)))
             else:
                 change_outs = [ XTxOutput(0, utxos[0].script_pubkey, # type: ignore
-                    inputs[0].script_type, inputs[0].x_pubkeys) ]
-            coin_chooser = coinchooser.CoinChooserPrivacy()
-            tx = coin_chooser.make_tx(inputs, outputs, change_outs, fee_estimator,
-                self.dust_threshold())
+                    utxos[0].script_type, self.get_xpubkeys_for_id(utxos[0].keyinstance_id)) ]
+            coin_chooser = coinchooser.get_coin_chooser(config, len(utxos))
+            tx = coin_chooser.make_tx(utxos, outputs, change_outs, fee_estimator,
+                self.dust_threshold(), self)
         else:
+            inputs = [utxo.to_tx_input(self) for utxo in utxos]
             assert all(txin.value is not None for txin in inputs)
             sendable = cast(int, sum(txin.value for txin in inputs))
             outputs[all_index].value = 0
@@ -1438,6 +2127,13 @@ class AbstractAccount:
     def get_public_keys_for_id(self, keyinstance_id: int) -> List[PublicKey]:
         raise NotImplementedError
 
+    def _derive_public_key(self, x_pubkey: XPublicKey) -> Optional[PublicKey]:
+        # The keystore that owns the key keeps the parent keys it derived it from.
+        for keystore in self.get_keystores():
+            if isinstance(keystore, DerivablePaths) and keystore.is_signature_candidate(x_pubkey):
+                return keystore.derive_pubkey(x_pubkey.derivation_path())
+        return None
+
     def sign_transaction(self, tx: Transaction, password: str,
             tx_context: Optional[TransactionContext]=None) -> None:
         if self.is_watching_only():
@@ -1451,12 +2147,17 @@ class AbstractAccount:
         self.obtain_supporting_data(tx, tx_context)
 
         # sign
-        for k in self.get_keystores():
-            try:
-                if k.can_sign(tx):
-                    k.sign_transaction(tx, password, tx_context)
-            except UserCancelled:
-                continue
+        # The keystores share the signing work that is the same for every keystore and input.
+        tx_context.signing_session = SigningSession(tx, self._derive_public_key)
+        try:
+            for k in self.get_keystores():
+                try:
+                    if k.can_sign(tx):
+                        k.sign_transaction(tx, password, tx_context)
+                except UserCancelled:
+                    continue
+        finally:
+            tx_context.signing_session = None
 
         # Incomplete transactions are multi-signature transactions that have not passed the
         # required signature threshold. We do not store these until they are fully signed.
@@ -1715,8 +2416,8 @@ class AbstractAccount:
         with self.lock:
             tx_key_ids: List[Tuple[bytes, Set[int]]] = []
             for tx_hash in reorged_tx_hashes:
-                tx_key_ids.append((tx_hash, self._sync_state.get_transaction_key_ids(
-                    hash_to_hex_str(tx_hash))))
+                tx_key_ids.append((tx_hash,
+                    self._sync_state.get_transaction_key_ids(tx_hash)))
             self.unarchive_transaction_keys(tx_key_ids)
 
     async def new_deactivated_keys(self) -> List[int]:
@@ -1942,6 +2643,7 @@ class DeterministicAccount(AbstractAccount):
     def __init__(self, wallet: 'Wallet', row: AccountRow,
             keyinstance_rows: List[KeyInstanceRow],
             output_rows: List[TransactionOutputRow]) -> None:
+        self._input_sizes: Dict[ScriptType, int] = {}
         AbstractAccount.__init__(self, wallet, row, keyinstance_rows, output_rows)
 
     def has_seed(self) -> bool:
@@ -1962,11 +2664,48 @@ class DeterministicAccount(AbstractAccount):
                 del self._keypath[key_id]
         super()._unload_keys(key_ids)
 
+    def estimate_input_size(self, utxo: UTXO) -> int:
+        # All the keys in the account have the same kind of public keys, so the inputs that
+        # spend coins of the same script type are all the same size.
+        size = self._input_sizes.get(utxo.script_type)
+        if size is None:
+            size = self._input_sizes[utxo.script_type] = super().estimate_input_size(utxo)
+        return size
+
     def get_next_derivation_index(self, derivation_path: Sequence[int]) -> int:
         with self.lock:
             keystore = cast(DerivablePaths, self.get_keystore())
             return keystore.get_next_index(derivation_path)
 
+    def _derive_public_keys_for_ids(self, keyinstance_ids: Sequence[int]) \
+            -> Dict[int, List[PublicKey]]:
+        '''The public keys for each of the given keys, one for each keystore in keystore order.
+        Keys with the same derivation parent are derived together.'''
+        ids_by_parent: Dict[Tuple[int, ...], List[int]] = defaultdict(list)
+        for keyinstance_id in keyinstance_ids:
+            ids_by_parent[tuple(self._keypath[keyinstance_id][:-1])].append(keyinstance_id)
+
+        results: Dict[int, List[PublicKey]] = { keyinstance_id: []
+            for keyinstance_id in keyinstance_ids }
+        for derivation_parent, parent_ids in ids_by_parent.items():
+            indexes = [ self._keypath[keyinstance_id][-1] for keyinstance_id in parent_ids ]
+            for keystore in self.get_keystores():
+                public_keys = cast(DerivablePaths, keystore).derive_pubkeys(derivation_parent,
+                    indexes)
+                for keyinstance_id, public_key in zip(parent_ids, public_keys):
+                    results[keyinstance_id].append(public_key)
+        return results
+
+    def _get_possible_scripts(self, public_keys: List[PublicKey]) \
+            -> List[Tuple[ScriptType, Script]]:
+        raise NotImplementedError
+
+    def get_possible_scripts_for_ids(self, keyinstance_ids: Sequence[int]) \
+            -> List[Tuple[int, ScriptType, Script]]:
+        public_keys = self._derive_public_keys_for_ids(keyinstance_ids)
+        return [ (keyinstance_id, script_type, script) for keyinstance_id in keyinstance_ids
+            for script_type, script in self._get_possible_scripts(public_keys[keyinstance_id]) ]
+
     def allocate_keys(self, count: int,
             derivation_path: Sequence[int]) -> Sequence[DeterministicKeyAllocation]:
         if count <= 0:
@@ -2064,9 +2803,11 @@ class SimpleDeterministicAccount(SimpleAccount, DeterministicAccount):
         return (ScriptType.P2PKH, ScriptType.P2PK)
 
     def get_possible_scripts_for_id(self, keyinstance_id: int) -> List[Tuple[ScriptType, Script]]:
-        public_key = self._get_public_key_for_id(keyinstance_id)
-        keyinstance = self._keyinstances[keyinstance_id]
-        return [ (script_type, self.get_script_template(public_key, script_type).to_script())
+        return self._get_possible_scripts([ self._get_public_key_for_id(keyinstance_id) ])
+
+    def _get_possible_scripts(self, public_keys: List[PublicKey]) \
+            -> List[Tuple[ScriptType, Script]]:
+        return [ (script_type, self.get_script_template(public_keys[0], script_type).to_script())
             for script_type in self.get_enabled_script_types() ]
 
     def get_script_template_for_id(self, keyinstance_id: int,
@@ -2117,8 +2858,11 @@ class MultisigAccount(DeterministicAccount):
     def get_enabled_script_types(self) -> Sequence[ScriptType]:
         return (ScriptType.MULTISIG_P2SH, ScriptType.MULTISIG_BARE, ScriptType.MULTISIG_ACCUMULATOR)
 
-    def get_possible_scripts_for_id(self, keyinstance_id: int) -> List[Script]:
-        public_keys = self.get_public_keys_for_id(keyinstance_id)
+    def get_possible_scripts_for_id(self, keyinstance_id: int) -> List[Tuple[ScriptType, Script]]:
+        return self._get_possible_scripts(self.get_public_keys_for_id(keyinstance_id))
+
+    def _get_possible_scripts(self, public_keys: List[PublicKey]) \
+            -> List[Tuple[ScriptType, Script]]:
         public_keys_hex = [pubkey.to_hex() for pubkey in public_keys]
         return [ (script_type, self.get_script_template(public_keys_hex, script_type).to_script())
             for script_type in self.get_enabled_script_types() ]
@@ -2199,6 +2943,7 @@ class MultisigAccount(DeterministicAccount):
 
 class Wallet(TriggeredCallbacks):
     _network: Optional['Network'] = None
+    _started: bool = False
     _stopped: bool = False
 
     def __init__(self, storage: WalletStorage) -> None:
@@ -2222,8 +2967,27 @@ class Wallet(TriggeredCallbacks):
         self._account_rows: Dict[int, AccountRow] = {}
 
         self._accounts: Dict[int, AbstractAccount] = {}
+        # Which accounts are involved in each transaction, filled in as the accounts are loaded.
+        self._routing_index: AccountRoutingIndex
+        # Accounts are only loaded from the database when first accessed.
+        self._unrealised_account_rows: Dict[int, AccountRow] = {}
+        self._accounts_lock = threading.RLock()
+        # Accounts are built without the accounts lock held, one loader at a time per account.
+        self._account_load_locks: Dict[int, threading.Lock] = {}
+        # The metadata changes made while an account is being built, which it has to be given
+        # once it is registered. This lock is only held to record or hand these over.
+        self._loading_metadata_changes: Dict[int, Set[bytes]] = {}
+        self._metadata_changes_lock = threading.Lock()
         self._keystores: Dict[int, KeyStore] = {}
 
+        # The cache should not keep the wallet alive.
+        wallet_ref = weakref.ref(self)
+        def _on_transaction_metadata_changes(tx_hashes: List[bytes]) -> None:
+            wallet = wallet_ref()
+            if wallet is not None:
+                wallet._on_transaction_metadata_changes(tx_hashes)
+        self._transaction_cache.set_metadata_change_callback(_on_transaction_metadata_changes)
+
         self.load_state()
 
         self.contacts = Contacts(self._storage)
@@ -2267,6 +3031,8 @@ class Wallet(TriggeredCallbacks):
 
         self._keystores.clear()
         self._accounts.clear()
+        self._unrealised_account_rows.clear()
+        self._routing_index = AccountRoutingIndex()
         self._transaction_descriptions.clear()
 
         with TransactionTable(self._db_context) as table:
@@ -2278,40 +3044,46 @@ class Wallet(TriggeredCallbacks):
             for row in sorted(table.read(), key=lambda t: 0 if t[1] is None else t[1]):
                 self._realize_keystore(row)
 
-        with KeyInstanceTable(self._db_context) as table:
-            all_account_keys: Dict[int, List[KeyInstanceRow]] = defaultdict(list)
-            keyinstances = {}
+        with AccountTable(self._db_context) as table:
             for row in table.read():
-                keyinstances[row.keyinstance_id] = row
-                all_account_keys[row.account_id].append(row)
+                self._unrealised_account_rows[row.account_id] = row
 
+    def _realize_stored_account(self, row: AccountRow) -> AbstractAccount:
+        assert self._db_context is not None
+        with KeyInstanceTable(self._db_context) as table:
+            account_keys = table.read_account(row.account_id)
+
+        # Spent outputs are left in the database for the account to look up as needed.
         with TransactionOutputTable(self._db_context) as table:
-            all_account_outputs: Dict[int, List[TransactionOutputRow]] = defaultdict(list)
-            for row in table.read():
-                keyinstance = keyinstances[row.keyinstance_id]
-                all_account_outputs[keyinstance.account_id].append(row)
+            account_outputs = table.read_account(row.account_id,
+                exclude_mask=TransactionOutputFlag.IS_SPENT)
 
-        with AccountTable(self._db_context) as table:
-            for row in table.read():
-                account_keys = all_account_keys.get(row.account_id, [])
-                account_outputs = all_account_outputs.get(row.account_id, [])
-                if row.default_masterkey_id is not None:
-                    account = self._realize_account(row, account_keys, account_outputs)
-                else:
-                    found_types = set(key.derivation_type for key in account_keys)
-                    prvkey_types = set([ DerivationType.PRIVATE_KEY ])
-                    address_types = set([ DerivationType.PUBLIC_KEY_HASH,
-                        DerivationType.SCRIPT_HASH ])
-                    if found_types & prvkey_types:
-                        account = ImportedPrivkeyAccount(self, row, account_keys, account_outputs)
-                    elif found_types & address_types:
-                        account = ImportedAddressAccount(self, row, account_keys, account_outputs)
-                    else:
-                        raise WalletLoadError(_("Account corrupt, types: %s"), found_types)
-                self.register_account(row.account_id, account)
+        if row.default_masterkey_id is not None:
+            account = self._realize_account(row, account_keys, account_outputs)
+        else:
+            found_types = set(key.derivation_type for key in account_keys)
+            prvkey_types = set([ DerivationType.PRIVATE_KEY ])
+            address_types = set([ DerivationType.PUBLIC_KEY_HASH,
+                DerivationType.SCRIPT_HASH ])
+            if found_types & prvkey_types:
+                account = ImportedPrivkeyAccount(self, row, account_keys, account_outputs)
+            elif found_types & address_types:
+                account = ImportedAddressAccount(self, row, account_keys, account_outputs)
+            else:
+                raise WalletLoadError(_("Account corrupt, types: %s"), found_types)
+        self._logger.debug("loaded account %d with %d keys and %d unspent outputs",
+            row.account_id, len(account_keys), len(account_outputs))
+        return account
 
     def register_account(self, account_id: int, account: AbstractAccount) -> None:
-        self._accounts[account_id] = account
+        with self._accounts_lock:
+            with self._metadata_changes_lock:
+                self._unrealised_account_rows.pop(account_id, None)
+                self._accounts[account_id] = account
+                metadata_changes = self._loading_metadata_changes.pop(account_id, None)
+        # The account may have read the metadata for these before they were changed.
+        if metadata_changes:
+            account._on_transaction_metadata_changes(list(metadata_changes))
 
     def name(self) -> str:
         return get_wallet_name_from_path(self.get_storage_path())
@@ -2348,7 +3120,38 @@ class Wallet(TriggeredCallbacks):
                     self.update_keyinstance_derivation_data(updates)
 
     def get_account(self, account_id: int) -> Optional[AbstractAccount]:
-        return self._accounts.get(account_id)
+        account = self._accounts.get(account_id)
+        if account is not None or account_id not in self._unrealised_account_rows:
+            return account
+
+        # Building the account takes the transaction cache lock, and the cache calls the wallet
+        # with that lock held. So the accounts lock is only held to check for and register the
+        # account, and not while it is built or started.
+        with self._accounts_lock:
+            load_lock = self._account_load_locks.setdefault(account_id, threading.Lock())
+        with load_lock:
+            with self._accounts_lock:
+                account = self._accounts.get(account_id)
+                row = self._unrealised_account_rows.get(account_id)
+                if account is not None or row is None:
+                    return account
+                with self._metadata_changes_lock:
+                    self._loading_metadata_changes[account_id] = set()
+
+            try:
+                account = self._realize_stored_account(row)
+            except Exception:
+                with self._metadata_changes_lock:
+                    del self._loading_metadata_changes[account_id]
+                raise
+
+            # An account loaded after the wallet has started is started on load.
+            with self._accounts_lock:
+                self.register_account(account_id, account)
+                start_account = self._started and not self._stopped
+            if start_account:
+                account.start(self._network)
+        return account
 
     def get_accounts_for_keystore(self, keystore: KeyStore) -> List[AbstractAccount]:
         accounts = []
@@ -2359,14 +3162,22 @@ class Wallet(TriggeredCallbacks):
         return accounts
 
     def get_account_ids(self) -> Set[int]:
-        return set(self._accounts)
+        with self._accounts_lock:
+            return set(self._accounts) | set(self._unrealised_account_rows)
 
     def get_accounts(self) -> Sequence[AbstractAccount]:
-        return list(self._accounts.values())
+        "Get all the accounts, loading any that have not been accessed yet."
+        accounts = (self.get_account(account_id) for account_id in sorted(self.get_account_ids()))
+        return [ account for account in accounts if account is not None ]
+
+    def get_loaded_accounts(self) -> Sequence[AbstractAccount]:
+        with self._accounts_lock:
+            return list(self._accounts.values())
 
     def get_default_account(self) -> Optional[AbstractAccount]:
-        if len(self._accounts):
-            return list(self._accounts.values())[0]
+        account_ids = self.get_account_ids()
+        if len(account_ids):
+            return self.get_account(min(account_ids))
         return None
 
     def _realize_keystore(self, row: MasterKeyRow) -> None:
@@ -2683,7 +3494,20 @@ class Wallet(TriggeredCallbacks):
 
     def is_synchronized(self) -> bool:
         "If all the accounts are synchronized"
-        return all(w.is_synchronized() for w in self.get_accounts())
+        # Accounts are all loaded when the wallet is started with a network, and the accounts
+        # that are not loaded yet are not being synchronized.
+        return all(w.is_synchronized() for w in self.get_loaded_accounts())
+
+    def _on_transaction_metadata_changes(self, tx_hashes: List[bytes]) -> None:
+        # This is called with the transaction cache lock held, so it must not take the accounts
+        # lock which is held while accounts read from the cache. Accounts that are not loaded yet
+        # will read the current metadata when they are.
+        with self._metadata_changes_lock:
+            for metadata_changes in self._loading_metadata_changes.values():
+                metadata_changes.update(tx_hashes)
+            accounts = list(self._accounts.values())
+        for account in accounts:
+            account._on_transaction_metadata_changes(tx_hashes)
 
     def get_transaction_cache(self) -> TransactionCache:
         return self._transaction_cache
@@ -2714,10 +3538,9 @@ class Wallet(TriggeredCallbacks):
     def unverified_transactions(self) -> Dict[bytes, int]:
         '''Returns a map of tx_hash to tx_height.'''
         results = self._transaction_cache.get_unverified_entries(self.get_local_height())
-        self._logger.debug("unverified_transactions: %s", [hash_to_hex_str(r[0]) for r in results])
+        self._logger.debug("unverified_transactions: %d", len(results))
         return { t[0]: cast(int, t[1].metadata.height) for t in results }
 
-    # Also called by network.
     def add_transaction(self, tx_hash: bytes, tx: Transaction, flags: TxFlags,
             external: bool=False) -> None:
         tx_id = hash_to_hex_str(tx_hash)
@@ -2746,52 +3569,166 @@ class Wallet(TriggeredCallbacks):
 
             attempt_callback()
 
-        self._logger.debug("adding tx data %s (flags: %r)", tx_id, flags)
-        self._transaction_cache.add_transaction(tx_hash, tx, flags, _completion_callback)
-
-        # TODO: It should be possible to determine what accounts are involved with this without
-        # entering the processing stage.
-        # TODO: It should be possible to parallelise each account's processing.
-        for account in self._accounts.values():
-            if account.process_key_usage(tx_hash, tx, None):
-                involved_account_ids.add(account.get_id())
-
+        involved_account_ids |= self._add_transaction(tx_hash, tx, flags, _completion_callback)
         attempt_callback()
 
     # Called by network.
-    def add_transaction_proof(self, tx_hash: bytes, height: int, timestamp: int, position: int,
-            proof_position: int, proof_branch: Sequence[bytes]) -> None:
+    async def add_transaction_async(self, tx_hash: bytes, tx: Transaction, flags: TxFlags,
+            external: bool=False) -> None:
+        """
+        The coroutine equivalent of `add_transaction`, which returns once the transaction has
+        been written to the database. Any database error is raised to the caller.
+        """
         tx_id = hash_to_hex_str(tx_hash)
         if self._stopped:
-            self._logger.debug("add_transaction_proof on stopped wallet: %s", tx_id)
+            self._logger.debug("add_transaction on stopped wallet: %s", tx_id)
             return
-        entry = self._transaction_cache.get_entry(tx_hash, TxFlags.StateCleared) # HasHeight
 
-        # Ensure we are not verifying transactions multiple times.
-        if entry is None:
-            # We have proof now so regardless what TxState is, we can 'upgrade' it to StateSettled.
-            # This rests on the commitment that any of the following four tx States *will*
-            # Have tx bytedata i.e. "HasByteData" flag is set.
-            entry = self._transaction_cache.get_entry(tx_hash, TxFlags.STATE_UNCLEARED_MASK)
-            assert entry is not None, f"expected uncleared tx {hash_to_hex_str(tx_hash)}"
-            if entry.flags & TxFlags.HasByteData != 0:
-                self._logger.debug("Fast_tracking entry to StateSettled: %r", entry)
-            else:
-                self._logger.error("Transaction bytedata absent for %s %r", tx_id, entry)
+        completion = AsyncCompletion()
+        involved_account_ids = self._add_transaction(tx_hash, tx, flags, completion)
+        await completion
+
+        self._logger.debug("wallet.add_transaction: %s = %s", tx_id, involved_account_ids)
+        self.trigger_callback('transaction_added', tx_hash, tx, involved_account_ids, external)
+
+    # Called by network.
+    async def add_transactions_async(self, entries: List[Tuple[bytes, Transaction]],
+            flags: TxFlags, external: bool=False) -> None:
+        """
+        Add a batch of transactions, writing their data to the database together. This returns
+        once they have all been written. Any database error is raised to the caller.
+        """
+        if self._stopped:
+            self._logger.debug("add_transactions on stopped wallet: %d transactions",
+                len(entries))
+            return
+
+        self._logger.debug("adding tx data for %d transactions (flags: %r)", len(entries), flags)
+        completion = AsyncCompletion()
+        self._transaction_cache.add_transactions(
+            [ (tx_hash, tx, flags) for (tx_hash, tx) in entries ], completion)
+        outputs_completion = AsyncCompletion()
+        involved_account_ids = self._process_transactions(entries, outputs_completion)
+        await completion
+        await outputs_completion
+
+        for (tx_hash, tx), account_ids in zip(entries, involved_account_ids):
+            self._logger.debug("wallet.add_transaction: %s = %s", hash_to_hex_str(tx_hash),
+                account_ids)
+            self.trigger_callback('transaction_added', tx_hash, tx, account_ids, external)
+
+    def _add_transaction(self, tx_hash: bytes, tx: Transaction, flags: TxFlags,
+            completion_callback: CompletionCallbackType) -> Set[int]:
+        self._logger.debug("adding tx data %s (flags: %r)", hash_to_hex_str(tx_hash), flags)
+        self._transaction_cache.add_transaction(tx_hash, tx, flags, completion_callback)
+        return self._process_transaction(tx_hash, tx)
+
+    def _process_transaction(self, tx_hash: bytes, tx: Transaction) -> Set[int]:
+        return self._process_transactions([ (tx_hash, tx) ])[0]
+
+    def _process_transactions(self, entries: List[Tuple[bytes, Transaction]],
+            completion_callback: Optional[CompletionCallbackType]=None) -> List[Set[int]]:
+        """
+        Match the transactions against each account, writing the resulting outputs and deltas
+        to the database in one batch. The completion callback is always called, even if there
+        was nothing to write.
+        """
+        self._load_spent_accounts(entries)
+        accounts = { account.get_id(): account for account in self.get_loaded_accounts() }
+        involved_account_ids: List[Set[int]] = []
+        write_batch = TransactionWriteBatch()
+        # The batch is written before the locks are released, so that any later changes made
+        # to these outputs by the accounts are written after it.
+        with ExitStack() as stack:
+            for account in accounts.values():
+                stack.enter_context(account.transaction_lock)
+            for tx_hash, tx in entries:
+                # This is done for each transaction in turn, as the outputs added by earlier
+                # transactions in the batch may be spent by later ones.
+                account_ids: Set[int] = set()
+                for account_id in self._routing_index.get_account_ids(tx_hash, tx):
+                    if accounts[account_id].process_key_usage(tx_hash, tx, None,
+                            write_batch):
+                        account_ids.add(account_id)
+                involved_account_ids.append(account_ids)
+            write_batch.write(self.get_db_context(), completion_callback)
+        return involved_account_ids
+
+    def _load_spent_accounts(self, entries: List[Tuple[bytes, Transaction]]) -> None:
+        """
+        Load the accounts that have unspent outputs spent by the given transactions, so that the
+        routing index knows about them. The other accounts that a transaction can be routed to
+        are those it was linked to when synchronising them, and the accounts are all loaded when
+        the wallet is started with a network.
+        """
+        with self._accounts_lock:
+            if not len(self._unrealised_account_rows):
                 return
+        txo_keys = [ TxoKeyType(txin.prev_hash, txin.prev_idx) for (tx_hash, tx) in entries
+            if not tx.is_coinbase() for txin in tx.inputs ]
+        with TransactionOutputTable(self.get_db_context()) as table:
+            output_rows = table.read_txokeys(txo_keys)
+        key_ids = [ row.keyinstance_id for row in output_rows
+            if not row.flags & TransactionOutputFlag.IS_SPENT ]
+        if not len(key_ids):
+            return
+        with KeyInstanceTable(self.get_db_context()) as table:
+            account_ids = set(row.account_id for row in table.read(key_ids=key_ids))
+        for account_id in sorted(account_ids):
+            self.get_account(account_id)
 
-        # We only update a subset.
-        flags = TxFlags.HasHeight | TxFlags.HasPosition
-        data = TxData(height=height, position=position)
-        self._transaction_cache.update(
-            [ (tx_hash, data, None, flags | TxFlags.StateSettled) ])
+    # Called by network.
+    def add_transaction_proof(self, tx_hash: bytes, height: int, timestamp: int, position: int,
+            proof_position: int, proof_branch: Sequence[bytes]) -> None:
+        self.add_transaction_proofs([ (tx_hash, height, timestamp, position, proof_position,
+            proof_branch) ])
+
+    # Called by network.
+    def add_transaction_proofs(self,
+            entries: Sequence[Tuple[bytes, int, int, int, int, Sequence[bytes]]]) -> None:
+        '''Each entry is (tx_hash, height, timestamp, position, proof_position, proof_branch).
+        The changes for all the entries are written to the database together.'''
+        if self._stopped:
+            self._logger.debug("add_transaction_proofs on stopped wallet: %d", len(entries))
+            return
 
-        proof = TxProof(proof_position, proof_branch)
-        self._transaction_cache.update_proof(tx_hash, proof)
+        settled_entries = []
+        for entry_data in entries:
+            tx_hash = entry_data[0]
+            entry = self._transaction_cache.get_entry(tx_hash, TxFlags.StateCleared) # HasHeight
+
+            # Ensure we are not verifying transactions multiple times.
+            if entry is None:
+                # We have proof now so regardless what TxState is, we can 'upgrade' it to
+                # StateSettled. This rests on the commitment that any of the following four tx
+                # States *will* Have tx bytedata i.e. "HasByteData" flag is set.
+                entry = self._transaction_cache.get_entry(tx_hash, TxFlags.STATE_UNCLEARED_MASK)
+                assert entry is not None, f"expected uncleared tx {hash_to_hex_str(tx_hash)}"
+                if entry.flags & TxFlags.HasByteData != 0:
+                    self._logger.debug("Fast_tracking entry to StateSettled: %r", entry)
+                else:
+                    self._logger.error("Transaction bytedata absent for %s %r",
+                        hash_to_hex_str(tx_hash), entry)
+                    continue
+            settled_entries.append(entry_data)
 
-        height, conf, _timestamp = self.get_tx_height(tx_hash)
-        self._logger.debug("add_transaction_proof %d %d %d", height, conf, timestamp)
-        self.trigger_callback('verified', tx_hash, height, conf, timestamp)
+        if not settled_entries:
+            return
+
+        # We only update a subset.
+        flags = TxFlags.HasHeight | TxFlags.HasPosition | TxFlags.StateSettled
+        self._transaction_cache.update([ (tx_hash, TxData(height=height, position=position),
+            None, flags) for (tx_hash, height, _timestamp, position, _proof_position, _branch)
+            in settled_entries ])
+        self._transaction_cache.update_proofs([ (tx_hash, TxProof(proof_position, branch))
+            for (tx_hash, _height, _timestamp, _position, proof_position, branch)
+            in settled_entries ])
+
+        for (tx_hash, _height, timestamp, _position, _proof_position, _branch) \
+                in settled_entries:
+            height, conf, _timestamp = self.get_tx_height(tx_hash)
+            self._logger.debug("add_transaction_proof %d %d %d", height, conf, timestamp)
+            self.trigger_callback('verified', tx_hash, height, conf, timestamp)
 
     def synchronize_incomplete_transaction(self, tx: Transaction) -> None:
         if tx.is_complete():
@@ -2829,13 +3766,21 @@ class Wallet(TriggeredCallbacks):
         self._logger.info(
             f'removing verification of {reorg_count} transactions above {above_height}')
 
+        # Reorgs come from the network, and accounts are all loaded when the wallet is started
+        # with one.
         if self._storage.get('deactivate_used_keys', False):
-            for account in self._accounts.values():
+            for account in self.get_loaded_accounts():
                 account.reactivate_reorged_keys(updated_tx_hashes)
 
     def resolve_xpubkey(self,
             x_pubkey: XPublicKey) -> Optional[Tuple[AbstractAccount, Optional[int]]]:
-        for account in self._accounts.values():
+        for account_id in sorted(self.get_account_ids()):
+            # Accounts that are not loaded yet are only loaded if they might have the key.
+            if not self._account_has_signature_candidate(account_id, x_pubkey):
+                continue
+            account = self.get_account(account_id)
+            if account is None:
+                continue
             for keystore in account.get_keystores():
                 if keystore.is_signature_candidate(x_pubkey):
                     if x_pubkey.kind() == XPublicKeyType.PRIVATE_KEY:
@@ -2848,6 +3793,24 @@ class Wallet(TriggeredCallbacks):
                     return account, keyinstance_id
         return None
 
+    def _account_has_signature_candidate(self, account_id: int, x_pubkey: XPublicKey) -> bool:
+        """
+        Whether the account might have the given key, without loading it. The keystores of
+        deterministic accounts are loaded with the wallet, but imported private keys are only
+        known to their loaded account.
+        """
+        with self._accounts_lock:
+            row = self._unrealised_account_rows.get(account_id)
+        if row is None:
+            return True
+        if row.default_masterkey_id is None:
+            return x_pubkey.kind() == XPublicKeyType.PRIVATE_KEY
+        keystore = self._keystores[row.default_masterkey_id]
+        keystores: Sequence[KeyStore] = [ keystore ]
+        if isinstance(keystore, Multisig_KeyStore):
+            keystores = keystore.get_cosigner_keystores()
+        return any(keystore.is_signature_candidate(x_pubkey) for keystore in keystores)
+
     def set_deactivate_used_keys(self, enabled: bool) -> None:
         current_setting = self._storage.get('deactivate_used_keys', None)
         if not enabled and current_setting is True:
@@ -2879,6 +3842,9 @@ class Wallet(TriggeredCallbacks):
         """
         return self._storage.get('tx_bytedata_cache_size', DEFAULT_TXDATA_CACHE_SIZE_MB)
 
+    def get_cache_statistics_for_tx_bytedata(self) -> CacheStatistics:
+        return self._transaction_cache.get_bytedata_cache_statistics()
+
     def set_cache_size_for_tx_bytedata(self, maximum_size: int, force_resize: bool=False) -> None:
         assert MINIMUM_TXDATA_CACHE_SIZE_MB <= maximum_size <= MAXIMUM_TXDATA_CACHE_SIZE_MB, \
             f"invalid cache size {maximum_size}"
@@ -2895,7 +3861,7 @@ class Wallet(TriggeredCallbacks):
     def get_request_response_counts(self) -> Tuple[int, int]:
         request_count = self.request_count
         response_count = self.response_count
-        for account in self.get_accounts():
+        for account in self.get_loaded_accounts():
             if account.request_count > account.response_count:
                 request_count += account.request_count
                 response_count += account.response_count
@@ -2910,7 +3876,7 @@ class Wallet(TriggeredCallbacks):
         # 1.3-related database fixups. We cannot put these in the migration as the master branch
         # with the 1.4 development may have users and we do not want to break the chain of
         # migration scripts and database versions.
-        if not len(self._accounts):
+        if not len(self.get_account_ids()):
             for wallet_event_row in self.read_wallet_events():
                 if wallet_event_row.event_type == WalletEventType.ACCOUNT_CREATION_HINT:
                     self.add_wallet_event_row = wallet_event_row
@@ -2924,9 +3890,16 @@ class Wallet(TriggeredCallbacks):
 
         if network is not None:
             network.add_wallet(self)
-        for account in self.get_accounts():
+        # Accounts have to be loaded to be synchronised, otherwise they are loaded on first use.
+        if network is not None:
+            self.get_accounts()
+        # Any account registered after this is started by the thread that loaded it.
+        with self._accounts_lock:
+            accounts = list(self._accounts.values())
+            self._started = True
+            self._stopped = False
+        for account in accounts:
             account.start(network)
-        self._stopped = False
 
     def stop(self) -> None:
         assert not self._stopped
@@ -2939,7 +3912,11 @@ class Wallet(TriggeredCallbacks):
         self._storage.put('stored_height', local_height)
         self._storage.put('last_tip_hash', chain_tip_hash.hex() if chain_tip_hash else None)
 
-        for account in self.get_accounts():
+        # Any account registered after this is not started by the thread that loaded it.
+        with self._accounts_lock:
+            accounts = list(self._accounts.values())
+            self._started = False
+        for account in accounts:
             account.stop()
         if self._network is not None:
             self._network.remove_wallet(self)
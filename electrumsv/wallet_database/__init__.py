@@ -1,5 +1,6 @@
-from .sqlite_support import DatabaseContext, SynchronousWriter, SqliteWriteDispatcher
+from .sqlite_support import (AsyncCompletion, DatabaseContext, SynchronousWriter,
+    SqliteWriteDispatcher)
 from .cache import TransactionCache, TransactionCacheEntry
 from .tables import (AccountTable, DataPackingError, InvalidDataError, KeyInstanceTable,
     MasterKeyTable, PaymentRequestTable, TransactionTable, TransactionDeltaTable,
-    TransactionOutputTable, TxData, TxProof, WalletDataTable)
+    TransactionOutputTable, TransactionWriteBatch, TxData, TxProof, WalletDataTable)
@@ -6,16 +6,20 @@ there will be no reads or
 
 import threading
 import time
-from typing import cast, Dict, Iterable, List, Optional, Sequence, Tuple
+from typing import Callable, cast, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from bitcoinx import double_sha256, hash_to_hex_str
 
 from ..constants import TxFlags, MAXIMUM_TXDATA_CACHE_SIZE_MB
 from ..logs import logs
 from ..transaction import Transaction
+from .sqlite_support import CombinedCompletion, CompletionWrapper
 from .tables import (CompletionCallbackType, InvalidDataError, MAGIC_UNTOUCHED_BYTEDATA,
-    MissingRowError, TransactionTable, TxData, TxProof, TransactionRow)
-from ..util.cache import LRUCache
+    MissingRowError, TransactionInputRow, TransactionTable, TxData, TxProof, TransactionRow)
+from ..util.cache import CacheStatistics, TransactionDataCache
+
+
+MetadataChangeCallbackType = Callable[[List[bytes]], None]
 
 
 class TransactionCacheEntry:
@@ -28,6 +32,20 @@ class TransactionCacheEntry:
         return f"TransactionCacheEntry({self.metadata}, {TxFlags.to_repr(self.flags)})"
 
 
+class _UnwrittenInputsCompletion(CompletionWrapper):
+    "Stops tracking the inputs of the written transactions, then passes on the completion."
+
+    def __init__(self, cache: "TransactionCache", input_rows: List[TransactionInputRow],
+            completion_callback: Optional[CompletionCallbackType]) -> None:
+        super().__init__(completion_callback)
+        self._cache = cache
+        self._input_rows = input_rows
+
+    def __call__(self, exc_value: Optional[Exception]) -> None:
+        self._cache._remove_unwritten_inputs(self._input_rows)
+        self._pass_on(exc_value)
+
+
 class TransactionCache:
     def __init__(self, store: TransactionTable, txdata_cache_size: Optional[int]=None) -> None:
         if txdata_cache_size is None:
@@ -35,10 +53,15 @@ class TransactionCache:
 
         self._logger = logs.get_logger("cache-tx")
         self._cache: Dict[bytes, TransactionCacheEntry] = {}
-        self._txdata_cache = LRUCache(max_size=txdata_cache_size)
+        self._txdata_cache = TransactionDataCache(max_size=txdata_cache_size)
         self._store = store
 
         self._lock = threading.RLock()
+        self._metadata_change_callback: Optional[MetadataChangeCallbackType] = None
+        # The inputs of added transactions that are not yet written to the database, by the
+        # hash of the transaction they spend from. The database is only consulted after these.
+        self._unwritten_inputs: Dict[bytes, List[Tuple[int, bytes]]] = {}
+        self._unwritten_inputs_lock = threading.Lock()
 
         self._logger.debug("caching all metadata records")
         self.get_metadatas()
@@ -49,16 +72,32 @@ class TransactionCache:
             self._logger.debug("attempting to cache unsettled transaction bytedata")
             rows = self._store.read(TxFlags.HasByteData, TxFlags.HasByteData|TxFlags.StateSettled)
             for row in rows:
-                self._txdata_cache.set(row[0], Transaction.from_bytes(row[1]))
+                self._txdata_cache.set_bytes(row[0], row[1])
             self._logger.debug("matched/cached %d unsettled transactions", len(rows))
 
     def set_store(self, store: TransactionTable) -> None:
         self._store = store
 
+    def set_metadata_change_callback(self,
+            callback: Optional[MetadataChangeCallbackType]) -> None:
+        """
+        The callback is given the hashes of transactions whose height or position has changed,
+        or that have been deleted. It is called with the cache lock held, so it should only
+        record the changes and not call back into the cache or take other locks.
+        """
+        self._metadata_change_callback = callback
+
+    def _notify_metadata_changes(self, tx_hashes: List[bytes]) -> None:
+        if self._metadata_change_callback is not None and len(tx_hashes):
+            self._metadata_change_callback(tx_hashes)
+
     def set_maximum_cache_size_for_bytedata(self, maximum_size: int,
             force_resize: bool=False) -> None:
         self._txdata_cache.set_maximum_size(maximum_size, force_resize)
 
+    def get_bytedata_cache_statistics(self) -> CacheStatistics:
+        return self._txdata_cache.get_statistics()
+
     def _validate_transaction_bytes(self, tx_hash: bytes, bytedata: Optional[bytes]) -> bool:
         if bytedata is None:
             return True
@@ -90,6 +129,36 @@ class TransactionCache:
         flags |= TxFlags.HasPosition if data.position is not None else 0
         return flags
 
+    @staticmethod
+    def _get_input_rows(tx_hash: bytes, tx: Transaction) -> List[TransactionInputRow]:
+        if tx.is_coinbase():
+            return []
+        return [ TransactionInputRow(txin.prev_hash, txin.prev_idx, tx_hash)
+            for txin in tx.inputs ]
+
+    def _add_unwritten_inputs(self, input_rows: List[TransactionInputRow],
+            completion_callback: Optional[CompletionCallbackType]) \
+                -> Optional[CompletionCallbackType]:
+        """
+        Track the inputs until they are written, returning the completion callback that the
+        write should be given in place of the caller's.
+        """
+        if not input_rows:
+            return completion_callback
+
+        with self._unwritten_inputs_lock:
+            for prev_hash, prev_idx, tx_hash in input_rows:
+                self._unwritten_inputs.setdefault(prev_hash, []).append((prev_idx, tx_hash))
+        return _UnwrittenInputsCompletion(self, input_rows, completion_callback)
+
+    def _remove_unwritten_inputs(self, input_rows: List[TransactionInputRow]) -> None:
+        with self._unwritten_inputs_lock:
+            for prev_hash, prev_idx, tx_hash in input_rows:
+                entries = self._unwritten_inputs[prev_hash]
+                entries.remove((prev_idx, tx_hash))
+                if not entries:
+                    del self._unwritten_inputs[prev_hash]
+
     @staticmethod
     def _validate_new_flags(tx_hash: bytes, flags: TxFlags) -> None:
         # All current states are expected to have bytedata.
@@ -102,17 +171,37 @@ class TransactionCache:
     def add_transaction(self, tx_hash: bytes, tx: Transaction,
             flags: TxFlags=TxFlags.Unset,
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
-        assert isinstance(tx, Transaction)
+        self.add_transactions([ (tx_hash, tx, flags) ], completion_callback)
 
+    def add_transactions(self, entries: List[Tuple[bytes, Transaction, TxFlags]],
+            completion_callback: Optional[CompletionCallbackType]=None) -> None:
+        """
+        Add the transaction data for the given transactions, whether they are new or already
+        have metadata entries. The data is written with at most one insert and one update, and
+        the completion callback is called once when both are done.
+        """
+        date_updated = self._store._get_current_timestamp()
+        inserts: List[Tuple[bytes, TxData, Transaction, TxFlags, Optional[str]]] = []
+        updates: List[Tuple[bytes, TxData, Optional[Transaction], TxFlags]] = []
         with self._lock:
-            date_updated = self._store._get_current_timestamp()
-            if tx_hash in self._cache:
-                self.update([ (tx_hash, TxData(date_added=date_updated, date_updated=date_updated),
-                    tx, flags | TxFlags.HasByteData) ], completion_callback=completion_callback)
-            else:
-                self.add([(tx_hash, TxData(date_added=date_updated, date_updated=date_updated),
-                        tx, flags | TxFlags.HasByteData, None)],
-                    completion_callback=completion_callback)
+            for tx_hash, tx, flags in entries:
+                assert isinstance(tx, Transaction)
+                metadata = TxData(date_added=date_updated, date_updated=date_updated)
+                if tx_hash in self._cache:
+                    updates.append((tx_hash, metadata, tx, flags | TxFlags.HasByteData))
+                else:
+                    inserts.append((tx_hash, metadata, tx, flags | TxFlags.HasByteData, None))
+
+            write_count = int(len(inserts) > 0) + int(len(updates) > 0)
+            write_callback: Optional[CompletionCallbackType] = completion_callback
+            if write_count > 1:
+                write_callback = CombinedCompletion(write_count, completion_callback)
+            if len(inserts):
+                self._add(inserts, completion_callback=write_callback)
+            # An update that changes nothing is not written and will never complete.
+            if len(updates) and self._update(updates, completion_callback=write_callback) == 0 \
+                    and write_callback is not None:
+                write_callback(None)
 
     def add(self, inserts: List[Tuple[bytes, TxData, Transaction, TxFlags, Optional[str]]],
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
@@ -128,6 +217,7 @@ class TransactionCache:
         overwrite them.
         """
         date_added = self._store._get_current_timestamp()
+        input_rows: List[TransactionInputRow] = []
         for i, (tx_hash, metadata, tx, add_flags, description) in enumerate(inserts):
             assert tx_hash not in self._cache, \
                 f"Tx {hash_to_hex_str(tx_hash)} found in cache unexpectedly"
@@ -142,11 +232,14 @@ class TransactionCache:
             self._cache[tx_hash] = TransactionCacheEntry(metadata, flags)
             bytedata = None
             if tx is not None:
-                self._txdata_cache.set(tx_hash, tx)
                 bytedata = tx.to_bytes()
+                self._txdata_cache.set(tx_hash, tx, bytedata)
+                input_rows.extend(self._get_input_rows(tx_hash, tx))
             inserts[i] = TransactionRow(  # type:ignore
                 tx_hash, metadata, bytedata, flags, description)
-        self._store.create(inserts, completion_callback=completion_callback)  # type:ignore
+        completion_callback = self._add_unwritten_inputs(input_rows, completion_callback)
+        self._store.create(inserts, completion_callback=completion_callback,  # type:ignore
+            input_rows=input_rows)
 
     def update(self, updates: List[Tuple[bytes, TxData, Optional[Transaction], TxFlags]],
             completion_callback: Optional[CompletionCallbackType]=None) -> int:
@@ -169,6 +262,8 @@ class TransactionCache:
         update_map = { t[0]: t for t in updates }
         desired_update_hashes = set(update_map)
         updated_entries: List[Tuple[bytes, TxData, Optional[bytes], TxFlags]] = []
+        input_rows: List[TransactionInputRow] = []
+        moved_hashes: List[bytes] = []
 
         date_updated = self._store._get_current_timestamp()
         for tx_hash, entry in self._get_entries(tx_hashes=desired_update_hashes,
@@ -206,13 +301,17 @@ class TransactionCache:
             self._logger.debug("_update: %s %r %s %r %r", hash_to_hex_str(tx_hash),
                 incoming_metadata, TxFlags.to_repr(incoming_flags), entry, new_entry)
             self._cache[tx_hash] = new_entry
+            if entry.metadata.height != height or entry.metadata.position != position:
+                moved_hashes.append(tx_hash)
             if incoming_tx:  # serialize txs -> binary before all db writes
                 incoming_bytedata: Optional[bytes] = incoming_tx.to_bytes()
             else:
                 incoming_bytedata = None
 
             if incoming_flags & TxFlags.HasByteData:
-                self._txdata_cache.set(tx_hash, incoming_tx)
+                self._txdata_cache.set(tx_hash, incoming_tx, incoming_bytedata)
+                if incoming_tx is not None:
+                    input_rows.extend(self._get_input_rows(tx_hash, incoming_tx))
             elif flags & TxFlags.HasByteData:
                 # Indicate the user is not changing the bytedata, it's a metadata/flags update.
                 incoming_bytedata = MAGIC_UNTOUCHED_BYTEDATA
@@ -221,7 +320,10 @@ class TransactionCache:
         # The reason we don't dispatch metadata and entry updates as separate calls
         # is that there's no way of reusing a completion context for more than one thing.
         if len(updated_entries):
-            self._store.update(updated_entries, completion_callback=completion_callback)
+            completion_callback = self._add_unwritten_inputs(input_rows, completion_callback)
+            self._store.update(updated_entries, completion_callback=completion_callback,
+                input_rows=input_rows)
+        self._notify_metadata_changes(moved_hashes)
         return len(updated_entries)
 
     # TODO: This is problematic as it discards non-metadata flags unless the caller provides a mask
@@ -251,15 +353,21 @@ class TransactionCache:
 
     def update_proof(self, tx_hash: bytes, proof: TxProof,
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
+        self.update_proofs([ (tx_hash, proof) ], completion_callback)
+
+    def update_proofs(self, entries: List[Tuple[bytes, TxProof]],
+            completion_callback: Optional[CompletionCallbackType]=None) -> None:
         with self._lock:
             date_updated = self._store._get_current_timestamp()
-            entry = self._get_entry(tx_hash)
-            assert entry is not None
-            metadata = entry.metadata
-            entry.metadata = TxData(metadata.height, metadata.position, metadata.fee,
-                metadata.date_added, date_updated)
-            self._store.update_proof([ (tx_hash, proof, date_updated) ],
-                completion_callback=completion_callback)
+            store_entries = []
+            for tx_hash, proof in entries:
+                entry = self._get_entry(tx_hash)
+                assert entry is not None
+                metadata = entry.metadata
+                entry.metadata = TxData(metadata.height, metadata.position, metadata.fee,
+                    metadata.date_added, date_updated)
+                store_entries.append((tx_hash, proof, date_updated))
+            self._store.update_proof(store_entries, completion_callback=completion_callback)
 
     def delete(self, tx_hash: bytes,
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
@@ -268,6 +376,24 @@ class TransactionCache:
             del self._cache[tx_hash]
             self._txdata_cache.set(tx_hash, None)
             self._store.delete([ tx_hash ], completion_callback=completion_callback)
+            self._notify_metadata_changes([ tx_hash ])
+
+    def get_spending_transactions(self, tx_hash: bytes) -> Dict[int, List[bytes]]:
+        """
+        The added transactions that spend outputs of the given transaction, mapped by output
+        index. An output can have more than one if there are conflicting transactions.
+        """
+        # The unwritten inputs are looked at before the database, as they are forgotten when
+        # they are written.
+        with self._unwritten_inputs_lock:
+            entries = list(self._unwritten_inputs.get(tx_hash, []))
+        entries.extend(self._store.read_spending_transactions(tx_hash))
+        results: Dict[int, List[bytes]] = {}
+        for prev_idx, spend_tx_hash in entries:
+            spend_tx_hashes = results.setdefault(prev_idx, [])
+            if spend_tx_hash not in spend_tx_hashes:
+                spend_tx_hashes.append(spend_tx_hash)
+        return results
 
     def get_flags(self, tx_hash: bytes) -> Optional[TxFlags]:
         # We cache all metadata, so this can avoid touching the database.
@@ -300,8 +426,7 @@ class TransactionCache:
             if mask is not None and (mask & TxFlags.HasByteData) == 0:
                 return entry
             # If they do, and we have it cached, then give them the entry.
-            tx = self._txdata_cache.get(tx_hash)
-            if tx is not None:
+            if tx_hash in self._txdata_cache:
                 return entry
             force_store_fetch = True
         if not force_store_fetch:
@@ -316,7 +441,7 @@ class TransactionCache:
                 entry = TransactionCacheEntry(metadata, flags_get)
                 self._cache.update({ tx_hash: entry })
                 if bytedata is not None:
-                    self._txdata_cache.set(tx_hash, Transaction.from_bytes(bytedata))
+                    self._txdata_cache.set_bytes(tx_hash, bytedata)
                 self._logger.debug("get_entry/cache_change: %r", (hash_to_hex_str(tx_hash),
                     entry, TxFlags.to_repr(flags), TxFlags.to_repr(mask)))
                 # If they filter the entry they request, we only give them a matched result.
@@ -394,7 +519,7 @@ class TransactionCache:
                         bytedata = cast(bytes, row[1])
                         tx = Transaction.from_bytes(bytedata)
                         results.append((row[0], tx))  # type: ignore
-                        self._txdata_cache.set(row[0], tx)
+                        self._txdata_cache.set(row[0], tx, bytedata)
         return results
 
     def get_entries(self, flags: Optional[TxFlags]=None, mask: Optional[TxFlags]=None,
@@ -506,8 +631,6 @@ class TransactionCache:
         results = self.get_metadatas(
             flags=TxFlags.HasByteData | TxFlags.HasHeight,
             mask=TxFlags.HasByteData | TxFlags.HasPosition | TxFlags.HasHeight)
-        if len(results) > 200:
-            results = results[:200]
         return [ (tx_hash, self._cache[tx_hash]) for (tx_hash, metadata) in results
             if 0 < cast(int, metadata.height) <= watermark_height ]
 
@@ -536,4 +659,5 @@ class TransactionCache:
             if len(store_updates):
                 self._store.update_metadata(store_updates,
                     completion_callback=completion_callback)
+            self._notify_metadata_changes([ t[0] for t in store_updates ])
             return len(store_updates), [tx_hash for tx_hash, metadata, flags in store_updates]
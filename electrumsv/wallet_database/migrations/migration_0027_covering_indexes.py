@@ -0,0 +1,46 @@
+import json
+try:
+    # Linux expects the latest package version of 3.31.1 (as of p)
+    import pysqlite3 as sqlite3
+except ModuleNotFoundError:
+    # MacOS expects the latest brew version of 3.32.1 (as of 2020-07-10).
+    # Windows builds use the official Python 3.7.9 builds and version of 3.31.1.
+    import sqlite3 # type: ignore
+import time
+
+MIGRATION = 27
+
+def execute(conn: sqlite3.Connection) -> None:
+    # Account-scoped queries join from the account to its keys. Including the flags allows the
+    # key activity filters to be applied without reading the key rows.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_KeyInstances_account "
+        "ON KeyInstances(account_id, flags)")
+
+    # The unique index only serves lookups by key, this serves lookups and joins by transaction.
+    # It includes the value so that transaction totals can be summed from the index alone.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_TransactionDeltas_tx_hash "
+        "ON TransactionDeltas(tx_hash, keyinstance_id, value_delta)")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_TransactionOutputs_keyinstance "
+        "ON TransactionOutputs(keyinstance_id, flags)")
+
+    # The transaction metadata is read for all transactions when the wallet is loaded, and the
+    # state filters test flags with bit masks which no index can seek on. This covers all the
+    # metadata columns so that neither reads the rows, which would otherwise mean stepping over
+    # the overflow pages of the transaction data that precede them.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_Transactions_flags "
+        "ON Transactions(flags, block_height, block_position, fee_value, date_created, "
+            "date_updated, tx_hash)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_Transactions_description "
+        "ON Transactions(tx_hash, description) WHERE description IS NOT NULL")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_PaymentRequests_keyinstance "
+        "ON PaymentRequests(keyinstance_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_Invoices_account ON Invoices(account_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_Invoices_tx_hash ON Invoices(tx_hash)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_WalletEvents_account "
+        "ON WalletEvents(account_id, date_created)")
+
+    date_updated = int(time.time())
+    conn.execute("UPDATE WalletData SET value=?, date_updated=? WHERE key=?",
+        [json.dumps(MIGRATION),date_updated,"migration"])
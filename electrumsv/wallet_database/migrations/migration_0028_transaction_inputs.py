@@ -0,0 +1,51 @@
+import json
+try:
+    # Linux expects the latest package version of 3.31.1 (as of p)
+    import pysqlite3 as sqlite3
+except ModuleNotFoundError:
+    # MacOS expects the latest brew version of 3.32.1 (as of 2020-07-10).
+    # Windows builds use the official Python 3.7.9 builds and version of 3.31.1.
+    import sqlite3 # type: ignore
+import time
+from typing import List, Tuple
+
+from bitcoinx import Tx
+
+MIGRATION = 28
+
+def execute(conn: sqlite3.Connection) -> None:
+    # The outputs spent by each transaction that has data, so that the transaction that spends
+    # a given output can be found without parsing the transactions that might.
+    conn.execute("CREATE TABLE IF NOT EXISTS TransactionInputs ("
+        "prev_hash BLOB NOT NULL,"
+        "prev_idx INTEGER NOT NULL,"
+        "tx_hash BLOB NOT NULL,"
+        "PRIMARY KEY (prev_hash, prev_idx, tx_hash),"
+        "FOREIGN KEY (tx_hash) REFERENCES Transactions (tx_hash)"
+    ") WITHOUT ROWID")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_TransactionInputs_tx_hash "
+        "ON TransactionInputs(tx_hash)")
+
+    cursor = conn.execute("SELECT tx_hash, tx_data FROM Transactions "
+        "WHERE tx_data IS NOT NULL")
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        input_rows: List[Tuple[bytes, int, bytes]] = []
+        for tx_hash, tx_data in rows:
+            try:
+                tx = Tx.from_bytes(tx_data)
+            except Exception:
+                # Data that cannot be parsed cannot be spending any of our outputs either.
+                continue
+            if tx.is_coinbase():
+                continue
+            input_rows.extend((txin.prev_hash, txin.prev_idx, tx_hash) for txin in tx.inputs)
+        conn.executemany("INSERT OR IGNORE INTO TransactionInputs (prev_hash, prev_idx, tx_hash) "
+            "VALUES (?, ?, ?)", input_rows)
+    cursor.close()
+
+    date_updated = int(time.time())
+    conn.execute("UPDATE WalletData SET value=?, date_updated=? WHERE key=?",
+        [json.dumps(MIGRATION),date_updated,"migration"])
@@ -1,3 +1,4 @@
+import asyncio
 from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 import queue
@@ -11,16 +12,33 @@ except ModuleNotFoundError:
 import threading
 import time
 import traceback
-from typing import Any, Callable, List, NamedTuple, Optional, Tuple, Set
+from typing import (Any, Callable, Dict, Generator, List, NamedTuple, Optional, Tuple, Set,
+    TypeVar)
 
 from ..constants import DATABASE_EXT
 from ..logs import logs
+from ..metrics import metrics
+
+
+commit_time_metric = metrics.histogram("electrumsv_database_commit_seconds",
+    "The time taken to apply and commit each batch of database writes.")
+batch_size_metric = metrics.histogram("electrumsv_database_batch_entries",
+    "The number of writes committed in each batch.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+write_failure_metric = metrics.counter("electrumsv_database_write_failures_total",
+    "The number of database writes that failed and were discarded.")
+retried_batch_metric = metrics.counter("electrumsv_database_retried_batches_total",
+    "The number of write batches that failed and were split up to be retried.")
 
 
 class LeakedSQLiteConnectionError(Exception):
     pass
 
 
+class ConnectionPoolTimeoutError(Exception):
+    pass
+
+
 # TODO(rt12): Remove the special case exception for WAL journal mode and see if the in-memory
 #     databases work now that there's locking preventing concurrent enabling of the WAL mode,
 #     in addition to the backing off of retries at enabling it. I vaguely recall that it perhaps
@@ -88,6 +106,101 @@ class WriteEntryType(NamedTuple):
 
 CompletionEntryType = Tuple[CompletionCallbackType, Optional[Exception]]
 
+T = TypeVar('T')
+ReadCallbackType = Callable[..., T]
+
+
+class AsyncCompletion:
+    """
+    A completion callback that resolves an asyncio future, for coroutines that want to await
+    the completion of a write. It must be created on the thread running the event loop.
+
+    The writer thread invokes these directly rather than through the completion thread pool, as
+    all they do is schedule the resolution of the future on the event loop.
+    """
+
+    def __init__(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._future: asyncio.Future = self._loop.create_future()
+
+    def __call__(self, exc_value: Optional[Exception]) -> None:
+        self._loop.call_soon_threadsafe(self._resolve, exc_value)
+
+    def __await__(self) -> Generator[Any, None, None]:
+        return self._future.__await__()
+
+    def _resolve(self, exc_value: Optional[Exception]) -> None:
+        # The awaiting coroutine may have been cancelled in the meantime.
+        if self._future.done():
+            return
+        if exc_value is None:
+            self._future.set_result(None)
+        else:
+            self._future.set_exception(exc_value)
+
+
+class CompletionWrapper:
+    """
+    A completion callback that does some bookkeeping of its own and passes the completion on to
+    the callback it wraps. The writer thread invokes it directly if what it wraps is an
+    `AsyncCompletion` or nothing at all, so the bookkeeping must be quick and thread-safe.
+    """
+
+    def __init__(self, completion_callback: Optional[CompletionCallbackType]) -> None:
+        self.completion_callback = completion_callback
+
+    def __call__(self, exc_value: Optional[Exception]) -> None:
+        raise NotImplementedError
+
+    def _pass_on(self, exc_value: Optional[Exception]) -> None:
+        if self.completion_callback is not None:
+            self.completion_callback(exc_value)
+
+
+class CombinedCompletion(CompletionWrapper):
+    """
+    A completion callback for several writes, that passes on the completion once all of them
+    have completed along with the first exception any of them raised.
+    """
+
+    def __init__(self, write_count: int,
+            completion_callback: Optional[CompletionCallbackType]) -> None:
+        super().__init__(completion_callback)
+        self._write_count = write_count
+        self._write_exception: Optional[Exception] = None
+        self._lock = threading.Lock()
+
+    def __call__(self, exc_value: Optional[Exception]) -> None:
+        with self._lock:
+            self._write_count -= 1
+            if self._write_exception is None:
+                self._write_exception = exc_value
+            if self._write_count > 0:
+                return
+        self._pass_on(self._write_exception)
+
+
+def is_direct_completion(completion_callback: CompletionCallbackType) -> bool:
+    "Whether the writer thread can invoke the completion callback itself."
+    callback: Optional[CompletionCallbackType] = completion_callback
+    while isinstance(callback, CompletionWrapper):
+        callback = callback.completion_callback
+    return callback is None or isinstance(callback, AsyncCompletion)
+
+
+class WriteDispatcherStatistics(NamedTuple):
+    batch_count: int
+    entry_count: int
+    failed_entry_count: int
+    retried_batch_count: int
+    queue_depth: int
+    batch_size_limit: int
+    last_batch_size: int
+    last_commit_ms: float
+    maximum_commit_ms: float
+    total_commit_ms: float
+
+
 class SqliteWriteDispatcher:
     """
     This is a relatively simple write batcher for Sqlite that keeps all the writes on one thread,
@@ -95,55 +208,70 @@ class SqliteWriteDispatcher:
     get notified on completion. If an exception happens in the course of a writer, the exception
     is passed back to the invoker in the completion notification.
 
-    Completion notifications are done in a thread so as to not block the write dispatcher.
-
-    TODO: Allow writes to be wrapped with async logic so that async coroutines can do writes
-    in their natural fashion.
+    Completion notifications are done in a thread so as to not block the write dispatcher. The
+    exception is `AsyncCompletion` callbacks, which are resolved on the asyncio event loop of the
+    coroutine awaiting them and are safe to invoke directly, and any `CompletionWrapper`
+    callbacks that wrap them.
+
+    Writes are grouped into a batch until it reaches the current entry limit, the total of the
+    size hints reaches `MAXIMUM_BATCH_BYTES`, or `MAXIMUM_BATCH_DELAY` seconds have been spent
+    gathering it. The entry limit adapts to the observed commit latency,
+    shrinking when commits take longer than `TARGET_COMMIT_TIME` and growing back towards
+    `MAXIMUM_BATCH_SIZE` when they are fast. If a batch fails it is split in half and each half
+    is retried, until the failing entry is isolated and reported to its invoker. The other
+    entries are committed as normal and later batches go back to the full entry limit.
     """
 
+    MINIMUM_BATCH_SIZE = 10
+    MAXIMUM_BATCH_SIZE = 500
+    MAXIMUM_BATCH_BYTES = 8 * 1024 * 1024
+    MAXIMUM_BATCH_DELAY = 0.05
+    TARGET_COMMIT_TIME = 0.2
+
     def __init__(self, db_context: "DatabaseContext") -> None:
         self._db_context = db_context
         self._logger = logs.get_logger("sqlite-writer")
 
         self._writer_queue: "queue.Queue[WriteEntryType]" = queue.Queue()
-        self._writer_thread = threading.Thread(target=self._writer_thread_main, daemon=True)
+        self._writer_thread = threading.Thread(target=self._writer_thread_main,
+            name="sqlite-writer", daemon=True)
         self._writer_loop_event = threading.Event()
 
-        self._callback_thread_pool = ThreadPoolExecutor()
+        self._callback_thread_pool = ThreadPoolExecutor(thread_name_prefix="sqlite-callback")
 
         self._allow_puts = True
         self._is_alive = True
         self._exit_when_empty = False
 
+        self._batch_size_limit = self.MAXIMUM_BATCH_SIZE
+        self._statistics_lock = threading.Lock()
+        self._batch_count = 0
+        self._entry_count = 0
+        self._failed_entry_count = 0
+        self._retried_batch_count = 0
+        self._last_batch_size = 0
+        self._last_commit_ms = 0.0
+        self._maximum_commit_ms = 0.0
+        self._total_commit_ms = 0.0
+
         self._writer_thread.start()
 
     def _writer_thread_main(self) -> None:
         self._db: sqlite3.Connection = self._db_context.acquire_connection()
 
-        maximum_batch_size = 10
-        write_entries: List[WriteEntryType] = []
-        write_entry_backlog: List[WriteEntryType] = []
+        # Batches split from a failed batch, these are applied before any new writes.
+        retry_batches: List[List[WriteEntryType]] = []
         while self._is_alive:
             self._writer_loop_event.set()
 
-            if len(write_entry_backlog):
-                assert maximum_batch_size == 1
-                write_entries = [ write_entry_backlog.pop(0) ]
+            if len(retry_batches):
+                write_entries = retry_batches.pop(0)
             else:
-                # Block until we have at least one write action. If we already have write
-                # actions at this point, it is because we need to retry after a transaction
-                # was rolled back.
-                try:
-                    write_entry: WriteEntryType = self._writer_queue.get(timeout=0.1)
-                except queue.Empty:
+                write_entries = self._gather_batch()
+                if not len(write_entries):
                     if self._exit_when_empty:
                         return
                     continue
-                write_entries = [ write_entry ]
-
-            # Gather the rest of the batch for this transaction.
-            while len(write_entries) < maximum_batch_size and not self._writer_queue.empty():
-                write_entries.append(self._writer_queue.get_nowait())
 
             # Using the connection as a context manager, apply the batch as a transaction.
             time_start = time.time()
@@ -162,26 +290,87 @@ class SqliteWriteDispatcher:
             except Exception as e:
                 # Exception: This is caught because we need to relay any exception to the
                 # calling context's completion notification callback.
-                self._logger.exception("Database write failure", exc_info=e)
                 # The transaction was rolled back.
                 if len(write_entries) > 1:
-                    self._logger.debug("Retrying with batch size of 1")
-                    # We're going to try and reapply the write actions one by one.
-                    maximum_batch_size = 1
-                    write_entry_backlog = write_entries
+                    # Bisect the batch and retry each half, narrowing down on the failing entry
+                    # without giving up on batching the remaining entries.
+                    self._logger.debug("Batch of %d writes failed, retrying as two halves",
+                        len(write_entries))
+                    middle = len(write_entries) // 2
+                    retry_batches[0:0] = [ write_entries[:middle], write_entries[middle:] ]
+                    with self._statistics_lock:
+                        self._retried_batch_count += 1
+                    retried_batch_metric.inc()
                     continue
-                # We applied the batch actions one by one. If there was an error with this action
-                # then we've logged it, so we can discard it for lack of any other option.
+                # This is the isolated failing write action. We've logged it, so we can discard
+                # it for lack of any other option.
+                self._logger.exception("Database write failure", exc_info=e)
+                with self._statistics_lock:
+                    self._failed_entry_count += 1
+                write_failure_metric.inc()
                 if write_entries[0][1] is not None:
                     completion_callbacks.append((write_entries[0][1], e))
             else:
-                if len(write_entries):
-                    time_ms = int((time.time() - time_start) * 1000)
-                    self._logger.debug("Invoked %d write callbacks (hinted at %d bytes) in %d ms",
-                        len(write_entries), total_size_hint, time_ms)
+                time_ms = (time.time() - time_start) * 1000
+                self._record_batch(len(write_entries), time_ms)
+                self._logger.debug("Invoked %d write callbacks (hinted at %d bytes) in %d ms, "
+                    "%d writes queued", len(write_entries), total_size_hint, time_ms,
+                    self._writer_queue.qsize())
+
+            for completion_callback, exc_value in completion_callbacks:
+                if is_direct_completion(completion_callback):
+                    self._dispatch_callback(completion_callback, exc_value)
+                else:
+                    self._callback_thread_pool.submit(self._dispatch_callback,
+                        completion_callback, exc_value)
 
-            for dispatchable_callback in completion_callbacks:
-                self._callback_thread_pool.submit(self._dispatch_callback, *dispatchable_callback)
+    def _gather_batch(self) -> List[WriteEntryType]:
+        # Block until we have at least one write action.
+        try:
+            write_entry: WriteEntryType = self._writer_queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+
+        write_entries = [ write_entry ]
+        total_size_hint = write_entry.size_hint
+        deadline = time.time() + self.MAXIMUM_BATCH_DELAY
+        # Gather the rest of the batch for this transaction.
+        while len(write_entries) < self._batch_size_limit and \
+                total_size_hint < self.MAXIMUM_BATCH_BYTES and time.time() < deadline:
+            try:
+                write_entry = self._writer_queue.get_nowait()
+            except queue.Empty:
+                break
+            write_entries.append(write_entry)
+            total_size_hint += write_entry.size_hint
+        return write_entries
+
+    def _record_batch(self, batch_size: int, time_ms: float) -> None:
+        # Adapt the entry limit to the commit latency. The limit is only grown when it was what
+        # constrained the batch, otherwise the queue was draining fine anyway.
+        if time_ms > self.TARGET_COMMIT_TIME * 1000:
+            self._batch_size_limit = max(self.MINIMUM_BATCH_SIZE, self._batch_size_limit // 2)
+        elif batch_size >= self._batch_size_limit and \
+                time_ms < self.TARGET_COMMIT_TIME * 500:
+            self._batch_size_limit = min(self.MAXIMUM_BATCH_SIZE,
+                self._batch_size_limit + max(1, self._batch_size_limit // 4))
+
+        with self._statistics_lock:
+            self._batch_count += 1
+            self._entry_count += batch_size
+            self._last_batch_size = batch_size
+            self._last_commit_ms = time_ms
+            self._maximum_commit_ms = max(self._maximum_commit_ms, time_ms)
+            self._total_commit_ms += time_ms
+        commit_time_metric.observe(time_ms / 1000)
+        batch_size_metric.observe(batch_size)
+
+    def get_statistics(self) -> WriteDispatcherStatistics:
+        with self._statistics_lock:
+            return WriteDispatcherStatistics(self._batch_count, self._entry_count,
+                self._failed_entry_count, self._retried_batch_count, self._writer_queue.qsize(),
+                self._batch_size_limit, self._last_batch_size, self._last_commit_ms,
+                self._maximum_commit_ms, self._total_commit_ms)
 
     def _dispatch_callback(self, callback: CompletionCallbackType,
             exc_value: Optional[Exception]) -> None:
@@ -218,6 +407,19 @@ class SqliteWriteDispatcher:
         return not self._is_alive
 
 
+class ConnectionPoolStatistics(NamedTuple):
+    connection_count: int
+    idle_count: int
+    acquire_count: int
+    created_count: int
+    wait_count: int
+    total_wait_ms: float
+    maximum_wait_ms: float
+    read_count: int
+    total_read_ms: float
+    maximum_read_ms: float
+
+
 class JournalModes(Enum):
     DELETE = "DELETE"
     TRUNCATE = "TRUNCATE"
@@ -228,60 +430,140 @@ class JournalModes(Enum):
 
 
 class DatabaseContext:
+    """
+    The connections to a wallet database are pooled, up to `MAXIMUM_CONNECTION_COUNT` of them.
+    When they are all in use, anything acquiring a connection waits for one to be released,
+    for at most `CONNECTION_WAIT_TIMEOUT` seconds. Released connections are preferentially given
+    back to the thread that last used them, which keeps reader threads on the same connection
+    along with its page cache and prepared statements.
+    """
+
     MEMORY_PATH = ":memory:"
     JOURNAL_MODE = JournalModes.WAL
 
-    SQLITE_CONN_POOL_SIZE = 0
+    MAXIMUM_CONNECTION_COUNT = 32
+    CONNECTION_WAIT_TIMEOUT = 10.0
+    # The number of prepared statements cached by each connection.
+    STATEMENT_CACHE_SIZE = 256
+    # Negative values are in KiB, positive values in pages.
+    CACHE_SIZE = -8 * 1024
+    MMAP_SIZE = 64 * 1024 * 1024
+    TEMP_STORE = "MEMORY"
+
+    READER_THREAD_COUNT = 4
 
     def __init__(self, wallet_path: str) -> None:
         if not self.is_special_path(wallet_path) and not wallet_path.endswith(DATABASE_EXT):
             wallet_path += DATABASE_EXT
         self._db_path = wallet_path
-        self._connection_pool: queue.Queue = queue.Queue()
+        # The idle connections are ordered from least to most recently released.
+        self._connection_pool: List[sqlite3.Connection] = []
         self._active_connections: Set = set()
+        self._connection_threads: Dict[sqlite3.Connection, int] = {}
+        self._connection_count = 0
+        self._connection_condition = threading.Condition()
         # self._debug_texts = {}
 
+        self._acquire_count = 0
+        self._created_count = 0
+        self._wait_count = 0
+        self._total_wait_ms = 0.0
+        self._maximum_wait_ms = 0.0
+        self._read_count = 0
+        self._total_read_ms = 0.0
+        self._maximum_read_ms = 0.0
+
         self._logger = logs.get_logger("sqlite-context")
         self._lock = threading.Lock()
         self._write_dispatcher = SqliteWriteDispatcher(self)
+        self._reader_thread_pool = ThreadPoolExecutor(max_workers=self.READER_THREAD_COUNT,
+            thread_name_prefix="sqlite-reader")
 
     def acquire_connection(self) -> sqlite3.Connection:
-        try:
-            conn = self._connection_pool.get_nowait()
-            self._active_connections.add(conn)
-            return conn
-        except queue.Empty as e:
-            self.increase_connection_pool()
-            conn = self._connection_pool.get_nowait()
+        thread_id = threading.get_ident()
+        time_start = time.time()
+        did_wait = False
+        with self._connection_condition:
+            while True:
+                if len(self._connection_pool):
+                    conn = self._take_idle_connection(thread_id)
+                    break
+                if self._connection_count < self.MAXIMUM_CONNECTION_COUNT:
+                    # Reserve the connection, it is created outside of the lock.
+                    self._connection_count += 1
+                    conn = None
+                    break
+                time_remaining = self.CONNECTION_WAIT_TIMEOUT - (time.time() - time_start)
+                if time_remaining <= 0:
+                    raise ConnectionPoolTimeoutError("Timed out waiting for one of "
+                        f"{self._connection_count} database connections to be released")
+                did_wait = True
+                self._connection_condition.wait(time_remaining)
+
+            self._acquire_count += 1
+            if did_wait:
+                wait_ms = (time.time() - time_start) * 1000
+                self._wait_count += 1
+                self._total_wait_ms += wait_ms
+                self._maximum_wait_ms = max(self._maximum_wait_ms, wait_ms)
+
+        if conn is None:
+            try:
+                conn = self._create_connection()
+            except Exception:
+                with self._connection_condition:
+                    self._connection_count -= 1
+                    self._connection_condition.notify()
+                raise
+
+        with self._connection_condition:
+            self._connection_threads[conn] = thread_id
             self._active_connections.add(conn)
-            return conn
+        return conn
 
-    def release_connection(self, connection: sqlite3.Connection) -> None:
-        self._active_connections.remove(connection)
-        self._connection_pool.put(connection)
+    def _take_idle_connection(self, thread_id: int) -> sqlite3.Connection:
+        # Prefer the most recently released connection that was last used by this thread,
+        # otherwise the most recently released connection.
+        for i in range(len(self._connection_pool)-1, -1, -1):
+            if self._connection_threads.get(self._connection_pool[i]) == thread_id:
+                return self._connection_pool.pop(i)
+        return self._connection_pool.pop()
 
-    def increase_connection_pool(self) -> None:
-        """adds 1 more connection to the pool"""
-        self.SQLITE_CONN_POOL_SIZE += 1
+    def release_connection(self, connection: sqlite3.Connection) -> None:
+        with self._connection_condition:
+            self._active_connections.remove(connection)
+            self._connection_pool.append(connection)
+            self._connection_condition.notify()
 
+    def _create_connection(self) -> sqlite3.Connection:
         # debug_text = traceback.format_stack()
         is_special_path = self.is_special_path(self._db_path)
         connection = sqlite3.connect(self._db_path, check_same_thread=False,
-            isolation_level=None, uri=is_special_path)
+            isolation_level=None, uri=is_special_path,
+            cached_statements=self.STATEMENT_CACHE_SIZE)
         connection.execute("PRAGMA busy_timeout=5000;")
         connection.execute("PRAGMA foreign_keys=ON;")
         # We do not enable journaling for in-memory databases. It resulted in 'database is locked'
         # errors. Perhaps it works now with the locking and backoff retries.
         if not self.is_special_path(self._db_path):
             self._ensure_journal_mode(connection)
+            connection.execute(f"PRAGMA mmap_size={self.MMAP_SIZE};")
+        # These read the schema, which holds the database open in a way that prevents other
+        # connections from switching the journal mode. So they must come after that.
+        connection.execute(f"PRAGMA cache_size={self.CACHE_SIZE};")
+        connection.execute(f"PRAGMA temp_store={self.TEMP_STORE};")
 
         # self._debug_texts[connection] = debug_text
-        self._connection_pool.put(connection)
+        with self._connection_condition:
+            self._created_count += 1
+        return connection
 
-    def decrease_connection_pool(self) -> None:
-        """release 1 more connection from the pool - raises empty queue error"""
-        connection = self._connection_pool.get_nowait()
-        connection.close()
+    def get_pool_statistics(self) -> ConnectionPoolStatistics:
+        with self._connection_condition:
+            return ConnectionPoolStatistics(self._connection_count, len(self._connection_pool),
+                self._acquire_count, self._created_count, self._wait_count, self._total_wait_ms,
+                self._maximum_wait_ms, self._read_count, self._total_read_ms,
+                self._maximum_read_ms)
 
     def _ensure_journal_mode(self, connection: sqlite3.Connection) -> None:
         with self._lock:
@@ -330,16 +612,55 @@ class DatabaseContext:
         self._write_dispatcher.put(WriteEntryType(write_callback, completion_callback,
             size_hint))
 
+    async def write(self, write_callback: WriteCallbackType, size_hint: int=0) -> None:
+        """
+        Queue a write and wait for it to be committed. Any exception raised in applying the
+        write is raised here.
+        """
+        completion = AsyncCompletion()
+        self.queue_write(write_callback, completion, size_hint)
+        await completion
+
+    async def read(self, read_callback: ReadCallbackType[T], *args: Any) -> T:
+        """
+        Call `read_callback(connection, *args)` on a reader thread with a pooled connection and
+        return what it returns, without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader_thread_pool, self._read, read_callback,
+            args)
+
+    def _read(self, read_callback: ReadCallbackType[T], args: Tuple[Any, ...]) -> T:
+        connection = self.acquire_connection()
+        time_start = time.time()
+        try:
+            return read_callback(connection, *args)
+        finally:
+            read_ms = (time.time() - time_start) * 1000
+            self.release_connection(connection)
+            with self._connection_condition:
+                self._read_count += 1
+                self._total_read_ms += read_ms
+                self._maximum_read_ms = max(self._maximum_read_ms, read_ms)
+
+    def get_write_statistics(self) -> WriteDispatcherStatistics:
+        return self._write_dispatcher.get_statistics()
+
     def close(self) -> None:
         self._write_dispatcher.stop()
+        self._reader_thread_pool.shutdown(wait=True)
 
         # Force close all outstanding connections
         outstanding_connections = list(self._active_connections)
         for conn in outstanding_connections:
             self.release_connection(conn)
 
-        for conn in range(self.SQLITE_CONN_POOL_SIZE):
-            self.decrease_connection_pool()
+        with self._connection_condition:
+            for conn in self._connection_pool:
+                conn.close()
+            self._connection_pool.clear()
+            self._connection_threads.clear()
+            self._connection_count = 0
 
         if len(outstanding_connections) != 0:
             raise LeakedSQLiteConnectionError("There were still outstanding SQLite connections "
@@ -347,7 +668,7 @@ class DatabaseContext:
         assert self.is_closed(), f"{self._write_dispatcher.is_stopped()}"
 
     def is_closed(self) -> bool:
-        return self._connection_pool.qsize() == 0 and self._write_dispatcher.is_stopped()
+        return len(self._connection_pool) == 0 and self._write_dispatcher.is_stopped()
 
     def is_special_path(self, path: str) -> bool:
         # Each connection has a private database.
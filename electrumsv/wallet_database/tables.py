@@ -8,7 +8,8 @@ except ModuleNotFoundError:
     # Windows builds use the official Python 3.7.9 builds and version of 3.31.1.
     import sqlite3 # type: ignore
 import time
-from typing import Any, Dict, Iterable, NamedTuple, Optional, List, Sequence, Tuple, Type, TypeVar
+from typing import (Any, Dict, Iterable, NamedTuple, Optional, List, Sequence, Set, Tuple, Type,
+    TypeVar)
 
 import bitcoinx
 from bitcoinx import hash_to_hex_str
@@ -255,6 +256,11 @@ class TransactionRow(NamedTuple):
     flags: TxFlags
     description: Optional[str]
 
+class TransactionInputRow(NamedTuple):
+    prev_hash: bytes
+    prev_idx: int
+    tx_hash: bytes
+
 
 class TransactionTable(BaseWalletStore):
     LOGGER_NAME = "db-table-tx"
@@ -280,6 +286,11 @@ class TransactionTable(BaseWalletStore):
     UPDATE_PROOF_SQL = ("UPDATE Transactions SET proof_data=?,date_updated=?,flags=(flags|?) "
         "WHERE tx_hash=?")
     DELETE_SQL = "DELETE FROM Transactions WHERE tx_hash=?"
+    # The inputs are written with the data of the transaction that has them.
+    CREATE_INPUTS_SQL = ("INSERT OR IGNORE INTO TransactionInputs (prev_hash, prev_idx, tx_hash) "
+        "VALUES (?, ?, ?)")
+    READ_SPENDING_SQL = "SELECT prev_idx, tx_hash FROM TransactionInputs WHERE prev_hash=?"
+    DELETE_INPUTS_SQL = "DELETE FROM TransactionInputs WHERE tx_hash=?"
 
     @staticmethod
     def _apply_flags(data: TxData, flags: TxFlags) -> TxFlags:
@@ -352,7 +363,8 @@ class TransactionTable(BaseWalletStore):
         return results
 
     def create(self, entries: List[TransactionRow], completion_callback: Optional[
-            CompletionCallbackType]=None) -> None:
+            CompletionCallbackType]=None,
+            input_rows: Optional[List[TransactionInputRow]]=None) -> None:
         datas = []
         size_hint = 0
         for tx_hash, metadata, bytedata, flags, description in entries:
@@ -369,6 +381,8 @@ class TransactionTable(BaseWalletStore):
         def _write(db: sqlite3.Connection) -> None:
             self._logger.debug("add %d transactions", len(datas))
             db.executemany(self.CREATE_SQL, datas)
+            if input_rows:
+                db.executemany(self.CREATE_INPUTS_SQL, input_rows)
         self._db_context.queue_write(_write, completion_callback, size_hint)
 
     def read(self, flags: Optional[TxFlags]=None, mask: Optional[TxFlags]=None,
@@ -392,6 +406,13 @@ class TransactionTable(BaseWalletStore):
         # This can be used directly as the query results map to the return type.
         return self._get_many_common(query, None, None, tx_hashes)
 
+    def read_spending_transactions(self, tx_hash: bytes) -> List[Tuple[int, bytes]]:
+        "The output index and spending transaction of each spent output of the transaction."
+        cursor = self._db.execute(self.READ_SPENDING_SQL, (tx_hash,))
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
     # Not called outside of the unit tests (at this time).
     def read_proof(self, tx_hashes: Sequence[bytes]) -> List[Tuple[bytes, Optional[TxProof]]]:
         query = self.READ_PROOF_SQL
@@ -399,9 +420,12 @@ class TransactionTable(BaseWalletStore):
             for row in self._get_many_common(query, None, None, tx_hashes) ]
 
     def update(self, entries: List[Tuple[bytes, TxData, Optional[bytes], TxFlags]],
-            completion_callback: Optional[CompletionCallbackType]=None) -> None:
+            completion_callback: Optional[CompletionCallbackType]=None,
+            input_rows: Optional[List[TransactionInputRow]]=None) -> None:
         data_rows = []
         metadata_rows = []
+        # Transactions that no longer have data no longer record what they spend.
+        cleared_rows = []
         size_hint = 0
         for tx_hash, metadata, bytedata, flags in entries:
             assert type(tx_hash) is bytes
@@ -417,6 +441,7 @@ class TransactionTable(BaseWalletStore):
             else:
                 if bytedata is None:
                     assert flags & TxFlags.HasByteData == 0, f"{hash_to_hex_str(tx_hash)} no flag"
+                    cleared_rows.append((tx_hash,))
                 else:
                     assert flags & TxFlags.HasByteData != 0, f"{hash_to_hex_str(tx_hash)} flag"
                     size_hint += len(bytedata)
@@ -434,6 +459,10 @@ class TransactionTable(BaseWalletStore):
                 db.executemany(self.UPDATE_MANY_SQL, data_rows)
             if len(metadata_rows):
                 db.executemany(self.UPDATE_METADATA_MANY_SQL, metadata_rows)
+            if len(cleared_rows):
+                db.executemany(self.DELETE_INPUTS_SQL, cleared_rows)
+            if input_rows:
+                db.executemany(self.CREATE_INPUTS_SQL, input_rows)
 
         self._db_context.queue_write(_write, completion_callback, size_hint)
 
@@ -478,8 +507,7 @@ class TransactionTable(BaseWalletStore):
             for (tx_hash, proof, date_updated) in entries ]
         size_hint = sum(len(t[0]) for t in datas)
         def _write(db: sqlite3.Connection) -> None:
-            tx_ids = [ hash_to_hex_str(entry[0]) for entry in entries ]
-            self._logger.debug("updating %d transaction proof '%s'", 1, tx_ids)
+            self._logger.debug("updating %d transaction proofs", len(datas))
             db.executemany(self.UPDATE_PROOF_SQL, datas)
         self._db_context.queue_write(_write, completion_callback, size_hint)
 
@@ -490,6 +518,7 @@ class TransactionTable(BaseWalletStore):
             self._logger.debug("deleting transactions %s", [hash_to_hex_str(b[0]) for b in datas])
             db.executemany(TransactionDeltaTable.DELETE_TRANSACTION_SQL, datas)
             db.executemany(TransactionOutputTable.DELETE_TRANSACTION_SQL, datas)
+            db.executemany(self.DELETE_INPUTS_SQL, datas)
             db.executemany(self.DELETE_SQL, datas)
         self._db_context.queue_write(_write, completion_callback)
 
@@ -645,6 +674,7 @@ class KeyInstanceTable(BaseWalletStore):
         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
     READ_SQL = ("SELECT keyinstance_id, account_id, masterkey_id, derivation_type, "
         "derivation_data, script_type, flags, description FROM KeyInstances")
+    READ_ACCOUNT_SQL = READ_SQL +" WHERE account_id=?"
     UPDATE_DERIVATION_DATA_SQL = ("UPDATE KeyInstances SET date_updated=?, derivation_data=? "
         "WHERE keyinstance_id=?")
     UPDATE_DESCRIPTION_SQL = ("UPDATE KeyInstances SET date_updated=?, description=? "
@@ -697,6 +727,13 @@ class KeyInstanceTable(BaseWalletStore):
 
         return results
 
+    def read_account(self, account_id: int) -> List[KeyInstanceRow]:
+        cursor = self._db.execute(self.READ_ACCOUNT_SQL, [account_id])
+        rows = cursor.fetchall()
+        cursor.close()
+        return [ KeyInstanceRow(row[0], row[1], row[2], DerivationType(row[3]), row[4],
+            ScriptType(row[5]), KeyInstanceFlag(row[6]), row[7]) for row in rows ]
+
     def update_derivation_data(self, entries: Iterable[Tuple[bytes, int]],
             date_updated: Optional[int]=None,
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
@@ -760,6 +797,10 @@ class TransactionOutputTable(BaseWalletStore):
     CREATE_SQL = ("INSERT INTO TransactionOutputs (tx_hash, tx_index, value, keyinstance_id, "
         "flags, date_created, date_updated) VALUES (?, ?, ?, ?, ?, ?, ?)")
     READ_SQL = "SELECT tx_hash, tx_index, value, keyinstance_id, flags FROM TransactionOutputs"
+    READ_ACCOUNT_SQL = ("SELECT TXO.tx_hash, TXO.tx_index, TXO.value, TXO.keyinstance_id, "
+        "TXO.flags FROM TransactionOutputs AS TXO "
+        "INNER JOIN KeyInstances AS KI ON TXO.keyinstance_id = KI.keyinstance_id "
+        "WHERE KI.account_id=? AND (TXO.flags & ?) = 0")
     UPDATE_FLAGS_SQL = ("UPDATE TransactionOutputs SET date_updated=?, flags=? "
         "WHERE tx_hash=? AND tx_index=?")
     DELETE_SQL = "DELETE FROM TransactionOutputs WHERE tx_hash=? AND tx_index=?"
@@ -800,6 +841,14 @@ class TransactionOutputTable(BaseWalletStore):
 
         return results
 
+    def read_account(self, account_id: int,
+            exclude_mask: TransactionOutputFlag=TransactionOutputFlag.NONE) \
+                -> List[TransactionOutputRow]:
+        results: List[TransactionOutputRow] = []
+        cursor = self._db.execute(self.READ_ACCOUNT_SQL, [account_id, exclude_mask])
+        collect_results(TransactionOutputRow, cursor, results)
+        return results
+
     def read_txokeys(self, txo_keys: List[TxoKeyType]) -> List[TransactionOutputRow]:
         results: List[TransactionOutputRow] = []
 
@@ -1136,6 +1185,103 @@ class TransactionDeltaTable(BaseWalletStore):
         self._db_context.queue_write(_write, completion_callback)
 
 
+class TransactionWriteBatch:
+    """
+    Gathers the new transaction outputs, output flag changes and transaction delta adjustments
+    made in processing transactions, so that they can be written with a few `executemany`
+    statements in one database transaction rather than as separate writes.
+
+    A flag change for an output created in the same batch is applied to the row that will be
+    inserted, and adjustments to the delta for the same transaction and key are summed. The
+    caller is responsible for writing the batch before anything else that depends on it is
+    queued, usually by holding the account transaction lock until it is written.
+    """
+
+    def __init__(self) -> None:
+        self._logger = logs.get_logger("db-write-batch")
+        self._output_rows: Dict[TxoKeyType, TransactionOutputRow] = {}
+        self._output_flags: Dict[TxoKeyType, TransactionOutputFlag] = {}
+        self._value_deltas: Dict[Tuple[bytes, int], int] = {}
+        self._completion_callbacks: List[CompletionCallbackType] = []
+        # The keys whose transaction deltas changed, by account. This allows an account to act
+        # on all of its changed keys in one completion callback.
+        self.changed_keyinstance_ids: Dict[int, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._output_rows) + len(self._output_flags) + len(self._value_deltas)
+
+    def add_outputs(self, entries: Iterable[TransactionOutputRow]) -> None:
+        for row in entries:
+            self._output_rows[TxoKeyType(row.tx_hash, row.tx_index)] = row
+
+    def add_output_flags(self, entries: Iterable[Tuple[TransactionOutputFlag, bytes, int]]) \
+            -> None:
+        for flags, tx_hash, tx_index in entries:
+            txo_key = TxoKeyType(tx_hash, tx_index)
+            row = self._output_rows.get(txo_key)
+            if row is not None:
+                self._output_rows[txo_key] = row._replace(flags=flags)
+            else:
+                self._output_flags[txo_key] = flags
+
+    def add_value_deltas(self, entries: Iterable[TransactionDeltaRow]) -> None:
+        for row in entries:
+            key = (row.tx_hash, row.keyinstance_id)
+            self._value_deltas[key] = self._value_deltas.get(key, 0) + row.value_delta
+
+    def add_completion_callback(self, callback: CompletionCallbackType) -> None:
+        "The callback is called once the batch has been written, or has failed to be."
+        self._completion_callbacks.append(callback)
+
+    def write(self, db_context: DatabaseContext,
+            completion_callback: Optional[CompletionCallbackType]=None) -> None:
+        """
+        Queue the write of everything gathered so far, and empty the batch. If there is nothing
+        to write the completion callbacks are still called, once the writes queued before this
+        have been applied.
+        """
+        timestamp = int(time.time())
+        output_datas = [ (*row, timestamp, timestamp) for row in self._output_rows.values() ]
+        flag_datas = [ (timestamp, flags, tx_hash, tx_index)
+            for (tx_hash, tx_index), flags in self._output_flags.items() ]
+        delta_update_datas = [ (timestamp, value_delta, tx_hash, keyinstance_id)
+            for (tx_hash, keyinstance_id), value_delta in self._value_deltas.items() ]
+        delta_insert_datas = [ (tx_hash, keyinstance_id, value_delta, timestamp, timestamp)
+            for (tx_hash, keyinstance_id), value_delta in self._value_deltas.items() ]
+        completion_callbacks = self._completion_callbacks
+        if completion_callback is not None:
+            completion_callbacks.append(completion_callback)
+
+        self._output_rows = {}
+        self._output_flags = {}
+        self._value_deltas = {}
+        self._completion_callbacks = []
+        self.changed_keyinstance_ids = {}
+        if not (output_datas or flag_datas or delta_update_datas or completion_callbacks):
+            return
+
+        def _write(db: sqlite3.Connection) -> None:
+            # The outputs are inserted before any flags are updated, as the updates may be for
+            # outputs created by earlier batches that are only now being written.
+            if output_datas:
+                db.executemany(TransactionOutputTable.CREATE_SQL, output_datas)
+            if flag_datas:
+                db.executemany(TransactionOutputTable.UPDATE_FLAGS_SQL, flag_datas)
+            if delta_update_datas:
+                db.executemany(TransactionDeltaTable.UPDATE_RELATIVE_SQL, delta_update_datas)
+                db.executemany(TransactionDeltaTable.CREATE_OR_IGNORE_SQL, delta_insert_datas)
+
+        def _completion(exc_value: Optional[Exception]) -> None:
+            # Every callback is called, even if an earlier one raises.
+            for callback in completion_callbacks:
+                try:
+                    callback(exc_value)
+                except Exception:
+                    self._logger.exception("Exception within completion callback")
+
+        db_context.queue_write(_write, _completion if completion_callbacks else None)
+
+
 class PaymentRequestRow(NamedTuple):
     paymentrequest_id: int
     keyinstance_id: int
@@ -1281,7 +1427,7 @@ class InvoiceTable(BaseWalletStore):
     CLEAR_TRANSACTION_SQL = "UPDATE Invoices SET date_updated=?, tx_hash=NULL WHERE tx_hash=?"
     DELETE_SQL = "DELETE FROM Invoices WHERE invoice_id=?"
     ARCHIVE_SQL = f"""
-    UPDATE Invoices SET state=state|{PaymentFlag.ARCHIVED} WHERE invoice_id=%d
+    UPDATE Invoices SET invoice_flags=invoice_flags|{PaymentFlag.ARCHIVED} WHERE invoice_id=%d
     """
 
     def create(self, entries: Iterable[InvoiceRow],
@@ -11,12 +11,10 @@ from bitcoinx import TxOutput, hash_to_hex_str, hex_str_to_hash
 from aiohttp import web
 
 from electrumsv.bitcoin import COINBASE_MATURITY
-from electrumsv.coinchooser import PRNG
-from electrumsv.constants import TxFlags, RECEIVING_SUBPATH, DATABASE_EXT
+from electrumsv.constants import TxFlags, RECEIVING_SUBPATH, DATABASE_EXT, HISTORY_PAGE_SIZE
 from electrumsv.exceptions import NotEnoughFunds
 from electrumsv.networks import Net
 from electrumsv.restapi_endpoints import HandlerUtils, VARNAMES, ARGTYPES
-from electrumsv.transaction import Transaction
 from electrumsv.wallet import AbstractAccount, Wallet, UTXO
 from electrumsv.logs import logs
 from electrumsv.app_state import app_state
@@ -48,6 +46,7 @@ class VNAME(VARNAMES):
     TXID = 'txid'
     UTXOS = 'utxos'
     OUTPUTS = 'outputs'
+    # No longer used, the coin chooser scales to any number of coins.
     UTXO_PRESELECTION = 'utxo_preselection'
     REQUIRE_CONFIRMED = 'require_confirmed'
     EXCLUDE_FROZEN = 'exclude_frozen'
@@ -58,6 +57,8 @@ class VNAME(VARNAMES):
     SPLIT_VALUE = 'split_value'
     NBLOCKS = 'nblocks'
     TX_FLAGS = 'tx_flags'
+    CURSOR = 'cursor'
+    LIMIT = 'limit'
 
 # Request types
 ADDITIONAL_ARGTYPES: Dict[str, type] = {
@@ -81,6 +82,8 @@ ADDITIONAL_ARGTYPES: Dict[str, type] = {
     VNAME.SPLIT_VALUE: int,
     VNAME.NBLOCKS: int,
     VNAME.TX_FLAGS: int,  # enum
+    VNAME.CURSOR: str,
+    VNAME.LIMIT: int,
 }
 
 ARGTYPES.update(ADDITIONAL_ARGTYPES)
@@ -89,7 +92,8 @@ HEADER_VARS = [VNAME.NETWORK, VNAME.ACCOUNT_ID, VNAME.WALLET_NAME]
 BODY_VARS = [VNAME.PASSWORD, VNAME.RAWTX, VNAME.TXIDS, VNAME.UTXOS, VNAME.OUTPUTS,
              VNAME.UTXO_PRESELECTION, VNAME.REQUIRE_CONFIRMED, VNAME.EXCLUDE_FROZEN,
              VNAME.CONFIRMED_ONLY, VNAME.MATURE, VNAME.AMOUNT, VNAME.SPLIT_COUNT,
-             VNAME.DESIRED_UTXO_COUNT, VNAME.SPLIT_VALUE, VNAME.NBLOCKS, VNAME.TX_FLAGS]
+             VNAME.DESIRED_UTXO_COUNT, VNAME.SPLIT_VALUE, VNAME.NBLOCKS, VNAME.TX_FLAGS,
+             VNAME.CURSOR, VNAME.LIMIT]
 
 
 class ExtendedHandlerUtils(HandlerUtils):
@@ -324,47 +328,6 @@ class ExtendedHandlerUtils(HandlerUtils):
         session = await self.app_state.daemon.network._main_session()
         return await session.send_request(method, args)
 
-    def preselect_utxos(self, utxos, outputs, batch_size=10):
-        """Inexact, random pre-selectiion of utxos for performance reasons.
-        'make_unsigned_transaction' is slow if it iterates over all utxos.
-        - Disabled via {'utxo_preselection': False} in body of request."""
-        BATCH_SIZE = batch_size
-        if len(utxos) <= BATCH_SIZE:
-            return utxos  # abort
-
-        selected_utxos = []
-        # Deterministic randomness from coins (only select first 10 (or batch_size) for speed)
-        p = PRNG(b''.join(sorted(utxo.tx_hash for utxo in utxos[0:BATCH_SIZE])))
-
-        tx = Transaction.from_io([], outputs)
-        # Size of the transaction with no inputs and no change
-        base_size = tx.estimated_size()
-        spent_amount = tx.output_value()
-        fee_estimator = app_state.config.estimate_fee
-
-        def sufficient_funds(selected_utxos):
-            """Given a list of utxos, return True if it has enough
-            value to pay for the transaction"""
-            INPUT_SIZE = 148
-            CHANGE_SAFE_MARGIN = 34 * 1000  # enough for 1000 change outputs
-            total_input = sum(utxo.value for utxo in selected_utxos)
-            total_size = sum(INPUT_SIZE for utxo in selected_utxos) + base_size + CHANGE_SAFE_MARGIN
-            return total_input >= spent_amount + fee_estimator(total_size)
-
-        # add batches of 10 utxos before sufficient_funds() check
-        batch = []
-        for i in range(1, len(utxos)):
-            utxo = p.pluck(utxos)
-            batch.append(utxo)
-            if i % BATCH_SIZE == 0:
-                selected_utxos.extend(batch)
-                batch = []
-                if sufficient_funds(selected_utxos):
-                    return selected_utxos
-                else:
-                    continue
-        return utxos  # may still be enough coins
-
     # ----- Data transfer objects ----- #
 
     def _balance_dto(self, wallet) -> Dict[Any, Any]:
@@ -391,6 +354,30 @@ class ExtendedHandlerUtils(HandlerUtils):
                            "value": int(tx_values[0].total)})
         return result
 
+    def _history_page_dto(self, account: AbstractAccount, tx_flags: int=None,
+            cursor: str=None, limit: int=None) -> Dict[str, Any]:
+        if limit is None:
+            limit = HISTORY_PAGE_SIZE
+        if limit < 1:
+            raise Fault(Errors.GENERIC_BAD_REQUEST_CODE, "limit must be a positive integer")
+
+        try:
+            lines, next_cursor = account.get_history_page(cursor, limit)
+        except ValueError as e:
+            raise Fault(Errors.GENERIC_BAD_REQUEST_CODE, str(e))
+        # Filtered out entries are dropped from the page rather than filled in from the pages
+        # that follow, so that one request never reads more than `limit` entries.
+        result: List[Dict[str, Any]] = []
+        for line, balance in lines:
+            if tx_flags is not None and line.tx_flags & tx_flags == 0:
+                continue
+            result.append({"txid": hash_to_hex_str(line.tx_hash),
+                           "height": line.height,
+                           "tx_flags": line.tx_flags,
+                           "value": line.value_delta,
+                           "balance": balance})
+        return {"history": result, "cursor": next_cursor}
+
     def _account_dto(self, account) -> Dict[Any, Any]:
         """child wallet data transfer object"""
         script_type = account._row.default_script_type
@@ -438,7 +425,6 @@ class ExtendedHandlerUtils(HandlerUtils):
             outputs = vars[VNAME.OUTPUTS]
 
             utxos = vars.get(VNAME.UTXOS, None)
-            utxo_preselection = vars.get(VNAME.UTXO_PRESELECTION, True)
             password = vars.get(VNAME.PASSWORD, None)
 
             child_wallet = self._get_account(wallet_name, index)
@@ -450,9 +436,6 @@ class ExtendedHandlerUtils(HandlerUtils):
                 utxos = child_wallet.get_utxos(exclude_frozen=exclude_frozen,
                                                confirmed_only=confirmed_only, mature=mature)
 
-            if utxo_preselection:  # Defaults to True
-                utxos = self.preselect_utxos(utxos, outputs)
-
             # Todo - loop.run_in_executor
             tx = child_wallet.make_unsigned_transaction(utxos, outputs, self.app_state.config)
             self.raise_for_duplicate_tx(tx)
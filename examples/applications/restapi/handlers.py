@@ -51,6 +51,7 @@ class ExtensionEndpoints(ExtendedHandlerUtils):
             web.get(self.ACCOUNT_UTXOS + "/balance", self.get_balance),
             web.delete(self.ACCOUNT_TXS, self.remove_txs),
             web.get(self.ACCOUNT_TXS + "/history", self.get_transaction_history),
+            web.get(self.ACCOUNT_TXS + "/history/page", self.get_transaction_history_page),
             web.post(self.ACCOUNT_TXS + "/fetch", self.fetch_transaction),
             web.post(self.ACCOUNT_TXS + "/create", self.create_tx),
             web.post(self.ACCOUNT_TXS + "/create_and_broadcast", self.create_and_broadcast),
@@ -264,6 +265,23 @@ class ExtensionEndpoints(ExtendedHandlerUtils):
         except Fault as e:
             return fault_to_http_response(e)
 
+    async def get_transaction_history_page(self, request):
+        """get a page of the account history, most recent first"""
+        try:
+            vars = await self.argparser(request, required_vars=[VNAME.WALLET_NAME,
+                                                                VNAME.ACCOUNT_ID])
+            wallet_name = vars[VNAME.WALLET_NAME]
+            account_id = vars[VNAME.ACCOUNT_ID]
+            tx_flags = vars.get(VNAME.TX_FLAGS)
+            cursor = vars.get(VNAME.CURSOR)
+            limit = vars.get(VNAME.LIMIT)
+
+            account = self._get_account(wallet_name, account_id)
+            response = self._history_page_dto(account, tx_flags, cursor, limit)
+            return good_response(response)
+        except Fault as e:
+            return fault_to_http_response(e)
+
     async def fetch_transaction(self, request):
         """get transaction"""
         try:
@@ -2,6 +2,7 @@ import asyncio
 import json
 import logging
 import tempfile
+import threading
 
 import pytest
 import bitcoinx
@@ -11,9 +12,9 @@ from bitcoinx import Address, Script, BitcoinTestnet, hex_str_to_hash
 from typing import List, Union, Dict, Any, Optional, Tuple
 from concurrent.futures.thread import ThreadPoolExecutor
 
-from electrumsv.constants import TransactionOutputFlag, ScriptType
+from electrumsv.constants import TransactionOutputFlag, ScriptType, TxFlags
 from electrumsv.restapi import good_response, Fault
-from electrumsv.wallet import UTXO, Wallet, AbstractAccount
+from electrumsv.wallet import UTXO, Wallet, AbstractAccount, HistoryLine
 from electrumsv.transaction import Transaction
 from ..errors import Errors
 
@@ -182,11 +183,27 @@ class MockAccount(AbstractAccount):
     def sign_transaction(self, tx=None, password=None):
         return Transaction.from_hex(rawtx)
 
+    def get_history_page(self, cursor=None, limit=None, domain=None) \
+            -> Tuple[List[Tuple[HistoryLine, int]], Optional[str]]:
+        pages = {
+            None: ([ (HistoryLine((0, 2), b"\3" * 32, TxFlags.StateCleared, 0, -50), 200),
+                     (HistoryLine((0, 1), b"\2" * 32, TxFlags.StateSigned, 0, -50), 250) ],
+                   "page2"),
+            "page2": ([ (HistoryLine((1, 0), b"\1" * 32, TxFlags.StateSettled, 1, 300), 300) ],
+                      None),
+        }
+        if cursor not in pages:
+            raise ValueError("invalid history cursor")
+        lines, next_cursor = pages[cursor]
+        return lines[:limit], next_cursor
+
 
 class MockWallet(Wallet):
 
     def __init__(self):
         self._accounts: Dict[int, AbstractAccount] = {1: MockAccount(self)}
+        self._unrealised_account_rows = {}
+        self._accounts_lock = threading.RLock()
         self._frozen_coins = set([])
 
     def set_boolean_setting(self, setting_name: str, enabled: bool) -> None:
@@ -330,6 +347,8 @@ class TestDefaultEndpoints:
         app.router.add_get(self.ACCOUNT_UTXOS + "/balance", self.rest_server.get_balance)
         app.router.add_delete(self.ACCOUNT_TXS, self.rest_server.remove_txs)
         app.router.add_get(self.ACCOUNT_TXS + "/history", self.rest_server.get_transaction_history)
+        app.router.add_get(self.ACCOUNT_TXS + "/history/page",
+            self.rest_server.get_transaction_history_page)
         app.router.add_get(self.ACCOUNT_TXS + "/fetch", self.rest_server.fetch_transaction)
         app.router.add_post(self.ACCOUNT_TXS + "/create", self.rest_server.create_tx)
         app.router.add_post(self.ACCOUNT_TXS + "/create_and_broadcast",
@@ -539,6 +558,69 @@ class TestDefaultEndpoints:
         response = await resp.read()
         assert json.loads(response) == expected_json
 
+    async def test_get_transaction_history_page(self, monkeypatch, cli):
+        monkeypatch.setattr(self.rest_server, '_get_account',
+                            _fake_get_account_succeeded)
+
+        network = "test"
+        wallet_name = "wallet_file1.sqlite"
+        account_id = "1"
+        resp = await cli.get(
+            f"/v1/{network}/dapp/wallets/{wallet_name}/{account_id}/txs/history/page",
+            json={"limit": 2})
+
+        expected_json = {
+            "history": [
+                {"txid": "03" * 32, "height": 0, "tx_flags": TxFlags.StateCleared,
+                 "value": -50, "balance": 200},
+                {"txid": "02" * 32, "height": 0, "tx_flags": TxFlags.StateSigned,
+                 "value": -50, "balance": 250},
+            ],
+            "cursor": "page2",
+        }
+        assert resp.status == 200, await resp.read()
+        response = await resp.read()
+        assert json.loads(response) == expected_json
+
+    async def test_get_transaction_history_page_filtered(self, monkeypatch, cli):
+        monkeypatch.setattr(self.rest_server, '_get_account',
+                            _fake_get_account_succeeded)
+
+        network = "test"
+        wallet_name = "wallet_file1.sqlite"
+        account_id = "1"
+        resp = await cli.get(
+            f"/v1/{network}/dapp/wallets/{wallet_name}/{account_id}/txs/history/page",
+            json={"tx_flags": TxFlags.StateCleared | TxFlags.StateSettled, "limit": 2})
+
+        # The filtered out entry is dropped, and the following page is not read to fill this one.
+        expected_json = {
+            "history": [
+                {"txid": "03" * 32, "height": 0, "tx_flags": TxFlags.StateCleared,
+                 "value": -50, "balance": 200},
+            ],
+            "cursor": "page2",
+        }
+        assert resp.status == 200, await resp.read()
+        response = await resp.read()
+        assert json.loads(response) == expected_json
+
+    async def test_get_transaction_history_page_bad_cursor(self, monkeypatch, cli):
+        monkeypatch.setattr(self.rest_server, '_get_account',
+                            _fake_get_account_succeeded)
+
+        network = "test"
+        wallet_name = "wallet_file1.sqlite"
+        account_id = "1"
+        resp = await cli.get(
+            f"/v1/{network}/dapp/wallets/{wallet_name}/{account_id}/txs/history/page",
+            json={"cursor": "page3"})
+
+        assert resp.status == 400, await resp.read()
+        response = await resp.read()
+        assert json.loads(response) == {"code": Errors.GENERIC_BAD_REQUEST_CODE,
+            "message": "invalid history cursor"}
+
     async def test_get_coin_state_good_response(self, monkeypatch, cli):
         monkeypatch.setattr(self.rest_server, '_coin_state_dto',
                             _fake_coin_state_dto)